@@ -0,0 +1,54 @@
+########################################################################
+# Compares per request latency of a new connection per request
+# (requests.get) with the pooled keep-alive session used by
+# nbastats_get_data.get_data, against a local stub of stats.nba.com.
+########################################################################
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+
+import requests
+
+from triple_triple_etl.core.nbastats_get_data import HEADERS, get_session
+
+N_REQUESTS = 500
+BODY = json.dumps({'resultSets': [{'headers': ['GAME_ID'], 'rowSet': [['0021500492']]}]}).encode()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so connections are kept alive
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, don't let them wait
+    # on the client's delayed ack
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+def time_requests(get, url: str):
+    start = time.perf_counter()
+    for _ in range(N_REQUESTS):
+        get(url=url, params={'GameID': '0021500492'}, headers=HEADERS).json()
+    return (time.perf_counter() - start) / N_REQUESTS * 1000
+
+
+if __name__ == '__main__':
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{}/stats/playbyplayv2'.format(server.server_port)
+
+    ms_get = time_requests(requests.get, url)
+    ms_session = time_requests(get_session().get, url)
+    server.shutdown()
+
+    print('requests.get:   {:.2f} ms per request'.format(ms_get))
+    print('pooled session: {:.2f} ms per request'.format(ms_session))
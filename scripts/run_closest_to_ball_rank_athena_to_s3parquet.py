@@ -1,8 +1,7 @@
-import numpy as np
-
+from triple_triple_etl.core.partition_projection import PartitionProjection
 from triple_triple_etl.core.s3 import get_bucket_content
 from triple_triple_etl.load.storage.closest_to_ball_rank_athena_to_s3parquet import (
-    ClosestToBallETL
+    ClosestToBallLocalETL
 )
 
 
@@ -17,12 +16,22 @@ if __name__ == '__main__':
         for x in get_bucket_content(bucket_name, prefix_game)
     ]
 
-    for i in range(570, len(gameposition_gameids), 10):
-        block = sorted(gameposition_gameids)[i: i + 10]
-        etl = ClosestToBallETL(
-            season=season,
-            gameid_bounds=[block[0], block[-1]]
-        )
-        etl.run()
+    # athena projects the partitions, nothing is added per game
+    partitions = PartitionProjection(
+        table='closest_to_ball',
+        seasons=[season],
+        gameids=gameposition_gameids
+    )
+    partitions.enable()
+
+    # games without gameposition files are skipped
+    missing_gameids = []
+    with partitions:
+        for gameid in sorted(gameposition_gameids)[570:]:
+            etl = ClosestToBallLocalETL(season=season, gameid=gameid, partitions=partitions)
+            try:
+                etl.run()
+            except FileNotFoundError:
+                missing_gameids.append(gameid)
 
 
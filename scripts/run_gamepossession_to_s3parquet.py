@@ -0,0 +1,20 @@
+from triple_triple_etl.core.s3 import get_bucket_content
+from triple_triple_etl.load.storage.gamepossession_to_s3parquet import (
+    upload_all_gamepossession
+)
+
+
+if __name__ == '__main__':
+    season = '2015-2016'
+    bucket_name = 'nba-game-info'
+    prefix_closest = 'closest_to_ball/season={}/'.format(season)
+
+    closest_to_ball_gameids = [
+        x['Prefix'].split('gameid=')[1][:-1]
+        for x in get_bucket_content(bucket_name, prefix_closest)
+    ]
+
+    upload_all_gamepossession(
+        season=season,
+        gameids=sorted(closest_to_ball_gameids)
+    )
@@ -0,0 +1,21 @@
+from triple_triple_etl.core.partition_projection import PartitionProjection
+
+
+if __name__ == '__main__':
+    season = '2015-2016'
+    # the regular season games
+    gameid_range = ('0021500001', '0021501230')
+
+    tables = [
+        'gameposition',
+        'closest_to_ball',
+        'player_actions',
+        'team_shooting_side',
+        'gamepossession',
+    ]
+    for table in tables:
+        PartitionProjection(
+            table=table,
+            seasons=[season],
+            gameid_range=gameid_range
+        ).enable()
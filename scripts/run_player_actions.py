@@ -1,9 +1,12 @@
-import time
-import numpy as np
-
-from triple_triple_etl.core.s3 import s3client, get_bucket_content, remove_bucket_contents
+from triple_triple_etl.core.partitions import PartitionRegistry
+from triple_triple_etl.core.s3 import (
+    s3client,
+    get_bucket_content,
+    iter_bucket_keys,
+    remove_bucket_contents
+)
 from triple_triple_etl.load.storage.player_actions import (
-    PlayerActionsETL
+    PlayerActionsLocalETL
 )
 
 
@@ -18,17 +21,19 @@ if __name__ == '__main__':
         for x in get_bucket_content(bucket_name, prefix_game)
     ]
 
+    # player_actions already loaded, the gameid= folders listed in parallel
+    keys_player_actions = {}
+    for key in iter_bucket_keys(bucket_name, prefix_player_actions):
+        gameid = key.split('gameid=')[1].split('/')[0]
+        keys_player_actions.setdefault(gameid, []).append(key)
+
     bad_gameids = []
+    # the partitions of all games are added in a few queries at the end
+    partitions = PartitionRegistry(table='player_actions')
 
     for gameid in playbyplay_gameids[970:]:
-        # get player_actions content:
         try:
-            keys_player_actions = get_bucket_content(
-                bucket_name='nba-game-info',
-                prefix='player_actions/season=2015-2016/gameid={}'.format(gameid),
-                delimiter=''
-            )
-            for file in keys_player_actions:
+            for file in keys_player_actions.get(gameid, []):
                 is_key_there = remove_bucket_contents(
                     bucket='nba-game-info',
                     key=file,
@@ -38,11 +43,14 @@ if __name__ == '__main__':
         except:
             bad_gameids.append(gameid)
         
-        etl = PlayerActionsETL(
-            season=season,
-            gameid_bounds=[gameid, gameid]
-        )
-        etl.run()
+        # games without playbyplay files are skipped
+        etl = PlayerActionsLocalETL(season=season, gameid=gameid, partitions=partitions)
+        try:
+            etl.run()
+        except FileNotFoundError:
+            bad_gameids.append(gameid)
+
+    partitions.flush()
 
 
 # bad gameids
@@ -16,7 +16,8 @@ if __name__ == '__main__':
 
     transform_upload_all_games(
         season='2015-2016',
-        all_files=df_all_files.filename
+        all_files=df_all_files.filename,
+        max_workers=4
     )
 
 
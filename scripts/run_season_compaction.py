@@ -0,0 +1,11 @@
+from triple_triple_etl.load.storage.season_compaction import (
+    compact_seasons,
+    COMPACTION_TABLES
+)
+
+
+if __name__ == '__main__':
+    seasons = ['2015-2016']
+
+    # the failed seasons are logged
+    failed = compact_seasons(seasons=seasons, tables=COMPACTION_TABLES)
@@ -1,6 +1,8 @@
 from triple_triple_etl.load.storage.teamshooting_athena_to_s3parquet import (
     TeamShootingSideALL,
-    TeamShootingSideETL
+    TeamShootingSideETL,
+    TeamShootingSideLocalETL,
+    upload_all_team_shooting_side
 )
 
 
@@ -13,3 +15,11 @@ if __name__ == '__main__':
     gameid = '0021500001'
     etl = TeamShootingSideETL(gameid=gameid)
     etl.run()
+
+    # a season, 20 queries at a time
+    gameids = ['00215{}'.format(str(x).zfill(5)) for x in range(1, 1231)]
+    failed = upload_all_team_shooting_side(gameids=gameids, max_concurrency=20)
+
+    # per game, computed locally without athena
+    etl = TeamShootingSideLocalETL(season='2015-2016', gameid=gameid)
+    etl.run()
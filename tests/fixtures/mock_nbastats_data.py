@@ -475,6 +475,7 @@ columns = [
     'season',
     'game_date',
     'game_id',
+    'game_data_type',
     'team1',
     'team2',
     'fileuploadedFLG',
@@ -483,8 +484,9 @@ columns = [
     'params'
 ]
 data = [
-    ['2015-16', '2015-10-27', '1234', 'someteam1', 'someteam2'] + 4 * ['somevalue'],
-    ['2015-16', '2015-10-28', '5678', 'otherteam1', 'otherteam2'] + 4 * ['somevalue']
+    ['2015-16', '2015-10-27', '1234', 'playbyplay', 'someteam1', 'someteam2'] + 4 * ['somevalue'],
+    ['2015-16', '2015-10-27', '1234', 'boxscore_player', 'someteam1', 'someteam2'] + 4 * ['somevalue'],
+    ['2015-16', '2015-10-28', '5678', 'playbyplay', 'otherteam1', 'otherteam2'] + 4 * ['somevalue']
 ]
 
 mock_df_uploaded = pd.DataFrame(data=data, columns=columns)
\ No newline at end of file
@@ -0,0 +1,159 @@
+import numpy as np
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+import tempfile
+import unittest
+
+from triple_triple_etl.core.arrow_table import (
+    dtype_to_schema,
+    to_arrow_array,
+    build_table,
+    rows_to_columns,
+    split_table,
+    write_batches,
+    write_buffer,
+    write_sorted_batches
+)
+
+
+class TestArrowTable(unittest.TestCase):
+    """Tests for arrow_table.py"""
+
+    def test_dtype_to_schema(self):
+        dtype = {'gameid': 'object', 'teamid': 'int64', 'x': 'float64'}
+        schema = dtype_to_schema(dtype, col_order=['x', 'gameid', 'teamid'])
+
+        self.assertEqual(first=schema.names, second=['x', 'gameid', 'teamid'])
+        self.assertEqual(
+            first=schema.types,
+            second=[pa.float64(), pa.string(), pa.int64()]
+        )
+
+    def test_to_arrow_array(self):
+        # values are converted like DataFrame.astype
+        array = to_arrow_array(['201946', 3], pa.int64())
+        self.assertEqual(first=array.to_pylist(), second=[201946, 3])
+
+        array = to_arrow_array([1610612761, None], pa.string())
+        self.assertEqual(first=array.to_pylist(), second=['1610612761', None])
+
+        # NaN is stored as null
+        array = to_arrow_array(np.array([1.5, np.nan]), pa.float64())
+        self.assertEqual(first=array.null_count, second=1)
+
+    def test_build_table(self):
+        schema = dtype_to_schema({'season': 'object', 'playerid': 'int64'})
+        table = build_table(
+            columns={
+                'season': '2015-2016',
+                'playerid': ['1', '2', '3'],
+                'x': np.array([1., 2., 3.])
+            },
+            schema=schema
+        )
+        self.assertEqual(first=table.schema.names, second=['season', 'playerid', 'x'])
+        self.assertEqual(first=table.num_rows, second=3)
+        self.assertEqual(
+            first=table.column('season').to_pylist(),
+            second=['2015-2016'] * 3
+        )
+        self.assertEqual(first=table.schema.field('x').type, second=pa.float64())
+
+        # schema columns must be in the data
+        with self.assertRaises(KeyError):
+            build_table(columns={'season': ['2015-2016']}, schema=schema)
+
+    def test_rows_to_columns(self):
+        columns = rows_to_columns([[1, 'a'], [2, 'b']], ['num', 'letter'])
+        self.assertEqual(first=columns, second={'num': [1, 2], 'letter': ['a', 'b']})
+
+        columns = rows_to_columns([], ['num', 'letter'])
+        self.assertEqual(first=columns, second={'num': [], 'letter': []})
+
+    def test_write_batches(self):
+        batches = [
+            pa.RecordBatch.from_arrays(
+                [pa.array(['0021500492'] * 2), pa.array([i, i + 1])],
+                names=['gameid', 'eventid']
+            )
+            for i in range(3)
+        ]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filepath = os.path.join(tmp_dir, 'batches.parquet')
+            num_rows = write_batches(iter(batches), filepath, drop_columns=['gameid'])
+
+            parquet_file = pq.ParquetFile(filepath)
+            self.assertEqual(first=num_rows, second=6)
+            self.assertEqual(first=parquet_file.metadata.num_row_groups, second=3)
+            self.assertEqual(first=parquet_file.schema_arrow.names, second=['eventid'])
+
+            # no batches, no file
+            filepath = os.path.join(tmp_dir, 'empty.parquet')
+            self.assertEqual(first=write_batches([], filepath), second=0)
+            self.assertFalse(os.path.exists(filepath))
+
+    def test_write_sorted_batches(self):
+        # events out of order, players of a moment shuffled, one ball per moment
+        batches = [
+            pa.RecordBatch.from_arrays(
+                [
+                    pa.array(['0021500492'] * 6),
+                    pa.array([eventid] * 6),
+                    pa.array([1, 0] * 3),
+                    pa.array([3, -1, 2, 1, -1, 2])
+                ],
+                names=['gameid', 'eventid', 'moment_num', 'playerid']
+            )
+            for eventid in [2, 1, 4, 3, 5]
+        ]
+        sort_by = [('eventid', 'ascending'), ('moment_num', 'ascending'), ('playerid', 'ascending')]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filepath = os.path.join(tmp_dir, 'sorted.parquet')
+            num_rows = write_sorted_batches(
+                iter(batches),
+                filepath,
+                sort_by=sort_by,
+                # two events of 6 rows of ~25 bytes per row group
+                row_group_bytes=300,
+                drop_columns=['gameid']
+            )
+
+            parquet_file = pq.ParquetFile(filepath)
+            table = parquet_file.read()
+            self.assertEqual(first=os.listdir(tmp_dir), second=['sorted.parquet'])
+
+        self.assertEqual(first=num_rows, second=30)
+        self.assertEqual(first=table.column_names, second=['eventid', 'moment_num', 'playerid'])
+        self.assertTrue(table.equals(table.sort_by(sort_by)))
+        self.assertEqual(first=table.column('playerid').to_pylist()[:6], second=[-1, 1, 2, -1, 2, 3])
+
+        statistics = [
+            parquet_file.metadata.row_group(i).column(0).statistics
+            for i in range(parquet_file.metadata.num_row_groups)
+        ]
+        self.assertEqual(
+            first=[(x.min, x.max) for x in statistics],
+            second=[(1, 2), (3, 4), (5, 5)]
+        )
+
+    def test_write_buffer(self):
+        table = pa.table({
+            'season': ['2015-2016'] * 3,
+            'game_id': ['02', '03', '02'],
+            'pts': [101, 99, 110]
+        })
+        games = split_table(table, 'game_id')
+        self.assertEqual(first=list(games), second=['02', '03'])
+        self.assertEqual(first=games['02']['pts'].to_pylist(), second=[101, 110])
+
+        buffer = write_buffer(games['02'], drop_columns=['season', 'game_id'])
+        self.assertIsInstance(buffer, pa.Buffer)
+        self.assertEqual(
+            first=pq.read_table(pa.BufferReader(buffer)).to_pydict(),
+            second={'pts': [101, 110]}
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,6 +8,8 @@ from triple_triple_etl.core.athena import (
     execute_athena_query,
     get_query_s3filepath,
     check_table_exists,
+    QueryExecutionError,
+    wait_for_query_execution,
 )
 from triple_triple_etl.core.s3 import remove_bucket_contents
 from triple_triple_etl.constants import ATHENA_OUTPUT
@@ -104,5 +106,55 @@ class TestAthena(unittest.TestCase):
                 self.assertEqual(first=table_exists, second=response)
 
 
+    def test_wait_for_query_execution(self):
+        athena_mock = mock.Mock()
+        athena_mock.get_query_execution.side_effect = [
+            {'QueryExecution': {'Status': {'State': 'QUEUED'}}},
+            {'QueryExecution': {'Status': {'State': 'RUNNING'}}},
+            {'QueryExecution': {'Status': {'State': 'RUNNING'}}},
+            {'QueryExecution': {
+                'Status': {'State': 'SUCCEEDED'},
+                'Statistics': {'DataScannedInBytes': 10, 'EngineExecutionTimeInMillis': 20}
+            }},
+        ]
+        with mock.patch('triple_triple_etl.core.athena.time.sleep') as sleep_mock:
+            execution = wait_for_query_execution(
+                'someid',
+                boto3_client=athena_mock,
+                initial_delay=1.,
+                max_delay=3.
+            )
+
+        self.assertEqual(first=execution['Statistics']['DataScannedInBytes'], second=10)
+        # backoff with jitter: half to all of 1, 2, then the max of 3 seconds
+        delays = [call[0][0] for call in sleep_mock.call_args_list]
+        for delay, max_delay in zip(delays, [1., 2., 3.]):
+            self.assertTrue(max_delay / 2 <= delay <= max_delay)
+
+    def test_wait_for_query_execution_errors(self):
+        athena_mock = mock.Mock()
+        athena_mock.get_query_execution.return_value = {
+            'QueryExecution': {
+                'QueryExecutionId': 'someid',
+                'Status': {'State': 'FAILED', 'StateChangeReason': 'bad query'}
+            }
+        }
+        with self.assertRaises(QueryExecutionError) as context:
+            wait_for_query_execution('someid', boto3_client=athena_mock)
+        self.assertEqual(first=context.exception.state, second='FAILED')
+        self.assertIn('bad query', str(context.exception))
+
+        athena_mock.get_query_execution.return_value = {
+            'QueryExecution': {'Status': {'State': 'RUNNING'}}
+        }
+        patches = {
+            'sleep': mock.Mock(),
+            'monotonic': mock.Mock(side_effect=[0., 1., 2., 3.])
+        }
+        with mock.patch.multiple('triple_triple_etl.core.athena.time', **patches):
+            with self.assertRaises(TimeoutError):
+                wait_for_query_execution('someid', boto3_client=athena_mock, max_time=2)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,64 @@
+import numpy as np
+import pyarrow as pa
+import unittest
+
+from triple_triple_etl.core.closest_to_ball import (
+    closest_to_ball,
+    group_moments,
+    rank_within_groups
+)
+
+
+class TestClosestToBall(unittest.TestCase):
+    """Tests for closest_to_ball.py"""
+
+    def test_group_moments(self):
+        eventid = np.array([2, 1, 1, 2, 1])
+        moment_num = np.array([0, 1, 0, 0, 1])
+        order, group_id, starts = group_moments(eventid, moment_num)
+
+        self.assertEqual(first=list(order), second=[2, 1, 4, 0, 3])
+        self.assertEqual(first=list(group_id), second=[0, 1, 1, 2, 2])
+        self.assertEqual(first=list(starts), second=[0, 1, 3])
+
+    def test_rank_within_groups(self):
+        values = np.array([3., 1., np.nan, 2., 5., 4.])
+        group_id = np.array([0, 0, 0, 0, 1, 1])
+        rank = rank_within_groups(values, group_id, num_groups=2)
+
+        # NaN ranks last
+        self.assertEqual(first=list(rank), second=[3, 1, 4, 2, 2, 1])
+
+    def test_closest_to_ball(self):
+        table = pa.table({
+            'eventid': [1, 1, 1, 1, 1, 1, 2, 2],
+            'moment_num': [1, 1, 1, 0, 0, 0, 0, 0],
+            'playerid': [10, -1, 20, 20, 10, -1, 10, 20],
+            'x_coordinate': [3., 0., 1., 1., 2., 0., 5., 6.],
+            'y_coordinate': [4., 0., 1., 0., 0., 0., 0., 0.],
+        })
+        output = closest_to_ball(table)
+
+        self.assertEqual(
+            first=output.schema.names,
+            second=table.schema.names + ['distance_from_ball_sq', 'closest_to_ball_rank']
+        )
+        # sorted by moment, rows of a moment keep their order
+        self.assertEqual(first=output.column('moment_num').to_pylist(), second=[0, 0, 0, 1, 1, 1, 0, 0])
+        self.assertEqual(
+            first=output.column('distance_from_ball_sq').to_pylist(),
+            second=[1., 4., 0., 25., 0., 2., None, None]
+        )
+        # the ball isn't ranked, no ball in event 2 ranks in row order
+        self.assertEqual(
+            first=output.column('closest_to_ball_rank').to_pylist(),
+            second=[1, 2, None, 2, None, 1, 1, 2]
+        )
+
+        empty = closest_to_ball(table.slice(0, 0))
+        self.assertEqual(first=empty.num_rows, second=0)
+        self.assertIn('closest_to_ball_rank', empty.schema.names)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,16 +1,35 @@
+import asyncio
 import mock
 import unittest
 
-from triple_triple_etl.core.nbastats_get_data import get_data
+from triple_triple_etl.constants import NBASTATS_POOL_SIZE, NBASTATS_TIMEOUT
+from triple_triple_etl.core.nbastats_get_data import (
+    get_data,
+    get_data_async,
+    get_session
+)
 
 
 class TestNBAStatsGetData(unittest.TestCase):
     """Tests for nbastats_get_data.py"""
-    
+
+    def setUp(self):
+        # no responses from the on disk cache
+        self.cache_mock = mock.Mock()
+        self.cache_mock.get.return_value = None
+        self.cache_patch = mock.patch(
+            'triple_triple_etl.core.nbastats_get_data.RESPONSE_CACHE',
+            self.cache_mock
+        )
+        self.cache_patch.start()
+
+    def tearDown(self):
+        self.cache_patch.stop()
+
     def test_get_data(self):
         response_mock = mock.Mock()
         status_values = [200, 300]
-        path = 'triple_triple_etl.core.nbastats_get_data.requests.get'
+        path = 'triple_triple_etl.core.nbastats_get_data.SESSION.get'
 
         for code in status_values:        
             response_mock.status_code = code
@@ -25,7 +44,8 @@ class TestNBAStatsGetData(unittest.TestCase):
             requests_get_mock.assert_called_once_with(
                 url='some_url',
                 params='some_params',
-                headers='headers'
+                headers='headers',
+                timeout=NBASTATS_TIMEOUT
             )
 
             if code == 200:
@@ -35,6 +55,107 @@ class TestNBAStatsGetData(unittest.TestCase):
                 response_mock.raise_for_status.assert_called_once_with()
                 assert response_mock.json.call_count == 2
 
+    def test_get_data_cache(self):
+        requests_get_mock = mock.Mock()
+        path = 'triple_triple_etl.core.nbastats_get_data.SESSION.get'
+
+        # cached, no request
+        self.cache_mock.get.return_value = {'some': 'data'}
+        with mock.patch(path, requests_get_mock):
+            output = get_data(base_url='some_url', params={'GameID': '1'}, cache_ttl=10)
+        self.assertEqual(first=output, second={'some': 'data'})
+        self.cache_mock.get.assert_called_once_with('some_url', {'GameID': '1'}, ttl=10)
+        assert not requests_get_mock.called
+
+        # not cached, the response is saved
+        self.cache_mock.get.return_value = None
+        requests_get_mock.return_value = mock.Mock(status_code=200)
+        with mock.patch(path, requests_get_mock):
+            output = get_data(base_url='some_url', params={'GameID': '1'})
+        self.cache_mock.set.assert_called_once_with('some_url', {'GameID': '1'}, output)
+
+        # use_cache=False skips it
+        with mock.patch(path, requests_get_mock):
+            get_data(base_url='some_url', params={'GameID': '1'}, use_cache=False)
+        self.assertEqual(first=self.cache_mock.get.call_count, second=2)
+        self.assertEqual(first=requests_get_mock.call_count, second=2)
+
+    def test_get_data_retry(self):
+        response_429 = mock.Mock(status_code=429, headers={'Retry-After': '2'})
+        response_200 = mock.Mock(status_code=200)
+        requests_get_mock = mock.Mock(side_effect=[response_429, response_200])
+        rate_limiter_mock = mock.Mock()
+        rate_limiter_mock.backoff.return_value = 2.
+        time_mock = mock.Mock()
+
+        path = 'triple_triple_etl.core.nbastats_get_data'
+        patches = {'time': time_mock}
+        with mock.patch(path + '.SESSION.get', requests_get_mock), \
+                mock.patch.multiple(path, **patches):
+            output = get_data(
+                base_url='some_url',
+                params='some_params',
+                rate_limiter=rate_limiter_mock
+            )
+
+        self.assertEqual(first=output, second=response_200.json.return_value)
+        self.assertEqual(first=rate_limiter_mock.acquire.call_count, second=2)
+        rate_limiter_mock.backoff.assert_called_once_with(attempt=0, retry_after=2.)
+        rate_limiter_mock.recover.assert_called_once_with()
+        time_mock.sleep.assert_called_once_with(2.)
+
+        # gives up after max_retries
+        requests_get_mock = mock.Mock(return_value=response_429)
+        with mock.patch(path + '.SESSION.get', requests_get_mock), \
+                mock.patch.multiple(path, **patches):
+            get_data(
+                base_url='some_url',
+                params='some_params',
+                rate_limiter=rate_limiter_mock,
+                max_retries=2
+            )
+        self.assertEqual(first=requests_get_mock.call_count, second=3)
+        response_429.raise_for_status.assert_called_once_with()
+
+    def test_get_data_async(self):
+        response_503 = mock.Mock(status_code=503, headers={})
+        response_200 = mock.Mock(status_code=200)
+        session_mock = mock.Mock()
+        session_mock.get.side_effect = [response_503, response_200]
+        rate_limiter_mock = mock.Mock()
+        rate_limiter_mock.reserve.return_value = 0.
+        rate_limiter_mock.backoff.return_value = 0.
+
+        output = asyncio.run(get_data_async(
+            base_url='some_url',
+            params='some_params',
+            headers='headers',
+            rate_limiter=rate_limiter_mock,
+            session=session_mock
+        ))
+
+        self.assertEqual(first=output, second=response_200.json.return_value)
+        self.assertEqual(first=rate_limiter_mock.reserve.call_count, second=2)
+        rate_limiter_mock.backoff.assert_called_once_with(attempt=0, retry_after=None)
+        rate_limiter_mock.recover.assert_called_once_with()
+        session_mock.get.assert_called_with(
+            url='some_url',
+            params='some_params',
+            headers='headers',
+            timeout=NBASTATS_TIMEOUT
+        )
+
+    def test_get_session(self):
+        session = get_session(max_retries=2)
+        adapter = session.get_adapter('https://stats.nba.com/stats/')
+
+        self.assertEqual(first=adapter._pool_maxsize, second=NBASTATS_POOL_SIZE)
+        self.assertEqual(first=adapter.max_retries.total, second=2)
+        self.assertEqual(
+            first=set(adapter.max_retries.status_forcelist),
+            second={500, 502, 504}
+        )
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -6,6 +6,7 @@ import unittest
 
 from triple_triple_etl.core.nbastats_json2df import (
     convert_data_to_df,
+    convert_data_to_columns,
     get_play_by_play,
     get_boxscore
 )
@@ -24,6 +25,21 @@ class TestNBAStatsJson2Df(unittest.TestCase):
         df = convert_data_to_df(mock_data_bs_traditional)
         # check season was added
         self.assertTrue(expr='season' in df.columns)
+
+    def test_convert_data_to_columns(self):
+        columns = convert_data_to_columns(mock_data_bs_traditional)
+        df = convert_data_to_df(mock_data_bs_traditional)
+
+        # same columns and rows as the dataframe
+        self.assertEqual(first=list(columns), second=list(df.columns))
+        self.assertTrue(
+            all(len(columns[col]) == df.shape[0] for col in columns if col != 'season')
+        )
+        # result sets without a column are filled with None
+        self.assertEqual(
+            first=sum(x is None for x in columns['starters_bench']),
+            second=df.starters_bench.isnull().sum()
+        )
     
 
     def test_get_play_by_play(self):
@@ -0,0 +1,94 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+import unittest
+import unittest.mock as mock
+
+from triple_triple_etl.core.parquet_reader import (
+    read_parquet,
+    read_parquet_s3,
+    S3File,
+    select_row_groups
+)
+
+
+def s3_client(data: bytes):
+    """s3client mock of one object, read with ranged GETs"""
+    s3client_mock = mock.Mock()
+    s3client_mock.head_object.return_value = {'ContentLength': len(data)}
+
+    def get_object(Bucket, Key, Range):
+        first, last = [int(x) for x in Range.split('=')[1].split('-')]
+        body = mock.Mock()
+        body.read.return_value = data[first:last + 1]
+        return {'Body': body}
+
+    s3client_mock.get_object.side_effect = get_object
+    return s3client_mock
+
+
+class TestParquetReader(unittest.TestCase):
+    """Tests for parquet_reader.py"""
+
+    def setUp(self):
+        # sorted by eventid, 10 row groups of 1000 events
+        self.table = pa.table({
+            'eventid': [i // 4 for i in range(40000)],
+            'playerid': [-1, 1, 2, 3] * 10000,
+            'x_coordinate': [float(i) for i in range(40000)],
+        })
+        sink = pa.BufferOutputStream()
+        pq.write_table(self.table, sink, row_group_size=4000)
+        self.data = sink.getvalue().to_pybytes()
+
+    def test_s3file(self):
+        s3file = S3File('somebucket', 'somekey', s3client=s3_client(self.data))
+        self.assertEqual(first=s3file.size, second=len(self.data))
+        s3file.seek(-4, 2)
+        self.assertEqual(first=s3file.read(), second=b'PAR1')
+        s3file.seek(0)
+        self.assertEqual(first=s3file.read(4), second=b'PAR1')
+        self.assertEqual(first=s3file.tell(), second=4)
+        self.assertEqual(first=s3file.requests, second=2)
+
+    def test_select_row_groups(self):
+        metadata = pq.ParquetFile(pa.BufferReader(self.data)).metadata
+        self.assertEqual(
+            first=select_row_groups(metadata, [('eventid', '>=', 2500), ('eventid', '<', 3500)]),
+            second=[2, 3]
+        )
+        self.assertEqual(first=select_row_groups(metadata, [('eventid', 'in', [5, 9500])]), second=[0, 9])
+        self.assertEqual(first=select_row_groups(metadata, [('eventid', '=', 10000)]), second=[])
+        # every row group has the ball, its statistics can't prune it
+        self.assertEqual(first=len(select_row_groups(metadata, [('playerid', '=', -1)])), second=10)
+
+    def test_read_parquet(self):
+        table = read_parquet(
+            pa.BufferReader(self.data),
+            columns=['x_coordinate'],
+            filters=[('eventid', '=', 12), ('playerid', '=', -1)]
+        )
+        self.assertEqual(first=table.to_pydict(), second={'x_coordinate': [48.]})
+        self.assertEqual(first=read_parquet(pa.BufferReader(self.data)).num_rows, second=40000)
+
+    def test_read_parquet_s3(self):
+        s3client_mock = s3_client(self.data)
+        table = read_parquet_s3(
+            'somebucket',
+            'somekey',
+            columns=['eventid', 'x_coordinate'],
+            filters=[('eventid', '>=', 9500)],
+            s3client=s3client_mock
+        )
+        expected = self.table.filter(pa.compute.greater_equal(self.table['eventid'], 9500))
+        self.assertTrue(table.equals(expected.select(['eventid', 'x_coordinate'])))
+
+        # the footer, then two columns of the last row group
+        fetched = 0
+        for call in s3client_mock.get_object.call_args_list:
+            first, last = [int(x) for x in call[1]['Range'].split('=')[1].split('-')]
+            fetched += last - first + 1
+        self.assertLess(fetched, len(self.data) / 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import mock
+import unittest
+
+from triple_triple_etl.core.partition_projection import PartitionProjection
+
+
+def athena_client():
+    athena_mock = mock.Mock()
+    athena_mock.start_query_execution.return_value = {'QueryExecutionId': 'someid'}
+    athena_mock.get_query_execution.return_value = {
+        'QueryExecution': {'Status': {'State': 'SUCCEEDED'}}
+    }
+    return athena_mock
+
+
+class TestPartitionProjection(unittest.TestCase):
+    """Tests for partition_projection.py"""
+
+    def test_properties(self):
+        projection = PartitionProjection(
+            table='closest_to_ball',
+            seasons=['2015-2016'],
+            gameid_range=('0021500001', '0021501230'),
+            bucket='somebucket'
+        )
+        properties = projection.properties()
+        self.assertEqual(first=properties['projection.gameid.type'], second='integer')
+        self.assertEqual(first=properties['projection.gameid.range'], second='21500001,21501230')
+        self.assertEqual(first=properties['projection.gameid.digits'], second='10')
+        self.assertEqual(
+            first=properties['storage.location.template'],
+            second='s3://somebucket/closest_to_ball/season=${season}/gameid=${gameid}'
+        )
+
+        projection = PartitionProjection(
+            table='closest_to_ball',
+            seasons=['2015-2016'],
+            gameids=['0021500002', '0021500001']
+        )
+        properties = projection.properties()
+        self.assertEqual(first=properties['projection.gameid.type'], second='enum')
+        self.assertEqual(first=properties['projection.gameid.values'], second='0021500001,0021500002')
+
+        with self.assertRaises(ValueError):
+            PartitionProjection(table='closest_to_ball', seasons=['2015-2016'])
+
+    def test_enable(self):
+        athena_mock = athena_client()
+        projection = PartitionProjection(
+            table='player_actions',
+            seasons=['2015-2016'],
+            gameids=['0021500001'],
+            athena_client=athena_mock
+        )
+        projection.enable()
+
+        query = athena_mock.start_query_execution.call_args[1]['QueryString']
+        self.assertTrue(query.startswith('ALTER TABLE nba.player_actions SET TBLPROPERTIES'))
+        self.assertIn("'projection.enabled' = 'true'", query)
+        self.assertIn("'projection.gameid.values' = '0021500001'", query)
+        athena_mock.get_query_execution.assert_called_once_with(QueryExecutionId='someid')
+
+    def test_add_flush(self):
+        athena_mock = athena_client()
+        projection = PartitionProjection(
+            table='player_actions',
+            seasons=['2015-2016'],
+            gameid_range=('0021500001', '0021501230'),
+            athena_client=athena_mock
+        )
+
+        # games in the projection need nothing
+        with projection:
+            for gameid in ['0021500001', '0021500500', '0021501230']:
+                projection.add('2015-2016', gameid, 's3://somewhere')
+        self.assertEqual(first=len(projection), second=0)
+        athena_mock.start_query_execution.assert_not_called()
+
+        # others extend it with one query
+        projection.add('2015-2016', '0041500101', 's3://somewhere')
+        projection.add('2016-2017', '0021600001', 's3://somewhere')
+        self.assertEqual(first=len(projection), second=2)
+        self.assertEqual(first=list(projection.flush()), second=['set_projection_player_actions'])
+
+        athena_mock.start_query_execution.assert_called_once()
+        properties = projection.properties()
+        self.assertEqual(first=properties['projection.gameid.range'], second='21500001,41500101')
+        self.assertEqual(first=properties['projection.season.values'], second='2015-2016,2016-2017')
+        self.assertEqual(first=len(projection), second=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
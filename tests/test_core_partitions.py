@@ -0,0 +1,92 @@
+import mock
+import unittest
+
+from triple_triple_etl.core.partitions import PartitionRegistry
+
+
+def athena_client():
+    athena_mock = mock.Mock()
+    athena_mock.start_query_execution.return_value = {'QueryExecutionId': 'someid'}
+    athena_mock.get_query_execution.return_value = {
+        'QueryExecution': {'Status': {'State': 'SUCCEEDED'}}
+    }
+    return athena_mock
+
+
+class TestPartitionRegistry(unittest.TestCase):
+    """Tests for partitions.py"""
+
+    def test_flush_athena(self):
+        athena_mock = athena_client()
+        registry = PartitionRegistry(table='closest_to_ball', athena_client=athena_mock)
+
+        # a season of games in a few queries
+        for gameid in range(1230):
+            registry.add('2015-2016', str(gameid), 's3://bucket/closest_to_ball/gameid={}'.format(gameid))
+        registry.add('2015-2016', '0', 's3://bucket/closest_to_ball/gameid=0')
+        self.assertEqual(first=len(registry), second=1230)
+
+        responses = registry.flush()
+
+        self.assertEqual(first=athena_mock.start_query_execution.call_count, second=3)
+        self.assertEqual(first=len(responses), second=3)
+        query = athena_mock.start_query_execution.call_args_list[0][1]['QueryString']
+        self.assertTrue(query.startswith('ALTER TABLE nba.closest_to_ball ADD IF NOT EXISTS'))
+        self.assertEqual(first=query.count('PARTITION ('), second=500)
+        self.assertIn(
+            "PARTITION (season = '2015-2016', gameid = '1') LOCATION 's3://bucket/closest_to_ball/gameid=1'",
+            query
+        )
+        # each query is waited on
+        self.assertEqual(first=athena_mock.get_query_execution.call_count, second=3)
+        self.assertEqual(first=len(registry), second=0)
+        self.assertEqual(first=len(registry.registered), second=1230)
+
+        # nothing left to add
+        self.assertEqual(first=registry.flush(), second={})
+        self.assertEqual(first=athena_mock.start_query_execution.call_count, second=3)
+
+    def test_flush_athena_failed(self):
+        athena_mock = athena_client()
+        athena_mock.get_query_execution.return_value = {
+            'QueryExecution': {'Status': {'State': 'FAILED', 'StateChangeReason': 'bad'}}
+        }
+        registry = PartitionRegistry(table='closest_to_ball', athena_client=athena_mock)
+        registry.add('2015-2016', '1234', 's3://bucket/key')
+
+        with self.assertRaises(RuntimeError):
+            registry.flush()
+        # the partition can be flushed again
+        self.assertEqual(first=len(registry), second=1)
+
+    def test_flush_glue(self):
+        glue_mock = mock.Mock()
+        glue_mock.get_table.return_value = {
+            'Table': {'StorageDescriptor': {'Location': 's3://bucket/table', 'Columns': []}}
+        }
+        glue_mock.batch_create_partition.return_value = {
+            'Errors': [{'ErrorDetail': {'ErrorCode': 'AlreadyExistsException'}}]
+        }
+
+        with PartitionRegistry(table='player_actions', use_glue=True, glue_client=glue_mock) as registry:
+            for gameid in range(150):
+                registry.add('2015-2016', str(gameid), 's3://bucket/gameid={}'.format(gameid))
+
+        self.assertEqual(first=glue_mock.batch_create_partition.call_count, second=2)
+        partitions = glue_mock.batch_create_partition.call_args_list[0][1]['PartitionInputList']
+        self.assertEqual(first=len(partitions), second=100)
+        self.assertEqual(first=partitions[1]['Values'], second=['2015-2016', '1'])
+        self.assertEqual(first=partitions[1]['StorageDescriptor']['Location'], second='s3://bucket/gameid=1')
+        self.assertEqual(first=len(registry), second=0)
+
+        # other errors are raised
+        glue_mock.batch_create_partition.return_value = {
+            'Errors': [{'ErrorDetail': {'ErrorCode': 'InternalServiceException'}}]
+        }
+        registry.add('2015-2016', '1234', 's3://bucket/key')
+        with self.assertRaises(RuntimeError):
+            registry.flush()
+
+
+if __name__ == '__main__':
+    unittest.main()
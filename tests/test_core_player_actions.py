@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import unittest
+
+from triple_triple_etl.core.player_actions import (
+    EventCodeLookup,
+    get_event_code_lookup,
+    get_player_actions,
+    PLAYER_ACTIONS_SCHEMA
+)
+
+
+def playbyplay_table(rows: list):
+    columns = [
+        'eventnum', 'eventmsgtype', 'eventmsgactiontype', 'homedescription',
+        'visitordescription', 'player1_id', 'player2_id', 'player3_id'
+    ]
+    df = pd.DataFrame(rows, columns=columns)
+    df['period'] = 1.
+    df['wctimestring'] = '19:00:00'
+    df['pctimestring'] = '11:42'
+    for i in [1, 2, 3]:
+        player_id = 'player{}_id'.format(i)
+        df[player_id] = df[player_id].astype(float)
+        df['player{}_name'.format(i)] = df[player_id].map(
+            lambda x: None if np.isnan(x) else 'player {}'.format(int(x))
+        )
+        df['player{}_team_id'.format(i)] = 100. * i
+        df['player{}_team_city'.format(i)] = 'city {}'.format(i)
+        df['player{}_team_abbreviation'.format(i)] = 'AB{}'.format(i)
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+class TestPlayerActions(unittest.TestCase):
+    """Tests for player_actions.py"""
+
+    def test_event_code_lookup(self):
+        df_codes = pd.DataFrame(
+            data=[
+                [3, 'field goal made', 1, 'jump shot'],
+                [3, 'field goal made', 5, 'layup shot'],
+                [5, 'offensive rebound', 0, 'placeholder'],
+                [10, 'substitution', None, None],
+            ],
+            columns=['event_code', 'event_action', 'event_subcode', 'event_subaction']
+        )
+        lookup = EventCodeLookup(df_codes)
+
+        eventmsgtype = np.array([1, 1, 1, 4, 8, 50, -1])
+        self.assertEqual(
+            first=list(lookup.get_action(eventmsgtype)),
+            second=['field goal made'] * 3 + ['offensive rebound', 'substitution', None, None]
+        )
+        # out of range codes are None, like a LEFT JOIN miss
+        self.assertEqual(
+            first=list(lookup.get_subaction(eventmsgtype, np.array([1, 5, 500, 0, 0, 1, 1]))),
+            second=['jump shot', 'layup shot', None, 'placeholder', None, None, None]
+        )
+        self.assertEqual(
+            first=list(lookup.get_single_subaction(eventmsgtype)),
+            second=[None, None, None, 'placeholder', None, None, None]
+        )
+
+    def test_get_event_code_lookup(self):
+        lookup = get_event_code_lookup()
+        self.assertIs(lookup, get_event_code_lookup())
+        self.assertEqual(first=lookup.action[1], second='field goal made')
+        self.assertEqual(first=lookup.subaction[3, 12], second='free throw 2 of 2')
+
+    def test_get_player_actions(self):
+        table = playbyplay_table([
+            # eventnum, type, actiontype, home, visitor, player1, player2, player3
+            [1, 10, 0, 'Jump Ball A vs. B: Tip to C', None, 1, 2, 3],
+            [2, 1, 102, None, 'A 3PT Jump Shot (3 PTS) (C 1 AST)', 1, 3, None],
+            [3, 2, 102, 'MISS B 15\' Jump Shot', None, 2, None, None],
+            [4, 4, 0, 'B Rebound', None, 2, None, None],
+            [5, 3, 12, 'MISS B Free Throw 2 of 2', None, 2, None, None],
+            [6, 5, 40, 'B Out of Bounds Turnover', None, 2, None, None],
+            [7, 5, 1, 'B STEAL (1 STL)', 'A Bad Pass Turnover (P1.T1)', 1, 2, None],
+            [8, 6, 1, 'B P.FOUL', None, 2, 1, None],
+            [9, 9, 1, 'Timeout', None, 0, None, None],
+        ])
+        output = get_player_actions(table, season='2015-2016', gameid='1234')
+
+        self.assertEqual(first=output.schema, second=PLAYER_ACTIONS_SCHEMA)
+        df = output.to_pandas()
+
+        self.assertEqual(
+            first=df[['eventnum', 'playerid', 'event_action', 'event_subsubaction']].values.tolist(),
+            second=[
+                [1., 1., 'jump ball', None],
+                [1., 2., 'jump ball', None],
+                [1., 3., 'jump ball', 'jump ball tip'],
+                [2., 1., 'field goal made', '3pt made'],
+                [2., 3., 'assist', None],
+                [3., 2., 'field goal missed', '2pt missed'],
+                [4., 2., 'rebound', None],
+                [5., 2., 'free throw missed', None],
+                [6., 2., 'turnover', None],
+                [7., 2., 'steal', None],
+                [7., 1., 'turnover', None],
+                [8., 1., 'foul', 'got fouled'],
+                [8., 2., 'foul', 'committed fouled'],
+                [9., 0., 'timeout', None],
+            ]
+        )
+        # made and missed shots differ on 102, 40 is the out of bounds turnover
+        self.assertEqual(
+            first=df.event_subaction.tolist()[3:9],
+            second=[
+                'driving floating bank jump shot',
+                None,
+                'driving bank jump shot',
+                'placeholder',
+                'free throw 2 of 2',
+                'out of bounds'
+            ]
+        )
+        # assists use the event code as eventmsgtype
+        self.assertEqual(first=df.eventmsgtype[4], second=25.)
+        self.assertTrue(np.isnan(df.eventmsgactiontype[4]))
+
+        self.assertEqual(first=df.description[3], second='A 3PT Jump Shot (3 PTS) (C 1 AST)')
+        self.assertEqual(first=df.is_home.tolist()[3:6], second=[0, 0, 1])
+        self.assertEqual(first=df.playername[2], second='player 3')
+        self.assertEqual(first=df.player_team_city[2], second='city 3')
+        self.assertEqual(first=df.period_time[0], second=702)
+        self.assertEqual(first=set(df.gameid), second={'1234'})
+
+        empty = get_player_actions(table.slice(0, 0), season='2015-2016', gameid='1234')
+        self.assertEqual(first=empty.num_rows, second=0)
+        self.assertEqual(first=empty.schema, second=PLAYER_ACTIONS_SCHEMA)
+
+
+if __name__ == '__main__':
+    unittest.main()
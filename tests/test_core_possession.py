@@ -0,0 +1,78 @@
+import numpy as np
+import pyarrow as pa
+import unittest
+
+from triple_triple_etl.core.possession import (
+    get_possessions,
+    run_length_encode,
+    POSSESSION_COL_ORDER
+)
+
+
+def closest_to_ball_table(eventid, moment_num, playerid, distance_sq):
+    num_rows = len(eventid)
+    return pa.table({
+        'eventid': eventid,
+        'moment_num': moment_num,
+        'timestamp_utc': [1000 + 40 * i for i in range(num_rows)],
+        'period': [1] * num_rows,
+        'periodclock': [720. - 0.04 * i for i in range(num_rows)],
+        'teamid': [100 if playerid < 20 else 200 for playerid in playerid],
+        'playerid': playerid,
+        'distance_from_ball_sq': distance_sq,
+        'closest_to_ball_rank': [1] * num_rows,
+    })
+
+
+class TestPossession(unittest.TestCase):
+    """Tests for possession.py"""
+
+    def test_run_length_encode(self):
+        starts, lengths = run_length_encode(
+            np.array([1, 1, 1, 2, 2]),
+            np.array([5, 5, 6, 6, 6])
+        )
+        self.assertEqual(first=list(starts), second=[0, 2, 3])
+        self.assertEqual(first=list(lengths), second=[2, 1, 2])
+
+        starts, lengths = run_length_encode(np.array([]))
+        self.assertEqual(first=len(starts), second=0)
+
+    def test_get_possessions(self):
+        table = closest_to_ball_table(
+            eventid=[1] * 8 + [2] * 3,
+            moment_num=list(range(8)) + [0, 1, 2],
+            # player 10 for 3 moments, no one within the distance, player 21
+            # for 2 moments, then 1 moment, event 2 continues player 21
+            playerid=[10, 10, 10, 10, 21, 21, 10, 21, 21, 21, 21],
+            distance_sq=[1., 0.5, 2., 9., 1., 3., 1., 1., 1., 1., np.nan]
+        )
+        # the second ranked player in a moment is ignored
+        second = closest_to_ball_table([1], [0], [22], [0.1]).set_column(
+            8, 'closest_to_ball_rank', pa.array([2])
+        )
+        table = pa.concat_tables([second, table])
+
+        output = get_possessions(table, has_ball_dist_sq=4., min_moments=2)
+
+        self.assertEqual(first=output.schema.names, second=POSSESSION_COL_ORDER)
+        self.assertEqual(first=output.column('playerid').to_pylist(), second=[10, 21, 21])
+        self.assertEqual(first=output.column('eventid').to_pylist(), second=[1, 1, 2])
+        self.assertEqual(first=output.column('start_moment_num').to_pylist(), second=[0, 4, 0])
+        self.assertEqual(first=output.column('end_moment_num').to_pylist(), second=[2, 5, 1])
+        self.assertEqual(first=output.column('num_moments').to_pylist(), second=[3, 2, 2])
+        self.assertEqual(first=output.column('teamid').to_pylist(), second=[100, 200, 200])
+        self.assertEqual(first=output.column('min_distance_from_ball_sq').to_pylist(), second=[0.5, 1., 1.])
+        self.assertEqual(first=output.column('duration').to_pylist(), second=[0.08, 0.04, 0.04])
+
+        # skipped moments break a possession
+        table = closest_to_ball_table([1] * 4, [0, 1, 3, 4], [10] * 4, [1.] * 4)
+        output = get_possessions(table, min_moments=2)
+        self.assertEqual(first=output.column('start_moment_num').to_pylist(), second=[0, 3])
+
+        output = get_possessions(table.slice(0, 0))
+        self.assertEqual(first=output.num_rows, second=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
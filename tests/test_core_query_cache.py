@@ -0,0 +1,134 @@
+import datetime
+import mock
+import shutil
+import tempfile
+import unittest
+
+from botocore.exceptions import ClientError
+
+from triple_triple_etl.core.athena import execute_athena_query
+from triple_triple_etl.core.query_cache import (
+    get_inputs_fingerprint,
+    is_read_only,
+    LocalQueryCacheBackend,
+    QueryResultCache
+)
+
+
+def s3_client(objects: dict):
+    """s3client mock listing `objects`, {key: etag}, in some-bucket."""
+    s3client_mock = mock.Mock()
+
+    def paginate(Bucket, Prefix):
+        return [{'Contents': [
+            {'Key': key, 'ETag': etag, 'LastModified': datetime.datetime(2018, 1, 1)}
+            for key, etag in objects.items() if key.startswith(Prefix)
+        ]}]
+
+    s3client_mock.get_paginator.return_value.paginate.side_effect = paginate
+    return s3client_mock
+
+
+class TestQueryCache(unittest.TestCase):
+    """Tests for query_cache.py"""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.inputs = ['s3://some-bucket/playbyplay/gameid=1/']
+        self.objects = {
+            'playbyplay/gameid=1/file1.parquet': '"etag1"',
+            'playbyplay/gameid=2/file1.parquet': '"etag2"'
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_is_read_only(self):
+        self.assertTrue(is_read_only('SELECT * FROM nba.gamelog'))
+        self.assertTrue(is_read_only('/*\n    some comment\n*/\n\nWITH first_bucket AS (SELECT 1)'))
+        self.assertTrue(is_read_only('-- comment\nselect 1'))
+        self.assertFalse(is_read_only('CREATE TABLE nba.ball_dist_tmp AS SELECT 1'))
+        self.assertFalse(is_read_only('DROP TABLE IF EXISTS nba.ball_dist_tmp'))
+        self.assertFalse(is_read_only('ALTER TABLE nba.closest_to_ball ADD IF NOT EXISTS'))
+
+    def test_get_inputs_fingerprint(self):
+        fingerprint = get_inputs_fingerprint(self.inputs, s3client=s3_client(self.objects))
+        self.assertEqual(
+            first=fingerprint,
+            second=[['s3://some-bucket/playbyplay/gameid=1/file1.parquet', '"etag1"', '2018-01-01 00:00:00']]
+        )
+
+    def test_key(self):
+        s3client_mock = s3_client(self.objects)
+        cache = QueryResultCache(backend=LocalQueryCacheBackend(self.cache_dir), s3client=s3client_mock)
+        key = cache.key('SELECT 1', 'nba', 'some_output', self.inputs)
+
+        self.assertEqual(first=cache.key('SELECT 1', 'nba', 'some_output', self.inputs), second=key)
+        self.assertNotEqual(first=cache.key('SELECT 2', 'nba', 'some_output', self.inputs), second=key)
+        # reloaded input
+        self.objects['playbyplay/gameid=1/file1.parquet'] = '"etag3"'
+        self.assertNotEqual(first=cache.key('SELECT 1', 'nba', 'some_output', self.inputs), second=key)
+        # other inputs don't matter
+        self.objects['playbyplay/gameid=1/file1.parquet'] = '"etag1"'
+        self.objects['playbyplay/gameid=2/file1.parquet'] = '"etag4"'
+        self.assertEqual(first=cache.key('SELECT 1', 'nba', 'some_output', self.inputs), second=key)
+
+    def test_get_set(self):
+        s3client_mock = s3_client(self.objects)
+        cache = QueryResultCache(backend=LocalQueryCacheBackend(self.cache_dir), s3client=s3client_mock)
+        self.assertIsNone(cache.get('somekey'))
+
+        record = cache.set('somekey', 'someid', 'some_output')
+        self.assertEqual(first=cache.get('somekey'), second=record)
+        self.assertTrue(record['OutputLocation'].endswith('/some_output/someid.csv'))
+
+        # expired
+        cache.ttl = -1
+        self.assertIsNone(cache.get('somekey'))
+        self.assertIsNone(cache.backend.get('somekey'))
+
+        # the result was removed, eg the query failed
+        cache.ttl = 60
+        cache.set('somekey', 'someid', 'some_output')
+        s3client_mock.head_object.side_effect = ClientError(
+            {'Error': {'Code': '404', 'Message': 'Not Found'}},
+            'HeadObject'
+        )
+        self.assertIsNone(cache.get('somekey'))
+
+    def test_execute_athena_query(self):
+        athena_mock = mock.Mock()
+        athena_mock.start_query_execution.side_effect = [
+            {'QueryExecutionId': 'id{}'.format(i)} for i in range(3)
+        ]
+        cache = QueryResultCache(
+            backend=LocalQueryCacheBackend(self.cache_dir),
+            s3client=s3_client(self.objects)
+        )
+
+        def execute(query):
+            return execute_athena_query(
+                query=query,
+                database='nba',
+                output_filename='team_shooting_side',
+                boto3_client=athena_mock,
+                cache=cache,
+                inputs=self.inputs
+            )
+
+        self.assertEqual(first=execute('SELECT 1'), second={'QueryExecutionId': 'id0'})
+        # same query on the same data
+        self.assertEqual(first=execute('SELECT 1'), second={'QueryExecutionId': 'id0', 'Cached': True})
+        self.assertEqual(first=athena_mock.start_query_execution.call_count, second=1)
+
+        # the input changed
+        self.objects['playbyplay/gameid=1/file2.parquet'] = '"etag5"'
+        self.assertEqual(first=execute('SELECT 1'), second={'QueryExecutionId': 'id1'})
+
+        # not cached
+        execute('DROP TABLE IF EXISTS nba.ball_dist_tmp')
+        self.assertEqual(first=athena_mock.start_query_execution.call_count, second=3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import mock
+import unittest
+
+from botocore.exceptions import ClientError
+
+from triple_triple_etl.core.query_scheduler import QueryScheduler
+
+
+class FakeAthena(object):
+    """Queries finish after `polls` batch_get_query_execution calls."""
+    def __init__(self, polls=2, failing=(), throttled=0):
+        self.polls = polls
+        self.failing = failing
+        self.throttled = throttled
+        self.queries = {}
+        self.in_flight = set()
+        self.max_in_flight = 0
+        self.started = []
+
+    def start_query_execution(self, QueryString, **kwargs):
+        if self.throttled:
+            self.throttled -= 1
+            raise ClientError(
+                {'Error': {'Code': 'TooManyRequestsException', 'Message': 'slow down'}},
+                'StartQueryExecution'
+            )
+        execution_id = 'id{}'.format(len(self.started))
+        self.started.append(QueryString)
+        self.queries[execution_id] = [QueryString, self.polls]
+        self.in_flight.add(execution_id)
+        self.max_in_flight = max(self.max_in_flight, len(self.in_flight))
+        return {'QueryExecutionId': execution_id}
+
+    def batch_get_query_execution(self, QueryExecutionIds):
+        assert len(QueryExecutionIds) <= 50
+        executions = []
+        for execution_id in QueryExecutionIds:
+            query = self.queries[execution_id]
+            query[1] -= 1
+            if query[1] > 0:
+                state = 'RUNNING'
+            else:
+                state = 'FAILED' if query[0] in self.failing else 'SUCCEEDED'
+                self.in_flight.discard(execution_id)
+            executions.append({'QueryExecutionId': execution_id, 'Status': {'State': state}})
+        return {'QueryExecutions': executions}
+
+
+class TestQueryScheduler(unittest.TestCase):
+    """Tests for query_scheduler.py"""
+
+    def setUp(self):
+        patcher = mock.patch('triple_triple_etl.core.query_scheduler.time.sleep')
+        self.sleep_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_max_concurrency(self):
+        athena_mock = FakeAthena(polls=3)
+        scheduler = QueryScheduler(max_concurrency=20, boto3_client=athena_mock)
+        for i in range(120):
+            scheduler.submit(name=str(i), query='query {}'.format(i), output_filename='team_shooting_side')
+
+        executions = scheduler.run()
+
+        self.assertEqual(first=len(executions), second=120)
+        self.assertEqual(first=scheduler.failed, second={})
+        self.assertEqual(first=athena_mock.max_in_flight, second=20)
+        self.assertEqual(first=scheduler.s3key('5'), second='team_shooting_side/id5.csv')
+        # 6 rounds of 20 queries, 3 polls each
+        self.assertEqual(first=self.sleep_mock.call_count, second=18)
+
+    def test_depends_on(self):
+        athena_mock = FakeAthena(polls=1, failing=('query b',))
+        scheduler = QueryScheduler(boto3_client=athena_mock)
+        scheduler.submit(name='a', query='query a')
+        scheduler.submit(name='b', query='query b')
+        scheduler.submit(name='c', query='query c', depends_on=['a'])
+        scheduler.submit(name='d', query='query d', depends_on=['b', 'c'])
+
+        scheduler.run()
+
+        self.assertEqual(first=athena_mock.started, second=['query a', 'query b', 'query c'])
+        self.assertEqual(first=sorted(scheduler.executions), second=['a', 'c'])
+        self.assertEqual(first=sorted(scheduler.failed), second=['b', 'd'])
+
+        with self.assertRaises(ValueError):
+            scheduler.submit(name='e', query='query e', depends_on=['f'])
+        with self.assertRaises(ValueError):
+            scheduler.submit(name='a', query='query a')
+
+    def test_throttled(self):
+        athena_mock = FakeAthena(polls=1, throttled=2)
+        scheduler = QueryScheduler(boto3_client=athena_mock)
+        scheduler.submit(name='a', query='query a')
+
+        self.assertEqual(first=list(scheduler.run()), second=['a'])
+        self.assertEqual(first=athena_mock.started, second=['query a'])
+
+    def test_on_success(self):
+        athena_mock = FakeAthena(polls=1, failing=('query b',))
+        scheduler = QueryScheduler(max_concurrency=1, boto3_client=athena_mock)
+        for name in ['a', 'b', 'c']:
+            scheduler.submit(name=name, query='query {}'.format(name))
+
+        # each query is handed over before the next one starts
+        succeeded = []
+        scheduler.run(on_success=lambda name: succeeded.append((name, len(athena_mock.started))))
+
+        self.assertEqual(first=succeeded, second=[('a', 1), ('c', 3)])
+
+    def test_timeout(self):
+        athena_mock = FakeAthena(polls=100)
+        scheduler = QueryScheduler(max_time=10, boto3_client=athena_mock)
+        scheduler.submit(name='a', query='query a')
+
+        path = 'triple_triple_etl.core.query_scheduler.time.monotonic'
+        with mock.patch(path, side_effect=[0, 5, 11]):
+            with self.assertRaises(TimeoutError):
+                scheduler.run()
+
+
+if __name__ == '__main__':
+    unittest.main()
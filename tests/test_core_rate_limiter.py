@@ -0,0 +1,59 @@
+import mock
+import unittest
+
+from triple_triple_etl.core.rate_limiter import TokenBucket
+
+
+class TestTokenBucket(unittest.TestCase):
+    """Tests for rate_limiter.py"""
+
+    def setUp(self):
+        # a clock we move by hand
+        self.now = 0.
+        patcher = mock.patch(
+            'triple_triple_etl.core.rate_limiter.time.monotonic',
+            side_effect=lambda: self.now
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reserve(self):
+        bucket = TokenBucket(rate=2., burst=3)
+
+        # the burst is free, then one request every 1 / rate seconds
+        waits = [bucket.reserve() for _ in range(5)]
+        self.assertEqual(first=waits, second=[0., 0., 0., 0.5, 1.])
+
+        # tokens refill over time, up to the burst
+        self.now = 100.
+        waits = [bucket.reserve() for _ in range(4)]
+        self.assertEqual(first=waits, second=[0., 0., 0., 0.5])
+
+    def test_backoff_recover(self):
+        bucket = TokenBucket(rate=4., burst=2, min_rate=1., recovery_step=1.)
+
+        wait = bucket.backoff(attempt=0, retry_after=3.)
+        self.assertEqual(first=wait, second=3.)
+        self.assertEqual(first=bucket.rate, second=2.)
+        # the bucket is emptied so the next request waits
+        self.assertEqual(first=bucket.reserve(), second=0.5)
+
+        bucket.backoff(attempt=1)
+        bucket.backoff(attempt=2)
+        self.assertEqual(first=bucket.rate, second=1.)
+
+        # exponential backoff with jitter
+        wait = bucket.backoff(attempt=3, base_delay=1.)
+        self.assertTrue(4. <= wait <= 8.)
+
+        for _ in range(10):
+            bucket.recover()
+        self.assertEqual(first=bucket.rate, second=4.)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            TokenBucket(rate=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
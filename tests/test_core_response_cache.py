@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from triple_triple_etl.core.response_cache import ResponseCache
+
+
+class TestResponseCache(unittest.TestCase):
+    """Tests for response_cache.py"""
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.params = {'GameID': '0021500492', 'Season': '2015-16'}
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_get_set(self):
+        cache = ResponseCache(self.cache_dir)
+        self.assertIsNone(cache.get('some_url', self.params))
+
+        data = {'resultSets': [{'headers': ['GAME_ID'], 'rowSet': [['0021500492']]}]}
+        cache.set('some_url', self.params, data)
+
+        # the params order doesn't matter
+        params = dict(reversed(list(self.params.items())))
+        self.assertEqual(first=cache.get('some_url', params), second=data)
+        self.assertIsNone(cache.get('other_url', self.params))
+        self.assertIsNone(cache.get('some_url', {'GameID': '0021500493'}))
+
+    def test_ttl(self):
+        cache = ResponseCache(self.cache_dir, ttl=60)
+        cache.set('some_url', self.params, {'some': 'data'})
+        self.assertEqual(first=cache.get('some_url', self.params), second={'some': 'data'})
+
+        # expired responses are removed
+        self.assertIsNone(cache.get('some_url', self.params, ttl=-1))
+        self.assertEqual(first=cache.size(), second=0)
+
+    def test_evict(self):
+        cache = ResponseCache(self.cache_dir, max_size_mb=1, evict_to=0.7)
+        # ~0.3 MB gzipped
+        data = {'rowSet': [os.urandom(4000).hex() for _ in range(70)]}
+        for i in range(3):
+            cache.set('some_url', {'GameID': str(i)}, data)
+            # older access times, least recently used is evicted first
+            filepath = cache._filepath(cache.key('some_url', {'GameID': str(i)}))
+            os.utime(filepath, (time.time() - 100 + i, time.time()))
+        self.assertIsNotNone(cache.get('some_url', {'GameID': '0'}))
+
+        # over 1 MB, evicts down to 0.7 MB
+        cache.set('some_url', {'GameID': '4'}, data)
+        self.assertLessEqual(cache.size(), 0.7 * 1024 ** 2)
+        self.assertIsNotNone(cache.get('some_url', {'GameID': '0'}))
+        self.assertIsNotNone(cache.get('some_url', {'GameID': '4'}))
+        self.assertIsNone(cache.get('some_url', {'GameID': '1'}))
+        self.assertIsNone(cache.get('some_url', {'GameID': '2'}))
+
+    def test_corrupt_file(self):
+        cache = ResponseCache(self.cache_dir)
+        cache.set('some_url', self.params, {'some': 'data'})
+        filepath = cache._filepath(cache.key('some_url', self.params))
+        with open(filepath, 'wb') as f:
+            f.write(b'not gzip')
+
+        self.assertIsNone(cache.get('some_url', self.params))
+
+        cache.clear()
+        self.assertEqual(first=cache.size(), second=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
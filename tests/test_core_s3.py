@@ -1,19 +1,37 @@
 import io
+import json
+import mock
 import os
 import pandas as pd
+import shutil
+import tempfile
 import unittest
 
 import boto3
 import moto
+import py7zr
 
 from triple_triple_etl.core.s3 import (
     get_game_files,
     s3download,
+    s3download_fileobj,
     get_bucket_content,
+    get_bucket_keys,
+    get_bucket_sizes,
+    iter_bucket_keys,
     check_key_exists,
     copy_bucket_contents,
-    remove_bucket_contents
+    copy_objects,
+    delete_objects,
+    remove_bucket_contents,
+    upload_object,
+    JSONItemParser,
+    iter_7z_json,
+    load_7z_json,
+    open_7z_json
 )
+from tests.fixtures.mock_s3rawdata import data
+from triple_triple_etl.core.response_cache import ResponseCache
 from triple_triple_etl.constants import META_DIR
 
 class TestS3(unittest.TestCase):
@@ -199,6 +217,83 @@ class TestS3(unittest.TestCase):
         if os.path.exists(path):
             os.remove(path)
 
+    @moto.mock_s3
+    def test_s3download_fileobj(self):
+        s3 = boto3.resource('s3')
+
+        output = io.BytesIO(b'some contents and stuff')
+        bucket = s3.Bucket('fake-bucket')
+
+        bucket.create()
+        bucket.upload_fileobj(Fileobj=output, Key='something.7z')
+
+        fileobj = s3download_fileobj(bucket_name='fake-bucket', filename='something.7z')
+        assert fileobj.read() == b'some contents and stuff'
+
+    def test_json_item_parser(self):
+        text = '{"gameid": "0021500492", "events": [{"eventId": "1"}, 2], "period": 1.5e3}'
+        expected = [
+            ('gameid', '0021500492'),
+            ('events', {'eventId': '1'}),
+            ('events', 2),
+            ('period', 1500.)
+        ]
+        # values split over chunks at every position
+        for chunk_size in [1, 2, 5, len(text)]:
+            items = []
+            parser = JSONItemParser(items.append, items_key='events')
+            for i in range(0, len(text), chunk_size):
+                parser.feed(text[i:i + chunk_size].encode())
+            parser.close()
+            self.assertEqual(first=items, second=expected)
+
+        parser = JSONItemParser(items.append)
+        parser.feed(b'{"gameid": "0021500492", "events": [')
+        with self.assertRaises(ValueError):
+            parser.close()
+
+        # a long event fed in small chunks is not decoded again per chunk
+        event = {'eventid': '1', 'moments': [[1, 2, [[-1, -1, 1.5, 2.5, 3.5]] * 10]] * 500}
+        text = json.dumps({'gameid': '0021500492', 'events': [event]})
+        items = []
+        parser = JSONItemParser(items.append)
+        parser.decoder = mock.Mock(wraps=json.JSONDecoder())
+        for i in range(0, len(text), 100):
+            parser.feed(text[i:i + 100].encode())
+        parser.close()
+        self.assertEqual(first=items[-1], second=('events', json.loads(json.dumps(event))))
+        self.assertLess(parser.decoder.raw_decode.call_count, len(text) // 100 // 10)
+
+    def test_iter_7z_json(self):
+        archive = io.BytesIO()
+        with py7zr.SevenZipFile(archive, mode='w') as f:
+            f.writestr(json.dumps(data), 'somefile.json')
+
+        archive.seek(0)
+        self.assertEqual(
+            first=load_7z_json(archive),
+            second=json.loads(json.dumps(data))
+        )
+
+        # stop reading after the first event
+        archive.seek(0)
+        items = iter_7z_json(archive, max_queued_items=1)
+        keys = [next(items)[0] for _ in range(3)]
+        items.close()
+        self.assertEqual(first=set(keys[:2]), second={'gameid', 'gamedate'})
+        self.assertEqual(first=keys[2], second='events')
+
+        # the top level values, then the events as they are consumed
+        archive.seek(0)
+        game = open_7z_json(archive)
+        self.assertEqual(first=game['gameid'], second=data['gameid'])
+        self.assertEqual(first=game['gamedate'], second=data['gamedate'])
+        self.assertNotIsInstance(game['events'], list)
+        self.assertEqual(
+            first=list(game['events']),
+            second=json.loads(json.dumps(data['events']))
+        )
+
     def test_extract2dir(self):
         # create a file path
         path = os.path.join(os.path.dirname(__file__), 'extract_dir')
@@ -206,5 +301,215 @@ class TestS3(unittest.TestCase):
             extract2dir(__file__, path)
 
 
+def s3_client(keys: list, page_size: int = 2):
+    """s3client mock with a list_objects_v2 paginator of `keys`"""
+    s3client_mock = mock.Mock()
+
+    def paginate(Bucket, Prefix, Delimiter):
+        contents, common_prefixes = [], []
+        for key in sorted(keys):
+            if not key.startswith(Prefix):
+                continue
+            rest = key[len(Prefix):]
+            if Delimiter and Delimiter in rest:
+                common_prefix = Prefix + rest.split(Delimiter)[0] + Delimiter
+                if {'Prefix': common_prefix} not in common_prefixes:
+                    common_prefixes.append({'Prefix': common_prefix})
+            else:
+                contents.append({'Key': key})
+        pages = [
+            {'Contents': contents[i:i + page_size]}
+            for i in range(0, len(contents), page_size)
+        ] or [{}]
+        pages[-1]['CommonPrefixes'] = common_prefixes
+        return pages
+
+    s3client_mock.get_paginator.return_value.paginate.side_effect = paginate
+    return s3client_mock
+
+
+class TestS3Listing(unittest.TestCase):
+    """Tests for the paginated listings of s3.py"""
+
+    def setUp(self):
+        self.keys = [
+            'gameposition/season=2015-2016/gameid={}/part{}.parquet'.format(gameid, part)
+            for gameid in ['0021500001', '0021500002', '0021500003']
+            for part in range(3)
+        ] + ['gameposition/season=2015-2016/_SUCCESS']
+        self.prefix = 'gameposition/season=2015-2016/'
+        self.path = 'triple_triple_etl.core.s3'
+
+    def test_get_bucket_content(self):
+        with mock.patch.multiple(self.path, s3client=s3_client(self.keys)):
+            keys = get_bucket_content('somebucket', self.prefix, delimiter='')
+            subfolders = get_bucket_content('somebucket', self.prefix)
+
+        # all pages
+        self.assertEqual(first=keys, second=sorted(self.keys))
+        self.assertEqual(
+            first=[x['Prefix'] for x in subfolders],
+            second=[self.prefix + 'gameid=002150000{}/'.format(i) for i in range(1, 4)]
+        )
+
+    def test_iter_bucket_keys(self):
+        s3client_mock = s3_client(self.keys)
+        with mock.patch.multiple(self.path, s3client=s3client_mock):
+            keys = list(iter_bucket_keys('somebucket', self.prefix, max_workers=4))
+            self.assertEqual(first=sorted(keys), second=sorted(self.keys))
+            # one listing of the season and one per gameid
+            self.assertEqual(first=s3client_mock.get_paginator.return_value.paginate.call_count, second=4)
+
+            keys = list(iter_bucket_keys('somebucket', self.prefix, max_workers=1))
+            self.assertEqual(first=keys, second=sorted(self.keys))
+
+            # stops early
+            keys = iter_bucket_keys('somebucket', self.prefix, max_workers=4)
+            self.assertEqual(first=next(keys), second='gameposition/season=2015-2016/_SUCCESS')
+            keys.close()
+
+    def test_get_bucket_keys_snapshot(self):
+        cache_dir = tempfile.mkdtemp()
+        s3client_mock = s3_client(self.keys)
+        patches = {
+            's3client': s3client_mock,
+            'LISTING_SNAPSHOTS': ResponseCache(cache_dir)
+        }
+        try:
+            with mock.patch.multiple(self.path, **patches):
+                keys = get_bucket_keys('somebucket', self.prefix, snapshot=True)
+                calls = s3client_mock.get_paginator.return_value.paginate.call_count
+
+                # the snapshot is reused, without listing again
+                self.assertEqual(first=get_bucket_keys('somebucket', self.prefix, snapshot=True), second=keys)
+                self.assertEqual(first=s3client_mock.get_paginator.return_value.paginate.call_count, second=calls)
+
+                # until it expires
+                get_bucket_keys('somebucket', self.prefix, snapshot=True, ttl=-1)
+                self.assertGreater(s3client_mock.get_paginator.return_value.paginate.call_count, calls)
+        finally:
+            shutil.rmtree(cache_dir)
+        self.assertEqual(first=keys, second=sorted(self.keys))
+
+
+class TestS3BulkMove(unittest.TestCase):
+    """Tests for the parallel copies and batch deletes of s3.py"""
+
+    def test_copy_objects(self):
+        s3client_mock = mock.Mock()
+
+        def copy_object(Bucket, CopySource, Key):
+            if 'bad' in Key:
+                raise ValueError('some error')
+
+        s3client_mock.copy_object.side_effect = copy_object
+        keys = ['tmp/season=2015-2016/gameid={}/file'.format(i) for i in range(100)]
+        keys += ['tmp/season=2015-2016/gameid=bad/file', 'tmp/season=2015-2016/gameid=big/file']
+
+        results = copy_objects(
+            copy_source_keys=keys,
+            source_bucket='somebucket',
+            destination_bucket='otherbucket',
+            destination_folder='final',
+            s3client=s3client_mock,
+            sizes={keys[-1]: 10 * 1024 ** 3}
+        )
+
+        self.assertEqual(first=list(results), second=keys)
+        self.assertEqual(
+            first=results[keys[0]],
+            second={'destination': 'final/season=2015-2016/gameid=0/file', 'copied': True, 'error': None}
+        )
+        self.assertEqual(first=results[keys[-2]]['copied'], second=False)
+        self.assertEqual(first=results[keys[-2]]['error'], second='some error')
+        self.assertEqual(first=s3client_mock.copy_object.call_count, second=101)
+        s3client_mock.copy_object.assert_any_call(
+            Bucket='otherbucket',
+            CopySource={'Bucket': 'somebucket', 'Key': keys[0]},
+            Key='final/season=2015-2016/gameid=0/file'
+        )
+        # large objects are copied in parts
+        self.assertEqual(first=s3client_mock.copy.call_args[1]['Key'], second='final/season=2015-2016/gameid=big/file')
+
+    def test_delete_objects(self):
+        s3client_mock = mock.Mock()
+
+        def delete_objects_response(Bucket, Delete):
+            keys = [obj['Key'] for obj in Delete['Objects']]
+            return {
+                'Deleted': [{'Key': key} for key in keys if key != 'key7'],
+                'Errors': [{'Key': key, 'Message': 'Access Denied'} for key in keys if key == 'key7']
+            }
+
+        s3client_mock.delete_objects.side_effect = delete_objects_response
+        keys = ['key{}'.format(i) for i in range(2500)]
+
+        results = delete_objects(bucket='somebucket', keys=keys, s3client=s3client_mock)
+
+        # 1000 keys per request
+        self.assertEqual(first=s3client_mock.delete_objects.call_count, second=3)
+        self.assertEqual(
+            first=[len(call[1]['Delete']['Objects']) for call in s3client_mock.delete_objects.call_args_list],
+            second=[1000, 1000, 500]
+        )
+        self.assertEqual(first=len(results), second=2500)
+        self.assertEqual(first=results['key0'], second={'deleted': True, 'error': None})
+        self.assertEqual(first=results['key7'], second={'deleted': False, 'error': 'Access Denied'})
+
+    def test_copy_bucket_contents_multipart(self):
+        keys = ['tmp/season=2015-2016/gameid=small/file', 'tmp/season=2015-2016/gameid=big/file']
+        s3client_mock = mock.Mock()
+        s3client_mock.get_paginator.return_value.paginate.return_value = [
+            {'Contents': [{'Key': keys[0], 'Size': 10}]},
+            {'Contents': [{'Key': keys[1], 'Size': 10 * 1024 ** 3}]}
+        ]
+
+        with mock.patch('triple_triple_etl.core.s3.s3client', s3client_mock):
+            sizes = get_bucket_sizes(bucket_name='somebucket', prefix='tmp')
+        self.assertEqual(first=sizes, second={keys[0]: 10, keys[1]: 10 * 1024 ** 3})
+
+        results = copy_bucket_contents(
+            copy_source_keys=list(sizes),
+            destination_bucket='somebucket',
+            destination_folder='final',
+            s3client=s3client_mock,
+            sizes=sizes
+        )
+
+        self.assertTrue(all(result['copied'] for result in results.values()))
+        # the large object is copied in parts, the small one in one request
+        s3client_mock.copy.assert_called_once()
+        self.assertEqual(first=s3client_mock.copy.call_args[1]['Key'], second='final/season=2015-2016/gameid=big/file')
+        s3client_mock.copy_object.assert_called_once_with(
+            Bucket='somebucket',
+            CopySource={'Bucket': 'somebucket', 'Key': keys[0]},
+            Key='final/season=2015-2016/gameid=small/file'
+        )
+
+
+class TestS3Upload(unittest.TestCase):
+    """Tests for upload_object"""
+
+    def test_upload_object(self):
+        s3client_mock = mock.Mock()
+
+        # small buffers with one request
+        upload_object(io.BytesIO(b'some bytes'), 'somebucket', 'somekey', s3client_mock)
+        s3client_mock.put_object.assert_called_once_with(
+            Bucket='somebucket',
+            Key='somekey',
+            Body=b'some bytes'
+        )
+
+        # large buffers and files in parts
+        upload_object(io.BytesIO(bytes(17 * 1024 ** 2)), 'somebucket', 'somekey', s3client_mock)
+        s3client_mock.upload_fileobj.assert_called_once()
+        self.assertEqual(first=s3client_mock.upload_fileobj.call_args[1]['Fileobj'].tell(), second=0)
+
+        upload_object('some/file.parquet', 'somebucket', 'somekey', s3client_mock)
+        s3client_mock.upload_file.assert_called_once()
+        self.assertEqual(first=s3client_mock.put_object.call_count, second=1)
+
+
 if __name__ == '__main__':
     unittest.main()
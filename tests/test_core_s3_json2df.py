@@ -1,4 +1,5 @@
 import copy
+from datetime import datetime
 
 import pandas.api.types as ptypes
 import pyarrow as pa
@@ -10,7 +11,8 @@ from triple_triple_etl.core.s3_json2df import (
     get_player_info,
     get_team_info,
     get_game_info,
-    get_game_position_info
+    get_game_position_info,
+    iter_game_position_batches
 )
 
 
@@ -211,6 +213,57 @@ class TestS3Json2Df(unittest.TestCase):
             all(df.y_coordinate.values >= -5)
         )
 
+    def test_get_game_position_info_vectorized(self):
+        table_loop = get_game_position_info(self.data, vectorized=False)
+        table_vectorized = get_game_position_info(self.data, vectorized=True)
+
+        # both engines return the same table
+        self.assertEqual(
+            first=table_loop.schema.names,
+            second=table_vectorized.schema.names
+        )
+        self.assertTrue(table_loop.equals(table_vectorized))
+
+        # timestamps formatted as in datetime.fromtimestamp
+        self.assertEqual(
+            first=table_vectorized.column('timestamp_dts').to_pylist(),
+            second=[
+                datetime.fromtimestamp(ts / 1000.).strftime('%F %TZ')
+                for ts in table_vectorized.column('timestamp_utc').to_pylist()
+            ]
+        )
+
+    def test_get_game_position_info_vectorized_empty_events(self):
+        moment = [1, 1446000000000, 720.0, None, None, [[-1, -1, 1., 2., 3.], [1, 2, 1., 2., 0.]]]
+        data = {
+            'gameid': '0021500001',
+            'events': [
+                {'eventId': '1', 'moments': []},
+                {'eventId': '2', 'moments': [moment, moment]},
+                {'eventId': '3', 'moments': []},
+                {'eventId': '4', 'moments': [moment]},
+            ]
+        }
+        table = get_game_position_info(data, vectorized=True)
+
+        self.assertTrue(table.equals(get_game_position_info(data, vectorized=False)))
+        # moment_num restarts in each event
+        self.assertEqual(first=table.column('eventid').to_pylist(), second=[2, 2, 2, 2, 4, 4])
+        self.assertEqual(first=table.column('moment_num').to_pylist(), second=[0, 0, 1, 1, 0, 0])
+
+    def test_iter_game_position_batches(self):
+        batches = list(iter_game_position_batches(self.data, events_per_batch=1))
+        self.assertEqual(first=len(batches), second=len(self.data['events']))
+
+        # events can be a generator, as from iter_7z_json
+        self.data['events'] = iter(self.data['events'])
+        table = pa.Table.from_batches(
+            iter_game_position_batches(self.data, events_per_batch=5)
+        )
+        self.assertTrue(table.equals(
+            pa.Table.from_batches(batches).combine_chunks()
+        ))
+        self.assertTrue(table.equals(get_game_position_info(data)))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,91 @@
+import pandas as pd
+import unittest
+
+from triple_triple_etl.core.team_shooting_side import (
+    get_first_bucket,
+    get_first_shot_shooting_side,
+    get_team_shooting_side,
+    pctimestring_to_seconds,
+    TEAM_SHOOTING_SIDE_COL_ORDER
+)
+
+
+df_playbyplay = pd.DataFrame({
+    'period': [1., 1., 1., 2., 3., 4., 5.],
+    'score': [None, '0 - 2', '2 - 2', None, None, None, None],
+    'wctimestring': ['20:01:00', '20:02:00', '20:01:30', '20:30:00', '21:00:00', '21:30:00', '22:00:00'],
+    'pctimestring': ['12:00', '11:10', '11:42', '12:00', '12:00', '12:00', '5:00'],
+    'player1_team_id': [1., 1., 2., 1., 1., 1., 1.],
+})
+df_gameposition = pd.DataFrame({
+    'period': [1, 1, 1, 1],
+    'periodclock': [702.5, 701.1, 702.1, 702.1],
+    'playerid': [-1, -1, -1, 201],
+    'x_coordinate': [60., 10., 85., 5.],
+})
+df_gamelog = pd.DataFrame({
+    'team_id': [1, 2],
+    'team_abbreviation': ['GSW', 'NOP'],
+    'game_date': ['2015-10-27', '2015-10-27'],
+})
+
+
+class TestTeamShootingSide(unittest.TestCase):
+    """Tests for team_shooting_side.py"""
+
+    def test_pctimestring_to_seconds(self):
+        seconds = pctimestring_to_seconds(pd.Series(['11:42', '0:05']))
+        self.assertEqual(first=list(seconds), second=[702., 5.])
+
+    def test_get_first_bucket(self):
+        # first by wall clock, not by row
+        self.assertEqual(
+            first=get_first_bucket(df_playbyplay),
+            second={'period': 1, 'teamid': 2, 'periodclock': 702.}
+        )
+        self.assertIsNone(get_first_bucket(df_playbyplay[df_playbyplay.score.isnull()]))
+
+    def test_get_first_shot_shooting_side(self):
+        first_bucket = {'period': 1, 'teamid': 2, 'periodclock': 702.}
+        # the closest ball clock, players are ignored
+        self.assertEqual(first=get_first_shot_shooting_side(df_gameposition, first_bucket), second='right')
+
+        first_bucket['periodclock'] = 600.
+        self.assertIsNone(get_first_shot_shooting_side(df_gameposition, first_bucket))
+        self.assertIsNone(get_first_shot_shooting_side(df_gameposition, None))
+
+    def test_get_team_shooting_side(self):
+        df = get_team_shooting_side(
+            df_playbyplay,
+            df_gameposition,
+            df_gamelog,
+            season='2015-2016',
+            gameid='0021500001'
+        )
+        self.assertEqual(first=list(df.columns), second=TEAM_SHOOTING_SIDE_COL_ORDER)
+        self.assertEqual(first=df.shape[0], second=10)
+
+        sides = df.set_index(['team_abbreviation', 'period']).shooting_side
+        # NOP scored first shooting right
+        self.assertEqual(
+            first=[sides['NOP', period] for period in range(1, 6)],
+            second=['right', 'right', 'left', 'left', None]
+        )
+        self.assertEqual(
+            first=[sides['GSW', period] for period in range(1, 6)],
+            second=['left', 'left', 'right', 'right', None]
+        )
+
+        # no ball position near the first bucket
+        df = get_team_shooting_side(
+            df_playbyplay,
+            df_gameposition.iloc[:0],
+            df_gamelog,
+            season='2015-2016',
+            gameid='0021500001'
+        )
+        self.assertTrue(df.shooting_side.isnull().all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,6 +4,8 @@ import boto3
 import moto
 import os
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import shutil
 import tempfile
 import unittest
@@ -112,7 +114,8 @@ class TestNBAStatsGameLogsS3ETL(unittest.TestCase):
         
         get_data_mock.assert_called_once_with(
             base_url=etl.base_url,
-            params=etl.params
+            params=etl.params,
+            cache_ttl=None
         )
 
     def test_transform(self):
@@ -123,28 +126,14 @@ class TestNBAStatsGameLogsS3ETL(unittest.TestCase):
             season_year='2015-2016',
             destination_bucket='nba-game-info',
         )
-        # re-assign tmp_dir for testing purposes
-        etl.tmp_dir = os.path.join(TEST_DIR, 'test_tmp')
-        etl.transform(mock_gamelog_data)
-
-        # check files/dir as expected
-        dirs_in_tmp = [
-            d for d in os.listdir(etl.tmp_dir) if
-            os.path.isdir(os.path.join(etl.tmp_dir, d))
-        ]
-        # check season
-        self.assertEqual(
-            first=set(dirs_in_tmp),
-            second={'season={}'.format(etl.season_year)}
-        )
+        df = etl.transform(mock_gamelog_data)
+
         # check games
-        season_dir = os.path.join(etl.tmp_dir, 'season={}'.format(etl.season_year))
-        self.assertEqual(
-            first=set(os.listdir(season_dir)),
-            second={'game_id=02', 'game_id=03'}
-        )
-        # remove created dir
-        shutil.rmtree(season_dir)
+        self.assertEqual(first=set(etl.buffers), second={'02', '03'})
+        table = pq.read_table(pa.BufferReader(etl.buffers['02']))
+        self.assertEqual(first=table.num_rows, second=len(df.query('game_id == "02"')))
+        self.assertNotIn('season', table.column_names)
+        self.assertNotIn('game_id', table.column_names)
 
     @moto.mock_s3
     def test_load(self):
@@ -176,15 +165,18 @@ class TestNBAStatsGameLogsS3ETL(unittest.TestCase):
             destination_bucket='nba-game-info',
         )
         # update some attributes
-        etl.tmp_dir = '/tmp/somedir'
+        etl.buffers = {'02': 'somebuffer'}
         # mock functions
         etl.df_uploaded = mock.Mock()
         etl.df_uploaded.to_parquet = mock.Mock()
 
-        path = 'triple_triple_etl.load.storage.nbastats_gamelog_to_s3parquet.shutil'
-        with mock.patch(path, mock.Mock()) as s:
-            etl.cleanup()
-            s.rmtree.assert_called_once_with(etl.tmp_dir)
+        etl.cleanup()
+        self.assertEqual(first=etl.buffers, second={})
+        etl.df_uploaded.to_parquet.assert_called_once_with(
+            fname=etl.uploaded_filepath,
+            compression='snappy',
+            index=False
+        )
 
 
     def test_run(self):
@@ -4,6 +4,8 @@ import boto3
 import moto
 import os
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import shutil
 import tempfile
 import unittest
@@ -13,10 +15,12 @@ from tests.fixtures.mock_nbastats_data import (
     # mock_gamelog_data,
     mock_df_uploaded
 )
+from triple_triple_etl.core.arrow_table import write_buffer
 from triple_triple_etl.load.storage.nbastats_to_s3parquet import (
     get_file_idx_in_uploaded,
     NBAStatsS3ETL,
-    upload_all_nbastats
+    upload_all_nbastats,
+    upload_all_nbastats_concurrent
 )
 from triple_triple_etl.constants import (
     BASE_URL_PLAY,
@@ -32,14 +36,30 @@ class TestHelper(unittest.TestCase):
     def test_file_exists(self):
         idx = get_file_idx_in_uploaded(
             df_uploaded=mock_df_uploaded,
-            gameid='1234'
+            gameid='1234',
+            game_data_type='playbyplay'
         )
         assert idx == 0
 
+        idx = get_file_idx_in_uploaded(
+            df_uploaded=mock_df_uploaded,
+            gameid='1234',
+            game_data_type='boxscore_player'
+        )
+        assert idx == 1
+
     def test_file_dne(self):
         idx = get_file_idx_in_uploaded(
             df_uploaded=mock_df_uploaded,
-            gameid='9999'
+            gameid='9999',
+            game_data_type='playbyplay'
+        )
+        assert idx == mock_df_uploaded.shape[0]
+
+        idx = get_file_idx_in_uploaded(
+            df_uploaded=mock_df_uploaded,
+            gameid='1234',
+            game_data_type='boxscore_traditional'
         )
         assert idx == mock_df_uploaded.shape[0]
 
@@ -72,11 +92,14 @@ class TestNBAStatsS3ETL(unittest.TestCase):
         
         get_upload_metadata_mock.assert_called_once_with(
             etl.uploaded_filepath,
-            columns=list(mock_df_uploaded.columns)
+            columns=list(mock_df_uploaded.columns),
+            key=['game_id', 'game_data_type'],
+            value=(etl.gameid, 'playbyplay')
         )
         get_file_idx_in_uploaded_mock.assert_called_once_with(
             df_uploaded=mock_df_uploaded,
-            gameid=etl.gameid
+            gameid=etl.gameid,
+            game_data_type='playbyplay'
         )
 
 
@@ -106,12 +129,11 @@ class TestNBAStatsS3ETL(unittest.TestCase):
         # mock functions
         data = {'some': 'data'}
         get_play_by_play_mock = mock.Mock(return_value='table_playbyplay')
-        pq_mock = mock.Mock()
-        pq_mock.write_to_dataset = mock.Mock()
-        
+        write_buffer_mock = mock.Mock(return_value='somebuffer')
+
         patches = {
             'get_play_by_play': get_play_by_play_mock,
-            'pq': pq_mock
+            'write_buffer': write_buffer_mock
         }        
         path = 'triple_triple_etl.load.storage.nbastats_to_s3parquet'        
         with mock.patch.multiple(path, **patches):
@@ -128,24 +150,21 @@ class TestNBAStatsS3ETL(unittest.TestCase):
 
         # check functions are called        
         get_play_by_play_mock.assert_called_once_with(data, season='2015-2016')
-        pq_mock.write_to_dataset.assert_called_once_with(
-            table=get_play_by_play_mock.return_value,
-            root_path=etl.tmp_dir,
-            partition_cols=['season', 'game_id'],
-            compression='snappy',
-            preserve_index=False
+        write_buffer_mock.assert_called_once_with(
+            get_play_by_play_mock.return_value,
+            drop_columns=['season', 'game_id']
         )
+        self.assertEqual(first=etl.buffer, second='somebuffer')
 
     def test_transform_boxscore(self):
         # mock functions
         data = {'some': 'data'}
         get_boxscore_mock = mock.Mock(return_value='table_boxscore')
-        pq_mock = mock.Mock()
-        pq_mock.write_to_dataset = mock.Mock()        
+        write_buffer_mock = mock.Mock()
 
         patches = {
             'get_boxscore': get_boxscore_mock,
-            'pq': pq_mock
+            'write_buffer': write_buffer_mock
         }
 
         path = 'triple_triple_etl.load.storage.nbastats_to_s3parquet'
@@ -167,7 +186,7 @@ class TestNBAStatsS3ETL(unittest.TestCase):
             mock.call(data, season='2015-2016', traditional_player='player')    
         ]
         get_boxscore_mock.assert_has_calls(expected_calls, any_order=False)        
-        self.assertEqual(pq_mock.write_to_dataset.call_count, 2)
+        self.assertEqual(write_buffer_mock.call_count, 2)
 
 
     @moto.mock_s3
@@ -185,7 +204,24 @@ class TestNBAStatsS3ETL(unittest.TestCase):
             season='2015-2016',
             destination_bucket='nba-game-info',
         )
-        # TODO: How to test this function
+        etl.buffer = write_buffer(
+            pa.Table.from_pandas(pd.DataFrame({'season': ['2015-16'], 'game_id': ['someid'], 'x': [1]})),
+            drop_columns=['season', 'game_id']
+        )
+        path = 'triple_triple_etl.load.storage.nbastats_to_s3parquet.s3'
+        with mock.patch(path, boto3.client('s3', region_name='us-east-1')):
+            etl.load()
+
+        self.assertEqual(first=etl.uploadedFLG, second=1)
+        key = 'playbyplay/season=2015-2016/gameid=someid/04012019mock-team1mock-team2.parquet.snappy'
+        body = s3.Object('nba-game-info', key).get()['Body'].read()
+        table = pq.read_table(pa.BufferReader(body))
+        self.assertEqual(first=table.column_names, second=['x'])
+
+        # transform failed
+        etl.buffer = None
+        etl.load()
+        self.assertEqual(first=etl.uploadedFLG, second=0)
 
     def test_cleanup(self):
 
@@ -199,16 +235,29 @@ class TestNBAStatsS3ETL(unittest.TestCase):
             destination_bucket='nba-game-info',
         )
         # update some attributes
-        etl.tmp_dir = '/tmp/somedir'
+        etl.buffer = 'somebuffer'
         etl.df_uploaded = copy.deepcopy(mock_df_uploaded)
         etl.file_idx = 1
         # mock functions
-        etl.df_uploaded.to_parquet = mock.Mock()
+        update_uploaded_metadata_mock = mock.Mock()
 
-        path = 'triple_triple_etl.load.storage.nbastats_to_s3parquet.shutil'
-        with mock.patch(path, mock.Mock()) as s:
+        patches = {
+            'update_uploaded_metadata': update_uploaded_metadata_mock
+        }
+        path = 'triple_triple_etl.load.storage.nbastats_to_s3parquet'
+        with mock.patch.multiple(path, **patches):
             etl.cleanup()
-            s.rmtree.assert_called_once_with(etl.tmp_dir)
+        self.assertIsNone(etl.buffer)
+
+        # only this game's row is saved
+        rows = update_uploaded_metadata_mock.call_args[1]['rows']
+        self.assertEqual(first=len(rows), second=1)
+        self.assertEqual(first=rows[0]['game_id'], second='someid')
+        self.assertEqual(first=rows[0]['game_data_type'], second=etl.game_data_type)
+        self.assertEqual(
+            first=update_uploaded_metadata_mock.call_args[1]['key'],
+            second=['game_id', 'game_data_type']
+        )
 
 
     def test_run(self):
@@ -245,5 +294,65 @@ class TestNBAStatsS3ETL(unittest.TestCase):
         cleanup_mock.assert_called_once_with()
 
 
+class TestUploadAllNBAStatsConcurrent(unittest.TestCase):
+    """Tests for upload_all_nbastats_concurrent"""
+
+    def test_upload_all_nbastats_concurrent(self):
+        df_gamelog_meta = pd.DataFrame(
+            data=[
+                ['2015-16', '2016-01-01', '0021500001', 'LAL', 'BOS'],
+                ['2015-16', '2016-01-01', '0021500001', 'BOS', 'LAL'],
+                ['2015-16', '2016-01-02', '0021500002', 'GSW', 'SAS'],
+                ['2015-16', '2016-01-05', '0021500003', 'MIA', 'NYK'],
+            ],
+            columns=['season', 'game_date', 'game_id', 'team1', 'team2']
+        )
+
+        async def get_data_async(base_url, params, executor=None):
+            if params['GameID'] == '0021500002' and base_url == BASE_URL_PLAY:
+                raise ValueError('bad game')
+            return {'url': base_url}
+
+        def load_nbastats(etl, data):
+            etl.uploadedFLG = True
+
+        load_mock = mock.Mock(side_effect=load_nbastats)
+        path = 'triple_triple_etl.load.storage.nbastats_to_s3parquet'
+        patches = {
+            'get_data_async': get_data_async,
+            '_load_nbastats': load_mock,
+            'export_uploaded_metadata': mock.Mock(),
+            'get_logger': mock.Mock()
+        }
+        with mock.patch.multiple(path, **patches):
+            summary = upload_all_nbastats_concurrent(
+                df_gamelog_meta=df_gamelog_meta,
+                game_data_types=['playbyplay', 'boxscore_traditional'],
+                end_date='2016-01-02',
+                max_concurrency=2
+            )
+
+        # one etl per game and type, the failed one doesn't stop the rest
+        self.assertEqual(first=load_mock.call_count, second=3)
+        self.assertEqual(
+            first=sorted(summary['succeeded']),
+            second=[
+                ('boxscore_traditional', '0021500001'),
+                ('boxscore_traditional', '0021500002'),
+                ('playbyplay', '0021500001')
+            ]
+        )
+        self.assertEqual(
+            first=list(summary['failed']),
+            second=[('playbyplay', '0021500002')]
+        )
+        patches['export_uploaded_metadata'].assert_called_once()
+
+        # each etl has its own params
+        gameids = {call[0][0].params['GameID'] for call in load_mock.call_args_list}
+        self.assertEqual(first=gameids, second={'0021500001', '0021500002'})
+        self.assertIsNone(NBASTATS_PARAMS['GameID'])
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
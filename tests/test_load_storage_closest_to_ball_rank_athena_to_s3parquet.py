@@ -6,15 +6,22 @@ import moto
 import numpy as np
 import os
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import unittest
 import unittest.mock as mock
 
+from triple_triple_etl.core.partition_projection import PartitionProjection
+from triple_triple_etl.core.partitions import PartitionRegistry
 from triple_triple_etl.core.s3 import get_bucket_content
 from triple_triple_etl.load.storage.closest_to_ball_rank_athena_to_s3parquet import (
     get_file_idx_in_uploaded,
-    ClosestToBallETL
+    ClosestToBallETL,
+    ClosestToBallLocalETL
 )
 
+HELPER_PATH = 'triple_triple_etl.load.storage.load_helper'
+
 
 mock_df_uploaded = pd.DataFrame(
     data=[
@@ -76,41 +83,71 @@ class TestClosestToBallETL(unittest.TestCase):
             )
         
     def test_create_tmp_tables(self):
-        execute_athena_query_mock = mock.Mock()
-        check_table_exists_mock = mock.Mock()  
+        started = []
+
+        def start_query_execution(QueryString, **kwargs):
+            started.append(QueryString)
+            return {'QueryExecutionId': str(len(started))}
+
+        def batch_get_query_execution(QueryExecutionIds):
+            return {'QueryExecutions': [
+                {'QueryExecutionId': execution_id, 'Status': {'State': 'SUCCEEDED'}}
+                for execution_id in QueryExecutionIds
+            ]}
+
+        athena_mock = mock.Mock()
+        athena_mock.start_query_execution.side_effect = start_query_execution
+        athena_mock.batch_get_query_execution.side_effect = batch_get_query_execution
 
         patches = {
-            'execute_athena_query': execute_athena_query_mock,
-            'check_table_exists': check_table_exists_mock
+            'athena': athena_mock,
+            'open': mock.mock_open(read_data='select {} {} {}')
         }
         path = (
             'triple_triple_etl.load.storage.'
             'closest_to_ball_rank_athena_to_s3parquet'
         )
-        with mock.patch.multiple(path, **patches):   
+        with mock.patch.multiple(path, **patches), mock.patch('time.sleep'):
             etl = ClosestToBallETL(
                 season='2015-2016',
                 gameid_bounds=['0010', '0020'],
             )
             etl.get_queries()
+            etl.query_closest_to_ball = 'select closest'
             etl.create_tmp_tables()
 
-            self.assertEqual(
-                first=execute_athena_query_mock.call_count,
-                second=2
-            )
-            self.assertEqual(
-                first=check_table_exists_mock.call_count,
-                second=2
-            )
+        # closest_to_ball_tmp started once ball_dist_tmp succeeded
+        self.assertEqual(first=started, second=['select 2015-2016 0010 0020', 'select closest'])
+        self.assertEqual(first=athena_mock.batch_get_query_execution.call_count, second=2)
+        self.assertEqual(
+            first=etl.s3keys['create_closest_to_ball_tmp'],
+            second={'QueryExecutionId': '2'}
+        )
+
+        # a failed query raises and the next one is not started
+        athena_mock.batch_get_query_execution.side_effect = None
+        athena_mock.batch_get_query_execution.return_value = {'QueryExecutions': [
+            {'QueryExecutionId': '3', 'Status': {'State': 'FAILED'}}
+        ]}
+        with mock.patch.multiple(path, **patches), mock.patch('time.sleep'):
+            with self.assertRaises(FileNotFoundError):
+                etl.create_tmp_tables()
+        self.assertEqual(first=len(started), second=3)
 
     def test_move_closest_to_ball_tmp_to_final(self):
-        get_bucket_content_mock = mock.Mock(return_value=['contents_list'])
-        copy_bucket_contents_mock = mock.Mock()
+        files = [
+            'closest_to_ball_tmp/season=2015-2016/gameid=1234/file1',
+            'closest_to_ball_tmp/season=2015-2016/gameid=9876/file2'
+        ]
+        get_bucket_sizes_mock = mock.Mock(return_value={files[0]: 10, files[1]: 10 * 1024 ** 3})
+        copy_bucket_contents_mock = mock.Mock(return_value={
+            files[0]: {'destination': 'somekey', 'copied': True, 'error': None},
+            files[1]: {'destination': 'somekey', 'copied': False, 'error': 'some error'}
+        })
         s3client_mock = mock.Mock()
 
         patches = {
-            'get_bucket_content': get_bucket_content_mock,
+            'get_bucket_sizes': get_bucket_sizes_mock,
             'copy_bucket_contents': copy_bucket_contents_mock,
             's3client': s3client_mock
         }
@@ -123,58 +160,67 @@ class TestClosestToBallETL(unittest.TestCase):
                 season='2015-2016',
                 gameid_bounds=['0010', '0020'],
             )
-            etl.move_closest_to_ball_tmp_to_final()
+            all_files = etl.move_closest_to_ball_tmp_to_final()
 
-            get_bucket_content_mock.assert_called_once_with(
+            get_bucket_sizes_mock.assert_called_once_with(
                 bucket_name=etl.destination_bucket,
-                prefix='closest_to_ball_tmp',
-                delimiter=''                
+                prefix='closest_to_ball_tmp'
             )
             copy_bucket_contents_mock.assert_called_once_with(
-                copy_source_keys=get_bucket_content_mock.return_value,
+                copy_source_keys=files,
                 destination_bucket=etl.destination_bucket,
                 destination_folder='closest_to_ball',
-                s3client=s3client_mock              
+                s3client=s3client_mock,
+                sizes=get_bucket_sizes_mock.return_value
             )
+        # only the files copied are returned, for the partitions
+        self.assertEqual(first=all_files, second=files[:1])
+        self.assertEqual(first=etl.failed_files, second=files[1:])
 
     def test_alter_tables(self):
         all_files = [
             'somekey/season=2015-2016/gameid=1234/file1',
             'somekey/season=2015-2016/gameid=9876/file2',
+            'somekey/season=2015-2016/gameid=9876/file3',
         ]
 
-        data_read = 'select * from blah'
-        open_mock = mock.mock_open(read_data=data_read)        
-        execute_athena_query_mock = mock.Mock()
         athena_mock = mock.Mock()
-
-        patches = {
-            'open': open_mock,
-            'execute_athena_query': execute_athena_query_mock,
-            'athena': athena_mock
+        athena_mock.start_query_execution.return_value = {'QueryExecutionId': 'someid'}
+        athena_mock.get_query_execution.return_value = {
+            'QueryExecution': {'Status': {'State': 'SUCCEEDED'}}
         }
         path = (
             'triple_triple_etl.load.storage.'
             'closest_to_ball_rank_athena_to_s3parquet'
         )
-        with mock.patch.multiple(path, **patches):   
+
+        with mock.patch.multiple(path, athena=athena_mock):
             etl = ClosestToBallETL(
                 season='2015-2016',
                 gameid_bounds=['0010', '0020'],
             )
             etl.alter_table(all_files)
-            self.assertEqual(
-                first=execute_athena_query_mock.call_count,
-                second=len(all_files)
-            )
-    
+
+        # one query adds the partitions of all games, and is waited on
+        athena_mock.start_query_execution.assert_called_once()
+        query = athena_mock.start_query_execution.call_args[1]['QueryString']
+        self.assertIn('ALTER TABLE nba.closest_to_ball ADD IF NOT EXISTS', query)
+        self.assertEqual(first=query.count('PARTITION ('), second=2)
+        athena_mock.get_query_execution.assert_called_once_with(QueryExecutionId='someid')
+        self.assertEqual(first=len(etl.partitions), second=0)
+
     def test_drop_tmp_tables(self):
-        execute_athena_query_mock = mock.Mock()
+        execute_athena_query_mock = mock.Mock(return_value={'QueryExecutionId': 'someid'})
+        wait_for_query_execution_mock = mock.Mock()
+        patches = {
+            'execute_athena_query': execute_athena_query_mock,
+            'wait_for_query_execution': wait_for_query_execution_mock
+        }
         path = (
             'triple_triple_etl.load.storage.'
-            'closest_to_ball_rank_athena_to_s3parquet.execute_athena_query'
+            'closest_to_ball_rank_athena_to_s3parquet'
         )
-        with mock.patch(path, execute_athena_query_mock):
+        with mock.patch.multiple(path, **patches):
             etl = ClosestToBallETL(
                 season='2015-2016',
                 gameid_bounds=['0010', '0020'],
@@ -184,23 +230,30 @@ class TestClosestToBallETL(unittest.TestCase):
                 first=execute_athena_query_mock.call_count,
                 second=2
             )
+            self.assertEqual(
+                first=wait_for_query_execution_mock.call_count,
+                second=2
+            )
 
     def test_cleanup(self):
         get_bucket_content_mock = mock.Mock()
         get_bucket_content_mock.side_effect = [
             ['ball_dist/somekey/season=2015-2016/gameid=1234/file1',
              'ball_dist/somekey/season=2015-2016/gameid=9876/file2'],
-            ['closest/somekey/season=2015-2016/gameid=1234/file1',
-             'closest/somekey/season=2015-2016/gameid=9876/file2'],
         ]
-        remove_bucket_contents_mock = mock.Mock(return_value=1)
+        s3client_mock = mock.Mock()
+        s3client_mock.delete_objects.side_effect = lambda Bucket, Delete: {
+            'Deleted': [{'Key': obj['Key']} for obj in Delete['Objects']]
+        }
         get_uploaded_metadata_mock = mock.Mock(return_value=copy.deepcopy(mock_df_uploaded))
         update_metadata_mock = mock.Mock()
+        update_uploaded_metadata_mock = mock.Mock()
 
         patches = {
             'get_bucket_content': get_bucket_content_mock,
-            'remove_bucket_contents': remove_bucket_contents_mock,
-            'get_uploaded_metadata': get_uploaded_metadata_mock
+            's3client': s3client_mock,
+            'get_uploaded_metadata': get_uploaded_metadata_mock,
+            'update_uploaded_metadata': update_uploaded_metadata_mock
         }
         path = (
             'triple_triple_etl.load.storage.'
@@ -211,7 +264,10 @@ class TestClosestToBallETL(unittest.TestCase):
             etl = ClosestToBallETL(
                 season='2015-2016',
                 gameid_bounds=['0010', '0020'],
-            )            
+            )
+            # the file of game 9876 did not copy
+            etl.copied_files = ['closest/somekey/season=2015-2016/gameid=1234/file1']
+            etl.failed_files = ['closest/somekey/season=2015-2016/gameid=9876/file2']
             etl.cleanup()
             
             # test df_uploaded is updated
@@ -220,10 +276,23 @@ class TestClosestToBallETL(unittest.TestCase):
                 second=3,
                 msg=etl.df_uploaded
             )
-            # check remove_bucket_contents called appropriate times (4 files balldist/closest)
+            # the 3 files are removed in one request, not the one that
+            # did not copy
+            s3client_mock.delete_objects.assert_called_once()
+            self.assertNotIn(
+                {'Key': etl.failed_files[0]},
+                s3client_mock.delete_objects.call_args[1]['Delete']['Objects']
+            )
+            self.assertEqual(
+                first=len(s3client_mock.delete_objects.call_args[1]['Delete']['Objects']),
+                second=3
+            )
+            # only the rows of this run's games are saved, and only the
+            # game copied is uploaded
+            rows = update_uploaded_metadata_mock.call_args[1]['rows']
             self.assertEqual(
-                first=remove_bucket_contents_mock.call_count,
-                second=4
+                first=sorted((row['gameid'], row['uploadedFLG']) for row in rows),
+                second=[('1234', 1), ('9876', 0)]
             )
 
     def test_run(self):
@@ -258,5 +327,147 @@ class TestClosestToBallETL(unittest.TestCase):
         etl.cleanup.assert_called_once_with()
 
 
+class TestClosestToBallLocalETL(unittest.TestCase):
+    """ Tests for ClosestToBallLocalETL """
+
+    def test_run(self):
+        gameposition = pa.table({
+            'eventid': [1, 1, 1],
+            'moment_num': [0, 0, 0],
+            'playerid': [10, -1, 20],
+            'x_coordinate': [3., 0., 1.],
+            'y_coordinate': [4., 0., 1.],
+        })
+
+        def download_file(Bucket, Key, Filename):
+            pq.write_table(gameposition, Filename)
+
+        uploaded = {}
+
+        def upload_file(Filename, Bucket, Key):
+            uploaded[Key] = pq.read_table(Filename)
+
+        s3client_mock = mock.Mock()
+        s3client_mock.download_file.side_effect = download_file
+        s3client_mock.upload_file.side_effect = upload_file
+        get_bucket_content_mock = mock.Mock(return_value=['gameposition/season=2015-2016/gameid=1234/file1'])
+        athena_mock = mock.Mock()
+        athena_mock.start_query_execution.return_value = {'QueryExecutionId': 'someid'}
+        athena_mock.get_query_execution.return_value = {
+            'QueryExecution': {'Status': {'State': 'SUCCEEDED'}}
+        }
+        update_uploaded_metadata_mock = mock.Mock()
+
+        patches = {
+            's3client': s3client_mock,
+            'athena': athena_mock
+        }
+        helper_patches = {
+            'get_bucket_content': get_bucket_content_mock,
+            'update_uploaded_metadata': update_uploaded_metadata_mock
+        }
+        path = (
+            'triple_triple_etl.load.storage.'
+            'closest_to_ball_rank_athena_to_s3parquet'
+        )
+        with mock.patch.multiple(path, **patches), \
+             mock.patch.multiple(HELPER_PATH, **helper_patches):
+            etl = ClosestToBallLocalETL(season='2015-2016', gameid='1234')
+            etl.run()
+
+        get_bucket_content_mock.assert_called_once_with(
+            bucket_name='nba-game-info',
+            prefix='gameposition/season=2015-2016/gameid=1234/',
+            delimiter=''
+        )
+        table = uploaded['closest_to_ball/season=2015-2016/gameid=1234/closest_to_ball.parquet.snappy']
+        self.assertEqual(first=table.column('closest_to_ball_rank').to_pylist(), second=[2, None, 1])
+
+        # the partition is added, no tmp tables
+        athena_mock.start_query_execution.assert_called_once()
+        self.assertIn("gameid = '1234'", athena_mock.start_query_execution.call_args[1]['QueryString'])
+
+        rows = update_uploaded_metadata_mock.call_args[1]['rows']
+        self.assertEqual(first=rows[0]['gameid'], second='1234')
+        self.assertEqual(first=rows[0]['uploadedFLG'], second=1)
+        self.assertFalse(os.path.exists(etl.tmp_dir))
+
+    def test_run_no_gameposition(self):
+        update_uploaded_metadata_mock = mock.Mock()
+        athena_mock = mock.Mock()
+
+        patches = {
+            's3client': mock.Mock(),
+            'athena': athena_mock
+        }
+        helper_patches = {
+            'get_bucket_content': mock.Mock(return_value=[]),
+            'update_uploaded_metadata': update_uploaded_metadata_mock
+        }
+        path = (
+            'triple_triple_etl.load.storage.'
+            'closest_to_ball_rank_athena_to_s3parquet'
+        )
+        with mock.patch.multiple(path, **patches), \
+             mock.patch.multiple(HELPER_PATH, **helper_patches):
+            etl = ClosestToBallLocalETL(season='2015-2016', gameid='1234')
+            with self.assertRaises(FileNotFoundError):
+                etl.run()
+
+        # the game is recorded as not uploaded
+        athena_mock.start_query_execution.assert_not_called()
+        rows = update_uploaded_metadata_mock.call_args[1]['rows']
+        self.assertEqual(first=rows[0]['uploadedFLG'], second=0)
+        self.assertFalse(os.path.exists(etl.tmp_dir))
+
+
+    def test_shared_partitions(self):
+        gameposition = pa.table({
+            'eventid': [1, 1],
+            'moment_num': [0, 0],
+            'playerid': [10, -1],
+            'x_coordinate': [3., 0.],
+            'y_coordinate': [4., 0.],
+        })
+
+        def download_file(Bucket, Key, Filename):
+            pq.write_table(gameposition, Filename)
+
+        s3client_mock = mock.Mock()
+        s3client_mock.download_file.side_effect = download_file
+        athena_mock = mock.Mock()
+        patches = {
+            's3client': s3client_mock,
+            'athena': athena_mock
+        }
+        helper_patches = {
+            'get_bucket_content': mock.Mock(return_value=['gameposition/season=2015-2016/gameid=1234/file1']),
+            'update_uploaded_metadata': mock.Mock()
+        }
+        path = (
+            'triple_triple_etl.load.storage.'
+            'closest_to_ball_rank_athena_to_s3parquet'
+        )
+        # empty when passed in, they are still the ones used
+        registry = PartitionRegistry(table='closest_to_ball', athena_client=athena_mock)
+        projection = PartitionProjection(
+            table='closest_to_ball',
+            seasons=['2015-2016'],
+            gameids=['0001'],
+            athena_client=athena_mock
+        )
+        for partitions in [registry, projection]:
+            with mock.patch.multiple(path, **patches), \
+                 mock.patch.multiple(HELPER_PATH, **helper_patches):
+                etl = ClosestToBallLocalETL(season='2015-2016', gameid='1234', partitions=partitions)
+                etl.run()
+
+            self.assertIs(etl.partitions, partitions)
+            self.assertFalse(etl.flush_partitions)
+            # added, flushed later by the caller
+            self.assertEqual(first=len(partitions), second=1)
+        athena_mock.start_query_execution.assert_not_called()
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,128 @@
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+import unittest
+import unittest.mock as mock
+
+from triple_triple_etl.load.storage.gamepossession_to_s3parquet import (
+    GamePossessionETL,
+    upload_all_gamepossession
+)
+
+HELPER_PATH = 'triple_triple_etl.load.storage.load_helper'
+
+
+class TestGamePossessionETL(unittest.TestCase):
+    """ Tests for GamePossessionETL """
+
+    def test_run(self):
+        closest_to_ball = pa.table({
+            'eventid': [1] * 6,
+            'moment_num': list(range(6)),
+            'timestamp_utc': [40 * i for i in range(6)],
+            'period': [1] * 6,
+            'periodclock': [720.] * 6,
+            'teamid': [100] * 6,
+            'playerid': [10] * 6,
+            'distance_from_ball_sq': [1.] * 6,
+            'closest_to_ball_rank': [1] * 6,
+        })
+
+        def download_file(Bucket, Key, Filename):
+            pq.write_table(closest_to_ball, Filename)
+
+        uploaded = {}
+
+        def upload_file(Filename, Bucket, Key):
+            uploaded[Key] = pq.read_table(Filename)
+
+        s3client_mock = mock.Mock()
+        s3client_mock.download_file.side_effect = download_file
+        s3client_mock.upload_file.side_effect = upload_file
+        athena_mock = mock.Mock()
+        athena_mock.start_query_execution.return_value = {'QueryExecutionId': 'someid'}
+        athena_mock.get_query_execution.return_value = {
+            'QueryExecution': {'Status': {'State': 'SUCCEEDED'}}
+        }
+        update_uploaded_metadata_mock = mock.Mock()
+
+        patches = {
+            's3client': s3client_mock,
+            'athena': athena_mock
+        }
+        helper_patches = {
+            'get_bucket_content': mock.Mock(return_value=['closest_to_ball/file1']),
+            'update_uploaded_metadata': update_uploaded_metadata_mock
+        }
+        path = 'triple_triple_etl.load.storage.gamepossession_to_s3parquet'
+        with mock.patch.multiple(path, **patches), \
+             mock.patch.multiple(HELPER_PATH, **helper_patches):
+            etl = GamePossessionETL(season='2015-2016', gameid='1234')
+            etl.run()
+
+        table = uploaded['gamepossession/season=2015-2016/gameid=1234/gamepossession.parquet.snappy']
+        self.assertEqual(first=table.num_rows, second=1)
+        self.assertEqual(first=table.column('num_moments').to_pylist(), second=[6])
+
+        query = athena_mock.start_query_execution.call_args[1]['QueryString']
+        self.assertIn('nba.gamepossession', query)
+        self.assertIn("gameid = '1234'", query)
+
+        rows = update_uploaded_metadata_mock.call_args[1]['rows']
+        self.assertEqual(first=rows[0]['uploadedFLG'], second=1)
+        self.assertFalse(os.path.exists(etl.tmp_dir))
+
+    def test_run_no_closest_to_ball(self):
+        update_uploaded_metadata_mock = mock.Mock()
+
+        patches = {
+            's3client': mock.Mock(),
+            'athena': mock.Mock()
+        }
+        helper_patches = {
+            'get_bucket_content': mock.Mock(return_value=[]),
+            'update_uploaded_metadata': update_uploaded_metadata_mock
+        }
+        path = 'triple_triple_etl.load.storage.gamepossession_to_s3parquet'
+        with mock.patch.multiple(path, **patches), \
+             mock.patch.multiple(HELPER_PATH, **helper_patches):
+            etl = GamePossessionETL(season='2015-2016', gameid='1234')
+            with self.assertRaises(FileNotFoundError):
+                etl.run()
+
+        rows = update_uploaded_metadata_mock.call_args[1]['rows']
+        self.assertEqual(first=rows[0]['uploadedFLG'], second=0)
+
+    def test_upload_all_gamepossession(self):
+        etl_mock = mock.Mock()
+        etl_mock.return_value.run.side_effect = [None, ValueError('bad game'), None]
+        export_uploaded_metadata_mock = mock.Mock()
+
+        patches = {
+            'GamePossessionETL': etl_mock,
+            'export_uploaded_metadata': export_uploaded_metadata_mock
+        }
+        path = 'triple_triple_etl.load.storage.gamepossession_to_s3parquet'
+        with mock.patch.multiple(path, **patches):
+            failed = upload_all_gamepossession(
+                season='2015-2016',
+                gameids=['1', '2', '3'],
+                max_workers=1,
+                min_moments=10
+            )
+
+        self.assertEqual(first=failed, second=['2'])
+        etl_mock.assert_any_call(
+            season='2015-2016',
+            gameid='1',
+            min_moments=10,
+            partitions=mock.ANY
+        )
+        # the games share one registry, flushed once at the end
+        registries = {id(call[1]['partitions']) for call in etl_mock.call_args_list}
+        self.assertEqual(first=len(registries), second=1)
+        export_uploaded_metadata_mock.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import os
+import pandas as pd
+import shutil
+import tempfile
+import unittest
+
+from triple_triple_etl.load.storage.ledger import LEDGER_FILENAME, UploadLedger
+
+
+class TestUploadLedger(unittest.TestCase):
+    """Tests for ledger.py"""
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmp_dir, 'closest_to_ball.parquet.snappy')
+        self.columns = ['season', 'gameid', 'uploadedFLG', 'lastuploadDTS']
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_read_without_database(self):
+        with UploadLedger(self.filepath, self.columns, key='gameid') as ledger:
+            df = ledger.to_dataframe()
+
+        self.assertEqual(first=list(df.columns), second=self.columns)
+        self.assertEqual(first=df.shape[0], second=0)
+        # reading does not create the database
+        self.assertEqual(first=os.listdir(self.tmp_dir), second=[])
+
+    def test_import_parquet(self):
+        df_parquet = pd.DataFrame(
+            data=[['2015-2016', '1234', 1., 'today'], ['2015-2016', '9876', np.nan, None]],
+            columns=self.columns
+        )
+        df_parquet.to_parquet(self.filepath)
+
+        with UploadLedger(self.filepath, self.columns, key='gameid') as ledger:
+            self.assertEqual(
+                first=ledger.get('1234'),
+                second={'season': '2015-2016', 'gameid': '1234', 'uploadedFLG': 1., 'lastuploadDTS': 'today'}
+            )
+            self.assertIsNone(ledger.get('0000'))
+            self.assertEqual(first=ledger.table, second='closest_to_ball')
+
+        self.assertTrue(os.path.isfile(os.path.join(self.tmp_dir, LEDGER_FILENAME)))
+
+        # the columns must match
+        with self.assertRaises(ValueError):
+            UploadLedger(self.filepath, self.columns[::-1], key='gameid').get('1234')
+
+    def test_upsert(self):
+        with UploadLedger(self.filepath, self.columns, key='gameid') as ledger:
+            ledger.upsert(
+                [{'season': '2015-2016', 'gameid': str(i), 'uploadedFLG': np.int64(0)} for i in range(5)],
+                batch_size=2
+            )
+            ledger.upsert([{'season': '2015-2016', 'gameid': '3', 'uploadedFLG': 1}])
+            df = ledger.to_dataframe()
+
+        # insert order is kept, the replaced row is updated in place
+        self.assertEqual(first=list(df.gameid), second=['0', '1', '2', '3', '4'])
+        self.assertEqual(first=list(df.uploadedFLG), second=[0, 0, 0, 1, 0])
+        self.assertTrue(df.lastuploadDTS.isnull().all())
+
+    def test_concurrent_writers(self):
+        def write(i):
+            with UploadLedger(self.filepath, self.columns, key='gameid') as ledger:
+                ledger.upsert([{'gameid': str(i), 'uploadedFLG': 1}])
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(write, range(40)))
+
+        with UploadLedger(self.filepath, self.columns, key='gameid') as ledger:
+            self.assertEqual(first=ledger.to_dataframe().shape[0], second=40)
+
+    def test_export_parquet(self):
+        with UploadLedger(self.filepath, self.columns, key='gameid') as ledger:
+            ledger.upsert([{'season': '2015-2016', 'gameid': '1234', 'uploadedFLG': 1}])
+            ledger.export_parquet()
+
+        df = pd.read_parquet(self.filepath)
+        self.assertEqual(first=list(df.columns), second=self.columns)
+        self.assertEqual(first=list(df.gameid), second=['1234'])
+
+    def test_composite_key(self):
+        columns = ['gameid', 'game_data_type', 'uploadedFLG']
+        key = ['gameid', 'game_data_type']
+        with UploadLedger(self.filepath, columns, key=key) as ledger:
+            ledger.upsert([
+                {'gameid': '1234', 'game_data_type': 'playbyplay', 'uploadedFLG': 0},
+                {'gameid': '1234', 'game_data_type': 'boxscore_player', 'uploadedFLG': 0}
+            ])
+            ledger.upsert([{'gameid': '1234', 'game_data_type': 'playbyplay', 'uploadedFLG': 1}])
+            df = ledger.to_dataframe()
+            row = ledger.get(('1234', 'boxscore_player'))
+
+        # one row per game and type
+        self.assertEqual(first=list(df.game_data_type), second=['playbyplay', 'boxscore_player'])
+        self.assertEqual(first=list(df.uploadedFLG), second=[1, 0])
+        self.assertEqual(
+            first=row,
+            second={'gameid': '1234', 'game_data_type': 'boxscore_player', 'uploadedFLG': 0}
+        )
+
+        with self.assertRaises(ValueError):
+            UploadLedger(self.filepath, columns, key=['gameid', 'season'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,17 @@
 import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+import tempfile
 import unittest
+import unittest.mock as mock
 
-from triple_triple_etl.load.storage.load_helper import get_uploaded_metadata
+from triple_triple_etl.load.storage.load_helper import (
+    get_uploaded_metadata,
+    update_uploaded_metadata,
+    export_uploaded_metadata,
+    read_game_table,
+    update_game_metadata
+)
 from triple_triple_etl.constants import META_DIR
 
 
@@ -54,6 +64,107 @@ class TestUploadedMetaData(unittest.TestCase):
         # check total row count
         self.assertEqual(first=df.shape[0], second=0)
 
+    def test_update_uploaded_metadata(self):
+        columns = ['input_filename', 'gameid', 'uploadedFLG']
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filepath = os.path.join(tmp_dir, 'uploaded.parquet.snappy')
+            update_uploaded_metadata(
+                filepath,
+                columns=columns,
+                rows=[
+                    {'input_filename': 'file1.7z', 'gameid': '1', 'uploadedFLG': 0},
+                    {'input_filename': 'file2.7z', 'gameid': '2', 'uploadedFLG': 1}
+                ],
+                key='input_filename'
+            )
+            # existing rows are replaced
+            update_uploaded_metadata(
+                filepath,
+                columns=columns,
+                rows=[{'input_filename': 'file1.7z', 'gameid': '1', 'uploadedFLG': 1}],
+                key='input_filename'
+            )
+            df = get_uploaded_metadata(filepath, columns, key='input_filename')
+            df_file2 = get_uploaded_metadata(
+                filepath,
+                columns,
+                key='input_filename',
+                value='file2.7z'
+            )
+
+            # parquet copy
+            export_uploaded_metadata(filepath, columns, key='input_filename')
+            df_parquet = get_uploaded_metadata(filepath, columns)
+
+        self.assertEqual(first=df.shape[0], second=2)
+        self.assertEqual(first=list(df.uploadedFLG), second=[1, 1])
+        self.assertEqual(first=list(df_file2.gameid), second=['2'])
+        self.assertTrue(df_parquet.equals(df))
+
+    def test_update_game_metadata(self):
+        columns = ['season', 'gameid', 'params', 'uploadedFLG', 'lastuploadDTS']
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filepath = os.path.join(tmp_dir, 'uploaded.parquet.snappy')
+            update_game_metadata(
+                filepath,
+                columns=columns,
+                season='2015-2016',
+                gameid='1234',
+                uploadedFLG=1,
+                params='{}'
+            )
+            df = get_uploaded_metadata(filepath, columns, key='gameid')
+
+        self.assertEqual(first=list(df.gameid), second=['1234'])
+        self.assertEqual(first=list(df.params), second=['{}'])
+        self.assertIsNotNone(df.lastuploadDTS.iloc[0])
+
+
+class TestReadGameTable(unittest.TestCase):
+    """Tests for read_game_table()"""
+    def test_read_game_table(self):
+        table = pa.table({'eventid': [1, 2], 'playerid': [-1, 10]})
+
+        def download_file(Bucket, Key, Filename):
+            pq.write_table(table, Filename)
+
+        s3client_mock = mock.Mock()
+        s3client_mock.download_file.side_effect = download_file
+        get_bucket_content_mock = mock.Mock(return_value=['file1', 'file2'])
+
+        path = 'triple_triple_etl.load.storage.load_helper'
+        with mock.patch.multiple(path, get_bucket_content=get_bucket_content_mock), \
+             tempfile.TemporaryDirectory() as tmp_dir:
+            result = read_game_table(
+                'nba-game-info',
+                tablename='gameposition',
+                season='2015-2016',
+                gameid='1234',
+                s3client=s3client_mock,
+                tmp_dir=tmp_dir,
+                columns=['playerid']
+            )
+
+        get_bucket_content_mock.assert_called_once_with(
+            bucket_name='nba-game-info',
+            prefix='gameposition/season=2015-2016/gameid=1234/',
+            delimiter=''
+        )
+        self.assertEqual(first=result.column_names, second=['playerid'])
+        self.assertEqual(first=result.column('playerid').to_pylist(), second=[-1, 10, -1, 10])
+
+    def test_read_game_table_no_files(self):
+        path = 'triple_triple_etl.load.storage.load_helper'
+        with mock.patch.multiple(path, get_bucket_content=mock.Mock(return_value=[])):
+            with self.assertRaises(FileNotFoundError):
+                read_game_table(
+                    'nba-game-info',
+                    tablename='gameposition',
+                    season='2015-2016',
+                    gameid='1234',
+                    s3client=mock.Mock()
+                )
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -4,6 +4,8 @@ import moto
 import numpy as np
 import os
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import unittest
 import unittest.mock as mock
 
@@ -11,11 +13,14 @@ from triple_triple_etl.constants import SQL_DIR
 from triple_triple_etl.core.s3 import get_bucket_content
 from triple_triple_etl.load.storage.player_actions import (
     get_file_idx_in_uploaded,
-    PlayerActionsETL
+    PlayerActionsETL,
+    PlayerActionsLocalETL
 )
 
 athena = boto3.client('athena', region_name='us-east-1')
 
+HELPER_PATH = 'triple_triple_etl.load.storage.load_helper'
+
 mock_df_uploaded = pd.DataFrame(
     data=[
         ['2015-2016', '1234', "{'fake': 'params'}"] + 2 * [np.nan],
@@ -74,12 +79,12 @@ class TestPlayerActionsETL(unittest.TestCase):
             open_mock.assert_called_once_with(player_action_path)
 
     def test_create_tmp_table(self):
-        execute_athena_query_mock = mock.Mock(return_value='some_return')
-        check_table_exists_mock = mock.Mock()
+        execute_athena_query_mock = mock.Mock(return_value={'QueryExecutionId': 'someid'})
+        wait_for_query_execution_mock = mock.Mock()
 
         patches = {
             'execute_athena_query': execute_athena_query_mock,
-            'check_table_exists': check_table_exists_mock
+            'wait_for_query_execution': wait_for_query_execution_mock
         }
         path = 'triple_triple_etl.load.storage.player_actions'
 
@@ -93,21 +98,28 @@ class TestPlayerActionsETL(unittest.TestCase):
 
             self.assertEqual(
                 first=etl.s3keys['create_player_actions_tmp'],
-                second='some_return'
+                second={'QueryExecutionId': 'someid'}
             )
-            check_table_exists_mock.assert_called_once_with(
-                database_name=etl.database,
-                table_name='player_actions_tmp',
+            wait_for_query_execution_mock.assert_called_once_with(
+                'someid',
+                boto3_client=mock.ANY,
                 max_time=300
             )
 
     def test_move_tmp_to_final(self):
-        get_bucket_content_mock = mock.Mock(return_value=['contents_list'])
-        copy_bucket_contents_mock = mock.Mock()
+        files = [
+            'player_actions_tmp/season=2015-2016/gameid=1234/file1',
+            'player_actions_tmp/season=2015-2016/gameid=9876/file2'
+        ]
+        get_bucket_sizes_mock = mock.Mock(return_value={files[0]: 10, files[1]: 10})
+        copy_bucket_contents_mock = mock.Mock(return_value={
+            files[0]: {'destination': 'somekey', 'copied': False, 'error': 'some error'},
+            files[1]: {'destination': 'somekey', 'copied': True, 'error': None}
+        })
         s3client_mock = mock.Mock()
 
         patches = {
-            'get_bucket_content': get_bucket_content_mock,
+            'get_bucket_sizes': get_bucket_sizes_mock,
             'copy_bucket_contents': copy_bucket_contents_mock,
             's3client': s3client_mock
         }
@@ -118,58 +130,63 @@ class TestPlayerActionsETL(unittest.TestCase):
                 season='2015-2016',
                 gameid_bounds=['0010', '0020'],
             )
-            etl.move_tmp_to_final()
+            all_files = etl.move_tmp_to_final()
 
-            get_bucket_content_mock.assert_called_once_with(
+            get_bucket_sizes_mock.assert_called_once_with(
                 bucket_name=etl.destination_bucket,
-                prefix='player_actions_tmp',
-                delimiter=''
+                prefix='player_actions_tmp'
             )
             copy_bucket_contents_mock.assert_called_once_with(
-                copy_source_keys=get_bucket_content_mock.return_value,
+                copy_source_keys=files,
                 destination_bucket=etl.destination_bucket,
                 destination_folder='player_actions',
-                s3client=s3client_mock
+                s3client=s3client_mock,
+                sizes=get_bucket_sizes_mock.return_value
             )
+        # only the files copied are returned, for the partitions
+        self.assertEqual(first=all_files, second=files[1:])
+        self.assertEqual(first=etl.failed_files, second=files[:1])
 
 
     def test_alter_tables(self):
         all_files = [
             'somekey/season=2015-2016/gameid=1234/file1',
             'somekey/season=2015-2016/gameid=9876/file2',
+            'somekey/season=2015-2016/gameid=9876/file3',
         ]
 
-        data_read = 'select * from blah'
-        open_mock = mock.mock_open(read_data=data_read)
-        execute_athena_query_mock = mock.Mock()
         athena_mock = mock.Mock()
-
-        patches = {
-            'open': open_mock,
-            'execute_athena_query': execute_athena_query_mock,
-            'athena': athena_mock
+        athena_mock.start_query_execution.return_value = {'QueryExecutionId': 'someid'}
+        athena_mock.get_query_execution.return_value = {
+            'QueryExecution': {'Status': {'State': 'SUCCEEDED'}}
         }
         path = 'triple_triple_etl.load.storage.player_actions'
-            
-        with mock.patch.multiple(path, **patches):
+
+        with mock.patch.multiple(path, athena=athena_mock):
             etl = PlayerActionsETL(
                 season='2015-2016',
                 gameid_bounds=['0010', '0020'],
             )
             etl.alter_table(all_files)
-            self.assertEqual(
-                first=execute_athena_query_mock.call_count,
-                second=len(all_files)
-            )
+
+        # one query adds the partitions of all games, and is waited on
+        athena_mock.start_query_execution.assert_called_once()
+        query = athena_mock.start_query_execution.call_args[1]['QueryString']
+        self.assertIn('ALTER TABLE nba.player_actions ADD IF NOT EXISTS', query)
+        self.assertEqual(first=query.count('PARTITION ('), second=2)
+        athena_mock.get_query_execution.assert_called_once_with(QueryExecutionId='someid')
+        self.assertEqual(first=len(etl.partitions), second=0)
 
     def test_drop_tmp_tables(self):
-        execute_athena_query_mock = mock.Mock()
+        execute_athena_query_mock = mock.Mock(return_value={'QueryExecutionId': 'someid'})
+        wait_for_query_execution_mock = mock.Mock()
         athena_mock = mock.Mock()
 
         path = 'triple_triple_etl.load.storage.player_actions'
 
         patches = {
             'execute_athena_query': execute_athena_query_mock,
+            'wait_for_query_execution': wait_for_query_execution_mock,
             'athena': athena_mock
         }
         with mock.patch.multiple(path, **patches):
@@ -185,22 +202,25 @@ class TestPlayerActionsETL(unittest.TestCase):
                 output_filename='drop_table_player_actions_tmp',
                 boto3_client=athena_mock
             )
+            wait_for_query_execution_mock.assert_called_once_with(
+                'someid',
+                boto3_client=athena_mock
+            )
             
     def test_cleanup(self):
-        get_bucket_content_mock = mock.Mock()
-        get_bucket_content_mock.side_effect = [
-            ['player_actions/somekey/season=2015-2016/gameid=1234/file1',
-             'player_actions/somekey/season=2015-2016/gameid=9876/file2'],
-        ]
-        remove_bucket_contents_mock = mock.Mock(return_value=1)
+        s3client_mock = mock.Mock()
+        s3client_mock.delete_objects.side_effect = lambda Bucket, Delete: {
+            'Deleted': [{'Key': obj['Key']} for obj in Delete['Objects']]
+        }
         get_uploaded_metadata_mock = mock.Mock(
             return_value=copy.deepcopy(mock_df_uploaded))
         update_metadata_mock = mock.Mock()
+        update_uploaded_metadata_mock = mock.Mock()
 
         patches = {
-            'get_bucket_content': get_bucket_content_mock,
-            'remove_bucket_contents': remove_bucket_contents_mock,
-            'get_uploaded_metadata': get_uploaded_metadata_mock
+            's3client': s3client_mock,
+            'get_uploaded_metadata': get_uploaded_metadata_mock,
+            'update_uploaded_metadata': update_uploaded_metadata_mock
         }
         path = 'triple_triple_etl.load.storage.player_actions'
 
@@ -209,6 +229,9 @@ class TestPlayerActionsETL(unittest.TestCase):
                 season='2015-2016',
                 gameid_bounds=['0010', '0020'],
             )
+            # the file of game 9876 did not copy
+            etl.copied_files = ['player_actions/somekey/season=2015-2016/gameid=1234/file1']
+            etl.failed_files = ['player_actions/somekey/season=2015-2016/gameid=9876/file2']
             etl.cleanup()
 
             # test df_uploaded is updated
@@ -217,10 +240,18 @@ class TestPlayerActionsETL(unittest.TestCase):
                 second=3,
                 msg=etl.df_uploaded
             )
-            # check remove_bucket_contents called appropriate times
+            # only the file copied is removed
+            s3client_mock.delete_objects.assert_called_once()
             self.assertEqual(
-                first=remove_bucket_contents_mock.call_count,
-                second=2
+                first=s3client_mock.delete_objects.call_args[1]['Delete']['Objects'],
+                second=[{'Key': etl.copied_files[0]}]
+            )
+            # only the rows of this run's games are saved, and only the
+            # game copied is uploaded
+            rows = update_uploaded_metadata_mock.call_args[1]['rows']
+            self.assertEqual(
+                first=sorted((row['gameid'], row['uploadedFLG']) for row in rows),
+                second=[('1234', 1), ('9876', 0)]
             )
 
     def test_run(self):
@@ -259,5 +290,95 @@ class TestPlayerActionsETL(unittest.TestCase):
 
 
 
+
+class TestPlayerActionsLocalETL(unittest.TestCase):
+    """ Tests for PlayerActionsLocalETL """
+
+    def test_run(self):
+        playbyplay = pa.table({
+            'eventnum': [1., 2.],
+            'eventmsgtype': [1., 4.],
+            'eventmsgactiontype': [1., 0.],
+            'period': [1., 1.],
+            'wctimestring': ['19:00:00', '19:00:10'],
+            'pctimestring': ['11:42', '11:30'],
+            'homedescription': ['A Jump Shot (2 PTS) (C 1 AST)', None],
+            'visitordescription': [None, 'B Rebound'],
+            'player1_id': [1., 2.],
+            'player1_name': ['A', 'B'],
+            'player1_team_id': [10., 20.],
+            'player1_team_city': ['X', 'Y'],
+            'player1_team_abbreviation': ['XX', 'YY'],
+            'player2_id': [3., None],
+            'player2_name': ['C', None],
+            'player2_team_id': [10., None],
+            'player2_team_city': ['X', None],
+            'player2_team_abbreviation': ['XX', None],
+            'player3_id': [None, None],
+            'player3_name': [None, None],
+            'player3_team_id': [None, None],
+            'player3_team_city': [None, None],
+            'player3_team_abbreviation': [None, None],
+            'season': ['2015-2016'] * 2,
+            'gameid': ['1234'] * 2,
+        })
+
+        def download_file(Bucket, Key, Filename):
+            pq.write_table(playbyplay, Filename)
+
+        uploaded = {}
+
+        def upload_file(Filename, Bucket, Key):
+            uploaded[Key] = pq.read_table(Filename)
+
+        s3client_mock = mock.Mock()
+        s3client_mock.download_file.side_effect = download_file
+        s3client_mock.upload_file.side_effect = upload_file
+        get_bucket_content_mock = mock.Mock(return_value=['playbyplay/season=2015-2016/gameid=1234/file1'])
+        athena_mock = mock.Mock()
+        athena_mock.start_query_execution.return_value = {'QueryExecutionId': 'someid'}
+        athena_mock.get_query_execution.return_value = {
+            'QueryExecution': {'Status': {'State': 'SUCCEEDED'}}
+        }
+        update_uploaded_metadata_mock = mock.Mock()
+
+        patches = {
+            's3client': s3client_mock,
+            'athena': athena_mock
+        }
+        helper_patches = {
+            'get_bucket_content': get_bucket_content_mock,
+            'update_uploaded_metadata': update_uploaded_metadata_mock
+        }
+        path = 'triple_triple_etl.load.storage.player_actions'
+        with mock.patch.multiple(path, **patches), \
+             mock.patch.multiple(HELPER_PATH, **helper_patches):
+            etl = PlayerActionsLocalETL(season='2015-2016', gameid='1234')
+            etl.run()
+
+        get_bucket_content_mock.assert_called_once_with(
+            bucket_name='nba-game-info',
+            prefix='playbyplay/season=2015-2016/gameid=1234/',
+            delimiter=''
+        )
+        table = uploaded['player_actions/season=2015-2016/gameid=1234/player_actions.parquet.snappy']
+        self.assertEqual(
+            first=table.column('event_action').to_pylist(),
+            second=['field goal made', 'assist', 'rebound']
+        )
+        self.assertEqual(first=table.column('playerid').to_pylist(), second=[1., 3., 2.])
+        # partition columns are in the key
+        self.assertNotIn('gameid', table.schema.names)
+
+        # the partition is added, no tmp table
+        athena_mock.start_query_execution.assert_called_once()
+        self.assertIn("gameid = '1234'", athena_mock.start_query_execution.call_args[1]['QueryString'])
+
+        rows = update_uploaded_metadata_mock.call_args[1]['rows']
+        self.assertEqual(first=rows[0]['gameid'], second='1234')
+        self.assertEqual(first=rows[0]['uploadedFLG'], second=1)
+        self.assertFalse(os.path.exists(etl.tmp_dir))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,19 +1,33 @@
+from concurrent.futures import ThreadPoolExecutor
 import copy
 import io
+import json
 import boto3
 import moto
 import os
+import py7zr
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shutil
 import tempfile
 import unittest
 import unittest.mock as mock
 
 from tests.fixtures.mock_s37z_to_s3parquet_data import mock_df_uploaded
 from tests.fixtures.mock_s3rawdata import data
+from triple_triple_etl.core.s3_json2df import (
+    get_game_info,
+    get_game_position_info,
+    get_team_info,
+    iter_game_position_batches
+)
 from triple_triple_etl.load.storage.s37z_to_s3parquet import (
+    GAMEPOSITION_SORT_BY,
     get_file_idx_in_uploaded,
     S3FileFormatETL,
     transform_upload_all_games
 )
+from triple_triple_etl.load.storage.load_helper import get_uploaded_metadata
 from triple_triple_etl.constants import META_DIR, TEST_DIR
 
 
@@ -62,7 +76,9 @@ class TestS3FileFormatETL(unittest.TestCase):
         
         get_uploaded_metadata_mock.assert_called_once_with(
             etl.uploaded_filepath,
-            columns=list(mock_df_uploaded.columns)
+            columns=list(mock_df_uploaded.columns),
+            key='input_filename',
+            value=inputfile_mock
         )
         get_file_idx_uploaded_mock.assert_called_once_with(
             df_uploaded=mock_df_uploaded,
@@ -109,7 +125,8 @@ class TestS3FileFormatETL(unittest.TestCase):
             input_filename=inputfile_mock,
             source_bucket=source_bucket_mock,
             destination_bucket=destination_bucket_mock,
-            season=season
+            season=season,
+            streaming=False
         )
         # test given open mock
         patches = {
@@ -153,6 +170,92 @@ class TestS3FileFormatETL(unittest.TestCase):
             first=extract_output,
             second={}
         )
+
+    def test_extract_from_s3_streaming(self):
+        # a real .7z of the mock data
+        archive = io.BytesIO()
+        with py7zr.SevenZipFile(archive, mode='w') as f:
+            f.writestr(json.dumps(data), 'somefile.json')
+        archive.seek(0)
+
+        s3download_fileobj_mock = mock.Mock(return_value=archive)
+        tempfile_mock = mock.Mock()
+        tempfile_mock.mkdtemp.return_value = 'tmp/somedir'
+
+        etl = S3FileFormatETL(
+            input_filename='somefile.7z',
+            source_bucket='nba-player-positions',
+            destination_bucket='nba-game-info',
+            season='2015-2016'
+        )
+        patches = {
+            's3download_fileobj': s3download_fileobj_mock,
+            'tempfile': tempfile_mock
+        }
+        path = 'triple_triple_etl.load.storage.s37z_to_s3parquet'
+        with mock.patch.multiple(path, **patches):
+            extract_output = etl.extract_from_s3()
+
+        s3download_fileobj_mock.assert_called_once_with(
+            bucket_name='nba-player-positions',
+            filename='somefile.7z'
+        )
+        expected = json.loads(json.dumps(data))
+        self.assertEqual(first=etl.gameid, second=data['gameid'])
+        # nothing is written to disk
+        tempfile_mock.mkdtemp.assert_not_called()
+        self.assertIsNone(etl.tmp_dir)
+
+        # the small tables get the top level values and the first event,
+        # the events are a stream
+        header = etl.split_header(extract_output)
+        self.assertEqual(first=header, second=dict(expected, events=expected['events'][:1]))
+        self.assertNotIsInstance(extract_output['events'], list)
+        self.assertEqual(first=list(extract_output['events']), second=expected['events'])
+
+        # a file that is not a .7z returns empty data
+        s3download_fileobj_mock.return_value = io.BytesIO(b'some contents and stuff')
+        with mock.patch.multiple(path, **patches):
+            extract_output = etl.extract_from_s3()
+        self.assertEqual(first=extract_output, second={})
+
+    def test_transform_streaming(self):
+        archive = io.BytesIO()
+        with py7zr.SevenZipFile(archive, mode='w') as f:
+            f.writestr(json.dumps(data), 'somefile.json')
+        archive.seek(0)
+
+        etl = S3FileFormatETL(
+            input_filename='somefile.7z',
+            source_bucket='nba-player-positions',
+            destination_bucket='nba-game-info',
+            season='2015-2016'
+        )
+        path = 'triple_triple_etl.load.storage.s37z_to_s3parquet'
+        with mock.patch(path + '.s3download_fileobj', mock.Mock(return_value=archive)):
+            game = etl.extract_from_s3()
+        header = etl.split_header(game)
+
+        try:
+            etl.transform_game(header)
+            etl.transform_player(header)
+            etl.transform_team(header)
+            etl.transform_position(game)
+            table = pq.read_table(etl.data_paths['gameposition'])
+        finally:
+            shutil.rmtree(etl.tmp_dir)
+
+        # same tables as from the whole data
+        expected = get_game_position_info(data)\
+            .drop(['season', 'gameid'])\
+            .sort_by(GAMEPOSITION_SORT_BY)
+        self.assertTrue(table.equals(expected))
+        self.assertTrue(
+            pq.read_table(pa.BufferReader(etl.data_paths['teaminfo'])).equals(
+                get_team_info(data).drop(['season', 'gameid'])
+            )
+        )
+
     def test_transform(self):
         # etl input mocks
         inputfile_mock = 'somefile.7z'
@@ -165,8 +268,7 @@ class TestS3FileFormatETL(unittest.TestCase):
         transform_function_mock = mock.Mock()
 
         # built in function mocks
-        pq_mock = mock.Mock()
-        pq_mock.write_to_dataset = mock.Mock()
+        write_buffer_mock = mock.Mock()
         os_mock = mock.Mock()
         os_mock.listdir = mock.Mock(return_value=['somefilename.parquet'])
 
@@ -186,7 +288,7 @@ class TestS3FileFormatETL(unittest.TestCase):
 
         # collect functions to patch
         patches = {
-            'pq': pq_mock,
+            'write_buffer': write_buffer_mock,
             'os': os_mock 
         }
         path = 'triple_triple_etl.load.storage.s37z_to_s3parquet'
@@ -203,6 +305,117 @@ class TestS3FileFormatETL(unittest.TestCase):
 
         # check transform_function called are called
         transform_function_mock.assert_called_once_with(data)
+        write_buffer_mock.assert_called_once_with(
+            transform_function_mock.return_value,
+            drop_columns=['season', 'gameid']
+        )
+
+    def test_transform_batches(self):
+        etl = S3FileFormatETL(
+            input_filename='somefile.7z',
+            source_bucket='nba-player-positions',
+            destination_bucket='nba-game-info',
+            season='2015-2016'
+        )
+        etl.tmp_dir = tempfile.mkdtemp()
+        etl.gameid = data['gameid']
+        # about one event per row group
+        etl.row_group_bytes = 1000
+
+        try:
+            etl._transform(
+                data=data,
+                tablename='gameposition',
+                transform_function=lambda x: iter_game_position_batches(x, events_per_batch=1)
+            )
+            table = pq.read_table(etl.data_paths['gameposition'])
+            metadata = pq.ParquetFile(etl.data_paths['gameposition']).metadata
+            # the unsorted spill file is removed
+            self.assertEqual(
+                first=os.listdir(os.path.dirname(etl.data_paths['gameposition'])),
+                second=['gameposition.parquet']
+            )
+        finally:
+            shutil.rmtree(etl.tmp_dir)
+
+        # sorted, partition columns left out as in pq.write_to_dataset
+        expected = get_game_position_info(data)\
+            .drop(['season', 'gameid'])\
+            .sort_by(GAMEPOSITION_SORT_BY)
+        self.assertTrue(table.equals(expected))
+        self.assertIn('gameid={}'.format(data['gameid']), etl.data_paths['gameposition'])
+
+        # row groups of consecutive eventids, with their min/max. an event
+        # is never split between row groups
+        self.assertGreater(metadata.num_row_groups, 1)
+        eventid_col = table.column_names.index('eventid')
+        ranges = [
+            (metadata.row_group(i).column(eventid_col).statistics.min,
+             metadata.row_group(i).column(eventid_col).statistics.max)
+            for i in range(metadata.num_row_groups)
+        ]
+        for (_, previous_max), (next_min, _) in zip(ranges, ranges[1:]):
+            self.assertLess(previous_max, next_min)
+
+    def test_transform_in_memory(self):
+        etl = S3FileFormatETL(
+            input_filename='somefile.7z',
+            source_bucket='nba-player-positions',
+            destination_bucket='nba-game-info',
+            season='2015-2016'
+        )
+        etl.tmp_dir = tempfile.mkdtemp()
+        etl.gameid = data['gameid']
+
+        try:
+            etl._transform(data=data, tablename='gameinfo', transform_function=get_game_info)
+            # nothing written to disk
+            self.assertEqual(first=os.listdir(etl.tmp_dir), second=[])
+        finally:
+            shutil.rmtree(etl.tmp_dir)
+
+        table = pq.read_table(pa.BufferReader(etl.data_paths['gameinfo']))
+        expected = get_game_info(data).drop(['season', 'gameid'])
+        self.assertTrue(table.equals(expected))
+
+    def test_load_concurrent(self):
+        s3_mock = mock.Mock()
+        etl = S3FileFormatETL(
+            input_filename='somestuff/rawdata/01.01.2016.GSW.at.NOP.7z',
+            destination_bucket='nba-game-info-test',
+            season='2015-2016'
+        )
+        etl.gameid = '1234'
+        etl.df_uploaded = copy.deepcopy(mock_df_uploaded)
+        etl.file_idx = 1
+
+        with tempfile.NamedTemporaryFile() as tmp_file:
+            etl.data_paths = {
+                'gameposition': tmp_file.name,
+                'gameinfo': io.BytesIO(b'gameinfo'),
+                'playerinfo': io.BytesIO(b'playerinfo'),
+                # teaminfo failed to transform
+            }
+            with mock.patch('triple_triple_etl.load.storage.s37z_to_s3parquet.s3', s3_mock):
+                etl.load()
+
+        # gameposition in parts, the small tables with one request
+        s3_mock.upload_file.assert_called_once()
+        self.assertEqual(
+            first=s3_mock.upload_file.call_args[1]['Key'],
+            second='gameposition/season=2015-2016/gameid=1234/01012016GSWatNOP.parquet.snappy'
+        )
+        self.assertIn('Config', s3_mock.upload_file.call_args[1])
+        self.assertEqual(first=s3_mock.put_object.call_count, second=2)
+        s3_mock.put_object.assert_any_call(
+            Bucket='nba-game-info-test',
+            Key='gameinfo/season=2015-2016/gameid=1234/01012016GSWatNOP.parquet.snappy',
+            Body=b'gameinfo'
+        )
+        row = etl.df_uploaded.loc[1]
+        self.assertEqual(first=row['gameposition_uploadedFLG'], second=1)
+        self.assertEqual(first=row['playerinfo_uploadedFLG'], second=1)
+        self.assertEqual(first=row['teaminfo_uploadedFLG'], second=0)
 
     @moto.mock_s3
     def test_load(self):
@@ -262,7 +475,7 @@ class TestS3FileFormatETL(unittest.TestCase):
             'get_game_info': get_game_info_mock,
             'get_player_info': get_player_info_mock,
             'get_team_info': get_team_info_mock,
-            'get_game_position_info': get_game_position_info_mock,
+            'iter_game_position_batches': get_game_position_info_mock,
         }
         path = 'triple_triple_etl.load.storage.s37z_to_s3parquet'
         with mock.patch.multiple(path, **patches):
@@ -329,27 +542,28 @@ class TestS3FileFormatETL(unittest.TestCase):
         # update some attributes
         etl.tmp_dir = '/tmp/somedir'
         etl.df_uploaded = copy.deepcopy(mock_df_uploaded)
-        tmp_filepath = os.path.join(
-            TEST_DIR,
-            'test_tmp',
-            's37z_s3parquet_cleanup.parquet'
-        )
+        ledger_dir = tempfile.mkdtemp()
+        tmp_filepath = os.path.join(ledger_dir, 's37z_s3parquet_cleanup.parquet')
         etl.uploaded_filepath = tmp_filepath
         etl.file_idx = 1
 
         path = 'triple_triple_etl.load.storage.s37z_to_s3parquet.shutil'
-        with mock.patch(path, mock.Mock()) as s:
-            etl.cleanup()
-            s.rmtree.assert_called_once_with(etl.tmp_dir)
-            
-            # check file exists
-            self.assertTrue(os.path.exists(tmp_filepath))
-
-        # remove the file created 's37z_s3parquet_cleanup.parquet'
         try:
-            os.remove(tmp_filepath)
-        except OSError:
-            pass
+            with mock.patch(path, mock.Mock()) as s:
+                etl.cleanup()
+                s.rmtree.assert_called_once_with(etl.tmp_dir)
+
+            # check the file's row is in the ledger
+            df = get_uploaded_metadata(
+                tmp_filepath,
+                columns=list(mock_df_uploaded.columns),
+                key='input_filename'
+            )
+        finally:
+            shutil.rmtree(ledger_dir)
+
+        self.assertEqual(first=list(df.input_filename), second=['somefile.7z'])
+        self.assertIsNotNone(df.lastuploadDTS.iloc[0])
 
     def test_run(self):
         # etl mock functions
@@ -374,7 +588,7 @@ class TestS3FileFormatETL(unittest.TestCase):
             'get_game_info': get_game_info_mock,
             'get_player_info': get_player_info_mock,
             'get_team_info': get_team_info_mock,
-            'get_game_position_info': get_game_position_info_mock,
+            'iter_game_position_batches': get_game_position_info_mock,
         }
         path = 'triple_triple_etl.load.storage.s37z_to_s3parquet'
         with mock.patch.multiple(path, **patches):
@@ -444,6 +658,55 @@ class TestTransformUploadAll(unittest.TestCase):
         assert S3FileFormatETL_mock.call_count == len(idx)
         assert etl_mock.run.call_count == len(idx)
 
+    def test_tranform_upload_all_games_parallel(self):
+        all_files = ['file1.7z', 'file2.7z', 'file3.7z']
+        rows = {
+            filename: {'input_filename': filename, 'gameid': str(i)}
+            for i, filename in enumerate(all_files)
+        }
+        results = {
+            'file1.7z': ('file1.7z', rows['file1.7z'], None),
+            'file2.7z': ('file2.7z', rows['file2.7z'], 'Not uploaded: gameinfo_uploadedFLG'),
+        }
+
+        def run_game_etl(filename, season, source_bucket, destination_bucket):
+            if filename not in results:
+                raise RuntimeError('worker died')
+            return results[filename]
+
+        update_uploaded_metadata_mock = mock.Mock()
+        export_uploaded_metadata_mock = mock.Mock()
+        patches = {
+            '_run_game_etl': run_game_etl,
+            'update_uploaded_metadata': update_uploaded_metadata_mock,
+            'export_uploaded_metadata': export_uploaded_metadata_mock,
+            # threads stand in for processes
+            'ProcessPoolExecutor': lambda max_workers, mp_context: ThreadPoolExecutor(max_workers)
+        }
+        path = 'triple_triple_etl.load.storage.s37z_to_s3parquet'
+        with mock.patch.multiple(path, **patches):
+            summary = transform_upload_all_games(
+                season='2015-2016',
+                all_files=all_files,
+                max_workers=2
+            )
+
+        self.assertEqual(first=summary['succeeded'], second=['file1.7z'])
+        self.assertEqual(
+            first=set(summary['failed']),
+            second={'file2.7z', 'file3.7z'}
+        )
+        # the ledger is saved by this process for every game with a row
+        saved_rows = [
+            call[1]['rows'][0]
+            for call in update_uploaded_metadata_mock.call_args_list
+        ]
+        self.assertCountEqual(
+            first=saved_rows,
+            second=[rows['file1.7z'], rows['file2.7z']]
+        )
+        export_uploaded_metadata_mock.assert_called_once()
+
 
 
 if __name__ == '__main__':
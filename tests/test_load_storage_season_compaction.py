@@ -0,0 +1,178 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+import unittest
+import unittest.mock as mock
+
+from triple_triple_etl.load.storage.season_compaction import (
+    compact_seasons,
+    get_gameid,
+    SeasonCompactionETL
+)
+
+
+class FakeS3(object):
+    """s3client and get_bucket_content mocks over a dict of key: bytes"""
+    def __init__(self, objects: dict):
+        self.objects = objects
+        self.client = mock.Mock()
+        self.client.get_object.side_effect = self.get_object
+        self.client.put_object.side_effect = self.put_object
+        self.client.head_object.side_effect = self.head_object
+        self.client.delete_objects.side_effect = self.delete_objects
+
+    def get_object(self, Bucket, Key):
+        body = mock.Mock()
+        body.read.return_value = self.objects[Key]
+        return {'Body': body}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = Body
+
+    def head_object(self, Bucket, Key):
+        return {'ContentLength': len(self.objects[Key])}
+
+    def delete_objects(self, Bucket, Delete):
+        for obj in Delete['Objects']:
+            del self.objects[obj['Key']]
+        return {'Deleted': Delete['Objects']}
+
+    def get_bucket_content(self, bucket_name, prefix, delimiter):
+        keys = sorted(key for key in self.objects if key.startswith(prefix))
+        if delimiter == '':
+            return keys
+        subfolders = sorted({
+            prefix + key[len(prefix):].split('/')[0] + '/'
+            for key in keys if '/' in key[len(prefix):]
+        })
+        return [{'Prefix': subfolder} for subfolder in subfolders]
+
+
+def game_file(gameid: int):
+    # written as the s37z ETL does, without season and gameid
+    sink = pa.BufferOutputStream()
+    pq.write_table(pa.table({'teamid': [1, 2], 'pts': [gameid, gameid + 1]}), sink)
+    return sink.getvalue().to_pybytes()
+
+
+class TestSeasonCompactionETL(unittest.TestCase):
+    """ Tests for SeasonCompactionETL """
+
+    def setUp(self):
+        self.s3 = FakeS3({
+            'teaminfo/season=2015-2016/gameid=00215000{:02d}/file.parquet.snappy'.format(i): game_file(i)
+            for i in [3, 1, 2, 4]
+        })
+        self.athena_mock = mock.Mock()
+        self.athena_mock.start_query_execution.return_value = {'QueryExecutionId': 'someid'}
+        self.athena_mock.get_query_execution.return_value = {
+            'QueryExecution': {'Status': {'State': 'SUCCEEDED'}}
+        }
+        self.update_uploaded_metadata_mock = mock.Mock()
+        patcher = mock.patch.multiple(
+            'triple_triple_etl.load.storage.season_compaction',
+            s3client=self.s3.client,
+            get_bucket_content=self.s3.get_bucket_content,
+            athena=self.athena_mock,
+            update_uploaded_metadata=self.update_uploaded_metadata_mock
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def compacted_keys(self):
+        return sorted(key for key in self.s3.objects if key.startswith('teaminfo_compacted/'))
+
+    def queries(self):
+        return [
+            call[1]['QueryString']
+            for call in self.athena_mock.start_query_execution.call_args_list
+        ]
+
+    def test_get_gameid(self):
+        key = 'gameinfo/season=2015-2016/gameid=0021500001/x.parquet.snappy'
+        self.assertEqual(first=get_gameid(key), second='0021500001')
+
+    def test_run(self):
+        etl = SeasonCompactionETL(table='teaminfo', season='2015-2016', row_group_mb=0.00001)
+        etl.run()
+
+        keys = self.compacted_keys()
+        self.assertEqual(
+            first=keys,
+            second=['{}part-00000.parquet.snappy'.format(etl.prefix)]
+        )
+        parquet_file = pq.ParquetFile(pa.BufferReader(self.s3.objects[keys[0]]))
+        table = parquet_file.read()
+        self.assertEqual(first=table.column_names, second=['teamid', 'pts', 'gameid'])
+        self.assertEqual(
+            first=table.column('gameid').to_pylist(),
+            second=['0021500001'] * 2 + ['0021500002'] * 2 + ['0021500003'] * 2 + ['0021500004'] * 2
+        )
+        # small row groups, gameid min/max to prune on
+        self.assertGreater(parquet_file.metadata.num_row_groups, 1)
+        statistics = parquet_file.metadata.row_group(0).column(2).statistics
+        self.assertEqual(first=(statistics.min, statistics.max), second=('0021500001', '0021500001'))
+
+        # the table, the partition and its location
+        queries = self.queries()
+        self.assertIn('CREATE EXTERNAL TABLE IF NOT EXISTS nba.teaminfo_compacted', queries[0])
+        self.assertIn('    gameid string', queries[0])
+        self.assertIn('ADD IF NOT EXISTS', queries[1])
+        self.assertEqual(
+            first=queries[2].strip(),
+            second="ALTER TABLE nba.teaminfo_compacted PARTITION (season = '2015-2016') SET LOCATION '{}';".format(etl.location)
+        )
+        rows = self.update_uploaded_metadata_mock.call_args[1]['rows']
+        self.assertEqual(first=(rows[0]['num_games'], rows[0]['num_rows']), second=(4, 8))
+        self.assertEqual(first=rows[0]['uploadedFLG'], second=1)
+
+    def test_run_files(self):
+        etl = SeasonCompactionETL(table='teaminfo', season='2015-2016', file_mb=0.0001)
+        etl.run()
+
+        # whole games in each file
+        tables = [
+            pq.read_table(pa.BufferReader(self.s3.objects[key]))
+            for key in self.compacted_keys()
+        ]
+        self.assertGreater(len(tables), 1)
+        gameids = [sorted(set(table.column('gameid').to_pylist())) for table in tables]
+        self.assertEqual(
+            first=sum(gameids, []),
+            second=['0021500001', '0021500002', '0021500003', '0021500004']
+        )
+
+    def test_versions(self):
+        versions = []
+        for _ in range(3):
+            etl = SeasonCompactionETL(table='teaminfo', season='2015-2016', keep_versions=1)
+            etl.run()
+            versions.append(etl.prefix)
+
+        # the current and the one before
+        self.assertEqual(
+            first=sorted({key.rsplit('/', 1)[0] + '/' for key in self.compacted_keys()}),
+            second=versions[1:]
+        )
+
+    def test_swap_failed(self):
+        self.athena_mock.get_query_execution.return_value = {
+            'QueryExecution': {'Status': {'State': 'FAILED', 'StateChangeReason': 'some reason'}}
+        }
+        etl = SeasonCompactionETL(table='teaminfo', season='2015-2016')
+        with self.assertRaises(Exception):
+            etl.run()
+
+        # nothing left of the version
+        self.assertEqual(first=self.compacted_keys(), second=[])
+        rows = self.update_uploaded_metadata_mock.call_args[1]['rows']
+        self.assertEqual(first=rows[0]['uploadedFLG'], second=0)
+
+    def test_compact_seasons(self):
+        failed = compact_seasons(seasons=['2015-2016'], tables=['teaminfo', 'gameinfo'])
+        # no gameinfo files
+        self.assertEqual(first=failed, second=[('gameinfo', '2015-2016')])
+        self.assertEqual(first=len(self.compacted_keys()), second=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
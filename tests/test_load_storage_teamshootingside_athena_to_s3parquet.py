@@ -5,6 +5,10 @@ import boto3
 import moto
 import os
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shutil
+import tempfile
 import unittest
 import unittest.mock as mock
 
@@ -12,15 +16,26 @@ from tests.fixtures.mock_teamshootingside_athena_to_s3parquet import (
     mock_df_uploaded
 )
 from triple_triple_etl.core.s3 import get_bucket_content
+from triple_triple_etl.load.storage.load_helper import get_uploaded_metadata
 from triple_triple_etl.load.storage.teamshooting_athena_to_s3parquet import (
     get_file_idx_in_uploaded,
+    get_season,
+    UPLOADED_COLUMNS,
     TeamShootingSideALL,
-    TeamShootingSideETL
+    TeamShootingSideETL,
+    TeamShootingSideLocalETL,
+    upload_all_team_shooting_side
 )
 
+HELPER_PATH = 'triple_triple_etl.load.storage.load_helper'
+
 
 class TestHelper(unittest.TestCase):
     """Test get_file_idx_in_uploaded"""
+    def test_get_season(self):
+        self.assertEqual(first=get_season('0021500001'), second='2015-2016')
+        self.assertEqual(first=get_season('0041600101'), second='2016-2017')
+
     def test_file_exists(self):
         idx = get_file_idx_in_uploaded(
             df_uploaded=mock_df_uploaded,
@@ -56,7 +71,8 @@ class TestTeamShootingSideALL(unittest.TestCase):
         
         get_upload_metadata_mock.assert_called_once_with(
             etl.uploaded_filepath,
-            columns=list(mock_df_uploaded.columns)
+            columns=list(mock_df_uploaded.columns),
+            key='gameid'
         )
 
     def test_execute_query(self):
@@ -69,12 +85,14 @@ class TestTeamShootingSideALL(unittest.TestCase):
 
         execute_athena_query_mock = mock.Mock()
         execute_athena_query_mock.return_value = {'QueryExecutionId': '1234'}
+        wait_for_query_execution_mock = mock.Mock()
 
         patches = {
             'athena': athena_mock,
             'os': os_mock,
             'open': open_mock,
-            'execute_athena_query': execute_athena_query_mock         
+            'execute_athena_query': execute_athena_query_mock,
+            'wait_for_query_execution': wait_for_query_execution_mock
         }
         path = (
             'triple_triple_etl.load.storage.'
@@ -90,6 +108,8 @@ class TestTeamShootingSideALL(unittest.TestCase):
             boto3_client=athena_mock,
             output_filename='test'
         )
+        # the csv is read after the query finished
+        wait_for_query_execution_mock.assert_called_once_with('1234', boto3_client=athena_mock)
 
     def test_extract(self):
         # mock functions
@@ -121,37 +141,25 @@ class TestTeamShootingSideALL(unittest.TestCase):
 
     def test_transform(self):
         # mock functions
-        df_mock = pd.DataFrame([[1, 2], [3, 4]], columns=['season', 'gameid'])
+        df_mock = pd.DataFrame(
+            [['2015-2016', '1234', 1], ['2015-2016', '1234', 2], ['2015-2016', '5678', 1]],
+            columns=['season', 'gameid', 'period']
+        )
         pd_mock = mock.Mock()
         pd_mock.read_csv.return_value = df_mock
-        
-        pq_mock = mock.Mock()
-        pq_mock.write_to_dataset = mock.Mock()
-
-        pa_mock = mock.Mock()
-        pa_mock.Table.from_pandas.return_value = 'some_table'
 
-        patches = {
-            'pa': pa_mock,
-            'pd': pd_mock,
-            'pq': pq_mock
-        }        
         path = (
             'triple_triple_etl.load.storage.'
-            'teamshooting_athena_to_s3parquet'
+            'teamshooting_athena_to_s3parquet.pd'
         )
-        with mock.patch.multiple(path, **patches):
+        with mock.patch(path, pd_mock):
             etl = TeamShootingSideALL()
             etl.transform(output_filepath='some/path')
 
-        # check functions are called        
-        pq_mock.write_to_dataset.assert_called_once_with(
-            table='some_table',
-            root_path=etl.tmp_dir,
-            partition_cols=['season', 'gameid'],
-            compression='snappy',
-            preserve_index=False
-        )
+        # one file per game
+        self.assertEqual(first=list(etl.buffers), second=['1234', '5678'])
+        table = pq.read_table(pa.BufferReader(etl.buffers['1234']))
+        self.assertEqual(first=table.to_pydict(), second={'period': [1, 2]})
 
     @moto.mock_s3
     def test_load(self):
@@ -166,51 +174,49 @@ class TestTeamShootingSideALL(unittest.TestCase):
             ['2015-2016', '1234', 1, '2016-04-23', 'FUN']
         ]
         df_mock = pd.DataFrame(data=data, columns=columns)
-        
-        os_mock = mock.Mock()
-        os_mock.path.join.return_value = 'some/season/filepath/'
-        os_mock.listdir.side_effect = [
-            ['season=2015-2016'],
-            ['gameid=1234'], 
-            ['test_filename']
-        ]
+
+        etl = TeamShootingSideALL()
+        etl.destination_bucket = fake_bucket
+        etl.df_uploaded = copy.deepcopy(mock_df_uploaded)
+        etl.file_idx = etl.df_uploaded.shape[0]
+        etl.buffers = {'1234': pa.py_buffer(b'some parquet')}
         path = (
             'triple_triple_etl.load.storage.'
-            'teamshooting_athena_to_s3parquet.os'
+            'teamshooting_athena_to_s3parquet.s3client'
         )
-
-        with mock.patch(path, os_mock):
-            etl = TeamShootingSideALL()
-            etl.destination_bucket = fake_bucket
-            etl.metadata()
-            etl.df_uploaded = copy.deepcopy(mock_df_uploaded)
+        with mock.patch(path, boto3.client('s3', region_name='us-east-1')):
             etl.load(df_mock)
 
-        # ans = get_bucket_content(
-        #     bucket_name=fake_bucket,
-        #     prefix='team_shooting_side/',
-        #     delimiter='/'
-        # )
-
-        # TODO: How to test this function
+        key = 'team_shooting_side/season=2015-2016/gameid=1234/20160423FANFUN.parquet.snappy'
+        body = s3resource.Object(fake_bucket, key).get()['Body'].read()
+        self.assertEqual(first=body, second=b'some parquet')
+        self.assertEqual(first=etl.df_uploaded.loc[etl.file_idx, 'uploadedFLG'], second=1)
 
     def test_cleanup(self):
 
         etl = TeamShootingSideALL()
         # update some attributes
         etl.tmp_dir = '/tmp/somedir'
+        etl.buffers = {'1234': 'somebuffer'}
         etl.df_uploaded = copy.deepcopy(mock_df_uploaded)
         etl.file_idx = 1
         # mock functions
-        etl.df_uploaded.to_parquet = mock.Mock()
+        update_uploaded_metadata_mock = mock.Mock()
 
+        patches = {
+            'shutil': mock.Mock(),
+            'update_uploaded_metadata': update_uploaded_metadata_mock
+        }
         path = (
             'triple_triple_etl.load.storage.'
-            'teamshooting_athena_to_s3parquet.shutil'
+            'teamshooting_athena_to_s3parquet'
         )
-        with mock.patch(path, mock.Mock()) as s:
+        with mock.patch.multiple(path, **patches):
             etl.cleanup()
-            s.rmtree.assert_called_once_with(etl.tmp_dir)
+            patches['shutil'].rmtree.assert_called_once_with(etl.tmp_dir)
+
+        self.assertEqual(first=etl.buffers, second={})
+        update_uploaded_metadata_mock.assert_called_once()
 
 
     def test_run(self):
@@ -242,5 +248,201 @@ class TestTeamShootingSideALL(unittest.TestCase):
         cleanup_mock.assert_called_once_with()
 
 
+class TestUploadAllTeamShootingSide(unittest.TestCase):
+    """ Tests for upload_all_team_shooting_side """
+
+    def test_upload_all_team_shooting_side(self):
+        athena_mock = mock.Mock()
+        athena_mock.start_query_execution.side_effect = [
+            {'QueryExecutionId': 'id{}'.format(i)} for i in range(3)
+        ]
+        athena_mock.batch_get_query_execution.return_value = {'QueryExecutions': [
+            {'QueryExecutionId': 'id0', 'Status': {'State': 'SUCCEEDED'}},
+            {'QueryExecutionId': 'id1', 'Status': {'State': 'FAILED'}},
+            {'QueryExecutionId': 'id2', 'Status': {'State': 'SUCCEEDED'}},
+        ]}
+        etl_mock = mock.Mock()
+        etl_mock.return_value.get_query.return_value = 'some query'
+        etl_mock.return_value.cache = None
+        etl_mock.return_value.load.side_effect = [None, RuntimeError('upload failed')]
+
+        patches = {
+            'athena': athena_mock,
+            'TeamShootingSideETL': etl_mock
+        }
+        path = 'triple_triple_etl.load.storage.teamshooting_athena_to_s3parquet'
+        with mock.patch.multiple(path, **patches), mock.patch('time.sleep'):
+            failed = upload_all_team_shooting_side(
+                gameids=['0021500001', '0021500002', '0021500003'],
+                max_concurrency=3,
+                max_workers=1
+            )
+
+        # all the queries are in flight together
+        self.assertEqual(first=athena_mock.start_query_execution.call_count, second=3)
+        athena_mock.batch_get_query_execution.assert_called_once_with(
+            QueryExecutionIds=['id0', 'id1', 'id2']
+        )
+        etl_mock.return_value.extract.assert_has_calls([
+            mock.call('team_shooting_side/id0.csv'),
+            mock.call('team_shooting_side/id2.csv')
+        ])
+        self.assertEqual(first=failed, second=['0021500002', '0021500003'])
+
+    def test_timeout(self):
+        athena_mock = mock.Mock()
+        athena_mock.start_query_execution.side_effect = [
+            {'QueryExecutionId': 'id{}'.format(i)} for i in range(2)
+        ]
+        athena_mock.batch_get_query_execution.return_value = {'QueryExecutions': [
+            {'QueryExecutionId': 'id0', 'Status': {'State': 'SUCCEEDED'}},
+            {'QueryExecutionId': 'id1', 'Status': {'State': 'RUNNING'}},
+        ]}
+        etl_mock = mock.Mock()
+        etl_mock.return_value.get_query.return_value = 'some query'
+        etl_mock.return_value.cache = None
+
+        patches = {
+            'athena': athena_mock,
+            'TeamShootingSideETL': etl_mock
+        }
+        path = 'triple_triple_etl.load.storage.teamshooting_athena_to_s3parquet'
+        monotonic_path = 'triple_triple_etl.core.query_scheduler.time.monotonic'
+        with mock.patch.multiple(path, **patches), mock.patch('time.sleep'), \
+             mock.patch(monotonic_path, side_effect=[0, 0, 4000]):
+            failed = upload_all_team_shooting_side(
+                gameids=['0021500001', '0021500002'],
+                max_concurrency=2
+            )
+
+        # the game whose query finished is loaded before the timeout
+        etl_mock.return_value.extract.assert_called_once_with('team_shooting_side/id0.csv')
+        etl_mock.return_value.load.assert_called_once()
+        self.assertEqual(first=failed, second=['0021500002'])
+
+
+class TestTeamShootingSideLocalETL(unittest.TestCase):
+    """ Tests for TeamShootingSideLocalETL """
+
+    def test_run(self):
+        tables = {
+            'playbyplay': pa.table({
+                'period': [1., 2.],
+                'score': ['0 - 2', None],
+                'wctimestring': ['20:02:00', '20:30:00'],
+                'pctimestring': ['11:42', '12:00'],
+                'player1_team_id': [2., 1.],
+            }),
+            'gameposition': pa.table({
+                'period': [1, 1],
+                'periodclock': [702.1, 702.1],
+                'playerid': [-1, 201],
+                'x_coordinate': [85., 5.],
+                'y_coordinate': [25., 25.],
+            }),
+            'gamelog': pa.table({
+                'team_id': [1, 2],
+                'team_abbreviation': ['GSW', 'NOP'],
+                'game_date': ['2015-10-27', '2015-10-27'],
+                'matchup': ['GSW vs. NOP', 'NOP @ GSW'],
+            }),
+        }
+
+        def get_bucket_content(bucket_name, prefix, delimiter):
+            return ['{}file1'.format(prefix)]
+
+        def parquet_file(key):
+            sink = pa.BufferOutputStream()
+            pq.write_table(tables[key.split('/')[0]], sink)
+            return sink.getvalue().to_pybytes()
+
+        def head_object(Bucket, Key):
+            return {'ContentLength': len(parquet_file(Key))}
+
+        def get_object(Bucket, Key, Range):
+            # 'bytes=first-last'
+            first, last = [int(x) for x in Range.split('=')[1].split('-')]
+            body = mock.Mock()
+            body.read.return_value = parquet_file(Key)[first:last + 1]
+            return {'Body': body}
+
+        uploaded = {}
+
+        def put_object(Bucket, Key, Body):
+            uploaded[Key] = pq.read_table(pa.BufferReader(Body)).to_pandas()
+
+        s3client_mock = mock.Mock()
+        s3client_mock.head_object.side_effect = head_object
+        s3client_mock.get_object.side_effect = get_object
+        s3client_mock.put_object.side_effect = put_object
+        athena_mock = mock.Mock()
+        athena_mock.start_query_execution.return_value = {'QueryExecutionId': 'someid'}
+        athena_mock.get_query_execution.return_value = {
+            'QueryExecution': {'Status': {'State': 'SUCCEEDED'}}
+        }
+        update_uploaded_metadata_mock = mock.Mock()
+
+        patches = {
+            's3client': s3client_mock,
+            'athena': athena_mock
+        }
+        helper_patches = {
+            'get_bucket_content': get_bucket_content,
+            'update_uploaded_metadata': update_uploaded_metadata_mock
+        }
+        path = 'triple_triple_etl.load.storage.teamshooting_athena_to_s3parquet'
+        with mock.patch.multiple(path, **patches), \
+             mock.patch.multiple(HELPER_PATH, **helper_patches):
+            etl = TeamShootingSideLocalETL(season='2015-2016', gameid='0021500001')
+            etl.run()
+
+        df = uploaded['team_shooting_side/season=2015-2016/gameid=0021500001/20151027GSWNOP.parquet.snappy']
+        self.assertEqual(first=list(df.shooting_side), second=['left', 'left', 'right', 'right'])
+        self.assertNotIn('gameid', df.columns)
+
+        # the partition is added, no query of the data
+        athena_mock.start_query_execution.assert_called_once()
+        self.assertIn('ALTER TABLE nba.team_shooting_side', athena_mock.start_query_execution.call_args[1]['QueryString'])
+
+        rows = update_uploaded_metadata_mock.call_args[1]['rows']
+        self.assertEqual(first=rows[0]['gamedate'], second='20151027')
+        self.assertEqual(first=rows[0]['uploadedFLG'], second=1)
+        # ranged reads, no downloads
+        s3client_mock.download_file.assert_not_called()
+
+
+class TestTeamShootingSideLedger(unittest.TestCase):
+    """The three ETLs write the same ledger"""
+
+    def test_shared_ledger(self):
+        ledger_dir = tempfile.mkdtemp()
+        uploaded_filepath = os.path.join(ledger_dir, 'teamshootingside.parquet.snappy')
+        path = (
+            'triple_triple_etl.load.storage.'
+            'teamshooting_athena_to_s3parquet'
+        )
+        try:
+            with mock.patch(path + '.shutil', mock.Mock()):
+                etl = TeamShootingSideETL(gameid='0021500001')
+                etl.uploaded_filepath = uploaded_filepath
+                etl.metadata()
+                etl.gamedate = '20151027'
+                etl.df_uploaded.loc[etl.file_idx, 'uploadedFLG'] = 1
+                etl.cleanup()
+
+            etl = TeamShootingSideLocalETL(season='2015-2016', gameid='0021500002')
+            etl.uploaded_filepath = uploaded_filepath
+            etl.gamedate = '20151028'
+            etl.uploadedFLG = 1
+            etl.cleanup()
+
+            df = get_uploaded_metadata(uploaded_filepath, columns=UPLOADED_COLUMNS, key='gameid')
+        finally:
+            shutil.rmtree(ledger_dir)
+
+        self.assertEqual(first=list(df.gameid), second=['0021500001', '0021500002'])
+        self.assertEqual(first=list(df.season), second=['2015-2016'] * 2)
+        self.assertEqual(first=list(df.gamedate), second=['20151027', '20151028'])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -14,6 +14,7 @@ DATASETS_DIR = os.path.abspath(config['path']['datasets_dir'])
 LOGS_DIR = os.path.abspath(config['path']['logs_dir'])
 SQL_DIR = os.path.abspath(config['path']['sql_dir'])
 META_DIR = os.path.abspath(config['path']['metadata_dir'])
+CACHE_DIR = os.path.abspath(config['path']['cache_dir'])
 TEST_DIR = os.path.abspath(config['path']['test_dir'])
 
 BASE_URL_GAMELOG = 'https://stats.nba.com/stats/leaguegamelog'
@@ -21,6 +22,17 @@ BASE_URL_PLAY = 'http://stats.nba.com/stats/playbyplayv2'
 BASE_URL_BOX_SCORE_TRADITIONAL = 'http://stats.nba.com/stats/boxscoretraditionalv2'
 BASE_URL_BOX_SCORE_PLAYER_TRACKING = 'http://stats.nba.com/stats/boxscoreplayertrackv2'
 
+# client side rate limit of stats.nba.com requests
+NBASTATS_REQUESTS_PER_SECOND = 1.
+NBASTATS_REQUESTS_BURST = 5
+# pooled session: connections kept open and (connect, read) timeouts
+NBASTATS_POOL_SIZE = 10
+NBASTATS_TIMEOUT = (10, 60)
+# on disk cache of the raw responses, finished games don't change
+NBASTATS_CACHE_TTL = 90 * 24 * 60 * 60
+NBASTATS_CACHE_RECENT_TTL = 60 * 60
+NBASTATS_CACHE_MAX_MB = 2000
+
 NBASTATS_PARAMS = {
     'EndPeriod': '10',
     'EndRange': '55800',    
@@ -33,7 +45,22 @@ NBASTATS_PARAMS = {
 }
 
 MAX_STORAGE_MB = 1000
+# s3 listings: threads listing subfolders and how long a local snapshot
+# of a listing is reused
+S3_LIST_MAX_WORKERS = 16
+S3_LISTING_SNAPSHOT_TTL = 24 * 60 * 60
+# threads copying objects
+S3_TRANSFER_MAX_WORKERS = 32
+# season compaction of the per-game files: target size of the files and
+# of their row groups, and the replaced versions kept for the queries
+# still reading them
+COMPACTION_FILE_MB = 128
+COMPACTION_ROW_GROUP_MB = 16
+COMPACTION_KEEP_VERSIONS = 1
+# uncompressed size of the row groups of the sorted gameposition files
+GAMEPOSITION_ROW_GROUP_MB = 32
 SCHEMA_DIR = os.path.join(MODULE_HOME, 'load', 'schemata')
+DATA_DIR = os.path.join(MODULE_HOME, 'data')
 
 # s3 source info
 SOURCE_BUCKET = config['s3']['source_bucket']
@@ -43,3 +70,9 @@ DESTINATION_BUCKET = config['s3']['destination_bucket']
 
 # athena queries output
 ATHENA_OUTPUT = config['athena']['query_output']
+# queries in flight at once, below the account limit of concurrent queries
+ATHENA_MAX_CONCURRENT_QUERIES = 20
+# results of read only queries, reused while their inputs don't change.
+# kept less than the 45 days athena keeps the query history
+ATHENA_QUERY_CACHE_PREFIX = 'query_cache'
+ATHENA_QUERY_CACHE_TTL = 30 * 24 * 60 * 60
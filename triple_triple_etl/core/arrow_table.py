@@ -0,0 +1,370 @@
+import numpy as np
+import os
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+
+# pandas dtype strings used in the transform dtype dicts
+PANDAS_TO_ARROW_TYPES = {
+    'object': pa.string(),
+    'int64': pa.int64(),
+    'float64': pa.float64(),
+}
+
+# hive types of the columns of the athena tables
+ARROW_TO_HIVE_TYPES = {
+    pa.int8(): 'tinyint',
+    pa.int16(): 'smallint',
+    pa.int32(): 'int',
+    pa.int64(): 'bigint',
+    pa.float32(): 'float',
+    pa.float64(): 'double',
+    pa.bool_(): 'boolean',
+    pa.string(): 'string',
+    pa.large_string(): 'string',
+    pa.date32(): 'date',
+    # columns that were null in every game
+    pa.null(): 'string',
+}
+
+
+def dtype_to_schema(dtype: dict, col_order: list = None):
+    """
+    Converts a pandas style dtype dict in to a `pa.schema`.
+
+    Parameters
+    ----------
+    dtype: `dict`
+        Column name to one of {'object', 'int64', 'float64'}
+
+    col_order: `list` (optional)
+        Order of the schema fields. Defaults to the order of `dtype`.
+
+    Returns
+    -------
+    A `pa.Schema`.
+    """
+    col_order = col_order or list(dtype)
+    return pa.schema([
+        pa.field(col, PANDAS_TO_ARROW_TYPES[dtype[col]]) for col in col_order
+    ])
+
+
+def _is_null(value):
+    return value is None or (isinstance(value, float) and np.isnan(value))
+
+
+def _coerce(values: list, arrow_type: pa.DataType):
+    # mirrors DataFrame.astype for the values we get from json
+    # e.g. playerid '201946' -> 201946, teamid 1610612761 -> '1610612761'
+    if arrow_type == pa.int64():
+        convert = int
+    elif arrow_type == pa.float64():
+        convert = float
+    else:
+        convert = str
+
+    return [None if _is_null(value) else convert(value) for value in values]
+
+
+def to_arrow_array(values, arrow_type: pa.DataType = None):
+    """
+    Converts a list, `np.ndarray` or `pa.Array` in to a `pa.Array`.
+
+    Parameters
+    ----------
+    values: `list`, `np.ndarray` or `pa.Array`
+        The column values. None and NaN are stored as null.
+
+    arrow_type: `pa.DataType` (optional)
+        The column type. If None, the type is inferred.
+
+    Returns
+    -------
+    A `pa.Array` (or `pa.ChunkedArray` if `values` is one).
+    """
+    if isinstance(values, (pa.Array, pa.ChunkedArray)):
+        if arrow_type is None or values.type == arrow_type:
+            return values
+        return values.cast(arrow_type)
+
+    try:
+        return pa.array(values, type=arrow_type, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+        # only values that need converting take the slow path
+        if arrow_type is None:
+            raise
+        if isinstance(values, np.ndarray):
+            values = values.tolist()
+        return pa.array(_coerce(values, arrow_type), type=arrow_type, from_pandas=True)
+
+
+def build_table(columns: dict, schema: pa.Schema = None):
+    """
+    Builds a `pa.Table` straight from column values, without a
+    `pd.DataFrame` in between.
+
+    Parameters
+    ----------
+    columns: `dict`
+        Column name to column values, in output order. Values are a `list`,
+        `np.ndarray`, `pa.Array` or a scalar. Scalars (eg season, gameid)
+        are repeated to the length of the other columns.
+
+    schema: `pa.Schema` (optional)
+        Types of the columns. Columns not in the schema are inferred.
+
+    Returns
+    -------
+    A `pa.Table` with the columns of `columns`.
+    """
+    if schema is None:
+        schema = pa.schema([])
+
+    missing = set(schema.names) - set(columns)
+    if missing:
+        raise KeyError('Columns {} are not in the data'.format(sorted(missing)))
+
+    is_scalar = {
+        col: not isinstance(values, (list, tuple, np.ndarray, pa.Array, pa.ChunkedArray))
+        for col, values in columns.items()
+    }
+    lengths = [len(columns[col]) for col in columns if not is_scalar[col]]
+    num_rows = lengths[0] if lengths else 1
+
+    arrays = []
+    fields = []
+    for col, values in columns.items():
+        arrow_type = schema.field(col).type if col in schema.names else None
+        if is_scalar[col]:
+            array = pa.repeat(to_arrow_array([values], arrow_type)[0], num_rows)
+        else:
+            array = to_arrow_array(values, arrow_type)
+
+        arrays.append(array)
+        fields.append(pa.field(col, array.type))
+
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+def rows_to_columns(rows: list, names: list):
+    """
+    Transposes row lists (eg an nba stats `rowSet`) in to a `dict` of
+    column lists, in the order of `names`.
+    """
+    if not rows:
+        return {name: [] for name in names}
+
+    return {name: list(values) for name, values in zip(names, zip(*rows))}
+
+
+def write_batches(
+        batches,
+        filepath: str,
+        drop_columns: list = None,
+        compression: str = 'snappy'
+):
+    """
+    Writes `pa.RecordBatch`es to one parquet file, one row group per
+    batch, so the full table is never held in memory.
+
+    Parameters
+    ----------
+    batches: iterable of `pa.RecordBatch`
+        All batches have the same schema.
+
+    filepath: `str`
+        Output parquet file. Nothing is written if there are no batches.
+
+    drop_columns: `list` (optional)
+        Columns left out of the file, eg the partition columns that
+        `pq.write_to_dataset` stores in the directory names instead.
+
+    compression: `str`
+        Parquet compression codec.
+
+    Returns
+    -------
+    The number of rows written.
+    """
+    drop_columns = drop_columns or []
+    writer = None
+    num_rows = 0
+    try:
+        for batch in batches:
+            table = pa.Table.from_batches([batch])
+            table = table.drop([col for col in drop_columns if col in table.schema.names])
+            if writer is None:
+                writer = pq.ParquetWriter(filepath, table.schema, compression=compression)
+            writer.write_table(table, row_group_size=table.num_rows)
+            num_rows += table.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return num_rows
+
+
+def _sort_ranges(values: pa.Array, row_group_size: int):
+    """
+    Consecutive (first, last) ranges of the sorted distinct `values`,
+    each with about `row_group_size` rows. A value is never split
+    between ranges.
+    """
+    counts = pc.value_counts(values.drop_null())
+    order = pc.sort_indices(counts.field('values'))
+    ranges = []
+    num_rows = 0
+    for value, count in zip(
+            counts.field('values').take(order).to_pylist(),
+            counts.field('counts').take(order).to_pylist()
+    ):
+        if ranges and num_rows + count <= row_group_size:
+            ranges[-1][1] = value
+            num_rows += count
+        else:
+            ranges.append([value, value])
+            num_rows = count
+    return ranges
+
+
+def write_sorted_batches(
+        batches,
+        filepath: str,
+        sort_by: list,
+        row_group_bytes: int,
+        drop_columns: list = None,
+        compression: str = 'snappy'
+):
+    """
+    Writes `pa.RecordBatch`es to one parquet file sorted by `sort_by`,
+    in row groups of about `row_group_bytes` (uncompressed), with the
+    column statistics and page index readers use to skip row groups.
+
+    The batches are first written unsorted to a spill file next to
+    `filepath`, then sorted one range of the first sort column at a
+    time, read back from the spill file with its row group statistics.
+    When the batches come mostly in order, eg the events of a game, about
+    one row group is in memory at a time.
+
+    Parameters
+    ----------
+    sort_by: `list`
+        (column, 'ascending' or 'descending') tuples, as in
+        `pa.Table.sort_by`
+
+    row_group_bytes: `int`
+        Target size of the row groups, a row group holds whole values of
+        the first sort column
+
+    Returns
+    -------
+    The number of rows written.
+    """
+    spill_filepath = '{}.unsorted'.format(filepath)
+    try:
+        num_rows = write_batches(
+            batches,
+            spill_filepath,
+            drop_columns=drop_columns,
+            compression='none'
+        )
+        if not num_rows:
+            return 0
+
+        spill = pq.ParquetFile(spill_filepath)
+        # the in memory size of a row, as the first batch
+        first_batch = spill.read_row_group(0)
+        bytes_per_row = max(first_batch.nbytes / max(first_batch.num_rows, 1), 1)
+        row_group_size = max(int(row_group_bytes / bytes_per_row), 1)
+
+        column = sort_by[0][0]
+        values = spill.read(columns=[column])[column]
+        filters = [
+            (pc.field(column) >= first) & (pc.field(column) <= last)
+            for first, last in _sort_ranges(values, row_group_size)
+        ]
+        if values.null_count:
+            filters.append(pc.field(column).is_null())
+
+        with pq.ParquetWriter(
+                filepath,
+                spill.schema_arrow,
+                compression=compression,
+                write_statistics=True,
+                write_page_index=True
+        ) as writer:
+            for filter_expression in filters:
+                table = pq.read_table(spill_filepath, filters=filter_expression)
+                # one row group per range
+                writer.write_table(table.sort_by(sort_by), row_group_size=max(table.num_rows, 1))
+    finally:
+        if os.path.exists(spill_filepath):
+            os.remove(spill_filepath)
+
+    return num_rows
+
+
+def write_buffer(
+        table: pa.Table,
+        drop_columns: list = None,
+        compression: str = 'snappy',
+        row_group_size: int = None
+):
+    """
+    Writes `table` as a parquet file in memory, to be uploaded without
+    a tmp dir.
+
+    Parameters
+    ----------
+    drop_columns: `list` (optional)
+        Columns left out of the file, eg season and gameid that are
+        in the s3 key.
+
+    compression: `str`
+        Parquet compression codec.
+
+    row_group_size: `int` (optional)
+        Rows per row group, all of them in one by default.
+
+    Returns
+    -------
+    A `pa.Buffer` of the parquet file.
+    """
+    drop_columns = drop_columns or []
+    table = table.drop([col for col in drop_columns if col in table.schema.names])
+
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink, compression=compression, row_group_size=row_group_size)
+    return sink.getvalue()
+
+
+def split_table(table: pa.Table, column: str):
+    """
+    Splits `table` by the values of `column`, eg the games of a gamelog.
+
+    Returns
+    -------
+    A `dict` of the rows of each value, in the order of first appearance.
+    """
+    values = table[column]
+    return {
+        value: table.filter(pc.equal(values, value))
+        for value in pc.unique(values).to_pylist()
+    }
+
+
+def to_hive_columns(schema: pa.Schema):
+    """
+    The columns of a `CREATE EXTERNAL TABLE` of parquet files with
+    `schema`, eg "    gameid string".
+    """
+    columns = []
+    for field in schema:
+        if pa.types.is_timestamp(field.type):
+            hive_type = 'timestamp'
+        else:
+            hive_type = ARROW_TO_HIVE_TYPES[field.type]
+        columns.append('    {} {}'.format(field.name, hive_type))
+    return ',\n'.join(columns)
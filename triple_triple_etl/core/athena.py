@@ -1,25 +1,45 @@
 import os
 import boto3
 import logging
+import random
 import time
 
 from triple_triple_etl.constants import ATHENA_OUTPUT
+from triple_triple_etl.core.query_cache import is_read_only
 
 
 athena = boto3.client('athena', region_name='us-east-1')
 glue = boto3.client('glue', region_name='us-east-1')
 s3 = boto3.resource('s3', region_name='us-east-1')
 
+# seconds between get_query_execution polls, doubling up to the max
+QUERY_POLL_INITIAL_DELAY = 0.25
+QUERY_POLL_MAX_DELAY = 10.
+
 # initiate logger
 logger = logging.getLogger()
 logger.setLevel('INFO')
 
 
+class QueryExecutionError(RuntimeError):
+    """An Athena query that FAILED or was CANCELLED."""
+    def __init__(self, execution: dict):
+        self.execution = execution
+        self.state = execution['Status']['State']
+        super().__init__('Query {} {}: {}'.format(
+            execution.get('QueryExecutionId'),
+            self.state,
+            execution['Status'].get('StateChangeReason')
+        ))
+
+
 def execute_athena_query(
         query: str,
         database: str,
         output_filename: str,
-        boto3_client #: botocore.client.Athena
+        boto3_client, #: botocore.client.Athena
+        cache=None,
+        inputs: list = None
 ):
 
     """
@@ -40,20 +60,40 @@ def execute_athena_query(
         
         boto3_client: `boto`?
             The boto3.client('athena') client.
+
+        cache: `QueryResultCache`
+            If given, a read only query that ran before on the same
+            `inputs` is not started again
+
+        inputs: `list`
+            s3 uris of the prefixes the query reads
     
     Returns
     -------
     A `dict` of the query execution meta data. 
     This has two keys:
         `QueryExecutionId` and `ResponseMetadata`.
+    A cached result has the `QueryExecutionId` of the query that made it
+    and `Cached` instead.
     """
-    return boto3_client.start_query_execution(
+    key = None
+    if cache is not None and is_read_only(query):
+        key = cache.key(query, database, output_filename, inputs)
+        record = cache.get(key)
+        if record is not None:
+            logger.info('Using the cached result {}'.format(record['OutputLocation']))
+            return {'QueryExecutionId': record['QueryExecutionId'], 'Cached': True}
+
+    response = boto3_client.start_query_execution(
         QueryString=query,
         QueryExecutionContext={'Database': database},
         ResultConfiguration={
             'OutputLocation': os.path.join('s3://', ATHENA_OUTPUT, output_filename)
         }
     )
+    if key is not None:
+        cache.set(key, response['QueryExecutionId'], output_filename)
+    return response
 
 
 def get_query_s3filepath(
@@ -83,6 +123,64 @@ def get_query_s3filepath(
     return response['QueryExecution']['ResultConfiguration']['OutputLocation']
 
 
+def wait_for_query_execution(
+        execution_id: str,
+        boto3_client, #: botocore.client.Athena
+        max_time: int = 300,
+        initial_delay: float = QUERY_POLL_INITIAL_DELAY,
+        max_delay: float = QUERY_POLL_MAX_DELAY
+):
+    """
+        Polls `get_query_execution` until the query is done. The delay
+        between polls doubles from `initial_delay` up to `max_delay`, with
+        jitter so concurrent waiters don't poll in step.
+
+    Parameters
+    ----------
+        execution_id: `str`
+            The QueryExecutionId returned by `execute_athena_query`
+
+        max_time: `int`
+            Seconds to wait before giving up
+
+    Returns
+    -------
+        The QueryExecution `dict` of the SUCCEEDED query, its `Status` and
+        `Statistics` (DataScannedInBytes, EngineExecutionTimeInMillis, ...).
+        Raises `QueryExecutionError` if the query FAILED or was CANCELLED,
+        and `TimeoutError` if it is still running after `max_time`.
+    """
+    start_time = time.monotonic()
+    delay = initial_delay
+    while True:
+        execution = boto3_client.get_query_execution(
+            QueryExecutionId=execution_id
+        )['QueryExecution']
+        state = execution['Status']['State']
+
+        if state == 'SUCCEEDED':
+            statistics = execution.get('Statistics', {})
+            logger.info('Query {} scanned {} bytes in {} ms'.format(
+                execution_id,
+                statistics.get('DataScannedInBytes'),
+                statistics.get('EngineExecutionTimeInMillis')
+            ))
+            return execution
+        if state in ('FAILED', 'CANCELLED'):
+            raise QueryExecutionError(execution)
+
+        time_left = max_time - (time.monotonic() - start_time)
+        if time_left <= 0:
+            raise TimeoutError('Query {} did not finish in {} seconds'.format(
+                execution_id,
+                max_time
+            ))
+
+        # equal jitter: between half and all of the delay
+        time.sleep(min(delay / 2. + random.uniform(0, delay / 2.), time_left))
+        delay = min(delay * 2, max_delay)
+
+
 def check_table_exists(
         database_name: str,
         table_name: str,
@@ -0,0 +1,119 @@
+########################################################################
+# closest_to_ball computed locally from a game's gameposition table,
+# instead of the Athena queries in sql/player/create_table_ball_dist_tmp.sql
+# and sql/player/create_table_closest_to_ball_tmp.sql:
+#   distance_from_ball_sq: squared xy distance to the ball in the moment
+#   closest_to_ball_rank: ROW_NUMBER() of the players in the moment by
+#                         distance_from_ball_sq, null for the ball
+########################################################################
+import numpy as np
+import pyarrow as pa
+
+
+BALL_PLAYERID = -1
+
+
+def group_moments(eventid: np.ndarray, moment_num: np.ndarray):
+    """
+    Sorts rows by (eventid, moment_num) and numbers the moments.
+
+    Returns
+    -------
+    order: `np.ndarray`
+        Row indices in (eventid, moment_num) order. The sort is stable,
+        rows of a moment keep their order.
+
+    group_id: `np.ndarray`
+        Moment number (0, 1, ...) of each row of `order`
+
+    starts: `np.ndarray`
+        Position in `order` of the first row of each moment
+    """
+    order = np.lexsort((moment_num, eventid))
+    eventid = eventid[order]
+    moment_num = moment_num[order]
+
+    is_start = np.empty(len(order), dtype=bool)
+    is_start[:1] = True
+    is_start[1:] = (eventid[1:] != eventid[:-1]) | (moment_num[1:] != moment_num[:-1])
+    starts = np.flatnonzero(is_start)
+    group_id = np.cumsum(is_start) - 1
+
+    return order, group_id, starts
+
+
+def rank_within_groups(values: np.ndarray, group_id: np.ndarray, num_groups: int):
+    """
+    ROW_NUMBER() OVER (PARTITION BY group_id ORDER BY values), starting
+    at 1. NaN values rank last, like nulls in Athena.
+    """
+    order = np.lexsort((values, group_id))
+    group_sizes = np.bincount(group_id, minlength=num_groups)
+    group_starts = np.cumsum(group_sizes) - group_sizes
+
+    rank = np.empty(len(values), dtype='int64')
+    rank[order] = np.arange(len(values)) - group_starts[group_id[order]] + 1
+    return rank
+
+
+def closest_to_ball(table: pa.Table):
+    """
+    Adds distance_from_ball_sq and closest_to_ball_rank to the
+    gameposition rows of a game.
+
+    Parameters
+    ----------
+    table: `pa.Table`
+        gameposition rows, with at least eventid, moment_num, playerid,
+        x_coordinate and y_coordinate. The ball is playerid -1.
+
+    Returns
+    -------
+    A `pa.Table` with the columns of `table` and the two new columns,
+    sorted by (eventid, moment_num). Players in a moment without a ball
+    row have a null distance and rank last.
+    """
+    if table.num_rows == 0:
+        return table.append_column(
+            'distance_from_ball_sq', pa.array([], type=pa.float64())
+        ).append_column(
+            'closest_to_ball_rank', pa.array([], type=pa.int64())
+        )
+
+    def column(name, dtype):
+        return table.column(name).to_numpy().astype(dtype, copy=False)
+
+    order, group_id, starts = group_moments(
+        column('eventid', 'int64'),
+        column('moment_num', 'int64')
+    )
+    table = table.take(pa.array(order))
+    playerid = column('playerid', 'int64')
+    x = column('x_coordinate', 'float64')
+    y = column('y_coordinate', 'float64')
+
+    # ball position of each moment, NaN if there is no ball row
+    is_ball = playerid == BALL_PLAYERID
+    ball_x = np.full(len(starts), np.nan)
+    ball_y = np.full(len(starts), np.nan)
+    ball_x[group_id[is_ball]] = x[is_ball]
+    ball_y[group_id[is_ball]] = y[is_ball]
+
+    distance_sq = (x - ball_x[group_id]) ** 2 + (y - ball_y[group_id]) ** 2
+
+    # the ball isn't ranked
+    rank = np.zeros(len(x), dtype='int64')
+    is_player = ~is_ball
+    rank[is_player] = rank_within_groups(
+        distance_sq[is_player],
+        group_id[is_player],
+        len(starts)
+    )
+
+    return table.append_column(
+        'distance_from_ball_sq',
+        pa.array(distance_sq, type=pa.float64(), from_pandas=True)
+    ).append_column(
+        'closest_to_ball_rank',
+        pa.array(rank, type=pa.int64(), mask=is_ball)
+    )
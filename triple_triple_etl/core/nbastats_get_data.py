@@ -1,4 +1,24 @@
+import asyncio
+import functools
 import requests
+from requests.adapters import HTTPAdapter
+import time
+from urllib3.util.retry import Retry
+
+from triple_triple_etl.constants import (
+    CACHE_DIR,
+    NBASTATS_CACHE_MAX_MB,
+    NBASTATS_CACHE_TTL,
+    NBASTATS_POOL_SIZE,
+    NBASTATS_REQUESTS_PER_SECOND,
+    NBASTATS_REQUESTS_BURST,
+    NBASTATS_TIMEOUT
+)
+from triple_triple_etl.core.rate_limiter import TokenBucket
+from triple_triple_etl.core.response_cache import ResponseCache
+from triple_triple_etl.log import get_logger
+
+logger = get_logger()
 
 HEADERS = {
     'user-agent': ('Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_6) '
@@ -7,10 +27,200 @@ HEADERS = {
     'referer': 'http://stats.nba.com/player/'
 }
 
-def get_data(base_url, params, headers=HEADERS):
-    response = requests.get(url=base_url, params=params, headers=headers)
+# status codes of stats.nba.com asking us to slow down
+RETRY_STATUS_CODES = {429, 503}
+
+# 429/503 are retried by get_data with the rate limiter
+RETRY_STATUS_FORCELIST = [500, 502, 504]
+
+
+def get_session(
+        pool_size: int = NBASTATS_POOL_SIZE,
+        max_retries: int = 3,
+        backoff_factor: float = 0.5
+):
+    """
+    A `requests.Session` that keeps connections to stats.nba.com open
+    between requests instead of a new TCP/TLS handshake each time.
+
+    Parameters
+    ----------
+    pool_size: `int`
+        Connections kept open per host, ie the number of threads that can
+        make requests at the same time without waiting for a connection.
+
+    max_retries: `int`
+        Retries of connection errors, read errors and 500/502/504
+
+    backoff_factor: `float`
+        Seconds between retries are backoff_factor * 2 ** (retry - 1)
+    """
+    retry = Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=max_retries,
+        status=max_retries,
+        status_forcelist=RETRY_STATUS_FORCELIST,
+        backoff_factor=backoff_factor,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=retry
+    )
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+# shared by all requests to stats.nba.com in this process
+SESSION = get_session()
+
+RATE_LIMITER = TokenBucket(
+    rate=NBASTATS_REQUESTS_PER_SECOND,
+    burst=NBASTATS_REQUESTS_BURST
+)
+
+# raw responses, so reruns don't fetch again
+RESPONSE_CACHE = ResponseCache(
+    cache_dir=CACHE_DIR,
+    ttl=NBASTATS_CACHE_TTL,
+    max_size_mb=NBASTATS_CACHE_MAX_MB
+)
+
+
+def _retry_after(response):
+    # Retry-After in seconds, if the server sent one
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def _check_response(response, attempt, max_retries, rate_limiter, base_url):
+    # returns the seconds to wait before retrying, or None if the
+    # response is final
+    if response.status_code in RETRY_STATUS_CODES and attempt < max_retries:
+        wait = rate_limiter.backoff(
+            attempt=attempt,
+            retry_after=_retry_after(response)
+        )
+        logger.warning('Got status {} from {}, retrying in {:.1f} seconds'.format(
+            response.status_code,
+            base_url,
+            wait
+        ))
+        return wait
 
     if response.status_code != 200:
         response.raise_for_status()
+    else:
+        rate_limiter.recover()
+    return None
+
+
+def _response_json(response, base_url, params, use_cache):
+    data = response.json()
+    if use_cache:
+        RESPONSE_CACHE.set(base_url, params, data)
+    return data
+
+
+def get_data(
+        base_url,
+        params,
+        headers=HEADERS,
+        rate_limiter: TokenBucket = RATE_LIMITER,
+        max_retries: int = 5,
+        session: requests.Session = None,
+        timeout=NBASTATS_TIMEOUT,
+        use_cache: bool = True,
+        cache_ttl: float = None
+):
+    """
+    GET a stats.nba.com endpoint and return the json.
+
+    Requests go through `session` (the pooled module `SESSION` by
+    default) and wait for `rate_limiter`. On 429/503 the limiter slows
+    down and the request is retried up to `max_retries` times, waiting
+    for Retry-After or an exponential backoff. `timeout` is
+    (connect, read) seconds.
+
+    If `use_cache`, responses are read from and saved to the on disk
+    `RESPONSE_CACHE`, so a request made before (and younger than
+    `cache_ttl` seconds, the cache's ttl if None) makes no network call.
+    """
+    if use_cache:
+        data = RESPONSE_CACHE.get(base_url, params, ttl=cache_ttl)
+        if data is not None:
+            return data
+
+    session = session or SESSION
+    for attempt in range(max_retries + 1):
+        rate_limiter.acquire()
+        response = session.get(
+            url=base_url,
+            params=params,
+            headers=headers,
+            timeout=timeout
+        )
+        wait = _check_response(response, attempt, max_retries, rate_limiter, base_url)
+        if wait is None:
+            return _response_json(response, base_url, params, use_cache)
+        time.sleep(wait)
+
+
+async def get_data_async(
+        base_url,
+        params,
+        headers=HEADERS,
+        rate_limiter: TokenBucket = RATE_LIMITER,
+        max_retries: int = 5,
+        session: requests.Session = None,
+        timeout=NBASTATS_TIMEOUT,
+        executor=None,
+        use_cache: bool = True,
+        cache_ttl: float = None
+):
+    """
+    asyncio version of `get_data`, sharing its rate limiter, session
+    and cache.
+
+    The rate limit and backoff waits are `asyncio.sleep`s and the
+    request itself runs on `executor` (a thread pool, the loop's default
+    if None), so many requests can be in flight from one event loop.
+    """
+    loop = asyncio.get_running_loop()
+    if use_cache:
+        data = await loop.run_in_executor(
+            executor,
+            functools.partial(RESPONSE_CACHE.get, base_url, params, ttl=cache_ttl)
+        )
+        if data is not None:
+            return data
+
+    session = session or SESSION
+    for attempt in range(max_retries + 1):
+        wait = rate_limiter.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
 
-    return response.json()
+        response = await loop.run_in_executor(
+            executor,
+            functools.partial(
+                session.get,
+                url=base_url,
+                params=params,
+                headers=headers,
+                timeout=timeout
+            )
+        )
+        wait = _check_response(response, attempt, max_retries, rate_limiter, base_url)
+        if wait is None:
+            return await loop.run_in_executor(
+                executor,
+                _response_json, response, base_url, params, use_cache
+            )
+        await asyncio.sleep(wait)
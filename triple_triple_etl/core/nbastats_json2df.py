@@ -1,7 +1,11 @@
 import datetime
 import pandas as pd
-import pyarrow as pa
 
+from triple_triple_etl.core.arrow_table import (
+    build_table,
+    dtype_to_schema,
+    rows_to_columns
+)
 from triple_triple_etl.log import get_logger
 
 
@@ -23,17 +27,42 @@ def convert_data_to_df(data: dict, season: str = '2015-16'):
     return df
 
 
+def convert_data_to_columns(data: dict, season: str = '2015-16'):
+    """
+    Same as `convert_data_to_df`, but returns a `dict` of column lists.
+    Columns of all result sets are joined (usually just one) and rows
+    missing a column are filled with None.
+    """
+    columns = {}
+    num_rows = 0
+    for games in data['resultSets']:
+        headers = [x.lower() for x in games['headers']]
+        game_columns = rows_to_columns(games['rowSet'], headers)
+        num_game_rows = len(games['rowSet'])
+
+        for col in headers:
+            columns.setdefault(col, [None] * num_rows)
+        for col, values in columns.items():
+            values.extend(game_columns.get(col, [None] * num_game_rows))
+
+        num_rows += num_game_rows
+    # add season
+    columns['season'] = season
+
+    return columns
+
+
 def get_play_by_play(play_data: dict, season: str = '2015-16'):
     logger.info('Get play by play data')
 
-    df = convert_data_to_df(data=play_data, season=season)
+    columns = convert_data_to_columns(data=play_data, season=season)
 
     # convert timestamp
-    df.loc[:, 'wctimestring'] = df.wctimestring.apply(
-        lambda x: 
-            datetime.datetime.strptime(x, '%I:%M %p').strftime('%H:%M:%S')
-            if pd.notnull(x) else x
-    )
+    columns['wctimestring'] = [
+        datetime.datetime.strptime(x, '%I:%M %p').strftime('%H:%M:%S')
+        if x is not None else x
+        for x in columns['wctimestring']
+    ]
     # enforce datatypes
     dtype = {    
         'game_id':'object',
@@ -68,11 +97,11 @@ def get_play_by_play(play_data: dict, season: str = '2015-16'):
         'player3_team_id':'float64',
         'player3_team_city':'object',
         'player3_team_nickname':'object',
-        'player3_team_abbreviation':'object'
+        'player3_team_abbreviation':'object',
+        'video_available_flag':'float64'
     }
-    df = df.astype(dtype)
     # convert to pyarrow table
-    return pa.Table.from_pandas(df, preserve_index=False)
+    return build_table(columns, schema=dtype_to_schema(dtype))
 
 
 def get_boxscore(
@@ -82,9 +111,12 @@ def get_boxscore(
 ):
     logger.info('Get {} box score data'.format(traditional_player))
 
-    df = convert_data_to_df(data=bs_data, season=season)
+    columns = convert_data_to_columns(data=bs_data, season=season)
     # convert minutes to datetime
-    df.loc[:, 'min'] = df['min'].apply(lambda x: x.replace(':', '.'))
+    columns['min'] = [
+        x.replace(':', '.') if x is not None else x
+        for x in columns['min']
+    ]
     
     if traditional_player == 'traditional':
         # rename min column to minutes (to avoid built-in min, pass)
@@ -160,8 +192,7 @@ def get_boxscore(
             'season': 'object',
         }
 
-    df.rename(columns=rename_cols, inplace=True)
-    df = df.astype(dtype)
+    columns = {rename_cols.get(col, col): values for col, values in columns.items()}
     # convert to pyarrow table
-    return pa.Table.from_pandas(df, preserve_index=False)
+    return build_table(columns, schema=dtype_to_schema(dtype))
 
@@ -0,0 +1,216 @@
+########################################################################
+# Reads parquet files, eg from s3, fetching only the row groups whose
+# column statistics can match the filters, and only the columns needed.
+# The gameposition files are sorted by (eventid, moment_num, playerid)
+# (see `arrow_table.write_sorted_batches`), so filters on eventid, or on
+# the period/clock columns that follow it, skip most of a game.
+# The ball (playerid -1) is in every moment, so every row group has it
+# and a filter on playerid alone only saves the columns not read.
+########################################################################
+import io
+import logging
+import operator
+
+import boto3
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+
+s3client = boto3.client('s3', region_name='us-east-1')
+
+logger = logging.getLogger()
+logger.setLevel('INFO')
+
+# the filter operators of `pq.read_table`
+COMPARISONS = {
+    '=': operator.eq,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+
+class S3File(io.RawIOBase):
+    """
+    A read only, seekable s3 object. Each read is a ranged GET, so
+    `pq.ParquetFile` fetches the footer and then only the column chunks
+    of the row groups it reads, instead of the whole object.
+    """
+    def __init__(self, bucket: str, key: str, s3client=s3client):
+        self.bucket = bucket
+        self.key = key
+        self.s3client = s3client
+        self.size = s3client.head_object(Bucket=bucket, Key=key)['ContentLength']
+        self.position = 0
+        # what was fetched, for logging
+        self.requests = 0
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = self.size + offset
+        return self.position
+
+    def read(self, size: int = -1):
+        end = self.size if size is None or size < 0 else min(self.position + size, self.size)
+        if self.position >= end:
+            return b''
+
+        response = self.s3client.get_object(
+            Bucket=self.bucket,
+            Key=self.key,
+            Range='bytes={}-{}'.format(self.position, end - 1)
+        )
+        data = response['Body'].read()
+        self.position += len(data)
+        self.requests += 1
+        self.bytes_read += len(data)
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+
+def _may_match(statistics, op: str, value):
+    # False only if no row of the row group can match
+    if statistics is None or not statistics.has_min_max:
+        return True
+
+    low, high = statistics.min, statistics.max
+    if op in ('=', '=='):
+        return low <= value <= high
+    elif op == '!=':
+        return not low == high == value
+    elif op == '<':
+        return low < value
+    elif op == '<=':
+        return low <= value
+    elif op == '>':
+        return high > value
+    elif op == '>=':
+        return high >= value
+    elif op == 'in':
+        return any(low <= x <= high for x in value)
+    return True
+
+
+def select_row_groups(metadata: pq.FileMetaData, filters: list):
+    """
+    Indices of the row groups whose min/max statistics can match all
+    `filters`.
+
+    Parameters
+    ----------
+    filters: `list`
+        (column, op, value) tuples, all of them must match, as in
+        `pq.read_table`. op is one of =, ==, !=, <, <=, >, >=, in,
+        not in.
+    """
+    column_index = {
+        metadata.schema.column(j).path: j for j in range(metadata.num_columns)
+    }
+    row_groups = []
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        if all(
+                _may_match(row_group.column(column_index[column]).statistics, op, value)
+                for column, op, value in filters
+        ):
+            row_groups.append(i)
+    return row_groups
+
+
+def filter_expression(filters: list):
+    """The `pc.Expression` of all `filters`, see `select_row_groups`."""
+    expression = None
+    for column, op, value in filters:
+        if op == 'in':
+            condition = pc.field(column).isin(value)
+        elif op == 'not in':
+            condition = ~pc.field(column).isin(value)
+        else:
+            condition = COMPARISONS[op](pc.field(column), value)
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def read_parquet(source, columns: list = None, filters: list = None):
+    """
+    Reads the rows of a parquet file matching `filters`, only from the
+    row groups whose statistics can match them.
+
+    Parameters
+    ----------
+    source:
+        A path, buffer or file object, eg an `S3File`
+
+    columns: `list` (optional)
+        Columns to return, all of them by default
+
+    filters: `list` (optional)
+        (column, op, value) tuples, see `select_row_groups`
+
+    Returns
+    -------
+    A `pa.Table`.
+    """
+    filters = filters or []
+    # without pre_buffer, which reads the whole file of a file object
+    parquet_file = pq.ParquetFile(source)
+    row_groups = select_row_groups(parquet_file.metadata, filters)
+    logger.info('Reading {} of {} row groups'.format(
+        len(row_groups),
+        parquet_file.metadata.num_row_groups
+    ))
+
+    read_columns = None
+    if columns is not None:
+        read_columns = list(columns)
+        for column, _, _ in filters:
+            if column not in read_columns:
+                read_columns.append(column)
+    table = parquet_file.read_row_groups(row_groups, columns=read_columns)
+
+    if filters:
+        table = table.filter(filter_expression(filters))
+    if columns is not None:
+        table = table.select(columns)
+    return table
+
+
+def read_parquet_s3(
+        bucket: str,
+        key: str,
+        columns: list = None,
+        filters: list = None,
+        s3client=s3client
+):
+    """`read_parquet` of an s3 object with ranged GETs, see `S3File`."""
+    s3file = S3File(bucket, key, s3client=s3client)
+    table = read_parquet(s3file, columns=columns, filters=filters)
+    logger.info('Read {} of {} bytes of {} in {} requests'.format(
+        s3file.bytes_read,
+        s3file.size,
+        key,
+        s3file.requests
+    ))
+    return table
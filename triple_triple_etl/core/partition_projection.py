@@ -0,0 +1,164 @@
+import logging
+import os
+import threading
+
+import boto3
+
+from triple_triple_etl.constants import DESTINATION_BUCKET, SQL_DIR
+from triple_triple_etl.core.athena import (
+    execute_athena_query,
+    wait_for_query_execution
+)
+
+
+athena = boto3.client('athena', region_name='us-east-1')
+
+logger = logging.getLogger()
+logger.setLevel('INFO')
+
+# gameids are zero padded, eg 0021500001
+GAMEID_DIGITS = 10
+PROPERTY_SPEC = "    '{}' = '{}'"
+
+
+class PartitionProjection(object):
+    """
+    Athena partition projection on the season and gameid of a table.
+    Athena computes the partitions from the table properties, so loading
+    a game needs no partition registration.
+
+    It has the `add`/`flush` interface of `PartitionRegistry` and the
+    ETLs take either as `partitions`. Games already covered by the
+    projection are no-ops, others extend it and the next `flush` updates
+    the table properties once.
+
+    Parameters
+    ----------
+    table: `str`
+        Table name, without the database
+
+    seasons: `list`
+        Projected seasons, eg ['2015-2016']
+
+    gameids: `list`
+        Projected gameids as an enum, or
+
+    gameid_range: `tuple`
+        (first, last) gameid of an integer projection, eg
+        ('0021500001', '0021501230')
+    """
+    def __init__(
+            self,
+            table: str,
+            seasons: list,
+            gameids: list = None,
+            gameid_range: tuple = None,
+            database: str = 'nba',
+            bucket: str = DESTINATION_BUCKET,
+            max_time: int = 300,
+            athena_client=athena
+    ):
+        if (gameids is None) == (gameid_range is None):
+            raise ValueError('Pass one of gameids or gameid_range')
+
+        self.table = table
+        self.database = database
+        self.bucket = bucket
+        self.max_time = max_time
+        self.athena_client = athena_client
+        self.seasons = list(seasons)
+        self.gameids = sorted(gameids) if gameids is not None else None
+        self.gameid_range = (
+            [int(gameid) for gameid in gameid_range] if gameid_range is not None else None
+        )
+        # (season, gameid) added outside of the projection
+        self.pending = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def properties(self):
+        """The TBLPROPERTIES of the projection."""
+        properties = {
+            'projection.enabled': 'true',
+            'projection.season.type': 'enum',
+            'projection.season.values': ','.join(self.seasons),
+            'storage.location.template': 's3://{}/{}/season=${{season}}/gameid=${{gameid}}'.format(
+                self.bucket,
+                self.table
+            ),
+        }
+        if self.gameids is not None:
+            properties['projection.gameid.type'] = 'enum'
+            properties['projection.gameid.values'] = ','.join(self.gameids)
+        else:
+            properties['projection.gameid.type'] = 'integer'
+            properties['projection.gameid.range'] = '{},{}'.format(*self.gameid_range)
+            properties['projection.gameid.digits'] = str(GAMEID_DIGITS)
+        return properties
+
+    def enable(self):
+        """Sets the projection properties on the table."""
+        with open(os.path.join(SQL_DIR, 'alter_table_set_tblproperties.sql')) as f:
+            query = f.read().format(
+                '{}.{}'.format(self.database, self.table),
+                ',\n'.join(
+                    PROPERTY_SPEC.format(key, value)
+                    for key, value in self.properties().items()
+                )
+            )
+
+        logger.info('Setting partition projection of {}.{}'.format(self.database, self.table))
+        response = execute_athena_query(
+            query=query,
+            database=self.database,
+            output_filename='set_projection_{}'.format(self.table),
+            boto3_client=self.athena_client
+        )
+        wait_for_query_execution(
+            response['QueryExecutionId'],
+            boto3_client=self.athena_client,
+            max_time=self.max_time
+        )
+        return response
+
+    def add(self, season: str, gameid: str, location: str = None):
+        # the location follows storage.location.template
+        with self._lock:
+            if season not in self.seasons:
+                self.seasons.append(season)
+                self.pending.add((season, gameid))
+
+            if self.gameids is not None:
+                if gameid not in self.gameids:
+                    self.gameids = sorted(self.gameids + [gameid])
+                    self.pending.add((season, gameid))
+            else:
+                first, last = self.gameid_range
+                if not first <= int(gameid) <= last:
+                    self.gameid_range = [min(first, int(gameid)), max(last, int(gameid))]
+                    self.pending.add((season, gameid))
+
+    def flush(self):
+        """
+        Updates the table properties if games outside of the projection
+        were added.
+
+        Returns
+        -------
+        A `dict` with the response of the query, empty if nothing changed.
+        """
+        with self._lock:
+            if not self.pending:
+                return {}
+
+            response = self.enable()
+            self.pending.clear()
+            return {'set_projection_{}'.format(self.table): response}
@@ -0,0 +1,171 @@
+import copy
+import logging
+import os
+import threading
+
+import boto3
+
+from triple_triple_etl.constants import SQL_DIR
+from triple_triple_etl.core.athena import (
+    execute_athena_query,
+    wait_for_query_execution
+)
+
+
+athena = boto3.client('athena', region_name='us-east-1')
+glue = boto3.client('glue', region_name='us-east-1')
+
+logger = logging.getLogger()
+logger.setLevel('INFO')
+
+PARTITION_SPEC = "    PARTITION (season = '{}', gameid = '{}') LOCATION '{}'"
+# an Athena query string is at most 256 KB, a partition spec ~150 bytes
+ATHENA_BATCH_SIZE = 500
+# the batch_create_partition limit
+GLUE_BATCH_SIZE = 100
+
+
+class PartitionRegistry(object):
+    """
+    Collects the new (season, gameid) partitions of a table and registers
+    them a batch at a time, with one multi-partition
+    `ALTER TABLE ADD IF NOT EXISTS` Athena query or one Glue
+    `batch_create_partition` call per batch, instead of one query per game.
+
+    ETLs sharing a registry `add` their partitions and the caller
+    `flush`es once, or uses it as a context manager. `add` and `flush`
+    are thread safe.
+
+    Parameters
+    ----------
+    table: `str`
+        Table name, without the database
+
+    use_glue: `bool`
+        Register with Glue instead of an Athena query. The partitions
+        get the storage descriptor of the table with their location.
+
+    max_time: `int`
+        Seconds to wait for each Athena query
+    """
+    def __init__(
+            self,
+            table: str,
+            database: str = 'nba',
+            use_glue: bool = False,
+            batch_size: int = None,
+            max_time: int = 300,
+            athena_client=athena,
+            glue_client=glue
+    ):
+        self.table = table
+        self.database = database
+        self.use_glue = use_glue
+        self.batch_size = batch_size or (GLUE_BATCH_SIZE if use_glue else ATHENA_BATCH_SIZE)
+        self.max_time = max_time
+        self.athena_client = athena_client
+        self.glue_client = glue_client
+        # (season, gameid) -> location, in the order they are added
+        self.pending = {}
+        self.registered = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def add(self, season: str, gameid: str, location: str):
+        with self._lock:
+            self.pending[(season, gameid)] = location
+
+    def flush(self):
+        """
+        Registers the pending partitions.
+
+        Returns
+        -------
+        A `dict` of the response of each batch by output name. Partitions
+        of a failed batch stay pending and the error is raised.
+        """
+        with self._lock:
+            responses = {}
+            while self.pending:
+                batch = list(self.pending.items())[:self.batch_size]
+                name = 'add_partitions_{}_{}'.format(self.table, batch[0][0][1])
+                logger.info('Adding {} partitions to {}.{}'.format(
+                    len(batch),
+                    self.database,
+                    self.table
+                ))
+
+                if self.use_glue:
+                    responses[name] = self._register_glue(batch)
+                else:
+                    responses[name] = self._register_athena(batch, output_filename=name)
+
+                for key, location in batch:
+                    del self.pending[key]
+                    self.registered[key] = location
+
+            return responses
+
+    def _register_athena(self, batch: list, output_filename: str):
+        with open(os.path.join(SQL_DIR, 'alter_table_add_partitions.sql')) as f:
+            query = f.read().format(
+                '{}.{}'.format(self.database, self.table),
+                '\n'.join(
+                    PARTITION_SPEC.format(season, gameid, location)
+                    for (season, gameid), location in batch
+                )
+            )
+
+        response = execute_athena_query(
+            query=query,
+            database=self.database,
+            output_filename=output_filename,
+            boto3_client=self.athena_client
+        )
+        wait_for_query_execution(
+            response['QueryExecutionId'],
+            boto3_client=self.athena_client,
+            max_time=self.max_time
+        )
+        return response
+
+    def _register_glue(self, batch: list):
+        storage_descriptor = self.glue_client.get_table(
+            DatabaseName=self.database,
+            Name=self.table
+        )['Table']['StorageDescriptor']
+
+        partitions = []
+        for (season, gameid), location in batch:
+            partition_descriptor = copy.deepcopy(storage_descriptor)
+            partition_descriptor['Location'] = location
+            partitions.append({
+                'Values': [season, gameid],
+                'StorageDescriptor': partition_descriptor
+            })
+
+        response = self.glue_client.batch_create_partition(
+            DatabaseName=self.database,
+            TableName=self.table,
+            PartitionInputList=partitions
+        )
+        # like ADD IF NOT EXISTS
+        errors = [
+            error for error in response.get('Errors', [])
+            if error['ErrorDetail']['ErrorCode'] != 'AlreadyExistsException'
+        ]
+        if errors:
+            raise RuntimeError('Error adding partitions to {}.{}: {}'.format(
+                self.database,
+                self.table,
+                errors
+            ))
+        return response
@@ -0,0 +1,323 @@
+########################################################################
+# player_actions of a game built locally from its playbyplay, instead of
+# sql/player/create_table_player_actions_tmp.sql. Each UNION ALL branch
+# of the query is a boolean mask over the playbyplay rows, and the join
+# with nba_event_codes is a lookup array indexed by
+# (eventmsgtype, eventmsgactiontype), so a game is one pass over its
+# columns.
+########################################################################
+import functools
+import os
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from triple_triple_etl.constants import DATA_DIR
+from triple_triple_etl.core.team_shooting_side import pctimestring_to_seconds
+from triple_triple_etl.load.parse_nba_event_codes import event_codes_to_pandas
+
+
+EVENT_CODES_FILEPATH = os.path.join(DATA_DIR, 'nba-event-codes.XML')
+
+# playbyplay eventmsgtype -> nba-event-codes event_code. Free throws and
+# rebounds have two event codes, the query uses the first one
+EVENTMSGTYPE_EVENT_CODE = {
+    1: 3,    # field goal made
+    2: 4,    # field goal missed
+    3: 1,    # free throw
+    4: 5,    # rebound
+    5: 7,    # turnover
+    6: 8,    # foul
+    7: 9,    # violation
+    8: 10,   # substitution
+    9: 11,   # timeout
+    10: 12,  # jump ball
+    11: 13,  # ejection
+    12: 14,  # start of period
+    13: 15,  # end of period
+    18: 17,  # instant replay
+}
+# assists have no eventmsgtype, the event_code is used instead
+ASSIST_EVENTMSGTYPE = 25
+
+# event_subaction of shots, the CASE of the query. Made and missed shots
+# differ on eventmsgactiontype 102
+SHOT_SUBACTION = {
+    1: 'jump shot',
+    5: 'layup shot',
+    7: 'slam dunk shot',
+    57: 'hook shot',
+    71: 'finger roll layup shot',
+    73: 'driving reverse layup shot',
+    75: 'driving finger roll layup shot',
+    76: 'running finger roll layup shot',
+    79: 'pull up jump shot',
+    81: 'pull up bank jump shot',
+    85: 'turnaround bank jump shot',
+    87: 'putback slam dunk shot',
+    106: 'running aley oop dunk shot',
+    107: 'tip dunk shot',
+    108: 'cutting dunk shot',
+    109: 'driving reverse dunk shot',
+}
+SHOT_MADE_SUBACTION = {**SHOT_SUBACTION, 102: 'driving floating bank jump shot'}
+SHOT_MISSED_SUBACTION = {**SHOT_SUBACTION, 102: 'driving bank jump shot'}
+
+# eventmsgactiontype -> event_subcode of turnovers missing from nba-event-codes
+TURNOVER_SUBCODE = {40: 3}
+
+FREE_THROW_SUBSUBACTIONS = ['flagrant', 'technical', 'clear path']
+
+PLAYER_ACTIONS_SCHEMA = pa.schema([
+    ('eventnum', pa.float64()),
+    ('period', pa.float64()),
+    ('wctimestring', pa.string()),
+    ('pctimestring', pa.string()),
+    ('period_time', pa.int64()),
+    ('eventmsgtype', pa.float64()),
+    ('eventmsgactiontype', pa.float64()),
+    ('event_action', pa.string()),
+    ('event_subaction', pa.string()),
+    ('event_subsubaction', pa.string()),
+    ('description', pa.string()),
+    ('is_home', pa.int64()),
+    ('playerid', pa.float64()),
+    ('playername', pa.string()),
+    ('player_teamid', pa.float64()),
+    ('player_team_city', pa.string()),
+    ('player_team_abbreviation', pa.string()),
+    ('season', pa.string()),
+    ('gameid', pa.string()),
+])
+
+# output column -> playbyplay column of player1, player2 or player3
+PLAYER_COLUMNS = {
+    'playerid': 'player{}_id',
+    'playername': 'player{}_name',
+    'player_teamid': 'player{}_team_id',
+    'player_team_city': 'player{}_team_city',
+    'player_team_abbreviation': 'player{}_team_abbreviation',
+}
+
+
+def _take(values: np.ndarray, *idx: np.ndarray):
+    """values[idx] where every index is in range, None elsewhere."""
+    in_range = np.ones(len(idx[0]), dtype=bool)
+    for axis, index in enumerate(idx):
+        in_range &= (index >= 0) & (index < values.shape[axis])
+
+    output = np.full(len(idx[0]), None, dtype=object)
+    output[in_range] = values[tuple(index[in_range] for index in idx)]
+    return output
+
+
+def _replace(codes: np.ndarray, mapping: dict, default: np.ndarray):
+    """`default` with the rows where `codes` is a key of `mapping` replaced."""
+    output = default.copy()
+    for code, value in mapping.items():
+        output[codes == code] = value
+    return output
+
+
+class EventCodeLookup(object):
+    """
+    nba-event-codes as arrays indexed by playbyplay codes.
+
+    Attributes
+    ----------
+    action: `np.ndarray`
+        event_action by eventmsgtype
+
+    subaction: `np.ndarray`
+        event_subaction by (eventmsgtype, event_subcode)
+
+    single_subaction: `np.ndarray`
+        event_subaction by eventmsgtype for event codes with at most one
+        subcode, which the query joins on eventmsgtype only
+    """
+    def __init__(self, df_codes: pd.DataFrame):
+        num_types = max(EVENTMSGTYPE_EVENT_CODE) + 1
+        num_subcodes = int(df_codes.event_subcode.max()) + 1
+
+        self.action = np.full(num_types, None, dtype=object)
+        self.subaction = np.full((num_types, num_subcodes), None, dtype=object)
+        self.single_subaction = np.full(num_types, None, dtype=object)
+
+        for eventmsgtype, event_code in EVENTMSGTYPE_EVENT_CODE.items():
+            df = df_codes[df_codes.event_code == event_code]
+            if df.empty:
+                continue
+            self.action[eventmsgtype] = df.event_action.iloc[0]
+
+            df = df[df.event_subcode.notnull()]
+            self.subaction[eventmsgtype, df.event_subcode.astype('int64').values] = \
+                df.event_subaction.values
+            if len(df) == 1:
+                self.single_subaction[eventmsgtype] = df.event_subaction.iloc[0]
+
+    def get_action(self, eventmsgtype: np.ndarray):
+        return _take(self.action, eventmsgtype)
+
+    def get_subaction(self, eventmsgtype: np.ndarray, subcode: np.ndarray):
+        return _take(self.subaction, eventmsgtype, subcode)
+
+    def get_single_subaction(self, eventmsgtype: np.ndarray):
+        return _take(self.single_subaction, eventmsgtype)
+
+
+@functools.lru_cache(maxsize=None)
+def get_event_code_lookup(filepath: str = EVENT_CODES_FILEPATH):
+    """`EventCodeLookup` of the nba-event-codes xml, parsed once per process."""
+    etree_root = ET.parse(filepath).getroot()
+    return EventCodeLookup(event_codes_to_pandas(etree_root=etree_root))
+
+
+def get_player_actions(
+        playbyplay: pa.Table,
+        season: str,
+        gameid: str,
+        lookup: EventCodeLookup = None
+):
+    """
+    One row per player and action of a game.
+
+    Parameters
+    ----------
+    playbyplay: `pa.Table`
+        playbyplay rows of the game (see nbastats_json2df.get_play_by_play)
+
+    lookup: `EventCodeLookup`
+        Defaults to the lookup of EVENT_CODES_FILEPATH
+
+    Returns
+    -------
+    A `pa.Table` with PLAYER_ACTIONS_SCHEMA in eventnum order, the actions
+    of an event in the order of the branches of the query.
+    """
+    lookup = lookup or get_event_code_lookup()
+    df = playbyplay.to_pandas()
+    num_rows = len(df)
+
+    eventmsgtype = df.eventmsgtype.fillna(-1).values.astype('int64')
+    actiontype = df.eventmsgactiontype.fillna(-1).values.astype('int64')
+    home = df.homedescription
+    visitor = df.visitordescription
+
+    def like(pattern):
+        # homedescription LIKE pattern OR visitordescription LIKE pattern
+        return (
+            home.str.contains(pattern, na=False) |
+            visitor.str.contains(pattern, na=False)
+        ).values
+
+    def constant(value):
+        return np.full(num_rows, value, dtype=object)
+
+    nulls = constant(None)
+    action = lookup.get_action(eventmsgtype)
+    subaction = lookup.get_subaction(eventmsgtype, actiontype)
+    single_subaction = lookup.get_single_subaction(eventmsgtype)
+
+    is_shot = np.isin(actiontype, list(SHOT_MADE_SUBACTION))
+    is_3pt = like(' 3PT ')
+
+    # the first of FREE_THROW_SUBSUBACTIONS in the subaction
+    free_throw_subsubaction = nulls.copy()
+    for name in reversed(FREE_THROW_SUBSUBACTIONS):
+        has_name = pd.Series(subaction).str.contains(' ' + name, regex=False, na=False)
+        free_throw_subsubaction[has_name.values] = name
+
+    turnover_subaction = lookup.get_subaction(
+        eventmsgtype,
+        _replace(actiontype, TURNOVER_SUBCODE, default=actiontype)
+    )
+    has_player2 = df.player2_id.notnull().values
+
+    # (where, player, event_action, event_subaction, event_subsubaction)
+    # of each branch of the query
+    branches = [
+        (
+            eventmsgtype == 1, 1,
+            np.where(is_shot, 'field goal made', action),
+            _replace(actiontype, SHOT_MADE_SUBACTION, default=subaction),
+            np.where(is_3pt, '3pt made', '2pt made')
+        ),
+        (
+            eventmsgtype == 2, 1,
+            np.where(is_shot, 'field goal missed', action),
+            _replace(actiontype, SHOT_MISSED_SUBACTION, default=subaction),
+            np.where(is_3pt, '3pt missed', '2pt missed')
+        ),
+        ((eventmsgtype == 1) & like(' AST\\)$'), 2, constant('assist'), nulls, nulls),
+        (
+            eventmsgtype == 3, 1,
+            np.where(like('^MISS '), 'free throw missed', 'free throw made'),
+            subaction,
+            free_throw_subsubaction
+        ),
+        (eventmsgtype == 4, 1, constant('rebound'), single_subaction, nulls),
+        ((eventmsgtype == 5) & like(' STEAL '), 2, constant('steal'), subaction, nulls),
+        (eventmsgtype == 5, 1, action, turnover_subaction, nulls),
+        ((eventmsgtype == 6) & has_player2, 2, action, subaction, constant('got fouled')),
+        (eventmsgtype == 6, 1, action, subaction, constant('committed fouled')),
+        ((eventmsgtype == 8) & has_player2, 2, action, single_subaction, constant('subbed in')),
+        (eventmsgtype == 8, 1, action, single_subaction, constant('subbed out')),
+        (eventmsgtype == 10, 1, action, single_subaction, nulls),
+        (eventmsgtype == 10, 2, action, single_subaction, nulls),
+        (eventmsgtype == 10, 3, action, single_subaction, constant('jump ball tip')),
+        (~np.isin(eventmsgtype, [1, 2, 3, 4, 5, 6, 8, 10]), 1, action, subaction, nulls),
+    ]
+
+    # playbyplay row, branch and player of every output row
+    idx, branch, player = [], [], []
+    event_action, event_subaction, event_subsubaction = [], [], []
+    for i, (where, player_num, branch_action, branch_subaction, branch_subsubaction) \
+            in enumerate(branches):
+        idx.append(np.flatnonzero(where))
+        branch.append(np.full(len(idx[-1]), i))
+        player.append(np.full(len(idx[-1]), player_num))
+        event_action.append(branch_action[where])
+        event_subaction.append(branch_subaction[where])
+        event_subsubaction.append(branch_subsubaction[where])
+
+    idx = np.concatenate(idx)
+    branch = np.concatenate(branch)
+    player = np.concatenate(player)
+    is_assist = branch == 2
+    is_home = home.notnull().values[idx]
+
+    columns = {
+        'eventnum': df.eventnum.values[idx],
+        'period': df.period.values[idx],
+        'wctimestring': df.wctimestring.values[idx],
+        'pctimestring': df.pctimestring.values[idx],
+        'period_time': pctimestring_to_seconds(df.pctimestring.iloc[idx]).values
+                       if len(idx) else np.array([]),
+        'eventmsgtype': np.where(is_assist, ASSIST_EVENTMSGTYPE, df.eventmsgtype.values[idx]),
+        'eventmsgactiontype': np.where(is_assist, np.nan, df.eventmsgactiontype.values[idx]),
+        'event_action': np.concatenate(event_action),
+        'event_subaction': np.concatenate(event_subaction),
+        'event_subsubaction': np.concatenate(event_subsubaction),
+        'description': np.where(is_home, home.values[idx], visitor.values[idx]),
+        'is_home': is_home.astype('int64'),
+        'season': np.full(len(idx), season, dtype=object),
+        'gameid': np.full(len(idx), gameid, dtype=object),
+    }
+    for col, playbyplay_col in PLAYER_COLUMNS.items():
+        values = df[playbyplay_col.format(1)].values[idx]
+        for player_num in [2, 3]:
+            is_player = player == player_num
+            values[is_player] = df[playbyplay_col.format(player_num)].values[idx[is_player]]
+        columns[col] = values
+
+    # stable, the actions of an event stay in branch order
+    order = np.lexsort((branch, columns['eventnum']))
+    return pa.table(
+        [
+            pa.array(columns[field.name][order], type=field.type, from_pandas=True)
+            for field in PLAYER_ACTIONS_SCHEMA
+        ],
+        schema=PLAYER_ACTIONS_SCHEMA
+    )
@@ -0,0 +1,146 @@
+########################################################################
+# Possessions of a game from its closest_to_ball table (see
+# closest_to_ball.py). A player has the ball in a moment if they are the
+# closest to it and within sqrt(has_ball_dist_sq) feet. Consecutive
+# moments of an event with the same player are run length encoded in to
+# one possession, and possessions shorter than min_moments are dropped.
+# This replaces the Postgres PossessionPostgresETL in old/.
+########################################################################
+import numpy as np
+import pyarrow as pa
+
+from triple_triple_etl.core.closest_to_ball import group_moments
+
+
+# the PossessionPostgresETL default
+HAS_BALL_DIST_SQ = 4.
+# 25 moments a second, ie 0.2 seconds
+MIN_POSSESSION_MOMENTS = 5
+
+# the player of moments where no one has the ball
+NO_PLAYER = np.iinfo('int64').min
+
+POSSESSION_COL_ORDER = [
+    'eventid',
+    'period',
+    'teamid',
+    'playerid',
+    'start_moment_num',
+    'end_moment_num',
+    'start_timestamp_utc',
+    'end_timestamp_utc',
+    'start_periodclock',
+    'end_periodclock',
+    'num_moments',
+    'duration',
+    'min_distance_from_ball_sq',
+]
+
+
+def run_length_encode(*keys: np.ndarray):
+    """
+    Finds the runs of consecutive equal rows of `keys`.
+
+    Returns
+    -------
+    starts: `np.ndarray`
+        Index of the first row of each run
+
+    lengths: `np.ndarray`
+        Number of rows of each run
+    """
+    num_rows = len(keys[0])
+    if num_rows == 0:
+        return np.array([], dtype='int64'), np.array([], dtype='int64')
+
+    is_start = np.zeros(num_rows, dtype=bool)
+    is_start[0] = True
+    for key in keys:
+        is_start[1:] |= key[1:] != key[:-1]
+
+    starts = np.flatnonzero(is_start)
+    lengths = np.diff(np.append(starts, num_rows))
+    return starts, lengths
+
+
+def get_possessions(
+        table: pa.Table,
+        has_ball_dist_sq: float = HAS_BALL_DIST_SQ,
+        min_moments: int = MIN_POSSESSION_MOMENTS
+):
+    """
+    Possession intervals of a game.
+
+    Parameters
+    ----------
+    table: `pa.Table`
+        closest_to_ball rows of a game, with at least eventid, moment_num,
+        timestamp_utc, period, periodclock, teamid, playerid,
+        distance_from_ball_sq and closest_to_ball_rank.
+
+    has_ball_dist_sq: `float`
+        Squared distance from the ball (feet) within which the closest
+        player has the ball
+
+    min_moments: `int`
+        Shortest possession, in moments
+
+    Returns
+    -------
+    A `pa.Table` with the columns POSSESSION_COL_ORDER, one row per
+    possession, in (eventid, start_moment_num) order. duration is in
+    seconds of timestamp_utc.
+    """
+    # the closest player of each moment
+    rank = table.column('closest_to_ball_rank').to_numpy(zero_copy_only=False)
+    table = table.filter(pa.array(rank == 1))
+
+    def column(name, dtype):
+        return table.column(name).to_numpy(zero_copy_only=False).astype(dtype, copy=False)
+
+    order, _, _ = group_moments(column('eventid', 'int64'), column('moment_num', 'int64'))
+    table = table.take(pa.array(order))
+
+    eventid = column('eventid', 'int64')
+    moment_num = column('moment_num', 'int64')
+    distance_sq = column('distance_from_ball_sq', 'float64')
+
+    # NaN (no ball in the moment) is never within the distance
+    has_ball = distance_sq < has_ball_dist_sq
+    playerid = np.where(has_ball, column('playerid', 'int64'), NO_PLAYER)
+
+    # a run breaks on a new event, a new player or a skipped moment
+    moment_step = np.zeros(len(moment_num), dtype='int64')
+    moment_step[1:] = np.cumsum(np.diff(moment_num) != 1)
+    starts, lengths = run_length_encode(eventid, playerid, moment_step)
+    # the runs cover every row, so each reduces up to the next start
+    min_distance_sq = (
+        np.minimum.reduceat(distance_sq, starts) if len(starts)
+        else np.array([], dtype='float64')
+    )
+
+    keep = (playerid[starts] != NO_PLAYER) & (lengths >= min_moments)
+    starts = starts[keep]
+    lengths = lengths[keep]
+    min_distance_sq = min_distance_sq[keep]
+    ends = starts + lengths - 1
+
+    timestamp_utc = column('timestamp_utc', 'int64')
+    periodclock = column('periodclock', 'float64')
+
+    columns = {
+        'eventid': eventid[starts],
+        'period': column('period', 'int64')[starts],
+        'teamid': column('teamid', 'int64')[starts],
+        'playerid': playerid[starts],
+        'start_moment_num': moment_num[starts],
+        'end_moment_num': moment_num[ends],
+        'start_timestamp_utc': timestamp_utc[starts],
+        'end_timestamp_utc': timestamp_utc[ends],
+        'start_periodclock': periodclock[starts],
+        'end_periodclock': periodclock[ends],
+        'num_moments': lengths,
+        'duration': (timestamp_utc[ends] - timestamp_utc[starts]) / 1000.,
+        'min_distance_from_ball_sq': min_distance_sq,
+    }
+    return pa.table({col: columns[col] for col in POSSESSION_COL_ORDER})
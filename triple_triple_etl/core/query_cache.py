@@ -0,0 +1,217 @@
+########################################################################
+# Results of Athena queries, reused when the same query runs again on
+# unchanged data instead of scanning (and paying for) it again.
+# A result is keyed by a hash of the query text and the ETag and
+# LastModified of every s3 object under its input prefixes, so new or
+# reloaded partitions give a new key.
+# Only read only queries are cached, DDL and CTAS change tables.
+########################################################################
+import datetime
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+from triple_triple_etl.constants import (
+    ATHENA_OUTPUT,
+    ATHENA_QUERY_CACHE_PREFIX,
+    ATHENA_QUERY_CACHE_TTL
+)
+
+
+s3client = boto3.client('s3', region_name='us-east-1')
+
+# leading /* */ and -- comments
+LEADING_COMMENTS = re.compile(r'^(\s*(/\*.*?\*/|--[^\n]*))*\s*', re.DOTALL)
+READ_ONLY_STATEMENTS = ('SELECT', 'WITH')
+
+
+def split_s3uri(s3uri: str):
+    """'s3://bucket/some/key' -> ('bucket', 'some/key')"""
+    bucket, _, key = s3uri.replace('s3://', '', 1).partition('/')
+    return bucket, key
+
+
+def is_read_only(query: str):
+    statement = LEADING_COMMENTS.sub('', query, count=1)
+    return statement[:6].upper().startswith(READ_ONLY_STATEMENTS)
+
+
+def get_inputs_fingerprint(inputs: list, s3client=s3client):
+    """
+        Lists the s3 objects under the input prefixes.
+
+    Parameters
+    ----------
+        inputs: `list`
+            s3 uris of the input prefixes, eg
+            's3://nba-game-info/playbyplay/season=2015-2016/gameid=0021500001/'
+
+    Returns
+    -------
+        A sorted `list` of [s3 uri, ETag, LastModified] of the objects.
+    """
+    fingerprint = []
+    paginator = s3client.get_paginator('list_objects_v2')
+    for s3uri in inputs:
+        bucket, prefix = split_s3uri(s3uri)
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for content in page.get('Contents', []):
+                fingerprint.append([
+                    's3://{}/{}'.format(bucket, content['Key']),
+                    content['ETag'],
+                    str(content['LastModified'])
+                ])
+    return sorted(fingerprint)
+
+
+class LocalQueryCacheBackend(object):
+    """
+    Records as json files in a directory, for tests and local runs.
+    """
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    def _filepath(self, key: str):
+        return os.path.join(self.cache_dir, '{}.json'.format(key))
+
+    def get(self, key: str):
+        try:
+            with open(self._filepath(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key: str, record: dict):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # renamed, so readers never see a partial file
+        fd, tmp_filepath = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(record, f)
+        os.replace(tmp_filepath, self._filepath(key))
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._filepath(key))
+        except OSError:
+            pass
+
+
+class S3QueryCacheBackend(object):
+    """
+    Records as json objects next to the query results, shared by every
+    machine running the ETLs.
+    """
+    def __init__(
+            self,
+            bucket: str = ATHENA_OUTPUT,
+            prefix: str = ATHENA_QUERY_CACHE_PREFIX,
+            s3client=s3client
+    ):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.s3client = s3client
+
+    def _key(self, key: str):
+        return '{}/{}.json'.format(self.prefix, key)
+
+    def get(self, key: str):
+        try:
+            response = self.s3client.get_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as err:
+            if err.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            raise
+        return json.loads(response['Body'].read())
+
+    def set(self, key: str, record: dict):
+        self.s3client.put_object(
+            Bucket=self.bucket,
+            Key=self._key(key),
+            Body=json.dumps(record).encode('utf-8')
+        )
+
+    def delete(self, key: str):
+        self.s3client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+
+class QueryResultCache(object):
+    """
+    Athena query results by query and inputs. `execute_athena_query`
+    takes a cache and returns the QueryExecutionId of the cached result
+    instead of starting the query again.
+
+    A record is dropped when it is older than `ttl`, or its csv was
+    removed from the athena output (eg the query failed).
+
+    Parameters
+    ----------
+    backend:
+        Where the records are kept, `LocalQueryCacheBackend` or
+        `S3QueryCacheBackend`
+
+    ttl: `float`
+        Seconds a result is reused
+    """
+    def __init__(
+            self,
+            backend=None,
+            ttl: float = ATHENA_QUERY_CACHE_TTL,
+            s3client=s3client
+    ):
+        self.backend = backend or S3QueryCacheBackend(s3client=s3client)
+        self.ttl = ttl
+        self.s3client = s3client
+
+    def key(
+            self,
+            query: str,
+            database: str,
+            output_filename: str,
+            inputs: list = None
+    ):
+        fingerprint = get_inputs_fingerprint(inputs or [], s3client=self.s3client)
+        request = json.dumps([query, database, output_filename, fingerprint])
+        return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+    def _result_exists(self, output_location: str):
+        bucket, key = split_s3uri(output_location)
+        try:
+            self.s3client.head_object(Bucket=bucket, Key=key)
+        except ClientError:
+            return False
+        return True
+
+    def get(self, key: str):
+        """
+        Returns the record of the result, a `dict` with the
+        QueryExecutionId and OutputLocation, or None.
+        """
+        record = self.backend.get(key)
+        if record is None:
+            return None
+
+        if (time.time() - record['created'] > self.ttl
+                or not self._result_exists(record['OutputLocation'])):
+            self.backend.delete(key)
+            return None
+        return record
+
+    def set(self, key: str, execution_id: str, output_filename: str):
+        record = {
+            'QueryExecutionId': execution_id,
+            'OutputLocation': 's3://{}/{}/{}.csv'.format(
+                ATHENA_OUTPUT,
+                output_filename,
+                execution_id
+            ),
+            'created': time.time(),
+            'createdDTS': datetime.datetime.utcnow().strftime('%F %TZ')
+        }
+        self.backend.set(key, record)
+        return record
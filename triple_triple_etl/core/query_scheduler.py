@@ -0,0 +1,249 @@
+import logging
+import random
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+from triple_triple_etl.constants import ATHENA_MAX_CONCURRENT_QUERIES
+from triple_triple_etl.core.athena import (
+    execute_athena_query,
+    QUERY_POLL_INITIAL_DELAY,
+    QUERY_POLL_MAX_DELAY
+)
+
+
+athena = boto3.client('athena', region_name='us-east-1')
+
+logger = logging.getLogger()
+logger.setLevel('INFO')
+
+# the batch_get_query_execution limit
+POLL_BATCH_SIZE = 50
+# start_query_execution errors worth retrying once a query finished
+THROTTLING_ERRORS = ('TooManyRequestsException', 'ThrottlingException')
+
+
+class QueryScheduler(object):
+    """
+    Runs many Athena queries with at most `max_concurrency` of them in
+    flight. Queries are `submit`ted by name, optionally after other
+    queries, eg closest_to_ball_tmp after ball_dist_tmp, and `run`
+    starts each one as soon as its dependencies SUCCEEDED. The running
+    queries are polled together with `batch_get_query_execution`.
+
+    A query that FAILED or was CANCELLED fails the queries depending on
+    it, the others still run. With a `cache`, read only queries that ran
+    before on the same inputs reuse their result.
+
+    Parameters
+    ----------
+    max_concurrency: `int`
+        Queries in flight at once, below the account limit
+
+    max_time: `int`
+        Seconds to wait for all the queries
+    """
+    def __init__(
+            self,
+            database: str = 'nba',
+            max_concurrency: int = ATHENA_MAX_CONCURRENT_QUERIES,
+            max_time: int = 3600,
+            initial_delay: float = QUERY_POLL_INITIAL_DELAY,
+            max_delay: float = QUERY_POLL_MAX_DELAY,
+            boto3_client=athena,
+            cache=None
+    ):
+        if max_concurrency < 1:
+            raise ValueError('max_concurrency must be at least 1')
+
+        self.database = database
+        self.max_concurrency = max_concurrency
+        self.max_time = max_time
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.boto3_client = boto3_client
+        self.cache = cache
+        # name -> query, output_filename, depends_on and inputs, in submit order
+        self.jobs = {}
+        # name -> start_query_execution response
+        self.responses = {}
+        # QueryExecutionId -> names of the queries in flight, cached
+        # results of the same query share an id
+        self.running = {}
+        # name -> QueryExecution of the SUCCEEDED queries
+        self.executions = {}
+        # name -> reason of the failed or skipped queries
+        self.failed = {}
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def submit(
+            self,
+            name: str,
+            query: str,
+            output_filename: str = None,
+            depends_on: list = (),
+            inputs: list = None
+    ):
+        """
+        Adds a query to run.
+
+        Parameters
+        ----------
+        name: `str`
+            Unique name of the query, the key of the results
+
+        output_filename: `str`
+            Folder of the results in the athena output, `name` by default
+
+        depends_on: `list`
+            Names of queries, submitted before, to wait for
+
+        inputs: `list`
+            s3 uris of the prefixes the query reads, for the cache
+        """
+        if name in self.jobs:
+            raise ValueError('Query {} was already submitted'.format(name))
+        unknown = [dependency for dependency in depends_on if dependency not in self.jobs]
+        if unknown:
+            raise ValueError('Query {} depends on unknown queries {}'.format(name, unknown))
+
+        self.jobs[name] = {
+            'query': query,
+            'output_filename': output_filename or name,
+            'depends_on': list(depends_on),
+            'inputs': inputs
+        }
+
+    def s3key(self, name: str):
+        """The s3key of the csv results of a query in the athena output."""
+        return '{}/{}.csv'.format(
+            self.jobs[name]['output_filename'],
+            self.responses[name]['QueryExecutionId']
+        )
+
+    def _start(self, name: str):
+        job = self.jobs[name]
+        response = execute_athena_query(
+            query=job['query'],
+            database=self.database,
+            output_filename=job['output_filename'],
+            boto3_client=self.boto3_client,
+            cache=self.cache,
+            inputs=job['inputs']
+        )
+        self.responses[name] = response
+        self.running.setdefault(response['QueryExecutionId'], []).append(name)
+        logger.info('Started query {} ({} in flight)'.format(name, len(self.running)))
+
+    def _start_ready(self, pending: list):
+        """Starts the pending queries whose dependencies SUCCEEDED."""
+        for name in list(pending):
+            depends_on = self.jobs[name]['depends_on']
+            failed = [dependency for dependency in depends_on if dependency in self.failed]
+            if failed:
+                self.failed[name] = 'Dependencies {} failed'.format(failed)
+                logger.error('Skipping query {}: {}'.format(name, self.failed[name]))
+                pending.remove(name)
+                continue
+
+            if len(self.running) >= self.max_concurrency:
+                continue
+            if not all(dependency in self.executions for dependency in depends_on):
+                continue
+
+            try:
+                self._start(name)
+            except ClientError as err:
+                if err.response['Error']['Code'] in THROTTLING_ERRORS:
+                    # retried after the next poll
+                    logger.info('Throttled starting query {}'.format(name))
+                    return
+                self.failed[name] = str(err)
+                logger.error('Error starting query {}: {}'.format(name, err))
+            pending.remove(name)
+
+    def _poll(self, on_success=None):
+        """
+        Updates the queries in flight, calling `on_success` with the name
+        of each query that SUCCEEDED.
+
+        Returns
+        -------
+        The number of queries that finished.
+        """
+        execution_ids = list(self.running)
+        finished = 0
+        for i in range(0, len(execution_ids), POLL_BATCH_SIZE):
+            response = self.boto3_client.batch_get_query_execution(
+                QueryExecutionIds=execution_ids[i:i + POLL_BATCH_SIZE]
+            )
+            for execution in response['QueryExecutions']:
+                state = execution['Status']['State']
+                if state not in ('SUCCEEDED', 'FAILED', 'CANCELLED'):
+                    continue
+
+                for name in self.running.pop(execution['QueryExecutionId']):
+                    finished += 1
+                    if state == 'SUCCEEDED':
+                        self.executions[name] = execution
+                        statistics = execution.get('Statistics', {})
+                        logger.info('Query {} scanned {} bytes in {} ms'.format(
+                            name,
+                            statistics.get('DataScannedInBytes'),
+                            statistics.get('EngineExecutionTimeInMillis')
+                        ))
+                        if on_success is not None:
+                            on_success(name)
+                    else:
+                        self.failed[name] = '{}: {}'.format(
+                            state,
+                            execution['Status'].get('StateChangeReason')
+                        )
+                        logger.error('Query {} {}'.format(name, self.failed[name]))
+        return finished
+
+    def run(self, on_success=None):
+        """
+        Runs the submitted queries that did not run yet.
+
+        Parameters
+        ----------
+        on_success: `callable` (optional)
+            Called with the name of each query as soon as it SUCCEEDED,
+            eg to load its results while the other queries run. It should
+            return quickly, the queries are not polled meanwhile.
+
+        Returns
+        -------
+        A `dict` of the QueryExecution of the SUCCEEDED queries by name.
+        The reasons of the others are in `failed`. Raises `TimeoutError`
+        if queries are left after `max_time`.
+        """
+        pending = [
+            name for name in self.jobs
+            if name not in self.responses and name not in self.failed
+        ]
+        start_time = time.monotonic()
+        delay = self.initial_delay
+
+        while True:
+            self._start_ready(pending)
+            if not pending and not self.running:
+                return self.executions
+
+            time_left = self.max_time - (time.monotonic() - start_time)
+            if time_left <= 0:
+                raise TimeoutError('{} queries did not finish in {} seconds'.format(
+                    len(pending) + len(self.running),
+                    self.max_time
+                ))
+
+            # equal jitter, back to the initial delay once queries finish
+            time.sleep(min(delay / 2. + random.uniform(0, delay / 2.), time_left))
+            if self._poll(on_success):
+                delay = self.initial_delay
+            else:
+                delay = min(delay * 2, self.max_delay)
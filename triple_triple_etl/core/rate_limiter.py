@@ -0,0 +1,102 @@
+import random
+import threading
+import time
+
+
+class TokenBucket(object):
+    """
+    Client side rate limiter. Tokens are added at `rate` per second up
+    to `burst`, and each request takes one, so requests are spread out at
+    `rate` per second after an initial burst.
+
+    The rate is adaptive: `backoff` (eg on HTTP 429/503) halves it and
+    `recover` (on success) adds back `recovery_step` at a time, up to the
+    configured rate.
+
+    Parameters
+    ----------
+    rate: `float`
+        Requests per second
+
+    burst: `int`
+        Requests allowed at once, after being idle
+
+    min_rate: `float`
+        The rate never goes below this after backing off
+
+    recovery_step: `float`
+        Requests per second added back after each successful request
+    """
+    def __init__(
+            self,
+            rate: float,
+            burst: int = 1,
+            min_rate: float = None,
+            recovery_step: float = None
+    ):
+        if rate <= 0 or burst < 1:
+            raise ValueError('rate must be > 0 and burst >= 1')
+
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.burst = burst
+        self.min_rate = min_rate or self.max_rate / 16.
+        self.recovery_step = recovery_step or self.max_rate / 10.
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        """
+        Takes a token and returns the seconds to wait before using it.
+        Callers that can't block (eg asyncio) sleep the returned time.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        """Blocks until a request is allowed."""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def backoff(
+            self,
+            attempt: int = 0,
+            retry_after: float = None,
+            base_delay: float = 1.,
+            max_delay: float = 60.
+    ):
+        """
+        Slows down after the server pushed back.
+
+        Halves the rate, empties the bucket so other callers wait too, and
+        returns the seconds to wait before retrying: `retry_after` if the
+        server sent one, otherwise exponential in `attempt` with jitter.
+        """
+        with self.lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.min_rate, self.rate / 2.)
+            self.tokens = min(self.tokens, 0.)
+
+        if retry_after is not None:
+            return min(max_delay, retry_after)
+        delay = min(max_delay, base_delay * 2 ** attempt)
+        return delay / 2. + random.uniform(0, delay / 2.)
+
+    def recover(self):
+        """Speeds back up towards the configured rate after a success."""
+        with self.lock:
+            if self.rate < self.max_rate:
+                self._refill(time.monotonic())
+                self.rate = min(self.max_rate, self.rate + self.recovery_step)
@@ -0,0 +1,146 @@
+########################################################################
+# Raw stats.nba.com responses, cached on disk so a rerun of an ETL (eg
+# after fixing a transform bug) reads the json locally instead of
+# fetching every game again from the rate limited api.
+# Files are gzipped json named after a hash of (base_url, params).
+########################################################################
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+class ResponseCache(object):
+    """
+    Content addressed cache of json responses.
+
+    Parameters
+    ----------
+    cache_dir: `str`
+        Directory of the cached files. Created when first written to.
+
+    ttl: `float`
+        Seconds a response is kept. None keeps it until evicted.
+
+    max_size_mb: `float`
+        When the files take more than this, the least recently used are
+        removed until they take less than `evict_to` of it.
+
+    evict_to: `float`
+        Fraction of `max_size_mb` left after evicting
+    """
+    def __init__(
+            self,
+            cache_dir: str,
+            ttl: float = None,
+            max_size_mb: float = 1000,
+            evict_to: float = 0.8
+    ):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_size = max_size_mb * 1024 ** 2
+        self.evict_to = evict_to
+        # bytes written since the last scan, a scan is only needed
+        # once the cache could be over max_size
+        self._size = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(base_url: str, params: dict):
+        # the same request gives the same key whatever the params order
+        request = json.dumps([base_url, params], sort_keys=True, default=str)
+        return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+    def _filepath(self, key: str):
+        return os.path.join(self.cache_dir, key[:2], '{}.json.gz'.format(key))
+
+    def get(self, base_url: str, params: dict, ttl: float = None):
+        """
+        Returns the cached json of the request, or None if it is not
+        cached or older than `ttl` (the cache's ttl if None).
+        """
+        ttl = self.ttl if ttl is None else ttl
+        filepath = self._filepath(self.key(base_url, params))
+        try:
+            if ttl is not None and time.time() - os.path.getmtime(filepath) > ttl:
+                self._remove(filepath)
+                return None
+            with gzip.open(filepath, 'rt', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError, EOFError):
+            # not cached, or a partial/corrupt file
+            return None
+
+        # the access time orders eviction
+        try:
+            os.utime(filepath, (time.time(), os.path.getmtime(filepath)))
+        except OSError:
+            pass
+        return data
+
+    def set(self, base_url: str, params: dict, data):
+        """Caches the json `data` of the request."""
+        filepath = self._filepath(self.key(base_url, params))
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+
+        # written to a temporary file and renamed, so readers (also in
+        # other processes) never see a partial file
+        fd, tmp_filepath = tempfile.mkstemp(dir=os.path.dirname(filepath), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f_raw:
+                with gzip.GzipFile(fileobj=f_raw, mode='wb') as f:
+                    f.write(json.dumps(data).encode('utf-8'))
+            os.replace(tmp_filepath, filepath)
+        except Exception:
+            self._remove(tmp_filepath)
+            raise
+
+        with self.lock:
+            if self._size is None:
+                self._size = self.size()
+            else:
+                self._size += os.path.getsize(filepath)
+            if self._size > self.max_size:
+                self._size = self._evict(self.max_size * self.evict_to)
+
+    def _files(self):
+        if not os.path.isdir(self.cache_dir):
+            return []
+        return [
+            entry
+            for subdir in os.scandir(self.cache_dir) if subdir.is_dir()
+            for entry in os.scandir(subdir.path)
+            if entry.name.endswith('.json.gz')
+        ]
+
+    def size(self):
+        """Bytes taken by the cached files"""
+        return sum(entry.stat().st_size for entry in self._files())
+
+    def _evict(self, max_size: float):
+        # least recently used first
+        files = sorted(self._files(), key=lambda entry: entry.stat().st_atime)
+        size = sum(entry.stat().st_size for entry in files)
+        for entry in files:
+            if size <= max_size:
+                break
+            size -= entry.stat().st_size
+            self._remove(entry.path)
+        return size
+
+    def clear(self):
+        """Removes all cached responses."""
+        with self.lock:
+            for entry in self._files():
+                self._remove(entry.path)
+            self._size = 0
+
+    @staticmethod
+    def _remove(filepath: str):
+        try:
+            os.remove(filepath)
+        except OSError:
+            pass
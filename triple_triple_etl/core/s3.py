@@ -2,18 +2,38 @@
 # Currently using both
 # TODO: Fix logging output for boto3. Logs output to this file s3.py
 
+import codecs
+import concurrent.futures
 import datetime
+import io
+from itertools import chain
+import json
 import logging
 import os
 import pandas as pd
+import queue
 import re
 import tempfile
+import threading
 import time
 
 import boto3
 import patoolib
-
-from triple_triple_etl.constants import DATASETS_DIR, META_DIR, LOGS_DIR
+import pyarrow as pa
+import py7zr
+from boto3.s3.transfer import TransferConfig
+from py7zr.io import Py7zIO, WriterFactory
+
+from triple_triple_etl.constants import (
+    CACHE_DIR,
+    DATASETS_DIR,
+    META_DIR,
+    LOGS_DIR,
+    S3_LIST_MAX_WORKERS,
+    S3_LISTING_SNAPSHOT_TTL,
+    S3_TRANSFER_MAX_WORKERS
+)
+from triple_triple_etl.core.response_cache import ResponseCache
 from triple_triple_etl.log import get_logger
 
 logger = logging.getLogger()
@@ -22,17 +42,36 @@ logger.setLevel('INFO')
 s3 = boto3.resource('s3')
 s3client = boto3.client('s3')
 REGEX = re.compile("(.+/rawdata/)(\d.+\d.)([a-zA-Z])")
+# the delete_objects limit
+S3_DELETE_BATCH_SIZE = 1000
+# larger objects are copied in 64 MB parts
+S3_MULTIPART_COPY_THRESHOLD = 256 * 1024 ** 2
+MULTIPART_COPY_CONFIG = TransferConfig(
+    multipart_threshold=S3_MULTIPART_COPY_THRESHOLD,
+    multipart_chunksize=64 * 1024 ** 2
+)
+# uploads: files from 16 MB are sent in 16 MB parts, 10 at a time.
+# Smaller buffers are sent with one put_object
+S3_UPLOAD_PART_SIZE = 16 * 1024 ** 2
+UPLOAD_CONFIG = TransferConfig(
+    multipart_threshold=S3_UPLOAD_PART_SIZE,
+    multipart_chunksize=S3_UPLOAD_PART_SIZE,
+    max_concurrency=10
+)
+# local snapshots of listings, by bucket and prefix
+LISTING_SNAPSHOTS = ResponseCache(
+    cache_dir=os.path.join(CACHE_DIR, 's3_listing'),
+    ttl=S3_LISTING_SNAPSHOT_TTL
+)
 
 
 def get_game_files(bucket_name: str, save_name: str):
-    bucket = s3.Bucket(bucket_name)
-    
     logger.info('Getting list of .7z files')
     all_files = [
-        obj.key for obj in bucket.objects.all()
-        if 'Raw' not in obj.key and '.7z' in obj.key
+        key for key in iter_bucket_keys(bucket_name, prefix='')
+        if 'Raw' not in key and '.7z' in key
     ]
-    df_all_files = pd.DataFrame(data=all_files, columns=['filename'])
+    df_all_files = pd.DataFrame(data=sorted(all_files), columns=['filename'])
     # add additional columns
     df_all_files['season'] = df_all_files.filename.apply(
         lambda x: x.split('/')[0]
@@ -46,10 +85,24 @@ def get_game_files(bucket_name: str, save_name: str):
     
 
 
+def _list_pages(bucket_name: str, prefix: str, delimiter: str, s3client):
+    paginator = s3client.get_paginator('list_objects_v2')
+    return paginator.paginate(Bucket=bucket_name, Prefix=prefix, Delimiter=delimiter)
+
+
+def _list_keys(bucket_name: str, prefix: str, s3client):
+    return [
+        content['Key']
+        for page in _list_pages(bucket_name, prefix, '', s3client)
+        for content in page.get('Contents', [])
+    ]
+
+
 def get_bucket_content(bucket_name: str, prefix: str, delimiter: str = '/'):
     """
     This function returns the elements ('subfolders) in the given `bucket_name`
-    with keys beginning with the given `prefix`.
+    with keys beginning with the given `prefix`. All pages of the listing
+    are read, not only the first 1000 elements.
 
     Parameters
     ----------
@@ -71,18 +124,98 @@ def get_bucket_content(bucket_name: str, prefix: str, delimiter: str = '/'):
     Example: 'gameposition/season=2015-2016/gameid=0021500663/'
 
     """
-    response = s3client.list_objects(
-        Bucket=bucket_name,
-        Prefix=prefix,
-        Delimiter=delimiter
-    )
-
     if delimiter == '/':
         # returns 'subfolders'
-        return response.get('CommonPrefixes')
+        return [
+            common_prefix
+            for page in _list_pages(bucket_name, prefix, delimiter, s3client)
+            for common_prefix in page.get('CommonPrefixes', [])
+        ]
     elif delimiter == '':
         # returns all 'files'
-        return [file['Key'] for file in response['Contents']]
+        return _list_keys(bucket_name, prefix, s3client)
+
+
+def get_bucket_sizes(bucket_name: str, prefix: str):
+    """
+    The size in bytes of all the files beginning with `prefix`, by key.
+    Same listing as `get_bucket_content` with delimiter ''.
+    """
+    return {
+        content['Key']: content['Size']
+        for page in _list_pages(bucket_name, prefix, '', s3client)
+        for content in page.get('Contents', [])
+    }
+
+
+def iter_bucket_keys(
+        bucket_name: str,
+        prefix: str,
+        max_workers: int = S3_LIST_MAX_WORKERS
+):
+    """
+    Yields all the keys beginning with `prefix`. The subfolders of
+    `prefix`, eg the gameid= folders of
+    'gameposition/season=2015-2016/', are listed in parallel threads and
+    their keys yielded as each listing finishes, in no particular order.
+
+    Parameters
+    ----------
+    max_workers: `int`
+        Threads listing subfolders, 1 lists everything in this thread
+    """
+    if max_workers <= 1:
+        yield from _list_keys(bucket_name, prefix, s3client)
+        return
+
+    subprefixes = []
+    for page in _list_pages(bucket_name, prefix, '/', s3client):
+        for content in page.get('Contents', []):
+            yield content['Key']
+        subprefixes.extend(x['Prefix'] for x in page.get('CommonPrefixes', []))
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = [
+            executor.submit(_list_keys, bucket_name, subprefix, s3client)
+            for subprefix in subprefixes
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            yield from future.result()
+    finally:
+        # the consumer may stop early
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def get_bucket_keys(
+        bucket_name: str,
+        prefix: str,
+        snapshot: bool = False,
+        ttl: float = S3_LISTING_SNAPSHOT_TTL,
+        max_workers: int = S3_LIST_MAX_WORKERS
+):
+    """
+    Sorted list of all the keys beginning with `prefix`, see
+    `iter_bucket_keys`.
+
+    Parameters
+    ----------
+    snapshot: `bool`
+        Reuse a local snapshot of the listing younger than `ttl`
+        seconds, or save one. Keys loaded since are missing from it.
+    """
+    s3uri = 's3://{}'.format(bucket_name)
+    params = {'prefix': prefix}
+    if snapshot:
+        keys = LISTING_SNAPSHOTS.get(s3uri, params, ttl=ttl)
+        if keys is not None:
+            logger.info('Using the snapshot of {}/{}'.format(s3uri, prefix))
+            return keys
+
+    keys = sorted(iter_bucket_keys(bucket_name, prefix, max_workers=max_workers))
+    if snapshot:
+        LISTING_SNAPSHOTS.set(s3uri, params, keys)
+    return keys
 
 
 def check_key_exists(bucket: str, key: str, s3client, max_time: int = 0):
@@ -103,25 +236,166 @@ def check_key_exists(bucket: str, key: str, s3client, max_time: int = 0):
         return 0
 
 
-def copy_bucket_contents(
-        copy_source_keys: list, # list of all files to move
+def _copy_object(
+        copy_source: dict,
         destination_bucket: str,
-        destination_folder: str,
+        destination_key: str,
+        size: int,
         s3client
 ):
-    for file in copy_source_keys:
-        copy_params = {'Bucket': destination_bucket, 'Key': file}
-        destination_suffix = '/'.join(file.split('/')[1:]) # removes source_folder
-        destination_key = '{}/{}'.format(destination_folder, destination_suffix)
-
-        logger.info('Copying {} in to {}'.format(file, destination_folder))
-        # copy object in to destination    
+    if size is not None and size >= S3_MULTIPART_COPY_THRESHOLD:
+        # parts copied in parallel, copy_object is limited to 5 GB
+        s3client.copy(
+            CopySource=copy_source,
+            Bucket=destination_bucket,
+            Key=destination_key,
+            Config=MULTIPART_COPY_CONFIG
+        )
+    else:
         s3client.copy_object(
             Bucket=destination_bucket,
-            CopySource=copy_params,
+            CopySource=copy_source,
             Key=destination_key
         )
 
+
+def copy_objects(
+        copy_source_keys: list,
+        source_bucket: str,
+        destination_bucket: str,
+        destination_folder: str,
+        s3client,
+        sizes: dict = None,
+        max_workers: int = S3_TRANSFER_MAX_WORKERS
+):
+    """
+    Server side copies of `copy_source_keys` in to `destination_folder`,
+    in parallel threads. The first folder of each key is replaced, eg
+    'closest_to_ball_tmp/season=.../file' is copied to
+    'closest_to_ball/season=.../file'.
+
+    Parameters
+    ----------
+    sizes: `dict`
+        Bytes of the keys, objects from S3_MULTIPART_COPY_THRESHOLD are
+        copied in parts
+
+    Returns
+    -------
+    A `dict` by source key of `dict`s with the 'destination' key, whether
+    it was 'copied' and the 'error' if not.
+    """
+    sizes = sizes or {}
+
+    def copy(file: str):
+        destination_suffix = '/'.join(file.split('/')[1:]) # removes source_folder
+        destination_key = '{}/{}'.format(destination_folder, destination_suffix)
+        try:
+            _copy_object(
+                copy_source={'Bucket': source_bucket, 'Key': file},
+                destination_bucket=destination_bucket,
+                destination_key=destination_key,
+                size=sizes.get(file),
+                s3client=s3client
+            )
+            return {'destination': destination_key, 'copied': True, 'error': None}
+        except Exception as err:
+            logger.error('Error copying {}: {}'.format(file, err))
+            return {'destination': destination_key, 'copied': False, 'error': str(err)}
+
+    logger.info('Copying {} files in to {}'.format(len(copy_source_keys), destination_folder))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = dict(zip(copy_source_keys, executor.map(copy, copy_source_keys)))
+
+    n_failed = sum(not result['copied'] for result in results.values())
+    if n_failed:
+        logger.error('{} of {} files did not copy'.format(n_failed, len(results)))
+    return results
+
+
+def delete_objects(bucket: str, keys: list, s3client):
+    """
+    Deletes `keys` with one `delete_objects` request per 1000 keys.
+
+    Returns
+    -------
+    A `dict` by key of `dict`s with whether it was 'deleted' and the
+    'error' if not.
+    """
+    results = {}
+    for i in range(0, len(keys), S3_DELETE_BATCH_SIZE):
+        batch = keys[i:i + S3_DELETE_BATCH_SIZE]
+        logger.info('Removing {} files'.format(len(batch)))
+        try:
+            response = s3client.delete_objects(
+                Bucket=bucket,
+                Delete={'Objects': [{'Key': key} for key in batch]}
+            )
+        except Exception as err:
+            logger.error(err)
+            results.update({key: {'deleted': False, 'error': str(err)} for key in batch})
+            continue
+
+        for deleted in response.get('Deleted', []):
+            results[deleted['Key']] = {'deleted': True, 'error': None}
+        for error in response.get('Errors', []):
+            logger.error('Error removing {}: {}'.format(error['Key'], error.get('Message')))
+            results[error['Key']] = {'deleted': False, 'error': error.get('Message')}
+    return results
+
+
+def copy_bucket_contents(
+        copy_source_keys: list, # list of all files to move
+        destination_bucket: str,
+        destination_folder: str,
+        s3client,
+        sizes: dict = None # bytes by key, see `get_bucket_sizes`
+):
+    return copy_objects(
+        copy_source_keys=copy_source_keys,
+        source_bucket=destination_bucket,
+        destination_bucket=destination_bucket,
+        destination_folder=destination_folder,
+        s3client=s3client,
+        sizes=sizes
+    )
+
+
+def upload_object(
+        data,
+        bucket: str,
+        key: str,
+        s3client,
+        config: TransferConfig = UPLOAD_CONFIG
+):
+    """
+    Uploads a file or an in-memory buffer.
+
+    Parameters
+    ----------
+    data: `str`, `pa.Buffer` or `io.BytesIO`
+        Path of the file, or the buffer, eg from `arrow_table.write_buffer`.
+        A buffer smaller than a part is sent with a single `put_object`,
+        larger ones and files in parallel parts with `config`.
+    """
+    if isinstance(data, str):
+        s3client.upload_file(Filename=data, Bucket=bucket, Key=key, Config=config)
+        return
+
+    if isinstance(data, pa.Buffer):
+        size = data.size
+        fileobj = pa.BufferReader(data)
+    else:
+        size = data.getbuffer().nbytes
+        fileobj = data
+        fileobj.seek(0)
+
+    if size < config.multipart_threshold:
+        s3client.put_object(Bucket=bucket, Key=key, Body=fileobj.read())
+    else:
+        s3client.upload_fileobj(Fileobj=fileobj, Bucket=bucket, Key=key, Config=config)
+
+
 def remove_bucket_contents(
         bucket: str,
         key: str,
@@ -183,6 +457,27 @@ def s3download(bucket_name: str, filename: str):
         raise
 
 
+def s3download_fileobj(bucket_name: str, filename: str):
+    """
+    Same as `s3download`, but keeps the file in memory instead of
+    writing it to the tmp dir.
+
+    Returns
+    -------
+    An `io.BytesIO` positioned at the start of the file.
+    """
+    fileobj = io.BytesIO()
+    try:
+        logger.info('Downloading file from s3 in to memory')
+        s3.Bucket(bucket_name).download_fileobj(Key=filename, Fileobj=fileobj)
+        fileobj.seek(0)
+        return fileobj
+
+    except boto3.exceptions.botocore.client.ClientError as err:
+        logger.error(err)
+        raise
+
+
 def extract2dir(filepath: str, directory: str = DATASETS_DIR):
     try:
         logger.info('Unzip file as .json')
@@ -194,3 +489,273 @@ def extract2dir(filepath: str, directory: str = DATASETS_DIR):
         logger.error(err)
         raise
 
+
+_STREAM_DONE = object()
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_NUMBER_CHARS = set('0123456789+-.eE')
+
+
+class _StreamClosed(Exception):
+    # raised in the extraction thread once the consumer stops reading
+    pass
+
+
+class JSONItemParser(object):
+    """
+    Push parser for a json object of the form
+    {"gameid": ..., "gamedate": ..., "events": [{...}, {...}, ...]}.
+
+    Bytes are fed in chunks and `put` is called with ('gameid', value),
+    ('gamedate', value), ... for each top level value and with
+    ('events', event) for each complete item of the `items_key` array, so
+    only the unparsed tail of the document is kept in memory. Each value
+    is parsed with the C json decoder.
+
+    A value spanning many chunks, eg a long event, is decoded again only
+    once the unparsed text doubled, so parsing stays linear in its size.
+    """
+    def __init__(self, put, items_key: str = 'events'):
+        self.put = put
+        self.items_key = items_key
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        # text fed since the last parse, and the unparsed size to reach
+        # before parsing again
+        self.chunks = []
+        self.unparsed_size = 0
+        self.retry_size = 0
+        self.state = 'start'
+        self.key = None
+        self.final = False
+
+    def feed(self, chunk: bytes):
+        text = self.utf8.decode(chunk)
+        self.chunks.append(text)
+        self.unparsed_size += len(text)
+        if self.unparsed_size >= self.retry_size:
+            self._parse_chunks()
+
+    def close(self):
+        self.chunks.append(self.utf8.decode(b'', final=True))
+        self.final = True
+        self._parse_chunks()
+        if self.state != 'done':
+            raise ValueError('Incomplete json document')
+
+    def _parse_chunks(self):
+        self.buffer = ''.join([self.buffer[self.pos:]] + self.chunks)
+        self.chunks = []
+        self.pos = 0
+        self._parse()
+        self.unparsed_size = len(self.buffer) - self.pos
+        self.retry_size = 2 * self.unparsed_size
+
+    def _skip_whitespace(self):
+        self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+        return self.pos < len(self.buffer)
+
+    def _decode(self):
+        # returns (True, value) or (False, None) if more data is needed.
+        # a number is only complete once a non number character follows,
+        # eg 1.5 may arrive as '1' and '.5'
+        try:
+            value, end = self.decoder.raw_decode(self.buffer, self.pos)
+        except json.JSONDecodeError:
+            if self.final:
+                raise
+            return False, None
+        if not self.final and (end == len(self.buffer) or (
+                isinstance(value, (int, float)) and self.buffer[end] in _NUMBER_CHARS)):
+            return False, None
+        self.pos = end
+        return True, value
+
+    def _expect(self, char: str):
+        if self.buffer[self.pos] != char:
+            raise ValueError('Expected {} at {!r}'.format(char, self.buffer[self.pos:self.pos + 20]))
+        self.pos += 1
+
+    def _parse(self):
+        while self.state != 'done' and self._skip_whitespace():
+            char = self.buffer[self.pos]
+            if self.state == 'start':
+                self._expect('{')
+                self.state = 'key'
+            elif self.state == 'key':
+                if char in ',}':
+                    self.pos += 1
+                    self.state = 'done' if char == '}' else 'key'
+                    continue
+                complete, self.key = self._decode()
+                if not complete:
+                    return
+                self.state = 'colon'
+            elif self.state == 'colon':
+                self._expect(':')
+                self.state = 'value'
+            elif self.state == 'value':
+                if self.key == self.items_key and char == '[':
+                    self.pos += 1
+                    self.state = 'item'
+                    continue
+                complete, value = self._decode()
+                if not complete:
+                    return
+                self.put((self.key, value))
+                self.state = 'key'
+            elif self.state == 'item':
+                if char in ',]':
+                    self.pos += 1
+                    self.state = 'key' if char == ']' else 'item'
+                    continue
+                complete, value = self._decode()
+                if not complete:
+                    return
+                self.put((self.items_key, value))
+
+
+class _JSONParserIO(Py7zIO):
+    # py7zr writes the decompressed bytes here, which go straight in
+    # to the json parser
+    def __init__(self, parser: JSONItemParser):
+        self.parser = parser
+        self._size = 0
+
+    def write(self, s):
+        self.parser.feed(bytes(s))
+        self._size += len(s)
+        return len(s)
+
+    def read(self, size=None):
+        return b''
+
+    def seek(self, offset, whence=0):
+        return 0
+
+    def flush(self):
+        pass
+
+    def size(self):
+        return self._size
+
+    def close(self):
+        self.parser.close()
+
+
+class _JSONParserFactory(WriterFactory):
+    def __init__(self, put, items_key: str):
+        self.put = put
+        self.items_key = items_key
+
+    def create(self, filename):
+        return _JSONParserIO(JSONItemParser(self.put, self.items_key))
+
+
+def iter_7z_json(
+        fileobj,
+        items_key: str = 'events',
+        max_queued_items: int = 8
+):
+    """
+    Decompresses a .7z archive holding one json file in-process and
+    parses it incrementally. The json text is never written to disk nor
+    held in memory as a whole.
+
+    Parameters
+    ----------
+    fileobj: file-like
+        The .7z archive, eg from `s3download_fileobj`.
+
+    items_key: `str`
+        Top level key of the array to yield one item at a time.
+        For the SportVU data, 'events' yields one event at a time.
+
+    max_queued_items: `int`
+        Number of parsed items allowed to wait for the consumer. This
+        bounds memory when the consumer is slower than decompression.
+
+    Yields
+    ------
+    (key, value) tuples in document order, eg ('gameid', '0021500492'),
+    ('gamedate', '2016-01-01'), then (`items_key`, event) per event.
+    """
+    items = queue.Queue(maxsize=max_queued_items)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        # the consumer went away, so stop decompressing
+        raise _StreamClosed
+
+    def extract():
+        try:
+            with py7zr.SevenZipFile(fileobj, mode='r') as archive:
+                archive.extract(factory=_JSONParserFactory(put, items_key))
+            put(_STREAM_DONE)
+        except _StreamClosed:
+            pass
+        except Exception as err:
+            try:
+                put(err)
+            except _StreamClosed:
+                pass
+
+    worker = threading.Thread(target=extract, daemon=True)
+    worker.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _STREAM_DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        worker.join()
+
+
+def open_7z_json(fileobj, items_key: str = 'events'):
+    """
+    Reads a .7z json archive with `iter_7z_json` up to the first item of
+    `items_key`, eg {'gameid': ..., 'gamedate': ..., 'events': <iterator>}.
+    The items, the first one included, are parsed as the iterator is
+    consumed, so the whole array is never in memory.
+
+    Values after the `items_key` array are not read.
+    """
+    items = iter_7z_json(fileobj, items_key=items_key)
+    data = {}
+    for key, value in items:
+        if key == items_key:
+            data[items_key] = chain(
+                [value],
+                (item for item_key, item in items if item_key == items_key)
+            )
+            return data
+        data[key] = value
+
+    data[items_key] = iter([])
+    return data
+
+
+def load_7z_json(fileobj, items_key: str = 'events'):
+    """
+    Reads a .7z json archive with `iter_7z_json` in to a `dict`, eg
+    {'gameid': ..., 'gamedate': ..., 'events': [...]}.
+    """
+    data = {}
+    for key, value in iter_7z_json(fileobj, items_key=items_key):
+        if key == items_key:
+            data.setdefault(items_key, []).append(value)
+        else:
+            data[key] = value
+
+    return data
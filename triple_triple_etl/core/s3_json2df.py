@@ -1,15 +1,56 @@
 from datetime import datetime
+from itertools import chain, islice
 import requests
+import time
 
 import numpy as np
-import pandas as pd
 import pyarrow as pa
 
+from triple_triple_etl.core.arrow_table import (
+    build_table,
+    dtype_to_schema,
+    rows_to_columns
+)
 from triple_triple_etl.log import get_logger
 from triple_triple_etl.constants import DATATABLES_DIR
 
 logger = get_logger()
 
+POSITION_COL_ORDER = [
+    'season',
+    'gameid',
+    'eventid',
+    'moment_num',
+    'timestamp_dts',
+    'timestamp_utc',
+    'period',
+    'periodclock',
+    'shotclock',
+    'teamid',
+    'playerid',
+    'x_coordinate',
+    'y_coordinate',
+    'z_coordinate',
+]
+
+POSITION_DTYPE = {
+    'season': 'object',
+    'gameid': 'object',
+    'eventid': 'int64',
+    'moment_num': 'int64',
+    'timestamp_dts': 'object',
+    'timestamp_utc': 'int64',
+    'period': 'int64',
+    'periodclock': 'float64',
+    'shotclock': 'float64',
+    'teamid': 'int64',
+    'playerid': 'int64',
+    'x_coordinate': 'float64',
+    'y_coordinate': 'float64',
+    'z_coordinate': 'float64'
+}
+POSITION_SCHEMA = dtype_to_schema(POSITION_DTYPE, POSITION_COL_ORDER)
+
 # TODO: get_player_info: get start/end date of player on specific team
 # TODO: get_team_info: get start/end date of teams and conference, division, city, state
 
@@ -27,28 +68,6 @@ def get_player_info(game_data_dict: dict, season: str = '2015-2016'):
         'startdate',
         'enddate'
     ]
-
-    # initiate list to collect home/visitor dataframes
-    player_dfs = []
-    # get home/visitor player_info
-    logger.info('Getting home and visitor player info df')
-    for loc in ['home', 'visitor']:
-        df = pd.DataFrame(data=game_data_dict['events'][0][loc]['players'])
-        # add team id column to df
-        df['teamid'] = game_data_dict['events'][0][loc]['teamid']
-        # collect df
-        player_dfs.append(df)
-
-    # combine home/visitor dataframes
-    df = pd.concat(player_dfs, axis=0)
-    # add start/end_date columns
-    df['startdate'] = '1970-01-01'
-    df['enddate'] = '1970-01-01'
-
-    # add gameid and season
-    df['gameid'] = game_data_dict['gameid']
-    df['season'] = season
-
     # enforce dtype
     dtype = {
         'season': 'object',
@@ -63,10 +82,25 @@ def get_player_info(game_data_dict: dict, season: str = '2015-2016'):
         'enddate': 'object',
     }
 
-    df = df.astype(dtype)
+    # get home/visitor player_info
+    logger.info('Getting home and visitor player info table')
+    players = []
+    for loc in ['home', 'visitor']:
+        team = game_data_dict['events'][0][loc]
+        # add team id to each player
+        players.extend(dict(player, teamid=team['teamid']) for player in team['players'])
 
-    # convert to pyarrow table
-    return pa.Table.from_pandas(df[col_order], preserve_index=False)
+    columns = {
+        'season': season,
+        'gameid': game_data_dict['gameid'],
+    }
+    for col in col_order[2:-2]:
+        columns[col] = [player.get(col) for player in players]
+    # add start/end_date columns
+    columns['startdate'] = '1970-01-01'
+    columns['enddate'] = '1970-01-01'
+
+    return build_table(columns, schema=dtype_to_schema(dtype, col_order))
 
 
 def get_team_info(game_data_dict: dict, season: str = '2015-2016'):
@@ -82,28 +116,6 @@ def get_team_info(game_data_dict: dict, season: str = '2015-2016'):
         'startdate',
         'enddate'
     ]
-    logger.info('Getting home and visitor team info df')
-    team_data = []
-    for loc in ['home', 'visitor']:
-        team_id = game_data_dict['events'][0][loc]['teamid']
-        name = game_data_dict['events'][0][loc]['name']
-        # add start/end date columns
-        team_data.append([
-            team_id,
-            name,
-            '1970-01-01',
-            '1970-01-01'
-        ])
-
-    df = pd.concat([
-        pd.DataFrame(data=team_data, columns=np.array(col_order[2:])[[0, 1, -2, -1]]),
-        pd.DataFrame(columns=col_order[4:8]) # adding null info for now
-    ], axis=1)
-
-    # add gameid and season
-    df['gameid'] = game_data_dict['gameid']
-    df['season'] = season
-
     # enforce dtypes
     dtype = {
         'season': 'object',
@@ -117,11 +129,23 @@ def get_team_info(game_data_dict: dict, season: str = '2015-2016'):
         'startdate': 'object',
         'enddate': 'object'
     }
-    df = df.astype(dtype)
+    logger.info('Getting home and visitor team info table')
+    teams = [game_data_dict['events'][0][loc] for loc in ['home', 'visitor']]
 
-    # convert to pyarrow table
-    return pa.Table.from_pandas(df[col_order], preserve_index=False)
+    columns = {
+        'season': season,
+        'gameid': game_data_dict['gameid'],
+        'teamid': [team['teamid'] for team in teams],
+        'name': [team['name'] for team in teams],
+    }
+    # adding null info for now
+    for col in col_order[4:8]:
+        columns[col] = [None] * len(teams)
+    # add start/end date columns
+    columns['startdate'] = '1970-01-01'
+    columns['enddate'] = '1970-01-01'
 
+    return build_table(columns, schema=dtype_to_schema(dtype, col_order))
 
 
 def get_game_info(game_data_dict: dict, season: str = '2015-2016'):
@@ -132,15 +156,6 @@ def get_game_info(game_data_dict: dict, season: str = '2015-2016'):
         'home_teamid', 
         'visitor_teamid'
     ]
-    logger.info('Getting game info data')
-    df = pd.DataFrame.from_dict([{
-        'season': season,
-        'gameid': game_data_dict['gameid'],
-        'gamedate': game_data_dict['gamedate'], # leave date as string for athena queries
-        'home_teamid': game_data_dict['events'][0]['home']['teamid'],
-        'visitor_teamid': game_data_dict['events'][0]['visitor']['teamid']
-    }])
-
     # enforce dtype
     dtype = {
         'season': 'object',
@@ -149,30 +164,20 @@ def get_game_info(game_data_dict: dict, season: str = '2015-2016'):
         'home_teamid': 'int64', 
         'visitor_teamid': 'int64'
     }
-    df = df.astype(dtype)
+    logger.info('Getting game info data')
+    columns = {
+        'season': season,
+        'gameid': game_data_dict['gameid'],
+        'gamedate': game_data_dict['gamedate'], # leave date as string for athena queries
+        'home_teamid': game_data_dict['events'][0]['home']['teamid'],
+        'visitor_teamid': game_data_dict['events'][0]['visitor']['teamid']
+    }
 
-    # convert to pyarrow table
-    return pa.Table.from_pandas(df[col_order], preserve_index=False)
+    return build_table(columns, schema=dtype_to_schema(dtype, col_order))
 
 
-def get_game_position_info(game_data_dict: dict, season: str = '2015-2016'):
-    col_order = [
-        'season',
-        'gameid',
-        'eventid',
-        'moment_num',
-        'timestamp_dts',
-        'timestamp_utc',
-        'period',
-        'periodclock',
-        'shotclock',
-        'teamid',
-        'playerid',
-        'x_coordinate',
-        'y_coordinate',
-        'z_coordinate',
-    ]
-    logger.info('Getting game position data')
+def _get_game_position_table(game_data_dict: dict, season: str):
+    # reference engine: walks every event/moment/player in python
     gameid = game_data_dict['gameid']
     player_position_data = []
 
@@ -200,27 +205,191 @@ def get_game_position_info(game_data_dict: dict, season: str = '2015-2016'):
             # add moment data to player position for given moment
             for player_data in moment[5]:
                 player_position_data.append(moment_data + player_data)
-    df = pd.DataFrame(data=player_position_data, columns=col_order[1:])
-    # add season
-    df['season'] = season
 
-    # enforce datatype
-    dtype = {
-        'season': 'object',
-        'gameid': 'object',
-        'eventid': 'int64',
-        'moment_num': 'int64',
-        'timestamp_dts': 'object',
-        'timestamp_utc': 'int64',
-        'period': 'int64',
-        'periodclock': 'float64',
-        'shotclock': 'float64',
-        'teamid': 'int64',
-        'playerid': 'int64',
-        'x_coordinate': 'float64',
-        'y_coordinate': 'float64',
-        'z_coordinate': 'float64'
+    columns = {'season': season}
+    columns.update(rows_to_columns(player_position_data, POSITION_COL_ORDER[1:]))
+
+    return build_table(columns, schema=POSITION_SCHEMA)
+
+
+def format_timestamps(timestamp_utc: np.ndarray, repeats: np.ndarray = None):
+    """
+    Vectorized equivalent of
+    `datetime.fromtimestamp(ts / 1000.).strftime('%F %TZ')`.
+
+    Parameters
+    ----------
+    timestamp_utc: `np.ndarray`
+        Integer array of milliseconds since the epoch.
+
+    repeats: `np.ndarray` (optional)
+        Number of times to repeat each formatted value, as in `np.repeat`.
+        Formatting per moment and repeating per row is much cheaper than
+        formatting per row.
+
+    Returns
+    -------
+    A string `pa.Array` of 'YYYY-MM-DD HH:MM:SSZ' values in local time.
+    """
+    seconds = np.asarray(timestamp_utc, dtype='int64') // 1000
+    if seconds.size == 0 or (repeats is not None and np.sum(repeats) == 0):
+        return pa.array([], type=pa.string())
+
+    # a game has a few thousand distinct seconds, so format those only
+    unique_seconds, inverse = np.unique(seconds, return_inverse=True)
+    if repeats is not None:
+        inverse = np.repeat(inverse, repeats)
+
+    # fromtimestamp uses local time. the utc offset only changes at a
+    # DST boundary, so look it up per second only if the game spans one
+    first_offset = time.localtime(unique_seconds[0]).tm_gmtoff
+    last_offset = time.localtime(unique_seconds[-1]).tm_gmtoff
+    if first_offset == last_offset:
+        offsets = first_offset
+    else:
+        offsets = np.array([time.localtime(s).tm_gmtoff for s in unique_seconds])
+
+    local_dts = (unique_seconds + offsets).astype('datetime64[s]')
+    formatted = np.char.add(
+        np.char.replace(np.datetime_as_string(local_dts, unit='s'), 'T', ' '),
+        'Z'
+    )
+
+    return pa.array(formatted).take(pa.array(inverse))
+
+
+def _get_game_position_table_vectorized(game_data_dict: dict, season: str):
+    # vectorized engine: the moments of each event are transposed in one
+    # pass to collect moment level values, then the player rows are copied
+    # into preallocated numpy arrays
+    event_ids = []
+    moments_per_event = []
+    periods = []
+    timestamps = []
+    periodclocks = []
+    shotclocks = []
+    players = []
+
+    for event in game_data_dict['events']:
+        moments = event['moments']
+        event_ids.append(int(event['eventId']))
+        moments_per_event.append(len(moments))
+        if not moments:
+            continue
+        # [period, timestamp, periodclock, shotclock, None, players]
+        values = list(zip(*moments))
+        periods.extend(values[0])
+        timestamps.extend(values[1])
+        periodclocks.extend(values[2])
+        shotclocks.extend(values[3])
+        players.extend(values[5])
+
+    # count rows first so the player arrays are allocated once
+    counts = np.fromiter(map(len, players), dtype='int64', count=len(players))
+    n_rows = int(counts.sum())
+
+    # eventid and moment_num per moment, moment_num restarts in each event
+    moments_per_event = np.array(moments_per_event, dtype='int64')
+    event_starts = np.cumsum(moments_per_event) - moments_per_event
+    eventids = np.repeat(np.array(event_ids, dtype='int64'), moments_per_event)
+    moment_nums = np.arange(len(players), dtype='int64') - np.repeat(event_starts, moments_per_event)
+
+    # each player row is [teamid, playerid, x, y, z]
+    player_values = np.fromiter(
+        chain.from_iterable(chain.from_iterable(players)),
+        dtype='float64',
+        count=n_rows * 5
+    ).reshape(n_rows, 5)
+
+    timestamps = np.array(timestamps, dtype='int64')
+
+    columns = {
+        'season': season,
+        'gameid': game_data_dict['gameid'],
+        'eventid': np.repeat(eventids, counts),
+        'moment_num': np.repeat(moment_nums, counts),
+        'timestamp_dts': format_timestamps(timestamps, repeats=counts),
+        'timestamp_utc': np.repeat(timestamps, counts),
+        'period': np.repeat(np.array(periods, dtype='int64'), counts),
+        # None (eg a missing shotclock) becomes null, as in the python engine
+        'periodclock': np.repeat(np.array(periodclocks, dtype='float64'), counts),
+        'shotclock': np.repeat(np.array(shotclocks, dtype='float64'), counts),
+        'teamid': player_values[:, 0].astype('int64'),
+        'playerid': player_values[:, 1].astype('int64'),
+        'x_coordinate': np.ascontiguousarray(player_values[:, 2]),
+        'y_coordinate': np.ascontiguousarray(player_values[:, 3]),
+        'z_coordinate': np.ascontiguousarray(player_values[:, 4]),
     }
-    df = df.astype(dtype)
-    # convert to pyarrow table
-    return pa.Table.from_pandas(df[col_order], preserve_index=False)
+
+    return build_table(columns, schema=POSITION_SCHEMA)
+
+
+def get_game_position_info(
+        game_data_dict: dict,
+        season: str = '2015-2016',
+        vectorized: bool = True
+):
+    """
+    Flattens `events[*].moments[*]` of the SportVU json into one row per
+    player (and ball) per moment.
+
+    Parameters
+    ----------
+    game_data_dict: `dict`
+        The extracted .7z json data
+
+    season: `str`
+        Season partition value, e.g. '2015-2016'
+
+    vectorized: `bool`
+        If True, use the numpy engine. If False, use the per row python
+        engine. Both return the same table.
+
+    Returns
+    -------
+    A `pa.Table` with columns in `POSITION_COL_ORDER`.
+    """
+    logger.info('Getting game position data')
+    if vectorized:
+        return _get_game_position_table_vectorized(game_data_dict, season)
+    return _get_game_position_table(game_data_dict, season)
+
+
+def iter_game_position_batches(
+        game_data_dict: dict,
+        season: str = '2015-2016',
+        events_per_batch: int = 50
+):
+    """
+    Same rows as `get_game_position_info`, built `events_per_batch` events
+    at a time so only one batch of rows is in memory, however long the game.
+
+    Parameters
+    ----------
+    game_data_dict: `dict`
+        The extracted .7z json data. `events` can be any iterable of events.
+
+    season: `str`
+        Season partition value, e.g. '2015-2016'
+
+    events_per_batch: `int`
+        Number of events in each batch
+
+    Yields
+    ------
+    `pa.RecordBatch` with columns in `POSITION_COL_ORDER`.
+    """
+    logger.info('Getting game position data in batches of {} events'.format(events_per_batch))
+    events = iter(game_data_dict['events'])
+    while True:
+        batch_events = list(islice(events, events_per_batch))
+        if not batch_events:
+            break
+
+        table = _get_game_position_table_vectorized(
+            {'gameid': game_data_dict['gameid'], 'events': batch_events},
+            season
+        )
+        for batch in table.to_batches():
+            if batch.num_rows:
+                yield batch
@@ -0,0 +1,2 @@
+ALTER TABLE {} ADD IF NOT EXISTS
+{};
@@ -0,0 +1 @@
+ALTER TABLE {} PARTITION (season = '{}') SET LOCATION '{}';
@@ -0,0 +1,3 @@
+ALTER TABLE {} SET TBLPROPERTIES (
+{}
+);
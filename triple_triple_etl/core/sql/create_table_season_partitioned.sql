@@ -0,0 +1,7 @@
+CREATE EXTERNAL TABLE IF NOT EXISTS {} (
+{}
+)
+PARTITIONED BY (season string)
+STORED AS PARQUET
+LOCATION '{}'
+TBLPROPERTIES ('parquet.compression' = 'SNAPPY');
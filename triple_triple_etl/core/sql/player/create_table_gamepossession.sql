@@ -0,0 +1,26 @@
+/*
+    The gamepossession table, written per game by
+    load/storage/gamepossession_to_s3parquet.py. Partitions are added in
+    batches by core/partitions.py, or projected (see
+    core/partition_projection.py).
+*/
+
+CREATE EXTERNAL TABLE IF NOT EXISTS nba.gamepossession (
+      eventid                       BIGINT
+    , period                        BIGINT
+    , teamid                        BIGINT
+    , playerid                      BIGINT
+    , start_moment_num              BIGINT
+    , end_moment_num                BIGINT
+    , start_timestamp_utc           BIGINT
+    , end_timestamp_utc             BIGINT
+    , start_periodclock             DOUBLE
+    , end_periodclock               DOUBLE
+    , num_moments                   BIGINT
+    , duration                      DOUBLE
+    , min_distance_from_ball_sq     DOUBLE
+)
+PARTITIONED BY (season STRING, gameid STRING)
+STORED AS PARQUET
+LOCATION 's3://nba-game-info/gamepossession/'
+TBLPROPERTIES ('parquet.compression' = 'SNAPPY');
@@ -0,0 +1,155 @@
+########################################################################
+# The shooting side of each team per period of a game, computed locally
+# like sql/team_shooting_side/team_shooting_side_per_game.sql:
+#   the first bucket of the game is the first scoring play by wall clock,
+#   and the ball position closest in period clock to it (within 2
+#   seconds) gives the side the scoring team shoots at in the first half.
+#   Teams switch sides at half time. Overtime periods have no side.
+########################################################################
+import datetime
+
+import numpy as np
+import pandas as pd
+
+
+BALL_PLAYERID = -1
+# half court line, in feet
+HALF_COURT_X = 47.
+# seconds of period clock between the play by play and the positions
+CLOCK_WINDOW = 2.
+
+TEAM_SHOOTING_SIDE_COL_ORDER = [
+    'game_date',
+    'teamid',
+    'team_abbreviation',
+    'period',
+    'shooting_side',
+    'lastupdate_dts',
+    'season',
+    'gameid',
+]
+
+
+def pctimestring_to_seconds(pctimestring: pd.Series):
+    """'11:42' -> 702."""
+    minutes_seconds = pctimestring.str.split(':', n=1, expand=True)
+    return minutes_seconds[0].astype(float) * 60 + minutes_seconds[1].astype(float)
+
+
+def get_first_bucket(df_playbyplay: pd.DataFrame):
+    """
+    The first scoring play of the game.
+
+    Returns
+    -------
+    A `dict` with period, teamid and periodclock (seconds), or None if
+    nobody scored.
+    """
+    df = df_playbyplay[df_playbyplay.score.notnull()]
+    if df.empty:
+        return None
+
+    first = df.sort_values('wctimestring', kind='mergesort').iloc[0]
+    return {
+        'period': int(first.period),
+        'teamid': int(first.player1_team_id),
+        'periodclock': pctimestring_to_seconds(pd.Series([first.pctimestring])).iloc[0]
+    }
+
+
+def get_first_shot_shooting_side(
+        df_gameposition: pd.DataFrame,
+        first_bucket: dict,
+        clock_window: float = CLOCK_WINDOW
+):
+    """
+    'left' or 'right', the side of the ball closest in period clock to
+    `first_bucket`, or None if there are no ball positions within
+    `clock_window` seconds.
+    """
+    if first_bucket is None:
+        return None
+
+    clock_diff = (df_gameposition.periodclock - first_bucket['periodclock']).abs()
+    df = df_gameposition[
+        (df_gameposition.playerid == BALL_PLAYERID) &
+        (df_gameposition.period == first_bucket['period']) &
+        (clock_diff <= clock_window)
+    ]
+    if df.empty:
+        return None
+
+    x_coordinate = df.x_coordinate.loc[clock_diff[df.index].idxmin()]
+    if x_coordinate < HALF_COURT_X:
+        return 'left'
+    if x_coordinate > HALF_COURT_X:
+        return 'right'
+    return None
+
+
+def get_team_shooting_side(
+        df_playbyplay: pd.DataFrame,
+        df_gameposition: pd.DataFrame,
+        df_gamelog: pd.DataFrame,
+        season: str,
+        gameid: str
+):
+    """
+    Shooting side of each team per period of one game.
+
+    Parameters
+    ----------
+    df_playbyplay: `pd.DataFrame`
+        playbyplay of the game, with period, score, wctimestring,
+        pctimestring and player1_team_id
+
+    df_gameposition: `pd.DataFrame`
+        gameposition of the game, with at least the ball rows and
+        period, periodclock, playerid and x_coordinate
+
+    df_gamelog: `pd.DataFrame`
+        gamelog of the game, one row per team with team_id,
+        team_abbreviation and game_date
+
+    Returns
+    -------
+    A `pd.DataFrame` with the columns TEAM_SHOOTING_SIDE_COL_ORDER, one
+    row per team and period.
+    """
+    first_bucket = get_first_bucket(df_playbyplay)
+    side = get_first_shot_shooting_side(df_gameposition, first_bucket)
+
+    # every period of the game for both teams
+    periods = np.sort(df_playbyplay.period.dropna().unique().astype('int64'))
+    df_teams = df_gamelog[['team_id', 'team_abbreviation', 'game_date']]\
+        .drop_duplicates(subset=['team_id'])
+    df = pd.DataFrame({
+        'teamid': np.repeat(df_teams.team_id.astype('int64').values, len(periods)),
+        'team_abbreviation': np.repeat(df_teams.team_abbreviation.values, len(periods)),
+        'game_date': np.repeat(df_teams.game_date.values, len(periods)),
+        'period': np.tile(periods, len(df_teams)),
+    })
+
+    # the scoring team keeps the side in the first half, the other team
+    # has it in the second half
+    if side is None:
+        df['shooting_side'] = None
+    else:
+        other_side = 'right' if side == 'left' else 'left'
+        is_first_team = (df.teamid == first_bucket['teamid']).values
+        first_half = df.period.isin([1, 2]).values
+        second_half = df.period.isin([3, 4]).values
+        df['shooting_side'] = np.select(
+            [
+                is_first_team & first_half,
+                ~is_first_team & second_half,
+                first_half | second_half
+            ],
+            [side, side, other_side],
+            default=None
+        )
+
+    df['lastupdate_dts'] = datetime.datetime.utcnow().strftime('%F %T')
+    df['season'] = season
+    df['gameid'] = gameid
+    return df[TEAM_SHOOTING_SIDE_COL_ORDER]
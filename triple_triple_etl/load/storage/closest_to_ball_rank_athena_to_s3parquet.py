@@ -11,16 +11,25 @@ import tempfile
 
 
 from triple_triple_etl.constants import ATHENA_OUTPUT, META_DIR, SQL_DIR 
+from triple_triple_etl.core.closest_to_ball import closest_to_ball
 from triple_triple_etl.core.athena import (
     execute_athena_query,
-    check_table_exists
+    wait_for_query_execution
 )
+from triple_triple_etl.core.partitions import PartitionRegistry
+from triple_triple_etl.core.query_scheduler import QueryScheduler
 from triple_triple_etl.core.s3 import (
     get_bucket_content,
+    get_bucket_sizes,
     copy_bucket_contents,
-    remove_bucket_contents
+    delete_objects
+)
+from triple_triple_etl.load.storage.load_helper import (
+    get_uploaded_metadata,
+    read_game_table,
+    update_game_metadata,
+    update_uploaded_metadata
 )
-from triple_triple_etl.load.storage.load_helper import get_uploaded_metadata
 from triple_triple_etl.log import get_logger
 
 s3 = boto3.resource('s3', region_name='us-east-1')
@@ -73,7 +82,8 @@ class ClosestToBallETL(object):
             gameid_bounds: list, # [lower_bound, upper_bound]
             source_bucket: str = ATHENA_OUTPUT,
             destination_bucket: str = 'nba-game-info',
-            database: str = 'nba'
+            database: str = 'nba',
+            partitions: PartitionRegistry = None
     ):
         self.season = season
         self.gameid_bounds = gameid_bounds
@@ -84,6 +94,17 @@ class ClosestToBallETL(object):
         self.query_closest_to_ball = None
         self.s3keys = {}
         self.df_uploaded = None
+        # registered at the end of alter_table, unless the registry is
+        # shared with other ETLs and flushed by the caller
+        self.partitions = partitions if partitions is not None else PartitionRegistry(
+            table='closest_to_ball',
+            database=database,
+            athena_client=athena
+        )
+        self.flush_partitions = partitions is None
+        # tmp files copied to closest_to_ball, the others are not deleted
+        self.copied_files = []
+        self.failed_files = []
         
         metadata_filename = 'closest_to_ball.parquet.snappy'
         self.uploaded_filepath = os.path.join(META_DIR, metadata_filename)
@@ -111,87 +132,81 @@ class ClosestToBallETL(object):
     def create_tmp_tables(self):
         tables = ['ball_dist_tmp', 'closest_to_ball_tmp']
         queries = [self.query_balldist, self.query_closest_to_ball]
-    
-        for table, query in zip(tables, queries):
+
+        # closest_to_ball_tmp reads ball_dist_tmp
+        scheduler = QueryScheduler(database=self.database, max_time=600, boto3_client=athena)
+        for i, (table, query) in enumerate(zip(tables, queries)):
             logger.info('Creating {} table'.format(table))
-            output_filename = '{}_gameids_{}_to_{}'.format(
-                table,
-                self.gameid_bounds[0],
-                self.gameid_bounds[1]
+            scheduler.submit(
+                name=table,
+                query=query,
+                output_filename='{}_gameids_{}_to_{}'.format(
+                    table,
+                    self.gameid_bounds[0],
+                    self.gameid_bounds[1]
+                ),
+                depends_on=tables[:i]
             )
-    
-            try:
-                self.s3keys['create_{}'.format(table)] = execute_athena_query(
-                    query=query,
-                    database=self.database,
-                    output_filename=output_filename,
-                    boto3_client=athena
-                )
-                # wait for table to appear max 5 min
-                table_exists = check_table_exists(
-                    database_name=self.database,
-                    table_name=table,
-                    max_time=300
-                )
-            
-            except Exception as err:
-                logger.error('Error creating {}'.format(table))
+        scheduler.run()
 
-            if not table_exists:
-                raise FileNotFoundError('Table {} did not load'.format(table))
+        for table in tables:
+            if table in scheduler.responses:
+                self.s3keys['create_{}'.format(table)] = scheduler.responses[table]
+        if scheduler.failed:
+            for table, reason in scheduler.failed.items():
+                logger.error('Error creating {}'.format(table))
+                logger.error(reason)
+            raise FileNotFoundError('Tables {} did not load'.format(list(scheduler.failed)))
 
     def move_closest_to_ball_tmp_to_final(self):
-        all_files = get_bucket_content(
+        # large files are copied in parts
+        sizes = get_bucket_sizes(
             bucket_name=self.destination_bucket,
-            prefix='closest_to_ball_tmp',
-            delimiter=''
-        )    
+            prefix='closest_to_ball_tmp'
+        )
         # move closest_to_ball_tmp to closest_to_ball
         logger.info('Move data gameids {} to {} from tmp to final'.format(
             self.gameid_bounds[0],
             self.gameid_bounds[1]
         ))
 
-        copy_bucket_contents(
-            copy_source_keys=all_files,
+        results = copy_bucket_contents(
+            copy_source_keys=list(sizes),
             destination_bucket=self.destination_bucket,
             destination_folder='closest_to_ball',
-            s3client=s3client
+            s3client=s3client,
+            sizes=sizes
         )
+        self.copied_files = [file for file, result in results.items() if result['copied']]
+        self.failed_files = [file for file, result in results.items() if not result['copied']]
+        if self.failed_files:
+            logger.error('{} files did not copy to closest_to_ball, they are kept in closest_to_ball_tmp'.format(
+                len(self.failed_files)
+            ))
 
-        return all_files
+        # only the games copied get a partition
+        return self.copied_files
 
 
     def alter_table(self, all_files: list):
         all_gameids = [re.search('gameid=(.+?)/', key).group(1) for key in all_files]
-        
-        for gameid in set(all_gameids):
+
+        for gameid in sorted(set(all_gameids)):
             location = 's3://{}/closest_to_ball/season={}/gameid={}'.format(
                 self.destination_bucket,
                 self.season,
                 gameid
             )
-            query_path = os.path.join(SQL_DIR, 'alter_table.sql')
-            
-            with open(query_path) as f:
-                query = f.read().format(
-                    'nba.closest_to_ball',
-                    self.season,
-                    gameid,
-                    location
-                )
-                try:
-                    logger.info('Adding gameid {} to closest_to_ball table'.format(gameid))
-                    self.s3keys['alter_table_{}'.format(gameid)] = execute_athena_query(
-                        query=query,
-                        database=self.database,
-                        output_filename='alter_table_{}'.format(gameid),
-                        boto3_client=athena
-                    )
-
-                except Exception as err:
-                    logger.error('Error adding row to table {}'.format(gameid))
-                    logger.error(err)
+            self.partitions.add(self.season, gameid, location)
+
+        if not self.flush_partitions:
+            return
+        try:
+            logger.info('Adding {} games to closest_to_ball table'.format(len(self.partitions)))
+            self.s3keys.update(self.partitions.flush())
+        except Exception as err:
+            logger.error('Error adding partitions to closest_to_ball table')
+            logger.error(err)
 
     def drop_tmp_tables(self):
         tables = ['ball_dist_tmp', 'closest_to_ball_tmp']
@@ -205,45 +220,57 @@ class ClosestToBallETL(object):
                 output_filename='drop_table_{}'.format(table),
                 boto3_client=athena
             )
+            wait_for_query_execution(
+                self.s3keys['drop_{}'.format(table)]['QueryExecutionId'],
+                boto3_client=athena
+            )
 
     def cleanup(self):
         # meta data of df columns
         columns = ['season', 'gameid', 'params', 'uploadedFLG', 'lastuploadDTS']
         self.df_uploaded = get_uploaded_metadata(
             self.uploaded_filepath,
-            columns=columns
+            columns=columns,
+            key='gameid'
         )
     
-        # tmp files
+        # tmp files, closest_to_ball_tmp only the ones copied
         keys_ball_dist_tmp = get_bucket_content(
             bucket_name=self.destination_bucket,
             prefix='ball_dist_tmp',
             delimiter=''
         )
-        keys_closest_to_ball_tmp = get_bucket_content(
-            bucket_name=self.destination_bucket,
-            prefix='closest_to_ball_tmp',
-            delimiter=''
-        )    
 
         # delete tmp keys and update metadata
-
-        for file in (keys_ball_dist_tmp + keys_closest_to_ball_tmp):
-            is_key_there = remove_bucket_contents(
-                bucket=self.destination_bucket,
-                key=file,
-                max_time=0,
-                s3client=s3client
-            )
-        
+        results = delete_objects(
+            bucket=self.destination_bucket,
+            keys=keys_ball_dist_tmp + self.copied_files,
+            s3client=s3client
+        )
+        # a game is uploaded if all its tmp files were copied and deleted
+        uploaded = {}
+        game_files = {}
+        for file in self.copied_files + self.failed_files:
+            gameid = re.search('gameid=(.+?)/', file).group(1)
+            moved = file in results and results[file]['deleted']
+            uploaded[gameid] = uploaded.get(gameid, True) and moved
+            game_files[gameid] = file
+        for gameid, file in game_files.items():
             self.df_uploaded = update_metadata(
                 df_uploaded=self.df_uploaded,
                 file=file,
-                uploadFLG=is_key_there,
+                uploadFLG=int(uploaded[gameid]),
                 params=str(self.s3keys)
             )
+        updated_gameids = set(game_files)
     
-        self.df_uploaded.to_parquet(fname=self.uploaded_filepath, compression='snappy')
+        # save the rows of the games in this run
+        update_uploaded_metadata(
+            self.uploaded_filepath,
+            columns=columns,
+            rows=self.df_uploaded[self.df_uploaded.gameid.isin(updated_gameids)].to_dict('records'),
+            key='gameid'
+        )
   
     def run(self):
         self.get_queries()
@@ -252,6 +279,105 @@ class ClosestToBallETL(object):
         self.alter_table(all_files)
         self.drop_tmp_tables()
         self.cleanup()
+        if self.failed_files:
+            raise IOError('{} files did not copy to closest_to_ball'.format(len(self.failed_files)))
+
+
+class ClosestToBallLocalETL(ClosestToBallETL):
+    """
+    closest_to_ball of one game, computed locally from its gameposition
+    parquet files instead of with the Athena tmp tables. Only the
+    partition is added with Athena.
+    """
+    def __init__(
+            self,
+            season: str,
+            gameid: str,
+            source_bucket: str = 'nba-game-info',
+            destination_bucket: str = 'nba-game-info',
+            database: str = 'nba',
+            partitions: PartitionRegistry = None
+    ):
+        super().__init__(
+            season=season,
+            gameid_bounds=[gameid, gameid],
+            source_bucket=source_bucket,
+            destination_bucket=destination_bucket,
+            database=database,
+            partitions=partitions
+        )
+        self.gameid = gameid
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filepath = None
+        self.s3key = None
+        self.uploadedFLG = 0
+
+    def extract(self):
+        logger.info('Getting gameposition of game {}'.format(self.gameid))
+        return read_game_table(
+            bucket_name=self.source_bucket,
+            tablename='gameposition',
+            season=self.season,
+            gameid=self.gameid,
+            s3client=s3client,
+            tmp_dir=self.tmp_dir
+        )
+
+    def transform(self, table: pa.Table):
+        start_time = datetime.datetime.now()
+        table = closest_to_ball(table)
+        # partition columns are in the s3 key
+        table = table.drop([col for col in ['season', 'gameid'] if col in table.schema.names])
+
+        self.filepath = os.path.join(self.tmp_dir, 'closest_to_ball.parquet.snappy')
+        pq.write_table(table, self.filepath, compression='snappy')
+
+        time_delta = (datetime.datetime.now() - start_time).total_seconds()
+        logger.info('Ranked {} rows of game {} in {} seconds'.format(
+            table.num_rows,
+            self.gameid,
+            round(time_delta, 2)
+        ))
+
+    def load(self):
+        self.s3key = 'closest_to_ball/season={}/gameid={}/closest_to_ball.parquet.snappy'.format(
+            self.season,
+            self.gameid
+        )
+        try:
+            logger.info('Uploading closest_to_ball of game {} to s3'.format(self.gameid))
+            s3client.upload_file(
+                Filename=self.filepath,
+                Bucket=self.destination_bucket,
+                Key=self.s3key
+            )
+            self.uploadedFLG = 1
+        except Exception as err:
+            logger.error('Error uploading game {}'.format(self.gameid))
+            logger.error(err)
+            return
+
+        self.alter_table([self.s3key])
+
+    def cleanup(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+        update_game_metadata(
+            self.uploaded_filepath,
+            columns=['season', 'gameid', 'params', 'uploadedFLG', 'lastuploadDTS'],
+            season=self.season,
+            gameid=self.gameid,
+            uploadedFLG=self.uploadedFLG,
+            params=str(self.s3keys)
+        )
+
+    def run(self):
+        try:
+            table = self.extract()
+            self.transform(table)
+            self.load()
+        finally:
+            self.cleanup()
 
 
 
@@ -0,0 +1,193 @@
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+import datetime
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shutil
+import tempfile
+
+from triple_triple_etl.constants import DESTINATION_BUCKET, META_DIR
+from triple_triple_etl.core.partitions import PartitionRegistry
+from triple_triple_etl.core.possession import (
+    get_possessions,
+    HAS_BALL_DIST_SQ,
+    MIN_POSSESSION_MOMENTS
+)
+from triple_triple_etl.load.storage.load_helper import (
+    export_uploaded_metadata,
+    read_game_table,
+    update_game_metadata
+)
+from triple_triple_etl.log import get_logger
+
+s3client = boto3.client('s3', region_name='us-east-1')
+athena = boto3.client('athena', region_name='us-east-1')
+
+THIS_FILENAME = os.path.splitext(os.path.basename(__file__))[0]
+LOG_FILENAME = '{}.log'.format(os.path.splitext(THIS_FILENAME)[0])
+logger = get_logger(output_file=LOG_FILENAME)
+
+UPLOADED_COLUMNS = ['season', 'gameid', 'params', 'uploadedFLG', 'lastuploadDTS']
+UPLOADED_FILEPATH = os.path.join(META_DIR, 'gamepossession.parquet.snappy')
+
+
+class GamePossessionETL(object):
+    """
+    Possessions of one game, from its closest_to_ball parquet files, in
+    to the `gamepossession` table (see sql/player/create_table_gamepossession.sql).
+    """
+    def __init__(
+            self,
+            season: str,
+            gameid: str,
+            source_bucket: str = DESTINATION_BUCKET,
+            destination_bucket: str = DESTINATION_BUCKET,
+            database: str = 'nba',
+            has_ball_dist_sq: float = HAS_BALL_DIST_SQ,
+            min_moments: int = MIN_POSSESSION_MOMENTS,
+            partitions: PartitionRegistry = None
+    ):
+        self.season = season
+        self.gameid = gameid
+        self.source_bucket = source_bucket
+        self.destination_bucket = destination_bucket
+        self.database = database
+        self.has_ball_dist_sq = has_ball_dist_sq
+        self.min_moments = min_moments
+        # registered in load, unless the registry is shared with other
+        # games and flushed by the caller
+        self.partitions = partitions if partitions is not None else PartitionRegistry(
+            table='gamepossession',
+            database=database,
+            athena_client=athena
+        )
+        self.flush_partitions = partitions is None
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filepath = None
+        self.s3keys = {}
+        self.uploadedFLG = 0
+
+    def extract(self):
+        logger.info('Getting closest_to_ball of game {}'.format(self.gameid))
+        return read_game_table(
+            bucket_name=self.source_bucket,
+            tablename='closest_to_ball',
+            season=self.season,
+            gameid=self.gameid,
+            s3client=s3client,
+            tmp_dir=self.tmp_dir
+        )
+
+    def transform(self, table: pa.Table):
+        table = get_possessions(
+            table,
+            has_ball_dist_sq=self.has_ball_dist_sq,
+            min_moments=self.min_moments
+        )
+        logger.info('Found {} possessions in game {}'.format(table.num_rows, self.gameid))
+
+        self.filepath = os.path.join(self.tmp_dir, 'gamepossession.parquet.snappy')
+        pq.write_table(table, self.filepath, compression='snappy')
+
+    def load(self):
+        location = 's3://{}/gamepossession/season={}/gameid={}'.format(
+            self.destination_bucket,
+            self.season,
+            self.gameid
+        )
+        s3key = 'gamepossession/season={}/gameid={}/gamepossession.parquet.snappy'.format(
+            self.season,
+            self.gameid
+        )
+        try:
+            logger.info('Uploading gamepossession of game {} to s3'.format(self.gameid))
+            s3client.upload_file(
+                Filename=self.filepath,
+                Bucket=self.destination_bucket,
+                Key=s3key
+            )
+            self.uploadedFLG = 1
+
+            self.partitions.add(self.season, self.gameid, location)
+            if self.flush_partitions:
+                self.s3keys.update(self.partitions.flush())
+        except Exception as err:
+            logger.error('Error loading game {}'.format(self.gameid))
+            logger.error(err)
+
+    def cleanup(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+        update_game_metadata(
+            UPLOADED_FILEPATH,
+            columns=UPLOADED_COLUMNS,
+            season=self.season,
+            gameid=self.gameid,
+            uploadedFLG=self.uploadedFLG,
+            params=str(self.s3keys)
+        )
+
+    def run(self):
+        try:
+            table = self.extract()
+            self.transform(table)
+            self.load()
+        finally:
+            self.cleanup()
+
+
+def _run_game(season: str, gameid: str, kwargs: dict):
+    try:
+        GamePossessionETL(season=season, gameid=gameid, **kwargs).run()
+    except Exception as err:
+        logger.error('Error with game {}, {}'.format(gameid, err))
+        return False
+    return True
+
+
+def upload_all_gamepossession(
+        season: str,
+        gameids: list,
+        max_workers: int = 4,
+        **kwargs
+):
+    """
+    Runs `GamePossessionETL` for `gameids` of `season`, `max_workers`
+    games at a time (the work is mostly s3 transfers). `kwargs` are
+    passed to `GamePossessionETL`. The partitions of all the games are
+    registered at the end, in a few batches.
+
+    Returns
+    -------
+    A `list` of the gameids that failed.
+    """
+    start_time = datetime.datetime.now()
+    partitions = kwargs.setdefault('partitions', PartitionRegistry(
+        table='gamepossession',
+        database=kwargs.get('database', 'nba'),
+        athena_client=athena
+    ))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        succeeded = list(executor.map(
+            lambda gameid: _run_game(season, gameid, kwargs),
+            gameids
+        ))
+
+    try:
+        partitions.flush()
+    except Exception as err:
+        logger.error('Error adding partitions to gamepossession table')
+        logger.error(err)
+
+    # parquet copy of the ledger
+    export_uploaded_metadata(UPLOADED_FILEPATH, columns=UPLOADED_COLUMNS, key='gameid')
+
+    time_delta = round((datetime.datetime.now() - start_time).seconds / 60., 2)
+    failed = [gameid for gameid, ok in zip(gameids, succeeded) if not ok]
+    logger.info('It took {} minutes to load {} games, {} failed'.format(
+        time_delta,
+        len(gameids),
+        len(failed)
+    ))
+    return failed
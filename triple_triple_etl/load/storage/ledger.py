@@ -0,0 +1,222 @@
+########################################################################
+# Upload ledgers (the metadata of what has been uploaded to s3) used to
+# be parquet files in META_DIR that every ETL run read and rewrote
+# whole. They are now tables in one SQLite database next to the parquet
+# files, keyed on the game (or file) so a run only touches its own row.
+# WAL mode lets several processes read and write at the same time.
+# The parquet files can still be exported for anything reading them.
+########################################################################
+import math
+import numpy as np
+import os
+import pandas as pd
+import sqlite3
+
+
+LEDGER_FILENAME = 'uploaded_ledger.sqlite3'
+
+
+def _quote(name: str):
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def _to_sql_value(value):
+    # sqlite3 only binds python builtins
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or value is pd.NaT:
+        return None
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, (int, float, str, bytes)):
+        return value
+    return str(value)
+
+
+class UploadLedger(object):
+    """
+    An upload metadata table, stored in SQLite.
+
+    Parameters
+    ----------
+    filepath: `str`
+        The metadata parquet file, eg META_DIR/closest_to_ball.parquet.snappy.
+        The table is named after it and lives in LEDGER_FILENAME in the
+        same directory. The parquet file is imported the first time the
+        table is used.
+
+    columns: `list`
+        Columns of the table
+
+    key: `str` or `list`
+        Column with one row per value, eg 'gameid', or columns with one
+        row per combination, eg ['game_id', 'game_data_type']. It is
+        indexed.
+
+    timeout: `float`
+        Seconds to wait for another writer to finish
+    """
+    def __init__(
+            self,
+            filepath: str,
+            columns: list,
+            key,
+            timeout: float = 60
+    ):
+        keys = [key] if isinstance(key, str) else list(key)
+        for col in keys:
+            if col not in columns:
+                raise ValueError('Key {} is not in the columns'.format(col))
+
+        self.filepath = filepath
+        self.columns = list(columns)
+        self.key = key
+        self.keys = keys
+        self.timeout = timeout
+        self.db_path = os.path.join(os.path.dirname(filepath), LEDGER_FILENAME)
+        self.table = os.path.basename(filepath).split('.')[0]
+        self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def _connect(self):
+        if self.conn is None:
+            # autocommit mode, transactions are started explicitly
+            self.conn = sqlite3.connect(
+                self.db_path,
+                timeout=self.timeout,
+                isolation_level=None
+            )
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self._create_table()
+        return self.conn
+
+    def _table_columns(self):
+        rows = self.conn.execute(
+            'PRAGMA table_info({})'.format(_quote(self.table))
+        ).fetchall()
+        return [row[1] for row in rows]
+
+    def _create_table(self):
+        table_columns = self._table_columns()
+        if table_columns:
+            if table_columns != self.columns:
+                raise ValueError('There is a column order discrepancy!')
+            return
+
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            # another process may have created it while we waited
+            if not self._table_columns():
+                self.conn.execute('CREATE TABLE {} ({}, PRIMARY KEY ({}))'.format(
+                    _quote(self.table),
+                    ', '.join(_quote(col) for col in self.columns),
+                    ', '.join(_quote(col) for col in self.keys)
+                ))
+                if os.path.isfile(self.filepath):
+                    df = pd.read_parquet(self.filepath)
+                    if list(df.columns) != self.columns:
+                        raise ValueError('There is a column order discrepancy!')
+                    self._upsert(df.to_dict('records'))
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+
+    def exists(self):
+        # True if there is anything to read, without creating the database
+        return os.path.isfile(self.db_path) or os.path.isfile(self.filepath)
+
+    def _upsert(self, rows: list):
+        columns = ', '.join(_quote(col) for col in self.columns)
+        updates = ', '.join(
+            '{0} = excluded.{0}'.format(_quote(col))
+            for col in self.columns if col not in self.keys
+        )
+        query = 'INSERT INTO {} ({}) VALUES ({}) ON CONFLICT ({}) DO UPDATE SET {}'.format(
+            _quote(self.table),
+            columns,
+            ', '.join(['?'] * len(self.columns)),
+            ', '.join(_quote(col) for col in self.keys),
+            updates
+        )
+        self.conn.executemany(
+            query,
+            ([_to_sql_value(row.get(col)) for col in self.columns] for row in rows)
+        )
+
+    def upsert(self, rows: list, batch_size: int = 500):
+        """
+        Inserts rows, or replaces the rows with the same key.
+
+        Parameters
+        ----------
+        rows: `list`
+            `dict`s of column to value. Missing columns are stored as null.
+
+        batch_size: `int`
+            Rows written per transaction
+        """
+        conn = self._connect()
+        rows = list(rows)
+        for start in range(0, len(rows), batch_size):
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._upsert(rows[start:start + batch_size])
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+    def get(self, value):
+        """Returns the row of key `value` as a `dict`, or None."""
+        df = self.to_dataframe(value=value)
+        if df.empty:
+            return None
+        return df.iloc[0].to_dict()
+
+    def to_dataframe(self, value=None):
+        """
+        Returns the table as a `pd.DataFrame`, in insert order.
+        If `value` is given, only the row of that key (looked up on the
+        index) is returned, a `tuple` of values for a key of several
+        columns.
+        """
+        if not self.exists():
+            return pd.DataFrame(columns=self.columns)
+
+        query = 'SELECT {} FROM {}'.format(
+            ', '.join(_quote(col) for col in self.columns),
+            _quote(self.table)
+        )
+        params = []
+        if value is not None:
+            values = [value] if isinstance(self.key, str) else list(value)
+            query += ' WHERE {}'.format(' AND '.join(
+                '{} = ?'.format(_quote(col)) for col in self.keys
+            ))
+            params.extend(_to_sql_value(val) for val in values)
+        query += ' ORDER BY rowid'
+
+        return pd.read_sql_query(query, self._connect(), params=params)
+
+    def export_parquet(self, filepath: str = None):
+        """
+        Writes the table to parquet, by default to the file it was
+        imported from, eg for scripts that read the parquet files.
+        """
+        filepath = filepath or self.filepath
+        tmp_filepath = '{}.tmp'.format(filepath)
+        self.to_dataframe().to_parquet(tmp_filepath, compression='snappy', index=False)
+        os.replace(tmp_filepath, filepath)
+        return filepath
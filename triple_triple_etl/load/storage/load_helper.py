@@ -1,11 +1,49 @@
+import datetime
 import os
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from triple_triple_etl.core.parquet_reader import read_parquet_s3
+from triple_triple_etl.core.s3 import get_bucket_content
+from triple_triple_etl.load.storage.ledger import UploadLedger
 
 
 def get_uploaded_metadata(
     filepath: str,
-    columns: list
+    columns: list,
+    key: str = None,
+    value=None
 ):
+    """
+    Reads the upload metadata of an ETL.
+
+    Parameters
+    ----------
+    filepath: `str`
+        Path of the metadata parquet file
+
+    columns: `list`
+        Columns of the metadata
+
+    key: `str` or `list` (optional)
+        Column with one row per value, eg 'gameid', or a `list` of
+        columns with one row per combination. If given, the
+        metadata is read from the `UploadLedger` (importing `filepath`
+        the first time), otherwise from the parquet file.
+
+    value: (optional)
+        Only return the row with this `key` value, a `tuple` of values
+        if `key` is a `list`
+
+    Returns
+    -------
+    A `pd.DataFrame` with `columns`.
+    """
+    if key is not None:
+        with UploadLedger(filepath, columns=columns, key=key) as ledger:
+            return ledger.to_dataframe(value=value)
+
     if os.path.isfile(filepath):
         df = pd.read_parquet(filepath)
         if list(df.columns) != columns:
@@ -15,6 +53,132 @@ def get_uploaded_metadata(
         return pd.DataFrame(columns=columns)
 
 
+def update_uploaded_metadata(
+    filepath: str,
+    columns: list,
+    rows: list,
+    key: str
+):
+    """
+    Inserts or replaces rows of the upload metadata, matched on `key`,
+    in one transaction of the `UploadLedger`. Only the given rows are
+    written, and several processes can update the same metadata.
+
+    Parameters
+    ----------
+    filepath: `str`
+        Path of the metadata parquet file
+
+    columns: `list`
+        Columns of the metadata
+
+    rows: `list`
+        `dict`s of column to value
+
+    key: `str` or `list`
+        Column identifying a row, eg 'input_filename', or a `list` of
+        columns, eg ['game_id', 'game_data_type']
+    """
+    with UploadLedger(filepath, columns=columns, key=key) as ledger:
+        ledger.upsert(rows)
+
+
+def export_uploaded_metadata(
+    filepath: str,
+    columns: list,
+    key: str
+):
+    """
+    Writes the upload metadata back to its parquet file `filepath`.
+    """
+    with UploadLedger(filepath, columns=columns, key=key) as ledger:
+        return ledger.export_parquet()
+
+
+def read_game_table(
+    bucket_name: str,
+    tablename: str,
+    season: str,
+    gameid: str,
+    s3client,
+    tmp_dir: str = None,
+    **kwargs
+):
+    """
+    Reads the parquet files of one game of a table, eg
+    gameposition/season=2015-2016/gameid=0021500001/, in to one table.
+
+    Parameters
+    ----------
+    bucket_name: `str`
+        The s3 bucket of the table
+
+    tablename: `str`
+        The table folder, eg 'gameposition'
+
+    season: `str`
+        eg '2015-2016'
+
+    gameid: `str`
+        eg '0021500001'
+
+    s3client:
+        The boto3 s3 client
+
+    tmp_dir: `str` (optional)
+        If given, the files are downloaded whole in to it. Otherwise only
+        the columns and row groups needed are read, see `read_parquet_s3`.
+
+    kwargs:
+        `columns` and `filters`, passed to the parquet reader
+
+    Returns
+    -------
+    A `pa.Table`. Raises FileNotFoundError if the game has no files.
+    """
+    keys = get_bucket_content(
+        bucket_name=bucket_name,
+        prefix='{}/season={}/gameid={}/'.format(tablename, season, gameid),
+        delimiter=''
+    )
+    if not keys:
+        raise FileNotFoundError('No {} files of game {}'.format(tablename, gameid))
+
+    tables = []
+    for i, key in enumerate(keys):
+        if tmp_dir is None:
+            tables.append(read_parquet_s3(bucket_name, key, s3client=s3client, **kwargs))
+        else:
+            filepath = os.path.join(tmp_dir, '{}_{}.parquet'.format(tablename, i))
+            s3client.download_file(Bucket=bucket_name, Key=key, Filename=filepath)
+            tables.append(pq.read_table(filepath, **kwargs))
+
+    return pa.concat_tables(tables)
+
+
+def update_game_metadata(
+    filepath: str,
+    columns: list,
+    season: str,
+    gameid: str,
+    uploadedFLG: int,
+    **values
+):
+    """
+    Inserts or replaces the upload metadata row of one game, keyed on
+    'gameid' and stamped with the current time in 'lastuploadDTS'.
+    `values` are the other columns, eg params=str(s3keys).
+    """
+    row = {
+        'season': season,
+        'gameid': gameid,
+        'uploadedFLG': uploadedFLG,
+        'lastuploadDTS': datetime.datetime.utcnow().strftime('%F %TZ')
+    }
+    row.update(values)
+    update_uploaded_metadata(filepath, columns=columns, rows=[row], key='gameid')
+
+
 def format_year(year: str):
     start = year.split('-')[0]
     end = str(int(start) + 1)
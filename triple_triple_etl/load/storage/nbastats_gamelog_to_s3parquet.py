@@ -3,18 +3,18 @@ import datetime
 import os
 import pandas as pd
 import pyarrow as pa
-import pyarrow.parquet as pq
 import re
-import tempfile
-import shutil
 import warnings
 
 from triple_triple_etl.constants import (
     BASE_URL_GAMELOG,
     DESTINATION_BUCKET,
-    META_DIR
+    META_DIR,
+    NBASTATS_CACHE_RECENT_TTL
 )
+from triple_triple_etl.core.arrow_table import split_table, write_buffer
 from triple_triple_etl.core.nbastats_get_data import get_data
+from triple_triple_etl.core.s3 import upload_object
 from triple_triple_etl.log import get_logger
 from triple_triple_etl.load.storage.load_helper import (
     get_uploaded_metadata,
@@ -96,9 +96,17 @@ class NBAStatsGameLogsS3ETL(object):
         self.dateto = dateto
         self.season_year = season_year
         self.destination_bucket = destination_bucket
-        self.tmp_dir = tempfile.mkdtemp()
+        # gameid -> parquet file of the game, in memory
+        self.buffers = {}
         self.loaddate = datetime.datetime.utcnow().strftime('%F %TZ')
 
+        # gamelogs of the last few days can still change, so their
+        # cached response expires sooner
+        self.cache_ttl = None
+        dateto_dt = datetime.datetime.strptime(self.dateto, '%m/%d/%Y')
+        if datetime.datetime.utcnow() - dateto_dt < datetime.timedelta(days=2):
+            self.cache_ttl = NBASTATS_CACHE_RECENT_TTL
+
         # api info
         self.base_url = BASE_URL_GAMELOG
         self.params = {
@@ -131,7 +139,11 @@ class NBAStatsGameLogsS3ETL(object):
 
     def extract(self):
         logger.info('Get gamelogs from {} to {}'.format(self.datefrom, self.dateto))
-        return get_data(base_url=self.base_url, params=self.params)
+        return get_data(
+            base_url=self.base_url,
+            params=self.params,
+            cache_ttl=self.cache_ttl
+        )
 
     def transform(self, data):
         all_dfs = [
@@ -145,41 +157,36 @@ class NBAStatsGameLogsS3ETL(object):
         df = pd.concat(all_dfs, ignore_index=True)
         df.loc[:, 'season'] = self.season_year
 
-        pq.write_to_dataset(
-            table=pa.Table.from_pandas(df, preserve_index=False),
-            root_path=self.tmp_dir,
-            partition_cols=['season', 'game_id'],
-            compression='snappy',
-            preserve_index=False
-        )    
-            
+        # one file per game, season and game_id are in the s3 key
+        games = split_table(pa.Table.from_pandas(df, preserve_index=False), 'game_id')
+        self.buffers = {
+            gameid: write_buffer(table, drop_columns=['season', 'game_id'])
+            for gameid, table in games.items()
+        }
+
         return df        
 
     def load(self, df):
 
         try:
-            table_dir = os.path.join(self.tmp_dir, 'season={}'.format(self.season_year))
-            for game in os.listdir(table_dir):
-                gameid = game.split('=')[1]
+            for gameid, buffer in self.buffers.items():
                 df_game = df.query('game_id == @gameid')
                 matchup = re.findall(r'[\w]+', df_game.matchup.iloc[0])
                 gamedate = ''.join(df_game.game_date.iloc[0].split('-'))
 
-                game_path = os.path.join(table_dir, game)
-                filepath = os.path.join(game_path, os.listdir(game_path)[0])
-           
                 # load to s3
                 logger.info('Uploading gamelog {} to s3'.format(gameid))
-                s3.upload_file(
-                    Filename=filepath,
-                    Bucket=self.destination_bucket,
-                    Key='gamelog/season={}/gameid={}/{}{}{}.parquet.snappy'.format(
+                upload_object(
+                    buffer,
+                    bucket=self.destination_bucket,
+                    key='gamelog/season={}/gameid={}/{}{}{}.parquet.snappy'.format(
                         format_year(self.season_year),
                         gameid,
                         gamedate,
                         matchup[0],
                         matchup[-1]
-                    )
+                    ),
+                    s3client=s3
                 )
                 # update metadata
                 self.df_uploaded = append_upload_metadata(
@@ -193,7 +200,7 @@ class NBAStatsGameLogsS3ETL(object):
                     uploadFLG=1
                 )
 
-        except (boto3.exceptions.botocore.client.ClientError, FileNotFoundError) as err:
+        except boto3.exceptions.botocore.client.ClientError as err:
             logger.error(err)
             # update metadata
             self.df_uploaded = append_upload_metadata(
@@ -208,9 +215,9 @@ class NBAStatsGameLogsS3ETL(object):
             )
 
     def cleanup(self):
-        # remove tmp directories
-        shutil.rmtree(self.tmp_dir)
-        
+        self.buffers = {}
+
+
         # save df_uploaded
         self.df_uploaded.to_parquet(
             fname=self.uploaded_filepath,
@@ -1,13 +1,11 @@
+import asyncio
 import boto3
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 import os
 import pandas as pd
 import pyarrow as pa
-import pyarrow.parquet as pq
 import re
-import shutil
-import tempfile
-import time
 
 import warnings
 
@@ -17,16 +15,21 @@ from triple_triple_etl.constants import (
     BASE_URL_BOX_SCORE_PLAYER_TRACKING,
     DESTINATION_BUCKET,
     META_DIR,
-    NBASTATS_PARAMS
+    NBASTATS_PARAMS,
+    NBASTATS_POOL_SIZE
 )
-from triple_triple_etl.core.nbastats_get_data import get_data
+from triple_triple_etl.core.arrow_table import write_buffer
+from triple_triple_etl.core.nbastats_get_data import get_data, get_data_async
 from triple_triple_etl.core.nbastats_json2df import (
     get_play_by_play,
     get_boxscore
 )
+from triple_triple_etl.core.s3 import upload_object
 from triple_triple_etl.log import get_logger
 from triple_triple_etl.load.storage.load_helper import (
     get_uploaded_metadata,
+    update_uploaded_metadata,
+    export_uploaded_metadata,
     format_year
 )
     
@@ -37,16 +40,29 @@ s3 = boto3.client('s3', region_name='us-east-1')
 
 THIS_FILENAME = os.path.splitext(os.path.basename(__file__))[0]
 
+GAME_DATA_TYPES = ['playbyplay', 'boxscore_traditional', 'boxscore_player']
+
+# metadata of the uploaded games, one row per game and game_data_type
+# since the types of a game are loaded at the same time. It is a new
+# ledger, the one keyed on game_id alone kept one type per game.
+UPLOADED_FILEPATH = '{}_by_type.parquet.snappy'.format(os.path.join(META_DIR, THIS_FILENAME))
+UPLOADED_COLUMNS = [
+    'season', 'game_date', 'game_id', 'game_data_type', 'team1', 'team2',
+    'fileuploadedFLG', 'lastuploadDTS',
+    'base_url', 'params'
+]
+UPLOADED_KEY = ['game_id', 'game_data_type']
 
 
 def get_file_idx_in_uploaded(
         df_uploaded: pd.DataFrame,
-        gameid: str
+        gameid: str,
+        game_data_type: str
 ):
     # get index if file exists or create a row with that filename
     try:
         return df_uploaded\
-            .query('game_id == @gameid')\
+            .query('game_id == @gameid and game_data_type == @game_data_type')\
             .index[0]
     except:
         return df_uploaded.shape[0]
@@ -75,9 +91,11 @@ class NBAStatsS3ETL(object):
         self.game_data_type = game_data_type
         self.season = season
         self.destination_bucket = destination_bucket
-        self.tmp_dir = tempfile.mkdtemp()
+        # the parquet file, in memory
+        self.buffer = None
         self.uploadedFLG = None
-        self.params = NBASTATS_PARAMS
+        # copy, so games run at the same time don't share params
+        self.params = dict(NBASTATS_PARAMS)
 
         # initialize logger
         log_filename = '{}_{}.log'.format(
@@ -87,8 +105,7 @@ class NBAStatsS3ETL(object):
         self.logger = get_logger(output_file=log_filename)
 
         # meta data file
-        meta_data_filename = os.path.join(META_DIR, THIS_FILENAME)
-        self.uploaded_filepath = '{}.parquet.snappy'.format(meta_data_filename)
+        self.uploaded_filepath = UPLOADED_FILEPATH
 
         # api info
         # update params
@@ -106,20 +123,19 @@ class NBAStatsS3ETL(object):
     def metadata(self):
         self.logger.info('Getting loaded files metadata')
         # meta data columns
-        columns = [
-            'season', 'game_date', 'game_id', 'team1', 'team2',
-            'fileuploadedFLG', 'lastuploadDTS',
-            'base_url', 'params'
-        ]
+        columns = UPLOADED_COLUMNS
         self.df_uploaded = get_uploaded_metadata(
             self.uploaded_filepath,
-            columns=columns
+            columns=columns,
+            key=UPLOADED_KEY,
+            value=(self.gameid, self.game_data_type)
         )
 
         # get index of filename
         self.file_idx = get_file_idx_in_uploaded(
             df_uploaded=self.df_uploaded,
-            gameid=self.gameid
+            gameid=self.gameid,
+            game_data_type=self.game_data_type
         )
 
     def extract(self):
@@ -137,46 +153,34 @@ class NBAStatsS3ETL(object):
         elif self.game_data_type == 'boxscore_player':
             table = get_boxscore(data, season=self.season, traditional_player='player')
 
-        pq.write_to_dataset(
-            table=table,
-            root_path=self.tmp_dir,
-            partition_cols=['season', 'game_id'],
-            compression='snappy',
-            preserve_index=False
-        )  
+        # season and game_id are in the s3 key
+        self.buffer = write_buffer(table, drop_columns=['season', 'game_id'])
     
     def load(self):
         try:
             self.logger.info(
                 'Uploading {} {} to s3'.format(self.game_data_type, self.gameid)
             )
-            filepath = os.path.join(
-                self.tmp_dir,
-                'season={}'.format(self.season),
-                'game_id={}'.format(self.gameid)
-            )
-            filename = os.listdir(filepath)[0]
-            s3.upload_file(
-                Filename=os.path.join(filepath, filename),
-                Bucket=self.destination_bucket,
-                Key='{}/season={}/gameid={}/{}{}{}.parquet.snappy'.format(
+            upload_object(
+                self.buffer,
+                bucket=self.destination_bucket,
+                key='{}/season={}/gameid={}/{}{}{}.parquet.snappy'.format(
                     self.game_data_type,
                     format_year(self.season),
                     self.gameid,
                     self.gamedate.replace('-', ''),
                     self.team1,
                     self.team2
-                )
+                ),
+                s3client=s3
             )
             self.uploadedFLG = 1
-        except (boto3.exceptions.botocore.client.ClientError, FileNotFoundError) as err:
+        except (boto3.exceptions.botocore.client.ClientError, AttributeError) as err:
             self.logger.error(err)
             self.uploadedFLG = 0
 
     def cleanup(self):
-        self.logger.info('Removing tmp dir')
-        # remove tmp dir
-        shutil.rmtree(self.tmp_dir)
+        self.buffer = None
         # update metadata info
         today = datetime.datetime.utcnow().strftime('%F %TZ')
 
@@ -185,6 +189,7 @@ class NBAStatsS3ETL(object):
             self.season,
             self.gamedate,
             self.gameid,
+            self.game_data_type,
             self.team1,
             self.team2,
             self.uploadedFLG,
@@ -192,11 +197,12 @@ class NBAStatsS3ETL(object):
             self.base_url,
             str(self.params)
         ]
-    
-        self.df_uploaded.to_parquet(
-            fname=self.uploaded_filepath,
-            compression='snappy',
-            index=False
+
+        update_uploaded_metadata(
+            self.uploaded_filepath,
+            columns=UPLOADED_COLUMNS,
+            rows=[self.df_uploaded.loc[self.file_idx].to_dict()],
+            key=UPLOADED_KEY
         )
 
     def run(self):
@@ -207,6 +213,22 @@ class NBAStatsS3ETL(object):
         self.cleanup()
 
 
+def _get_games(
+        df_gamelog_meta: pd.DataFrame,
+        start_date: str = None,
+        end_date: str = None
+):
+    # one row per game between start_date and end_date
+    if not start_date:
+        start_date = df_gamelog_meta.sort_values('game_date').game_date.iloc[0]
+    if not end_date:
+        end_date = df_gamelog_meta.sort_values('game_date').game_date.iloc[-1]
+
+    cols = ['season', 'game_date', 'game_id', 'team1', 'team2']
+    return df_gamelog_meta[cols].drop_duplicates(subset=['game_id'])\
+                .query('@start_date <= game_date <= @end_date')
+
+
 def upload_all_nbastats(
         df_gamelog_meta: pd.DataFrame,
         game_data_type: str,
@@ -216,16 +238,10 @@ def upload_all_nbastats(
     """
     Extract ALL games data from NBA stats API. 
     'game_data_type' is one of {'playbyplay', 'boxscore_traditional', boxscore_player'}
+    Requests are throttled by the rate limiter in `get_data`.
     """
-    if not start_date:
-        start_date = df_gamelog_meta.sort_values('game_date').game_date.iloc[0]
-    if not end_date:
-        end_date = df_gamelog_meta.sort_values('game_date').game_date.iloc[-1]
-    
-    cols = ['season', 'game_date', 'game_id', 'team1', 'team2']
-    df = df_gamelog_meta[cols].drop_duplicates(subset=['game_id'])\
-                 .query('@start_date <= game_date <= @end_date')
-    
+    df = _get_games(df_gamelog_meta, start_date=start_date, end_date=end_date)
+
     start_time = datetime.datetime.now()
     for i, row in enumerate(df.values):
         try:
@@ -244,21 +260,134 @@ def upload_all_nbastats(
             etl_time = datetime.datetime.now()
             time_delta = round((etl_time - start_time).seconds / 60., 2)
             etl.logger.info("It's been {} minutes".format(time_delta))
-
-            # pause every 10 games so we don't go over request limit
-            if i % 20 == 0:
-                print('Sleep for a min to not overload api calls')
-                time.sleep(60)
         except Exception as err:
             etl.logger.error('Error with game {}, {}'.format(i, row[2]))
             continue
 
+    # parquet copy of the ledger
+    export_uploaded_metadata(
+        UPLOADED_FILEPATH,
+        columns=UPLOADED_COLUMNS,
+        key=UPLOADED_KEY
+    )
+
     end_time = datetime.datetime.now()
     time_delta = round((end_time - start_time).seconds / 60., 2)
 
     etl.logger.info('It took {} minutes to load'.format(time_delta))
 
 
+async def _run_etl_async(
+        row: list,
+        game_data_type: str,
+        semaphore: asyncio.Semaphore,
+        executor: ThreadPoolExecutor
+):
+    # fetch with the shared rate limit, then transform and load on a
+    # thread so the event loop keeps fetching
+    async with semaphore:
+        etl = NBAStatsS3ETL(
+            season=row[0],
+            gamedate=row[1],
+            gameid=row[2],
+            team1=row[3],
+            team2=row[4],
+            game_data_type=game_data_type,
+            destination_bucket=DESTINATION_BUCKET
+        )
+        loop = asyncio.get_running_loop()
+        try:
+            etl.logger.info(
+                'Getting {} data of game {}'.format(game_data_type, etl.gameid)
+            )
+            data = await get_data_async(
+                base_url=etl.base_url,
+                params=etl.params,
+                executor=executor
+            )
+            await loop.run_in_executor(executor, _load_nbastats, etl, data)
+        except Exception as err:
+            etl.logger.error('Error with {} game {}, {}'.format(game_data_type, etl.gameid, err))
+            return game_data_type, etl.gameid, repr(err)
+
+        if not etl.uploadedFLG:
+            return game_data_type, etl.gameid, 'Not uploaded'
+        return game_data_type, etl.gameid, None
+
+
+def _load_nbastats(etl: NBAStatsS3ETL, data: dict):
+    # NBAStatsS3ETL.run without the extract
+    etl.metadata()
+    etl.transform(data)
+    etl.load()
+    etl.cleanup()
+
+
+async def _upload_all_nbastats_async(
+        df_games: pd.DataFrame,
+        game_data_types: list,
+        max_concurrency: int
+):
+    semaphore = asyncio.Semaphore(max_concurrency)
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        tasks = [
+            _run_etl_async(row, game_data_type, semaphore, executor)
+            for row in df_games.values
+            for game_data_type in game_data_types
+        ]
+        return await asyncio.gather(*tasks)
+
+
+def upload_all_nbastats_concurrent(
+        df_gamelog_meta: pd.DataFrame,
+        game_data_types: list = GAME_DATA_TYPES,
+        start_date: str = None,
+        end_date: str = None,
+        max_concurrency: int = NBASTATS_POOL_SIZE
+):
+    """
+    Same as `upload_all_nbastats`, but fetches every game and every type
+    in `game_data_types` in one pass, with up to `max_concurrency` games
+    in flight at once. All requests share the rate limiter and session
+    of `get_data`, so the rate limit, not the concurrency, sets the pace.
+
+    Returns
+    -------
+    A `dict` {'succeeded': [(game_data_type, gameid)],
+              'failed': {(game_data_type, gameid): error}}.
+    """
+    logger = get_logger(output_file='{}.log'.format(THIS_FILENAME))
+    df = _get_games(df_gamelog_meta, start_date=start_date, end_date=end_date)
+
+    start_time = datetime.datetime.now()
+    results = asyncio.run(
+        _upload_all_nbastats_async(df, game_data_types, max_concurrency)
+    )
+
+    summary = {'succeeded': [], 'failed': {}}
+    for game_data_type, gameid, error in results:
+        if error is None:
+            summary['succeeded'].append((game_data_type, gameid))
+        else:
+            summary['failed'][(game_data_type, gameid)] = error
+
+    # parquet copy of the ledger
+    export_uploaded_metadata(
+        UPLOADED_FILEPATH,
+        columns=UPLOADED_COLUMNS,
+        key=UPLOADED_KEY
+    )
+
+    end_time = datetime.datetime.now()
+    time_delta = round((end_time - start_time).seconds / 60., 2)
+    logger.info('It took {} minutes to load'.format(time_delta))
+    logger.info('{} succeeded, {} failed'.format(
+        len(summary['succeeded']),
+        len(summary['failed'])
+    ))
+    return summary
+
+
 
 
 
@@ -20,16 +20,23 @@ import tempfile
 
 
 from triple_triple_etl.constants import ATHENA_OUTPUT, META_DIR, SQL_DIR 
+from triple_triple_etl.core.player_actions import get_player_actions
 from triple_triple_etl.core.athena import (
     execute_athena_query,
-    check_table_exists
+    wait_for_query_execution
 )
+from triple_triple_etl.core.partitions import PartitionRegistry
 from triple_triple_etl.core.s3 import (
-    get_bucket_content,
+    get_bucket_sizes,
     copy_bucket_contents,
-    remove_bucket_contents
+    delete_objects
+)
+from triple_triple_etl.load.storage.load_helper import (
+    get_uploaded_metadata,
+    read_game_table,
+    update_game_metadata,
+    update_uploaded_metadata
 )
-from triple_triple_etl.load.storage.load_helper import get_uploaded_metadata
 from triple_triple_etl.log import get_logger
 
 s3 = boto3.resource('s3', region_name='us-east-1')
@@ -82,7 +89,8 @@ class PlayerActionsETL(object):
             gameid_bounds: list, # [lower_bound, upper_bound]
             source_bucket: str = ATHENA_OUTPUT,
             destination_bucket: str = 'nba-game-info',
-            database: str = 'nba'
+            database: str = 'nba',
+            partitions: PartitionRegistry = None
     ):
         self.season = season
         self.gameid_bounds = gameid_bounds
@@ -92,6 +100,17 @@ class PlayerActionsETL(object):
         self.query_create_player_action_table = None
         self.s3keys = {}
         self.df_uploaded = None
+        # registered at the end of alter_table, unless the registry is
+        # shared with other ETLs and flushed by the caller
+        self.partitions = partitions if partitions is not None else PartitionRegistry(
+            table='player_actions',
+            database=database,
+            athena_client=athena
+        )
+        self.flush_partitions = partitions is None
+        # tmp files copied to player_actions, the others are not deleted
+        self.copied_files = []
+        self.failed_files = []
         
         metadata_filename = 'player_actions.parquet.snappy'
         self.uploaded_filepath = os.path.join(META_DIR, metadata_filename)
@@ -127,72 +146,66 @@ class PlayerActionsETL(object):
                 output_filename=output_filename,
                 boto3_client=athena
             )
-            # wait for table to appear max 5 min
-            table_exists = check_table_exists(
-                database_name=self.database,
-                table_name=table,
+            # the table exists once the query succeeded, max 5 min
+            wait_for_query_execution(
+                self.s3keys['create_{}'.format(table)]['QueryExecutionId'],
+                boto3_client=athena,
                 max_time=300
             )
-        
         except Exception as err:
             logger.error('Error creating {}'.format(table))
-
-        if not table_exists:
-            raise FileNotFoundError('Table {} did not load'.format(table))
+            logger.error(err)
+            raise FileNotFoundError('Table {} did not load'.format(table)) from err
 
     def move_tmp_to_final(self):
-        all_files = get_bucket_content(
+        # large files are copied in parts
+        sizes = get_bucket_sizes(
             bucket_name=self.destination_bucket,
-            prefix='player_actions_tmp',
-            delimiter=''
-        )    
+            prefix='player_actions_tmp'
+        )
         # move player_actions_tmp to player_actions
         logger.info('Move data gameids {} to {} from tmp to final'.format(
             self.gameid_bounds[0],
             self.gameid_bounds[1]
         ))
 
-        copy_bucket_contents(
-            copy_source_keys=all_files,
+        results = copy_bucket_contents(
+            copy_source_keys=list(sizes),
             destination_bucket=self.destination_bucket,
             destination_folder='player_actions',
-            s3client=s3client
+            s3client=s3client,
+            sizes=sizes
         )
+        self.copied_files = [file for file, result in results.items() if result['copied']]
+        self.failed_files = [file for file, result in results.items() if not result['copied']]
+        if self.failed_files:
+            logger.error('{} files did not copy to player_actions, they are kept in player_actions_tmp'.format(
+                len(self.failed_files)
+            ))
 
-        return all_files
+        # only the games copied get a partition
+        return self.copied_files
 
 
     def alter_table(self, all_files: list):
         all_gameids = [re.search('gameid=(.+?)/', key).group(1) for key in all_files]
-        
-        for gameid in set(all_gameids):
+
+        for gameid in sorted(set(all_gameids)):
             location = 's3://{}/player_actions/season={}/gameid={}'.format(
                 self.destination_bucket,
                 self.season,
                 gameid
             )
-            query_path = os.path.join(SQL_DIR, 'alter_table.sql')
-            
-            with open(query_path) as f:
-                query = f.read().format(
-                    'nba.player_actions',
-                    self.season,
-                    gameid,
-                    location
-                )
-                try:
-                    logger.info(
-                        'Adding gameid {} to player_actions table'.format(gameid))
-                    self.s3keys['alter_table_{}'.format(gameid)] = execute_athena_query(
-                        query=query,
-                        database=self.database,
-                        output_filename='alter_table_{}'.format(gameid),
-                        boto3_client=athena
-                    )
-
-                except Exception as err:
-                    logger.error('Error adding row to table {}'.format(gameid))
-                    logger.error(err)
+            self.partitions.add(self.season, gameid, location)
+
+        if not self.flush_partitions:
+            return
+        try:
+            logger.info('Adding {} games to player_actions table'.format(len(self.partitions)))
+            self.s3keys.update(self.partitions.flush())
+        except Exception as err:
+            logger.error('Error adding partitions to player_actions table')
+            logger.error(err)
 
     def drop_tmp_table(self, table: str = 'player_actions_tmp'):
         query = "DROP TABLE IF EXISTS nba.{}".format(table)
@@ -203,38 +216,49 @@ class PlayerActionsETL(object):
             output_filename='drop_table_{}'.format(table),
             boto3_client=athena
         )
+        wait_for_query_execution(
+            self.s3keys['drop_{}'.format(table)]['QueryExecutionId'],
+            boto3_client=athena
+        )
 
     def cleanup(self):
         # meta data of df columns
         columns = ['season', 'gameid', 'params', 'uploadedFLG', 'lastuploadDTS']
         self.df_uploaded = get_uploaded_metadata(
             self.uploaded_filepath,
-            columns=columns
+            columns=columns,
+            key='gameid'
         ) 
-        # tmp files
-        keys_player_actions_tmp = get_bucket_content(
-            bucket_name=self.destination_bucket,
-            prefix='player_actions_tmp',
-            delimiter=''
+        # delete the tmp keys copied and update metadata
+        results = delete_objects(
+            bucket=self.destination_bucket,
+            keys=self.copied_files,
+            s3client=s3client
         )
-
-        # delete tmp keys and update metadata
-        for file in keys_player_actions_tmp:
-            is_key_there = remove_bucket_contents(
-                bucket=self.destination_bucket,
-                key=file,
-                max_time=0,
-                s3client=s3client
-            )
-        
+        # a game is uploaded if all its tmp files were copied and deleted
+        uploaded = {}
+        game_files = {}
+        for file in self.copied_files + self.failed_files:
+            gameid = re.search('gameid=(.+?)/', file).group(1)
+            moved = file in results and results[file]['deleted']
+            uploaded[gameid] = uploaded.get(gameid, True) and moved
+            game_files[gameid] = file
+        for gameid, file in game_files.items():
             self.df_uploaded = update_metadata(
                 df_uploaded=self.df_uploaded,
                 file=file,
-                uploadFLG=is_key_there,
+                uploadFLG=int(uploaded[gameid]),
                 params=str(self.s3keys)
             )
+        updated_gameids = set(game_files)
     
-        self.df_uploaded.to_parquet(fname=self.uploaded_filepath, compression='snappy')
+        # save the rows of the games in this run
+        update_uploaded_metadata(
+            self.uploaded_filepath,
+            columns=columns,
+            rows=self.df_uploaded[self.df_uploaded.gameid.isin(updated_gameids)].to_dict('records'),
+            key='gameid'
+        )
   
     def run(self):
         self.get_query()
@@ -243,3 +267,102 @@ class PlayerActionsETL(object):
         self.alter_table(all_files)
         self.drop_tmp_table()
         self.cleanup()
+        if self.failed_files:
+            raise IOError('{} files did not copy to player_actions'.format(len(self.failed_files)))
+
+
+class PlayerActionsLocalETL(PlayerActionsETL):
+    """
+    player_actions of one game, built locally from its playbyplay parquet
+    files (see core/player_actions.py) instead of with the Athena tmp
+    table. Only the partition is added with Athena.
+    """
+    def __init__(
+            self,
+            season: str,
+            gameid: str,
+            source_bucket: str = 'nba-game-info',
+            destination_bucket: str = 'nba-game-info',
+            database: str = 'nba',
+            partitions: PartitionRegistry = None
+    ):
+        super().__init__(
+            season=season,
+            gameid_bounds=[gameid, gameid],
+            source_bucket=source_bucket,
+            destination_bucket=destination_bucket,
+            database=database,
+            partitions=partitions
+        )
+        self.gameid = gameid
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filepath = None
+        self.s3key = None
+        self.uploadedFLG = 0
+
+    def extract(self):
+        logger.info('Getting playbyplay of game {}'.format(self.gameid))
+        return read_game_table(
+            bucket_name=self.source_bucket,
+            tablename='playbyplay',
+            season=self.season,
+            gameid=self.gameid,
+            s3client=s3client,
+            tmp_dir=self.tmp_dir
+        )
+
+    def transform(self, table: pa.Table):
+        start_time = datetime.datetime.now()
+        table = get_player_actions(table, season=self.season, gameid=self.gameid)
+        # partition columns are in the s3 key
+        table = table.drop(['season', 'gameid'])
+
+        self.filepath = os.path.join(self.tmp_dir, 'player_actions.parquet.snappy')
+        pq.write_table(table, self.filepath, compression='snappy')
+
+        time_delta = (datetime.datetime.now() - start_time).total_seconds()
+        logger.info('Built {} player actions of game {} in {} seconds'.format(
+            table.num_rows,
+            self.gameid,
+            round(time_delta, 3)
+        ))
+
+    def load(self):
+        self.s3key = 'player_actions/season={}/gameid={}/player_actions.parquet.snappy'.format(
+            self.season,
+            self.gameid
+        )
+        try:
+            logger.info('Uploading player_actions of game {} to s3'.format(self.gameid))
+            s3client.upload_file(
+                Filename=self.filepath,
+                Bucket=self.destination_bucket,
+                Key=self.s3key
+            )
+            self.uploadedFLG = 1
+        except Exception as err:
+            logger.error('Error uploading game {}'.format(self.gameid))
+            logger.error(err)
+            return
+
+        self.alter_table([self.s3key])
+
+    def cleanup(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+        update_game_metadata(
+            self.uploaded_filepath,
+            columns=['season', 'gameid', 'params', 'uploadedFLG', 'lastuploadDTS'],
+            season=self.season,
+            gameid=self.gameid,
+            uploadedFLG=self.uploadedFLG,
+            params=str(self.s3keys)
+        )
+
+    def run(self):
+        try:
+            table = self.extract()
+            self.transform(table)
+            self.load()
+        finally:
+            self.cleanup()
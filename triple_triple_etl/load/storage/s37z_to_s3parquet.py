@@ -1,26 +1,42 @@
 import boto3
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import datetime
+from itertools import chain, islice
 import json
 import logging
+import multiprocessing
 import numpy as np
 import os
 import pandas as pd
-import pyarrow.parquet as pq
 import tempfile
+import threading
 import shutil
 
 from triple_triple_etl.core.s3_json2df import (
     get_player_info,
     get_team_info,
     get_game_info,
-    get_game_position_info
+    iter_game_position_batches
+)
+from triple_triple_etl.core.arrow_table import write_buffer, write_sorted_batches
+from triple_triple_etl.load.storage.load_helper import (
+    get_uploaded_metadata,
+    update_uploaded_metadata,
+    export_uploaded_metadata
+)
+from triple_triple_etl.core.s3 import (
+    s3download,
+    s3download_fileobj,
+    extract2dir,
+    open_7z_json,
+    upload_object
 )
-from triple_triple_etl.load.storage.load_helper import get_uploaded_metadata
-from triple_triple_etl.core.s3 import s3download, extract2dir
 from triple_triple_etl.log import get_logger
 from triple_triple_etl.constants import (
     META_DIR,
     DESTINATION_BUCKET,
+    GAMEPOSITION_ROW_GROUP_MB,
     SOURCE_BUCKET
 )
 
@@ -30,6 +46,25 @@ s3 = boto3.client('s3', region_name='us-east-1')
 LOG_FILENAME = '{}.log'.format(os.path.splitext(os.path.basename(__file__))[0])
 logger = get_logger(output_file=LOG_FILENAME)
 
+# metadata of the uploaded files
+UPLOADED_FILENAME = 'rawpositiontransformed_s3uploaded.parquet.snappy'
+UPLOADED_COLUMNS = [
+    'input_filename',
+    'gameid',
+    'gameinfo_uploadedFLG',
+    'gameposition_uploadedFLG',
+    'playerinfo_uploadedFLG',
+    'teaminfo_uploadedFLG',
+    'lastuploadDTS'
+]
+# rows of a moment are together and row groups cover a few events, so
+# the min/max statistics of the time columns skip most of a game
+GAMEPOSITION_SORT_BY = [
+    ('eventid', 'ascending'),
+    ('moment_num', 'ascending'),
+    ('playerid', 'ascending')
+]
+
 
 def get_file_idx_in_uploaded(
         df_uploaded: pd.DataFrame,
@@ -50,36 +85,38 @@ class S3FileFormatETL(object):
         input_filename: str, 
         source_bucket: str = SOURCE_BUCKET,
         destination_bucket: str = DESTINATION_BUCKET,
-        season: str = '2015-2016'
+        season: str = '2015-2016',
+        streaming: bool = True, # decompress and parse without a .json on disk
+        save_metadata: bool = True, # False if the caller saves df_uploaded
+        row_group_mb: float = GAMEPOSITION_ROW_GROUP_MB # of gameposition
     ):
         self.input_filename = input_filename
         self.source_bucket = source_bucket
         self.destination_bucket = destination_bucket
         self.season = season
+        self.streaming = streaming
+        self.save_metadata = save_metadata
+        self.row_group_bytes = row_group_mb * 1024 * 1024
         self.tmp_dir = None
         self.gameid = None
+        # parquet file of gameposition, in-memory buffers of the small tables
         self.data_paths = {}
         self.df_uploaded = None
+        # the tables are uploaded in parallel threads
+        self.lock = threading.Lock()
         
-        meta_data_filename = 'rawpositiontransformed_s3uploaded.parquet.snappy'
-        self.uploaded_filepath = os.path.join(META_DIR, meta_data_filename)
+        self.uploaded_filepath = os.path.join(META_DIR, UPLOADED_FILENAME)
 
 
     def metadata(self):
         logger.info('Getting loaded files metadata')
         # meta data df columns
-        columns = [
-            'input_filename',
-            'gameid',
-            'gameinfo_uploadedFLG',
-            'gameposition_uploadedFLG',
-            'playerinfo_uploadedFLG',
-            'teaminfo_uploadedFLG',
-            'lastuploadDTS'
-        ]
+        columns = UPLOADED_COLUMNS
         self.df_uploaded = get_uploaded_metadata(
             self.uploaded_filepath,
-            columns=columns
+            columns=columns,
+            key='input_filename',
+            value=self.input_filename
         )
         # get index of filename
         self.file_idx = get_file_idx_in_uploaded(
@@ -92,6 +129,9 @@ class S3FileFormatETL(object):
             self.df_uploaded.loc[self.file_idx] = [self.input_filename] + [np.nan] * (len(columns) - 1)
 
     def extract_from_s3(self):
+        if self.streaming:
+            return self._extract_from_s3_streaming()
+
         filepath = s3download(
             bucket_name=self.source_bucket,
             filename=self.input_filename
@@ -119,24 +159,76 @@ class S3FileFormatETL(object):
 
         return data
 
+    def _extract_from_s3_streaming(self):
+        # the .7z is kept in memory and decompressed straight in to the
+        # json parser. data['events'] is an iterator, the events are
+        # parsed as gameposition consumes them
+        try:
+            fileobj = s3download_fileobj(
+                bucket_name=self.source_bucket,
+                filename=self.input_filename
+            )
+            logger.info('Getting data')
+            data = open_7z_json(fileobj)
+            self.gameid = data['gameid']
+        except Exception as err:
+            logger.error(err)
+            data = {}
+
+        return data
+
+    def split_header(self, data: dict):
+        """
+        The top level values and the first event of `data`, all the game,
+        player and team tables need. The first event is put back in to
+        data['events'], which may be a stream.
+        """
+        if 'events' not in data:
+            return data
+
+        events = iter(data['events'])
+        first_events = list(islice(events, 1))
+        data['events'] = chain(first_events, events)
+        return dict(
+            {key: value for key, value in data.items() if key != 'events'},
+            events=first_events
+        )
+
     def _transform(self, data, tablename, transform_function):
         # this generic transform function is used to transform data in to 
         # four tables
         try:    
             logger.info('Transforming {} data and saving as parquet'.format(tablename))
-            table_dir = os.path.join(
-                self.tmp_dir,
-                tablename,
-                'season={}'.format(self.season),
-                'gameid={}'.format(self.gameid)
-            )
-            pq.write_to_dataset(
-                table=transform_function(data),
-                root_path=os.path.join(self.tmp_dir, tablename),
-                partition_cols=['season', 'gameid'],
-                compression='snappy',
-                preserve_index=False
-            )
+            output = transform_function(data)
+            if isinstance(output, Iterator):
+                # record batches are spilled to disk and written back
+                # sorted, a row group at a time
+                if self.tmp_dir is None:
+                    logger.info('Creating temporary directory')
+                    self.tmp_dir = tempfile.mkdtemp()
+                table_dir = os.path.join(
+                    self.tmp_dir,
+                    tablename,
+                    'season={}'.format(self.season),
+                    'gameid={}'.format(self.gameid)
+                )
+                os.makedirs(table_dir, exist_ok=True)
+                write_sorted_batches(
+                    batches=output,
+                    filepath=os.path.join(table_dir, '{}.parquet'.format(tablename)),
+                    sort_by=GAMEPOSITION_SORT_BY,
+                    row_group_bytes=self.row_group_bytes,
+                    drop_columns=['season', 'gameid'],
+                    compression='snappy'
+                )
+            else:
+                # small tables stay in memory, season and gameid are
+                # in the s3 key
+                self.data_paths[tablename] = write_buffer(
+                    output,
+                    drop_columns=['season', 'gameid']
+                )
+                return
 
             # collect table filepath
             self.data_paths[tablename] = os.path.join(table_dir, os.listdir(table_dir)[0])
@@ -150,28 +242,31 @@ class S3FileFormatETL(object):
     def _load(self, tablename: str):
         # this generic load function is used to load data all
         # four tables in to s3
-        path = self.data_paths[tablename]
         try:
+            path = self.data_paths[tablename]
             logger.info('Uploading {} to s3'.format(tablename))
             output_file = os.path\
                             .splitext(os.path.basename(self.input_filename))[0]\
                             .replace('.', '')
-            s3.upload_file(
-                Filename=path,
-                Bucket=self.destination_bucket,
-                Key='{}/season={}/gameid={}/{}.parquet.snappy'.format(
+            upload_object(
+                path,
+                bucket=self.destination_bucket,
+                key='{}/season={}/gameid={}/{}.parquet.snappy'.format(
                     tablename,
                     self.season,
                     self.gameid,
                     output_file
-                )
+                ),
+                s3client=s3
             )
-            self.df_uploaded\
-                .loc[self.file_idx, '{}_uploadedFLG'.format(tablename)] = 1
-        except (boto3.exceptions.botocore.client.ClientError, FileNotFoundError) as err:
+            uploadedFLG = 1
+        except (boto3.exceptions.botocore.client.ClientError, FileNotFoundError, KeyError) as err:
             logger.error(err)
+            uploadedFLG = 0
+
+        with self.lock:
             self.df_uploaded\
-                .loc[self.file_idx, '{}_uploadedFLG'.format(tablename)] = 0
+                .loc[self.file_idx, '{}_uploadedFLG'.format(tablename)] = uploadedFLG
 
 
     def transform_game(self, data: dict):
@@ -199,7 +294,7 @@ class S3FileFormatETL(object):
         self._transform(
             data=data, 
             tablename='gameposition', 
-            transform_function=get_game_position_info
+            transform_function=iter_game_position_batches
         )
 
 
@@ -215,71 +310,189 @@ class S3FileFormatETL(object):
     def load_position(self):
         self._load(tablename='gameposition')
 
+    def load(self):
+        # the four tables at the same time, gameposition takes the longest
+        loads = [self.load_position, self.load_game, self.load_player, self.load_team]
+        with ThreadPoolExecutor(max_workers=len(loads)) as executor:
+            for future in [executor.submit(load) for load in loads]:
+                future.result()
+
 
     def cleanup(self):
         # remove tmp directory
-        logger.info('Removing temporary directory')
-        shutil.rmtree(self.tmp_dir)
+        if self.tmp_dir is not None:
+            logger.info('Removing temporary directory')
+            shutil.rmtree(self.tmp_dir)
 
         # update the uploadDTS stamp
         today = datetime.datetime.utcnow().strftime('%F %TZ')
         self.df_uploaded.loc[self.file_idx, 'lastuploadDTS'] = today
         # update gameid
         self.df_uploaded.loc[self.file_idx, 'gameid'] = self.gameid
-        # save df_uploaded
-        self.df_uploaded.to_parquet(fname=self.uploaded_filepath, compression='snappy')
+        # save this file's row of df_uploaded
+        if self.save_metadata:
+            update_uploaded_metadata(
+                self.uploaded_filepath,
+                columns=UPLOADED_COLUMNS,
+                rows=[self.df_uploaded.loc[self.file_idx].to_dict()],
+                key='input_filename'
+            )
 
     def run(self):
         self.metadata()
 
         data = self.extract_from_s3()
+        header = self.split_header(data)
 
-        self.transform_game(data)
-        self.transform_player(data)
-        self.transform_team(data)
+        self.transform_game(header)
+        self.transform_player(header)
+        self.transform_team(header)
+        # the events are streamed in to gameposition
         self.transform_position(data)
 
-        self.load_game()
-        self.load_player()
-        self.load_team()
-        self.load_position()
+        self.load()
 
         self.cleanup()
 
 
+def _run_game_etl(
+        filename: str,
+        season: str,
+        source_bucket: str,
+        destination_bucket: str
+):
+    # runs one game, possibly in a worker process. The ledger row is
+    # returned instead of saved so only the parent writes the ledger.
+    # returns (filename, ledger row or None, error message or None)
+    try:
+        etl = S3FileFormatETL(
+            input_filename=filename,
+            source_bucket=source_bucket,
+            destination_bucket=destination_bucket,
+            season=season,
+            save_metadata=False
+        )
+        etl.run()
+        row = etl.df_uploaded.loc[etl.file_idx].to_dict()
+    except Exception as err:
+        logger.error('Error with file {}, {}'.format(filename, err))
+        return filename, None, repr(err)
+
+    not_uploaded = [
+        col for col in UPLOADED_COLUMNS
+        if col.endswith('uploadedFLG') and row[col] != 1
+    ]
+    if not_uploaded:
+        return filename, row, 'Not uploaded: {}'.format(', '.join(not_uploaded))
+    return filename, row, None
+
+
 def transform_upload_all_games(
         season: str,
         all_files: list,
         idx: list = [],
         source_bucket: str = SOURCE_BUCKET,
-        destination_bucket: str = DESTINATION_BUCKET
+        destination_bucket: str = DESTINATION_BUCKET,
+        max_workers: int = 1
 ):
+    """
+    Runs `S3FileFormatETL` for every file in `all_files`.
+
+    Parameters
+    ----------
+    season: `str`
+        e.g. '2015-2016'
 
+    all_files: `list`
+        The .7z keys in `source_bucket`
+
+    idx: `list`
+        Positions of `all_files` to run. All files if empty.
+
+    max_workers: `int`
+        Number of games run at the same time, each in its own process.
+        1 runs the games one after another in this process.
+
+    Returns
+    -------
+    A `dict` {'succeeded': [filenames], 'failed': {filename: error}}.
+
+    A failed game does not stop the others. Workers return their row of
+    the `rawpositiontransformed_s3uploaded` ledger and this process saves
+    it after each game. The parquet copy of the ledger is written once,
+    at the end.
+    """
     if idx:
         all_files = np.array(all_files)[idx]
+    all_files = list(all_files)
 
+    uploaded_filepath = os.path.join(META_DIR, UPLOADED_FILENAME)
+    summary = {'succeeded': [], 'failed': {}}
     start_time = datetime.datetime.now()
-    for i, filename in enumerate(all_files):
-        logger.info('Running etl file {} of {}'.format(i + 1, len(all_files)))
-        try:
-            etl = S3FileFormatETL(
-                input_filename=filename, 
-                source_bucket=source_bucket,
-                destination_bucket=destination_bucket,
-                season=season
-            )
-            etl.run()
-            etl_time = datetime.datetime.now()
-            time_delta = round((etl_time - start_time).seconds / 60., 2)
-            logger.info("It's been {} minutes".format(time_delta))
 
-        except Exception as err:
-            logger.error('Error with file {}, {}'.format(i, filename))
-            continue
+    saved_rows = []
+
+    def collect(filename, row, error):
+        if row is not None:
+            saved_rows.append(filename)
+            update_uploaded_metadata(
+                uploaded_filepath,
+                columns=UPLOADED_COLUMNS,
+                rows=[row],
+                key='input_filename'
+            )
+        if error is None:
+            summary['succeeded'].append(filename)
+        else:
+            summary['failed'][filename] = error
+
+        time_delta = round((datetime.datetime.now() - start_time).seconds / 60., 2)
+        logger.info('Finished file {} of {}. It\'s been {} minutes'.format(
+            len(summary['succeeded']) + len(summary['failed']),
+            len(all_files),
+            time_delta
+        ))
+
+    etl_args = [
+        (filename, season, source_bucket, destination_bucket)
+        for filename in all_files
+    ]
+    if max_workers == 1:
+        for args in etl_args:
+            collect(*_run_game_etl(*args))
+    else:
+        # spawn so each worker creates its own boto3 clients
+        with ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context('spawn')
+        ) as executor:
+            futures = {executor.submit(_run_game_etl, *args): args[0] for args in etl_args}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as err:
+                    # eg a worker process died
+                    logger.error('Error with file {}, {}'.format(futures[future], err))
+                    result = (futures[future], None, repr(err))
+                collect(*result)
+
+    if saved_rows:
+        # parquet copy of the ledger
+        export_uploaded_metadata(
+            uploaded_filepath,
+            columns=UPLOADED_COLUMNS,
+            key='input_filename'
+        )
 
     end_time = datetime.datetime.now()
     time_delta = round((end_time - start_time).seconds / 60., 2)
 
     logger.info('It took {} minutes to load'.format(time_delta))
-
-
+    logger.info('{} files succeeded, {} failed'.format(
+        len(summary['succeeded']),
+        len(summary['failed'])
+    ))
+    for filename, error in summary['failed'].items():
+        logger.info('Failed {}: {}'.format(filename, error))
+
+    return summary
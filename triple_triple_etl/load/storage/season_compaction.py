@@ -0,0 +1,342 @@
+########################################################################
+# This file compacts the per-game parquet files of a table in to a few
+# large files per season.
+# Each game adds one small file to `gameinfo`, `teaminfo` and
+# `playerinfo`, so a season is ~1230 objects of a handful of rows.
+# SeasonCompactionETL merges them, sorted by gameid, in to the
+# `<table>_compacted` table partitioned by season only, so a season is
+# one or two object reads.
+# The files of each run go to a new version folder and the season
+# partition is then pointed to it with one ALTER TABLE, so queries read
+# either the old or the new version, never a mix. The per-game table is
+# not changed and stays queryable.
+########################################################################
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+import datetime
+import math
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from triple_triple_etl.constants import (
+    COMPACTION_FILE_MB,
+    COMPACTION_KEEP_VERSIONS,
+    COMPACTION_ROW_GROUP_MB,
+    DESTINATION_BUCKET,
+    META_DIR,
+    S3_TRANSFER_MAX_WORKERS,
+    SQL_DIR
+)
+from triple_triple_etl.core.arrow_table import (
+    split_table,
+    to_hive_columns,
+    write_buffer
+)
+from triple_triple_etl.core.athena import (
+    execute_athena_query,
+    wait_for_query_execution
+)
+from triple_triple_etl.core.s3 import (
+    delete_objects,
+    get_bucket_content,
+    upload_object
+)
+from triple_triple_etl.load.storage.load_helper import update_uploaded_metadata
+from triple_triple_etl.log import get_logger
+
+s3client = boto3.client('s3', region_name='us-east-1')
+athena = boto3.client('athena', region_name='us-east-1')
+
+THIS_FILENAME = os.path.splitext(os.path.basename(__file__))[0]
+LOG_FILENAME = '{}.log'.format(os.path.splitext(THIS_FILENAME)[0])
+logger = get_logger(output_file=LOG_FILENAME)
+
+# the small dimension tables of the s37z files
+COMPACTION_TABLES = ['gameinfo', 'teaminfo', 'playerinfo']
+COMPACTED_TABLE = '{}_compacted'
+UPLOADED_COLUMNS = [
+    'partition', 'table', 'season', 'version', 'location',
+    'num_games', 'num_rows', 'uploadedFLG', 'lastuploadDTS'
+]
+UPLOADED_FILEPATH = os.path.join(META_DIR, 'season_compaction.parquet.snappy')
+
+
+def get_gameid(key: str):
+    """'gameinfo/season=2015-2016/gameid=0021500001/x.parquet' -> '0021500001'"""
+    return [
+        folder.split('=', 1)[1] for folder in key.split('/')
+        if folder.startswith('gameid=')
+    ][0]
+
+
+class SeasonCompactionETL(object):
+    """
+    Compacts the per-game files of one season of `table` in to files of
+    about `file_mb`, with the rows sorted by gameid and row groups of
+    about `row_group_mb`, so the row group statistics of gameid prune
+    the games a reader doesn't need.
+
+    Every run compacts the whole season again, games loaded since the
+    last run are included.
+
+    Parameters
+    ----------
+    table: `str`
+        Per-game table, without the database, eg 'gameinfo'
+
+    season: `str`
+        As in the s3 keys, eg '2015-2016'
+
+    keep_versions: `int`
+        Replaced versions kept for the queries that started before the
+        swap, older ones are removed
+    """
+    def __init__(
+            self,
+            table: str,
+            season: str,
+            source_bucket: str = DESTINATION_BUCKET,
+            destination_bucket: str = DESTINATION_BUCKET,
+            database: str = 'nba',
+            file_mb: float = COMPACTION_FILE_MB,
+            row_group_mb: float = COMPACTION_ROW_GROUP_MB,
+            keep_versions: int = COMPACTION_KEEP_VERSIONS,
+            max_workers: int = S3_TRANSFER_MAX_WORKERS,
+            max_time: int = 300
+    ):
+        self.table = table
+        self.season = season
+        self.source_bucket = source_bucket
+        self.destination_bucket = destination_bucket
+        self.database = database
+        self.file_bytes = file_mb * 1024 * 1024
+        self.row_group_bytes = row_group_mb * 1024 * 1024
+        self.keep_versions = keep_versions
+        self.max_workers = max_workers
+        self.max_time = max_time
+
+        self.compacted_table = COMPACTED_TABLE.format(table)
+        self.version = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S%fZ')
+        self.season_prefix = '{}/season={}/'.format(self.compacted_table, self.season)
+        self.prefix = '{}version={}/'.format(self.season_prefix, self.version)
+        self.location = 's3://{}/{}'.format(self.destination_bucket, self.prefix)
+        # parquet files of this version, in memory
+        self.buffers = []
+        # keys uploaded to this version
+        self.s3keys = []
+        self.num_games = 0
+        self.num_rows = 0
+        self.swapped = False
+
+    def _read_game(self, key: str):
+        body = s3client.get_object(Bucket=self.source_bucket, Key=key)['Body'].read()
+        table = pq.read_table(pa.BufferReader(body))
+        # the gameid is in the key, the season is the partition
+        table = table.drop([col for col in ['season', 'gameid'] if col in table.column_names])
+        gameid = pa.array([get_gameid(key)] * table.num_rows, type=pa.string())
+        return table.append_column('gameid', gameid)
+
+    def extract(self):
+        logger.info('Getting the {} files of season {}'.format(self.table, self.season))
+        keys = get_bucket_content(
+            bucket_name=self.source_bucket,
+            prefix='{}/season={}/'.format(self.table, self.season),
+            delimiter=''
+        )
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            tables = list(executor.map(self._read_game, keys))
+
+        logger.info('Read {} files of {}'.format(len(tables), self.table))
+        return tables
+
+    def transform(self, tables: list):
+        if not tables:
+            raise FileNotFoundError(
+                'No {} files in season {}'.format(self.table, self.season)
+            )
+
+        table = pa.concat_tables(tables).sort_by('gameid')
+        self.num_rows = table.num_rows
+        bytes_per_row = max(table.nbytes / max(table.num_rows, 1), 1)
+        row_group_size = max(int(self.row_group_bytes / bytes_per_row), 1)
+
+        # whole games per file, in gameid order
+        games = list(split_table(table, 'gameid').values())
+        self.num_games = len(games)
+        num_files = max(math.ceil(table.nbytes / self.file_bytes), 1)
+        games_per_file = math.ceil(len(games) / num_files)
+
+        self.buffers = [
+            write_buffer(
+                pa.concat_tables(games[i:i + games_per_file]),
+                row_group_size=row_group_size
+            )
+            for i in range(0, len(games), games_per_file)
+        ]
+        logger.info('Compacted {} games of {} in to {} files'.format(
+            self.num_games,
+            self.table,
+            len(self.buffers)
+        ))
+        return table.schema
+
+    def _execute(self, query: str, output_filename: str):
+        response = execute_athena_query(
+            query=query,
+            database=self.database,
+            output_filename=output_filename,
+            boto3_client=athena
+        )
+        wait_for_query_execution(
+            response['QueryExecutionId'],
+            boto3_client=athena,
+            max_time=self.max_time
+        )
+        return response
+
+    def create_table(self, schema: pa.Schema):
+        with open(os.path.join(SQL_DIR, 'create_table_season_partitioned.sql')) as f:
+            query = f.read().format(
+                '{}.{}'.format(self.database, self.compacted_table),
+                to_hive_columns(schema),
+                's3://{}/{}/'.format(self.destination_bucket, self.compacted_table)
+            )
+        return self._execute(query, output_filename='create_{}'.format(self.compacted_table))
+
+    def swap(self):
+        """
+        Points the season partition of the compacted table to this
+        version, adding the partition the first time.
+        """
+        table = '{}.{}'.format(self.database, self.compacted_table)
+        with open(os.path.join(SQL_DIR, 'alter_table_add_partitions.sql')) as f:
+            add_query = f.read().format(
+                table,
+                "    PARTITION (season = '{}') LOCATION '{}'".format(self.season, self.location)
+            )
+        with open(os.path.join(SQL_DIR, 'alter_table_set_partition_location.sql')) as f:
+            set_query = f.read().format(table, self.season, self.location)
+
+        output_filename = 'swap_{}'.format(self.compacted_table)
+        self._execute(add_query, output_filename=output_filename)
+        # a no-op if the partition was just added
+        response = self._execute(set_query, output_filename=output_filename)
+        self.swapped = True
+        logger.info('{} season {} now reads {}'.format(table, self.season, self.location))
+        return response
+
+    def load(self, schema: pa.Schema):
+        for i, buffer in enumerate(self.buffers):
+            key = '{}part-{:05d}.parquet.snappy'.format(self.prefix, i)
+            logger.info('Uploading {}'.format(key))
+            upload_object(buffer, bucket=self.destination_bucket, key=key, s3client=s3client)
+            self.s3keys.append(key)
+
+        # every file is readable before the partition points to them
+        for key, buffer in zip(self.s3keys, self.buffers):
+            response = s3client.head_object(Bucket=self.destination_bucket, Key=key)
+            if response['ContentLength'] != buffer.size:
+                raise IOError('{} was not fully uploaded'.format(key))
+
+        self.create_table(schema)
+        self.swap()
+
+    def _old_versions(self):
+        versions = sorted(
+            common_prefix['Prefix']
+            for common_prefix in get_bucket_content(
+                bucket_name=self.destination_bucket,
+                prefix=self.season_prefix,
+                delimiter='/'
+            )
+            if common_prefix['Prefix'] != self.prefix
+        )
+        # versions are named by time, the newest are kept
+        if self.keep_versions > 0:
+            return versions[:-self.keep_versions]
+        return versions
+
+    def cleanup(self):
+        self.buffers = []
+        if self.swapped:
+            # the replaced versions no query can still be reading
+            keys = [
+                key
+                for prefix in self._old_versions()
+                for key in get_bucket_content(
+                    bucket_name=self.destination_bucket,
+                    prefix=prefix,
+                    delimiter=''
+                )
+            ]
+        else:
+            # this version was never read
+            keys = self.s3keys
+        if keys:
+            delete_objects(self.destination_bucket, keys, s3client=s3client)
+
+        update_uploaded_metadata(
+            UPLOADED_FILEPATH,
+            columns=UPLOADED_COLUMNS,
+            rows=[{
+                'partition': '{}/season={}'.format(self.table, self.season),
+                'table': self.table,
+                'season': self.season,
+                'version': self.version,
+                'location': self.location,
+                'num_games': self.num_games,
+                'num_rows': self.num_rows,
+                'uploadedFLG': int(self.swapped),
+                'lastuploadDTS': datetime.datetime.utcnow().strftime('%F %TZ')
+            }],
+            key='partition'
+        )
+
+    def run(self):
+        # etl start time
+        start_time = datetime.datetime.utcnow()
+        try:
+            tables = self.extract()
+            schema = self.transform(tables)
+            self.load(schema)
+        finally:
+            self.cleanup()
+
+        # etl end time
+        time_delta = round((datetime.datetime.utcnow() - start_time).seconds / 60., 2)
+        logger.info('It took {} minutes to compact {} season {}'.format(
+            time_delta,
+            self.table,
+            self.season
+        ))
+
+
+def compact_seasons(
+        seasons: list,
+        tables: list = COMPACTION_TABLES,
+        **kwargs
+):
+    """
+    Compacts each season of each table, see `SeasonCompactionETL`.
+
+    Returns
+    -------
+    A `list` of the (table, season) that failed.
+    """
+    failed = []
+    for table in tables:
+        for season in seasons:
+            try:
+                SeasonCompactionETL(table=table, season=season, **kwargs).run()
+            except Exception as err:
+                logger.error('Error compacting {} season {}'.format(table, season))
+                logger.error(err)
+                failed.append((table, season))
+
+    logger.info('Compacted {} of {} seasons, failed: {}'.format(
+        len(tables) * len(seasons) - len(failed),
+        len(tables) * len(seasons),
+        failed
+    ))
+    return failed
@@ -9,29 +9,77 @@
 # and uploads the result to s3.
 # TeamShootingSideETL queries data for only one game. Useful once the initial
 # table is created and we just want to append data.
+# upload_all_team_shooting_side runs the TeamShootingSideETL queries of many
+# games concurrently, eg to backfill a season.
+# TeamShootingSideLocalETL computes one game locally from its playbyplay,
+# gameposition and gamelog parquet files, without Athena or csv files.
 ########################################################################
 import boto3
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 import os
 import pandas as pd
 import pyarrow as pa
-import pyarrow.parquet as pq
 import shutil
 import tempfile
 
-from triple_triple_etl.constants import ATHENA_OUTPUT, META_DIR, SQL_DIR 
-from triple_triple_etl.core.athena import execute_athena_query
-from triple_triple_etl.load.storage.load_helper import get_uploaded_metadata
+from triple_triple_etl.constants import (
+    ATHENA_MAX_CONCURRENT_QUERIES,
+    ATHENA_OUTPUT,
+    META_DIR,
+    SQL_DIR
+)
+from triple_triple_etl.core.arrow_table import split_table, write_buffer
+from triple_triple_etl.core.athena import (
+    execute_athena_query,
+    wait_for_query_execution
+)
+from triple_triple_etl.core.partitions import PartitionRegistry
+from triple_triple_etl.core.query_cache import QueryResultCache
+from triple_triple_etl.core.query_scheduler import QueryScheduler
+from triple_triple_etl.core.s3 import upload_object
+from triple_triple_etl.core.team_shooting_side import (
+    BALL_PLAYERID,
+    get_team_shooting_side
+)
+from triple_triple_etl.load.storage.load_helper import (
+    get_uploaded_metadata,
+    read_game_table,
+    update_game_metadata,
+    update_uploaded_metadata
+)
 from triple_triple_etl.log import get_logger
 
 s3 = boto3.resource('s3', region_name='us-east-1')
+s3client = boto3.client('s3', region_name='us-east-1')
 athena = boto3.client('athena', region_name='us-east-1')
+# reruns of a game on unchanged data reuse the query result
+query_cache = QueryResultCache(s3client=s3client)
 
 THIS_FILENAME = os.path.splitext(os.path.basename(__file__))[0]
 LOG_FILENAME = '{}.log'.format(os.path.splitext(THIS_FILENAME)[0])
 logger = get_logger(output_file=LOG_FILENAME)
 
 
+# one ledger for the games of the three ETLs, whichever loaded them
+UPLOADED_FILENAME = 'teamshootingside.parquet.snappy'
+UPLOADED_COLUMNS = [
+    'season',
+    'gameid',
+    'gamedate',
+    'teamid1',
+    'teamid2',
+    'uploadedFLG',
+    'lastuploadDTS'
+]
+
+
+def get_season(gameid: str):
+    # gameids are 00YSSxxxxx, eg 0021500001 is in 2015-2016
+    year = 2000 + int(gameid[3:5])
+    return '{}-{}'.format(year, year + 1)
+
+
 def get_file_idx_in_uploaded(
         gameid: str,
         df_uploaded: pd.DataFrame
@@ -58,6 +106,8 @@ class TeamShootingSideALL(object):
         self.destination_bucket = destination_bucket
         self.database = database
         self.tmp_dir = None
+        # gameid -> parquet file of the game, in memory
+        self.buffers = {}
         self.df_uploaded = None
         self.query = None
         self.file_idx = None
@@ -68,24 +118,14 @@ class TeamShootingSideALL(object):
         self.team2 = None
 
 
-        metadata_filename = 'teamshootingside.parquet.snappy'
-        self.uploaded_filepath = os.path.join(META_DIR, metadata_filename)
+        self.uploaded_filepath = os.path.join(META_DIR, UPLOADED_FILENAME)
     
     def metadata(self):
         logger.info('Getting loaded metadata')
-        # meta data of df columns
-        columns = [
-            'season',
-            'gameid',
-            'gamedate',
-            'teamid1',
-            'teamid2',
-            'uploadedFLG',
-            'lastuploadDTS'
-        ]
         self.df_uploaded = get_uploaded_metadata(
             self.uploaded_filepath,
-            columns=columns
+            columns=UPLOADED_COLUMNS,
+            key='gameid'
         )
         self.file_idx = self.df_uploaded.shape[0]
         
@@ -106,6 +146,9 @@ class TeamShootingSideALL(object):
             boto3_client=athena,
             output_filename=output_filename
         )
+        # the csv is written once the query succeeded
+        wait_for_query_execution(response['QueryExecutionId'], boto3_client=athena)
+
         # return s3key
         return '{}/{}.csv'.format(output_filename, response['QueryExecutionId'])
     
@@ -127,30 +170,21 @@ class TeamShootingSideALL(object):
         df = pd.read_csv(output_filepath, dtype={'gameid': str})
 
         logger.info('Convert to parquet')
-        table = pa.Table.from_pandas(df, preserve_index=False)
-        pq.write_to_dataset(
-            table=table,
-            root_path=self.tmp_dir,
-            partition_cols=['season', 'gameid'],
-            compression='snappy',
-            preserve_index=False
-        )
+        # one file per game, season and gameid are in the s3 key
+        games = split_table(pa.Table.from_pandas(df, preserve_index=False), 'gameid')
+        self.buffers = {
+            gameid: write_buffer(table, drop_columns=['season', 'gameid'])
+            for gameid, table in games.items()
+        }
         return df
     
     def load(self, df: pd.DataFrame):
-        # get season dir
-        season_dir = [x for x in os.listdir(self.tmp_dir) if 'season' in x][0]
-        season_filepath = os.path.join(self.tmp_dir, season_dir)
-        all_files = os.listdir(season_filepath)
-        
-        for game in all_files:
+        for gameid, buffer in self.buffers.items():
             # upload to s3 team_shooting_side folder
-            self.gameid = game.split('=')[1]
-            filename = os.listdir(os.path.join(season_filepath, game))[0]
-            full_path = os.path.join(season_filepath, game, filename)
+            self.gameid = gameid
 
             # collect meta data
-            df_game = df.query('gameid == @self.gameid')\
+            df_game = df.query('gameid == @gameid')\
                         .query('period == 1')
             self.season = df_game.season.iloc[0]
             self.gamedate = df_game.game_date.iloc[0].replace('-', '')
@@ -172,22 +206,23 @@ class TeamShootingSideALL(object):
 
             try:
                 logger.info('Uploading game {} to s3'.format(self.gameid))
-                s3.meta.client.upload_file(
-                    Filename=full_path,
-                    Bucket=self.destination_bucket,
-                    Key = '{}/season={}/gameid={}/{}{}{}.parquet.snappy'.format(
+                upload_object(
+                    buffer,
+                    bucket=self.destination_bucket,
+                    key='{}/season={}/gameid={}/{}{}{}.parquet.snappy'.format(
                         'team_shooting_side',
                         self.season,
                         self.gameid,
                         self.gamedate,
                         self.team1,
                         self.team2
-                    )
+                    ),
+                    s3client=s3client
                 )
                 # update metadata
                 self.df_uploaded.loc[self.file_idx, 'uploadedFLG'] = 1
 
-            except (boto3.exceptions.botocore.client.ClientError, FileNotFoundError) as err:
+            except boto3.exceptions.botocore.client.ClientError as err:
                 logger.error(err)
                 self.df_uploaded.loc[self.file_idx, 'uploadedFLG'] = 0
     
@@ -195,9 +230,15 @@ class TeamShootingSideALL(object):
         # remove tmp directory
         logger.info('Remove temporary directory')
         shutil.rmtree(self.tmp_dir)
+        self.buffers = {}
 
         # save df_uploaded
-        self.df_uploaded.to_parquet(fname=self.uploaded_filepath, compression='snappy')
+        update_uploaded_metadata(
+            self.uploaded_filepath,
+            columns=UPLOADED_COLUMNS,
+            rows=self.df_uploaded.to_dict('records'),
+            key='gameid'
+        )
 
     def run(self):
         # etl start time
@@ -227,37 +268,36 @@ class TeamShootingSideETL(object):
             gameid: str,
             source_bucket: str = ATHENA_OUTPUT,
             destination_bucket: str = 'nba-game-info',
-            database: str = 'nba' # database where tables are stored
+            database: str = 'nba', # database where tables are stored
+            use_cache: bool = True
     ):
         self.gameid = gameid
+        self.cache = query_cache if use_cache else None
         self.source_bucket = source_bucket
         self.destination_bucket = destination_bucket
         self.database = database
         self.tmp_dir = None
+        # the parquet file, in memory
+        self.buffer = None
         self.df_uploaded = None
         self.file_idx = None
         self.query = None
+        self.season = None
         self.team1 = None
         self.team2 = None
         self.gamedate = None
 
-        metadata_filename = 'teamshootingside.parquet.snappy'
-        self.uploaded_filepath = os.path.join(META_DIR, metadata_filename)
+        self.uploaded_filepath = os.path.join(META_DIR, UPLOADED_FILENAME)
+        # meta data of df columns
+        self.uploaded_columns = UPLOADED_COLUMNS
     
     def metadata(self):
         logger.info('Getting loaded metadata')
-        # meta data of df columns
-        columns = [
-            'gameid',
-            'teamid1',
-            'teamid2',
-            'uploadedFLG',
-            'lastuploadDTS'
-        ]
-
         self.df_uploaded = get_uploaded_metadata(
             self.uploaded_filepath,
-            columns=columns
+            columns=self.uploaded_columns,
+            key='gameid',
+            value=self.gameid
         )
 
         self.file_idx = get_file_idx_in_uploaded(
@@ -265,8 +305,7 @@ class TeamShootingSideETL(object):
             gameid=self.gameid
         )
         
-    def execute_query(self, output_filename='team_shooting_side'):
-        logger.info('Executing query')
+    def get_query(self):
         query_path = os.path.join(
             SQL_DIR,
             'team_shooting_side',
@@ -275,13 +314,34 @@ class TeamShootingSideETL(object):
 
         with open(query_path) as f:
             self.query = f.read().format(self.gameid)
+        return self.query
+
+    def get_inputs(self):
+        # the game's partitions of the tables the query reads
+        return [
+            's3://{}/{}/season={}/gameid={}/'.format(
+                self.destination_bucket,
+                table,
+                get_season(self.gameid),
+                self.gameid
+            )
+            for table in ['playbyplay', 'gameposition', 'gamelog']
+        ]
+
+    def execute_query(self, output_filename='team_shooting_side'):
+        logger.info('Executing query')
+        self.get_query()
         
         response = execute_athena_query(
             query=self.query, 
             database=self.database, 
             boto3_client=athena,
-            output_filename=output_filename
+            output_filename=output_filename,
+            cache=self.cache,
+            inputs=self.get_inputs()
         )
+        # the csv is written once the query succeeded
+        wait_for_query_execution(response['QueryExecutionId'], boto3_client=athena)
 
         # return s3key
         return '{}/{}.csv'.format(output_filename, response['QueryExecutionId'])
@@ -307,45 +367,37 @@ class TeamShootingSideETL(object):
         self.team1 = df.team_abbreviation.unique()[0]
         self.team2 = df.team_abbreviation.unique()[1]
         self.gamedate = df.gamedate.iloc[0].replace('-', '')
+        self.season = df.season.iloc[0]
 
         logger.info('Convert to parquet')
-        table = pa.Table.from_pandas(df, preserve_index=False)
-        pq.write_to_dataset(
-            table=table,
-            root_path=self.tmp_dir,
-            partition_cols=['season', 'gameid'],
-            compression='snappy',
-            preserve_index=False
+        # season and gameid are in the s3 key
+        self.buffer = write_buffer(
+            pa.Table.from_pandas(df, preserve_index=False),
+            drop_columns=['season', 'gameid']
         )
     
     def load(self):
         # upload to s3 team_shooting_side folder
         try:
-            self.logger.info('Uploading game {} to s3'.format(self.gameid))
-            filepath = os.path.join(
-                self.tmp_dir,
-                'season={}'.format(self.season),
-                'gameid={}'.format(self.gameid)
-            )
-            filename = os.listdir(filepath)[0]
-
-            s3.meta.client.upload_file(
-                Filename=os.path.join(filepath, filename),
-                Bucket=self.destination_bucket,
-                Key = '{}/season={}/gameid={}/{}{}{}.parquet.snappy'.format(
+            logger.info('Uploading game {} to s3'.format(self.gameid))
+            upload_object(
+                self.buffer,
+                bucket=self.destination_bucket,
+                key='{}/season={}/gameid={}/{}{}{}.parquet.snappy'.format(
                     'team_shooting_side',
                     self.season,
                     self.gameid,
                     self.gamedate,
                     self.team1,
                     self.team2
-                )
-            ) 
+                ),
+                s3client=s3client
+            )
 
             # update metadata
             self.df_uploaded.loc[self.file_idx, 'uploadedFLG'] = 1
 
-        except (boto3.exceptions.botocore.client.ClientError, FileNotFoundError) as err:
+        except (boto3.exceptions.botocore.client.ClientError, AttributeError) as err:
             logger.error(err)
             self.df_uploaded.loc[self.file_idx, 'uploadedFLG'] = 0
     
@@ -354,16 +406,23 @@ class TeamShootingSideETL(object):
         # remove tmp directory
         logger.info('Remove temporary directory')
         shutil.rmtree(self.tmp_dir)
+        self.buffer = None
 
         # update the uploadDTS stamp
         today = datetime.datetime.utcnow().strftime('%F %TZ')
         self.df_uploaded.loc[self.file_idx, 'lastuploadDTS'] = today
-        # update gameid
+        # update season and gameid
+        self.df_uploaded.loc[self.file_idx, 'season'] = self.season or get_season(self.gameid)
         self.df_uploaded.loc[self.file_idx, 'gameid'] = self.gameid
         # update gamedate
         self.df_uploaded.loc[self.file_idx, 'gamedate'] = self.gamedate
-        # save df_uploaded
-        self.df_uploaded.to_parquet(fname=self.uploaded_filepath, compression='snappy')
+        # save this game's row of df_uploaded
+        update_uploaded_metadata(
+            self.uploaded_filepath,
+            columns=self.uploaded_columns,
+            rows=[self.df_uploaded.loc[self.file_idx].to_dict()],
+            key='gameid'
+        )
 
     
     def run(self):
@@ -384,3 +443,235 @@ class TeamShootingSideETL(object):
                .format(time_delta, self.gameid)
         logger.info(msg)
 
+
+def _load_game(etl, s3key: str):
+    # TeamShootingSideETL.run once its query SUCCEEDED
+    try:
+        etl.metadata()
+        output_filepath = etl.extract(s3key)
+        etl.transform(output_filepath)
+        etl.load()
+        etl.cleanup()
+    except Exception as err:
+        logger.error('Error loading game {}'.format(etl.gameid))
+        logger.error(err)
+        return False
+    return True
+
+
+def upload_all_team_shooting_side(
+        gameids: list,
+        max_concurrency: int = ATHENA_MAX_CONCURRENT_QUERIES,
+        output_filename: str = 'team_shooting_side',
+        max_workers: int = 4,
+        **kwargs
+):
+    """
+        Loads the team_shooting_side of many games with TeamShootingSideETL.
+        The per game queries are independent and run with at most
+        `max_concurrency` in flight. Each game is extracted and loaded,
+        `max_workers` at a time, as soon as its query SUCCEEDED, so the
+        games loaded are kept if the other queries time out.
+
+    Parameters
+    ----------
+        gameids: `list`
+            The games to load
+
+        max_workers: `int`
+            Games extracted and loaded at once
+
+        kwargs:
+            Passed to TeamShootingSideETL
+
+    Returns
+    -------
+        A `list` of the gameids that failed to load, or whose query
+        failed or did not finish.
+    """
+    start_time = datetime.datetime.utcnow()
+    etls = {}
+    for gameid in gameids:
+        etls[gameid] = TeamShootingSideETL(gameid=gameid, **kwargs)
+
+    scheduler = QueryScheduler(
+        database=kwargs.get('database', 'nba'),
+        max_concurrency=max_concurrency,
+        boto3_client=athena,
+        cache=etls[gameids[0]].cache if gameids else None
+    )
+    for gameid, etl in etls.items():
+        scheduler.submit(
+            name=gameid,
+            query=etl.get_query(),
+            output_filename=output_filename,
+            inputs=etl.get_inputs()
+        )
+
+    logger.info('Executing {} queries'.format(len(scheduler)))
+    loads = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def on_success(gameid):
+            loads[gameid] = executor.submit(_load_game, etls[gameid], scheduler.s3key(gameid))
+
+        try:
+            scheduler.run(on_success=on_success)
+        except TimeoutError as err:
+            # the games whose query finished are still loaded
+            logger.error(err)
+
+    failed = sorted(
+        gameid for gameid in etls
+        if gameid not in loads or not loads[gameid].result()
+    )
+
+    time_delta = round((datetime.datetime.utcnow() - start_time).seconds / 60., 2)
+    logger.info('It took {} minutes to load {} games, {} failed.'.format(
+        time_delta,
+        len(gameids),
+        len(failed)
+    ))
+    return failed
+
+
+class TeamShootingSideLocalETL(object):
+    """
+        This ETL computes the 'team shooting side' data of a specific game
+        locally and adds it to the `team_shooting_side` folder.
+    """
+    def __init__(
+            self,
+            season: str,
+            gameid: str,
+            source_bucket: str = 'nba-game-info',
+            destination_bucket: str = 'nba-game-info',
+            database: str = 'nba', # database where tables are stored
+            partitions: PartitionRegistry = None
+    ):
+        self.season = season
+        self.gameid = gameid
+        self.source_bucket = source_bucket
+        self.destination_bucket = destination_bucket
+        self.database = database
+        # registered in load, unless the registry is shared with other
+        # games and flushed by the caller
+        self.partitions = partitions if partitions is not None else PartitionRegistry(
+            table='team_shooting_side',
+            database=database,
+            athena_client=athena
+        )
+        self.flush_partitions = partitions is None
+        # the parquet file, in memory
+        self.buffer = None
+        self.s3keys = {}
+        self.gamedate = None
+        self.team1 = None
+        self.team2 = None
+        self.uploadedFLG = 0
+
+        self.uploaded_filepath = os.path.join(META_DIR, UPLOADED_FILENAME)
+        self.uploaded_columns = UPLOADED_COLUMNS
+
+    def _read_table(self, tablename: str, **kwargs):
+        # only the columns needed are fetched, and the row groups whose
+        # statistics can match the filters
+        return read_game_table(
+            bucket_name=self.source_bucket,
+            tablename=tablename,
+            season=self.season,
+            gameid=self.gameid,
+            s3client=s3client,
+            **kwargs
+        ).to_pandas()
+
+    def extract(self):
+        logger.info('Getting playbyplay, gameposition and gamelog of game {}'.format(self.gameid))
+        df_playbyplay = self._read_table(
+            'playbyplay',
+            columns=['period', 'score', 'wctimestring', 'pctimestring', 'player1_team_id']
+        )
+        # only the ball is needed, it is in every row group of the
+        # (eventid, moment_num, playerid) sort so this prunes columns only
+        df_gameposition = self._read_table(
+            'gameposition',
+            columns=['period', 'periodclock', 'playerid', 'x_coordinate'],
+            filters=[('playerid', '=', BALL_PLAYERID)]
+        )
+        df_gamelog = self._read_table(
+            'gamelog',
+            columns=['team_id', 'team_abbreviation', 'game_date']
+        )
+        return df_playbyplay, df_gameposition, df_gamelog
+
+    def transform(self, df_playbyplay, df_gameposition, df_gamelog):
+        df = get_team_shooting_side(
+            df_playbyplay=df_playbyplay,
+            df_gameposition=df_gameposition,
+            df_gamelog=df_gamelog,
+            season=self.season,
+            gameid=self.gameid
+        )
+        teams = df.team_abbreviation.unique()
+        self.team1 = teams[0]
+        self.team2 = teams[-1]
+        self.gamedate = df.game_date.iloc[0].replace('-', '')
+
+        # season and gameid are in the s3 key
+        self.buffer = write_buffer(
+            pa.Table.from_pandas(df, preserve_index=False),
+            drop_columns=['season', 'gameid']
+        )
+        return df
+
+    def load(self):
+        s3key = '{}/season={}/gameid={}/{}{}{}.parquet.snappy'.format(
+            'team_shooting_side',
+            self.season,
+            self.gameid,
+            self.gamedate,
+            self.team1,
+            self.team2
+        )
+        location = 's3://{}/team_shooting_side/season={}/gameid={}'.format(
+            self.destination_bucket,
+            self.season,
+            self.gameid
+        )
+        try:
+            logger.info('Uploading game {} to s3'.format(self.gameid))
+            upload_object(
+                self.buffer,
+                bucket=self.destination_bucket,
+                key=s3key,
+                s3client=s3client
+            )
+            self.uploadedFLG = 1
+
+            self.partitions.add(self.season, self.gameid, location)
+            if self.flush_partitions:
+                self.s3keys.update(self.partitions.flush())
+        except Exception as err:
+            logger.error('Error loading game {}'.format(self.gameid))
+            logger.error(err)
+
+    def cleanup(self):
+        self.buffer = None
+
+        update_game_metadata(
+            self.uploaded_filepath,
+            columns=self.uploaded_columns,
+            season=self.season,
+            gameid=self.gameid,
+            uploadedFLG=self.uploadedFLG,
+            gamedate=self.gamedate,
+            teamid1=self.team1,
+            teamid2=self.team2
+        )
+
+    def run(self):
+        try:
+            dfs = self.extract()
+            self.transform(*dfs)
+            self.load()
+        finally:
+            self.cleanup()